@@ -58,6 +58,7 @@ def full_setup(project, logger):
     project.install_file(img_pre_trained_data_path, "hutts_verification/image_preprocessing/trained_data/dlib_face_recognition_resnet_model_v1.dat")
     project.install_file(img_pre_trained_data_path, "hutts_verification/image_preprocessing/trained_data/shape_predictor_face_landmarks.dat")
     project.install_file(img_pre_templates_path, "hutts_verification/image_preprocessing/templates/pp2.jpg")
+    project.install_file(img_pre_templates_path, "hutts_verification/image_preprocessing/templates/manifest.json")
     project.install_file(img_pre_templates_path, "hutts_verification/image_preprocessing/templates/temp_flag.jpg")
     project.install_file(img_pre_templates_path, "hutts_verification/image_preprocessing/templates/wap.jpg")
 
@@ -0,0 +1,142 @@
+"""
+----------------------------------------------------------------------
+Authors: Stephan Nell
+----------------------------------------------------------------------
+Benchmarks the downscaled face detection modes against detection at full
+resolution with one upsample (the original behaviour), using the bundled
+sample images at their own size and scaled up to the size of a phone
+photo. For every mode the run time and the overlap (intersection over
+union) of the detected face with the face found at full resolution are
+reported. Finally the throughput of the default mode is reported for a
+single thread and for one thread per CPU, which shows how well face
+stages overlap on the face stage pool.
+
+Usage: python benchmark_face_detection.py [repeats] [threads]
+----------------------------------------------------------------------
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import imutils
+from hutts_verification.image_preprocessing.face_manager import FaceDetector, get_detection_mode
+from hutts_verification.image_preprocessing.template_matching import TEMPLATE_DIR
+from hutts_verification.utils.model_registry import SHAPE_PREDICTOR_PATH
+
+# The detection modes (maximum side, upsample policy) that are compared, the first being the original behaviour.
+MODES = [(None, 1), (1600, 'auto'), (1024, 'auto'), (1024, 0), (800, 'auto'), (640, 1)]
+# The sample images that contain a face.
+SAMPLES = ['obama.jpg', 'obamaSkew.jpg', 'soapJoeExample.jpg', 'ID.jpg']
+# The longest side of the sample images scaled up to the size of a phone photo (roughly 12MP).
+PHONE_PHOTO_SIDE = 4000
+
+
+def sample_images():
+    """
+    Loads the sample images at their own size and scaled up to the size of a phone photo.
+
+    Returns:
+        - (list): The names and images of the samples.
+
+    """
+    samples = []
+    for file_name in SAMPLES:
+        image = cv2.imread(os.path.join(TEMPLATE_DIR, file_name))
+        samples.append((file_name, image))
+        if image.shape[0] > image.shape[1]:
+            large = imutils.resize(image, height=PHONE_PHOTO_SIDE, inter=cv2.INTER_CUBIC)
+        else:
+            large = imutils.resize(image, width=PHONE_PHOTO_SIDE, inter=cv2.INTER_CUBIC)
+        samples.append(('%s@%dx%d' % (file_name, large.shape[1], large.shape[0]), large))
+    return samples
+
+
+def overlap(first, second):
+    """
+    Calculates the intersection over union of two rectangles.
+
+    :param first (rectangle): The first dlib rectangle, or None.
+    :param second (rectangle): The second dlib rectangle, or None.
+
+    Returns:
+        - (float): The intersection over union, which is 1 if neither rectangle exists.
+
+    """
+    if first is None or second is None:
+        return 1.0 if first is second else 0.0
+    intersection = first.intersect(second).area() if first.intersect(second).width() > 0 else 0
+    return intersection / (first.area() + second.area() - intersection)
+
+
+def timed(function, repeats):
+    """
+    Runs a function a number of times and returns its result along with the best run time.
+
+    :param function (callable): The function to run.
+    :param repeats (int): The number of times to run the function.
+
+    Returns:
+        - (obj): The result of the function.
+        - (float): The shortest run time in seconds.
+
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def throughput(detector, images, threads, repeats):
+    """
+    Detects the faces in the images on a number of threads, every thread detecting the faces in all the images.
+
+    :param detector (FaceDetector): The detector, which is shared by the threads.
+    :param images (list): The images.
+    :param threads (int): The number of threads.
+    :param repeats (int): The number of times every thread detects the faces in the images.
+
+    Returns:
+        - (float): The number of images processed per second.
+
+    """
+    def detect_all():
+        for _ in range(repeats):
+            for image in images:
+                detector.detect(image)
+
+    with ThreadPoolExecutor(threads) as executor:
+        start = time.perf_counter()
+        [future.result() for future in [executor.submit(detect_all) for _ in range(threads)]]
+        elapsed = time.perf_counter() - start
+    return threads * repeats * len(images) / elapsed
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    detectors = [FaceDetector(SHAPE_PREDICTOR_PATH, max_side, upsample) for (max_side, upsample) in MODES]
+    totals = [0.0] * len(MODES)
+    print('%-32s' % 'Image' + ''.join('%22s' % ('%s/%s' % mode) for mode in MODES))
+    print('%-32s' % '' + ''.join('%22s' % 'ms (IoU)' for _ in MODES))
+    for (name, image) in sample_images():
+        (expected, _) = timed(lambda: detectors[0].detect(image), 1)
+        row = '%-32s' % name
+        for (index, detector) in enumerate(detectors):
+            (rectangle, elapsed) = timed(lambda: detector.detect(image), repeats)
+            totals[index] += elapsed
+            row += '%22s' % ('%.1f (%.2f)' % (elapsed * 1000, overlap(expected, rectangle)))
+        print(row)
+    print('%-32s' % 'Total' + ''.join('%22s' % ('%.1f' % (total * 1000)) for total in totals))
+
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    detector = FaceDetector(SHAPE_PREDICTOR_PATH, *get_detection_mode())
+    images = [image for (_, image) in sample_images()]
+    single = throughput(detector, images, 1, repeats)
+    concurrent = throughput(detector, images, threads, repeats)
+    print()
+    print('Throughput (%s/%s): 1 thread %.2f images/s, %d threads %.2f images/s (%.2fx)' % (
+        get_detection_mode() + (single, threads, concurrent, concurrent / single)))
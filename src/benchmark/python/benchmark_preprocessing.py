@@ -0,0 +1,83 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Benchmarks the fused preprocessing of the text extraction pipelines
+(a single weighted sum of the channels that are kept, followed by
+blurring and thresholding one plane) against the separate blur,
+color extraction, grayscale conversion and thresholding steps it
+replaced, using the sample ID card at a range of widths. Both should
+produce the same image, apart from a few pixels that lie on the
+threshold.
+
+Usage: python benchmark_preprocessing.py [repeats]
+----------------------------------------------------------------------
+"""
+
+import os
+import sys
+import time
+import cv2
+import imutils
+from hutts_verification.image_preprocessing.build_director import BuildDirector
+from hutts_verification.image_preprocessing.template_matching import TEMPLATE_DIR
+
+"""The largest fraction of pixels in which the fused and separate preprocessing may differ."""
+TOLERANCE = 0.005
+"""The preferences and ID types of the pipelines that are compared."""
+PIPELINES = [
+    ({}, 'idcard'),
+    ({}, 'studentcard'),
+    ({'blur_method': 'median'}, 'idcard'),
+    ({'blur_method': 'normal', 'threshold_method': 'otsu'}, 'idbook'),
+    ({'color': 'green'}, 'idcard')
+]
+
+
+def timed(function, repeats):
+    """
+    Runs a function a number of times and returns its result along with the best run time.
+
+    :param function (callable): The function to run.
+    :param repeats (int): The number of times to run the function.
+
+    Returns:
+        - (obj): The result of the function.
+        - (float): The shortest run time in seconds.
+
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    id_card = cv2.imread(os.path.join(TEMPLATE_DIR, 'ID.jpg'))
+    totals = [0.0, 0.0]
+    print('%-64s %6s %14s %12s %8s %10s' % ('Pipeline', 'Width', 'Separate (ms)', 'Fused (ms)', 'Speedup',
+                                            'Differ (%)'))
+    for (preferences, id_type) in PIPELINES:
+        pipeline = BuildDirector.construct_text_extract_pipeline(preferences, id_type)
+        name = '%s %s%s' % (id_type, preferences, '' if pipeline.fused_weights() is not None else ' (not fused)')
+        for width in (600, 1200, 2400):
+            image = imutils.resize(id_card, width=width)
+            (separate, separate_time) = timed(
+                lambda: pipeline.process_text_extraction(False, image, fused=False), repeats
+            )
+            (fused, fused_time) = timed(lambda: pipeline.process_text_extraction(False, image), repeats)
+            differ = (fused != separate).mean()
+            if differ > TOLERANCE:
+                print('Mismatch for %s at width %d: %.2f%% of the pixels differ' % (name, width, differ * 100))
+                sys.exit(1)
+            totals[0] += separate_time
+            totals[1] += fused_time
+            print('%-64s %6d %14.2f %12.2f %7.2fx %10.3f' % (
+                name, width, separate_time * 1000, fused_time * 1000, separate_time / fused_time, differ * 100
+            ))
+    print('%-64s %6s %14.2f %12.2f %7.2fx' % ('Total', '', totals[0] * 1000, totals[1] * 1000,
+                                              totals[0] / totals[1]))
@@ -0,0 +1,115 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Benchmarks the coarse-to-fine template matching against the brute-force
+multi-scale search it replaced, using the bundled templates and sample
+images. Both searches should identify every image as the same ID type.
+
+Usage: python benchmark_template_matching.py [repeats]
+----------------------------------------------------------------------
+"""
+
+import os
+import sys
+import time
+import cv2
+import imutils
+import numpy as np
+from hutts_verification.image_preprocessing.template_matching import TemplateMatching, TEMPLATE_DIR
+
+
+def brute_force_identify(templates, source):
+    """
+    The brute-force multi-scale search that resizes the colour source for every template and scale.
+
+    :param templates (list): The templates of a TemplateMatching object.
+    :param source (obj): The image that needs to be identified.
+
+    Returns:
+        - (str): Either type of the image or 'None' if the type could not be identified.
+
+    """
+    for (original_template_image_width, template_image, threshold, object_identifier) in templates:
+        ratio = original_template_image_width / source.shape[1]
+        dimension = (original_template_image_width, int(source.shape[0] * ratio))
+        resized = cv2.resize(source, dimension, interpolation=cv2.INTER_AREA)
+        if resized.shape[0] < template_image.shape[0] or resized.shape[1] < template_image.shape[1]:
+            return 'None'
+        result = cv2.matchTemplate(resized, template_image, cv2.TM_CCOEFF_NORMED)
+        if cv2.minMaxLoc(result)[1] > threshold:
+            return object_identifier
+    for scale in np.linspace(0.8, 1.8, 10)[::-1]:
+        resized = imutils.resize(source, width=int(source.shape[1] * scale))
+        for (original_template_image_width, template_image, threshold, object_identifier) in templates:
+            if resized.shape[0] < template_image.shape[0] or resized.shape[1] < template_image.shape[1]:
+                return 'None'
+            result = cv2.matchTemplate(resized, template_image, cv2.TM_CCOEFF_NORMED)
+            if cv2.minMaxLoc(result)[1] > threshold:
+                return object_identifier
+    return 'None'
+
+
+def sample_images():
+    """
+    Loads the sample images: every image bundled with the templates, as well as the sample ID card at a range of
+    widths and blurred on a noisy background.
+
+    Returns:
+        - (list): The names and images of the samples.
+
+    """
+    samples = []
+    for file_name in sorted(os.listdir(TEMPLATE_DIR)):
+        image = cv2.imread(os.path.join(TEMPLATE_DIR, file_name))
+        if image is not None:
+            samples.append((file_name, image))
+    id_card = cv2.imread(os.path.join(TEMPLATE_DIR, 'ID.jpg'))
+    for width in (400, 1000, 1600):
+        samples.append(('ID.jpg@%d' % width, imutils.resize(id_card, width=width)))
+    background = np.random.RandomState(0).randint(0, 255, (900, 1300, 3)).astype('uint8')
+    background[100:100 + id_card.shape[0], 100:100 + id_card.shape[1]] = cv2.GaussianBlur(id_card, (9, 9), 0)
+    samples.append(('ID.jpg (blurred, noisy background)', background))
+    return samples
+
+
+def timed(function, repeats):
+    """
+    Runs a function a number of times and returns its result along with the best run time.
+
+    :param function (callable): The function to run.
+    :param repeats (int): The number of times to run the function.
+
+    Returns:
+        - (obj): The result of the function.
+        - (float): The shortest run time in seconds.
+
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    matcher = TemplateMatching()
+    totals = [0.0, 0.0]
+    print('%-40s %-12s %12s %12s %8s' % ('Image', 'ID type', 'Brute (ms)', 'Pyramid (ms)', 'Speedup'))
+    for (name, image) in sample_images():
+        (expected, brute_time) = timed(lambda: brute_force_identify(matcher.template, image), repeats)
+        (actual, pyramid_time) = timed(lambda: matcher.identify(image), repeats)
+        if actual != expected:
+            print('Mismatch for %s: expected %s, received %s' % (name, expected, actual))
+            sys.exit(1)
+        totals[0] += brute_time
+        totals[1] += pyramid_time
+        print('%-40s %-12s %12.1f %12.1f %7.1fx' % (
+            name, actual, brute_time * 1000, pyramid_time * 1000, brute_time / pyramid_time
+        ))
+    print('%-40s %-12s %12.1f %12.1f %7.1fx' % (
+        'Total', '', totals[0] * 1000, totals[1] * 1000, totals[0] / totals[1]
+    ))
@@ -17,6 +17,14 @@ __maintainer__ = "Jan-Justin van Tonder"
 __email__ = "J.vanTonder@tuks.co.za"
 __status__ = "Development"
 
+"""Specifies the characters that may be recognised in field regions containing only text (names may contain hyphens
+and apostrophes, e.g. "Smith-O'Neill")."""
+ALPHA_WHITELIST = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-\''
+"""Specifies the characters that may be recognised in field regions containing only numbers."""
+NUMERIC_WHITELIST = '0123456789'
+"""Specifies the characters that may be recognised in field regions containing text and numbers."""
+ALPHANUMERIC_WHITELIST = ALPHA_WHITELIST + NUMERIC_WHITELIST
+
 
 class IDContext(ABC):
     """
@@ -47,19 +55,35 @@ class IDContext(ABC):
                                                  # converted to uppercase.
                }
 
+        :field_regions (list): (Optional) A list of dictionaries that describe where the field values are located on
+            ID documents with a fixed layout, so that only those regions need to be passed through OCR.
+            Example::
+
+                {
+                    'field': 'surname',          # The field name - should correspond to the field name in the match
+                                                 # context that is used to normalise the field value.
+                    'region': (0.26, 0.27,       # The bounding box of the field value, given as the normalised
+                               0.70, 0.32),      # (left, top, right, bottom) coordinates of the ID document.
+                    'whitelist': ALPHA_WHITELIST # (Optional) The characters that may be recognised in the region.
+               }
+
     """
-    def __init__(self, match_contexts):
+    def __init__(self, match_contexts, field_regions=None):
         """
         Responsible for initialising the IDContext object.
 
             :param match_contexts (list): A list of dictionaries that contain the contextual information
                     used in the process of retrieving field values from the OCR output string.
+            :param field_regions (list): A list of dictionaries that describe where the field values are located
+                    on ID documents with a fixed layout.
 
         """
         # Logging for debugging purposes.
         logger.debug('Initialising %s...' % type(self).__name__)
         # Assign match contexts
         self._match_contexts = match_contexts
+        # Assign field regions
+        self._field_regions = field_regions
 
     def get_id_info(self, id_string, barcode_data=None, ignore_fields=None, fuzzy_min_ratio=60.0, max_multi_line=2):
         """
@@ -118,6 +142,74 @@ class IDContext(ABC):
         # Extract ID information and house it in a dictionary, which is returned.
         return self._dictify(match_contexts, id_string, barcode_data, fuzzy_min_ratio, max_multi_line)
 
+    def get_field_regions(self):
+        """
+        Returns the regions in which the field values are located on the ID document.
+
+        Returns:
+            - (list): A list of dictionaries that describe the field regions.
+            - (None): If the ID document does not have a fixed layout.
+
+        """
+        return self._field_regions
+
+    def get_id_info_from_fields(self, field_texts, barcode_data=None):
+        """
+        Responsible for extracting ID information from the OCR output of the individual field regions and housing
+        said information in a convenient dictionary.
+
+        :param field_texts (dict): The OCR output string of every field region, keyed by field name.
+        :param barcode_data (dict): A dictionary object containing information extracted from a barcode.
+
+        Returns:
+            - (dict): A dictionary object containing the relevant, extracted ID information.
+            - (None): If the ID information extracted from the field regions is not trustworthy, in which
+                case the entire ID document should be passed through OCR instead.
+
+        Raises:
+            - TypeError: If field_texts is not a dictionary.
+            - TypeError: If barcode_data is not a dictionary.
+            - ValueError: If the ID context does not define any field regions.
+
+        """
+        if not isinstance(field_texts, dict):
+            raise TypeError(
+                'Bad type for arg field_texts - expected dictionary. Received type "%s".' %
+                type(field_texts).__name__
+            )
+        if barcode_data and not isinstance(barcode_data, dict):
+            raise TypeError(
+                'Bad type for arg barcode_data - expected dictionary. Received type "%s".' %
+                type(barcode_data).__name__
+            )
+        if not self._field_regions:
+            raise ValueError('%s does not define any field regions' % type(self).__name__)
+        return self._dictify_fields(field_texts, barcode_data)
+
+    def _dictify_fields(self, field_texts, barcode_data):
+        """
+        Normalises the OCR output of every field region according to the match context of the field.
+        Subclasses may override this in order to validate and post-process the extracted information.
+
+        :param field_texts (dict): The OCR output string of every field region, keyed by field name.
+        :param barcode_data (dict): A dictionary object containing information extracted from a barcode.
+
+        Returns:
+            - (dict): A dictionary object containing the relevant, extracted ID information.
+            - (None): If the ID information extracted from the field regions is not trustworthy.
+
+        """
+        id_info = {}
+        for match_context in self._match_contexts:
+            field_text = field_texts.get(match_context['field'])
+            if not field_text:
+                continue
+            # Field values are expected on a single line, so collapse any line breaks and surplus whitespace.
+            match = self._normalise_match(match_context, ' '.join(field_text.split()))
+            if match:
+                id_info[match_context['field']] = match
+        return id_info
+
     def _filter_ignore_match_contexts(self, ignore_fields):
         """
         Filters out fields which are to be ignored from the match_contexts.
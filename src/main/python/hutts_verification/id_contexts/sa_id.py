@@ -35,18 +35,20 @@ class SAID(IDContext):
     # Define a class-level constant as a year delta for year threshold.
     YEAR_DELTA = 100
 
-    def __init__(self, match_contexts):
+    def __init__(self, match_contexts, field_regions=None):
         """
         Initialises the SAID object.
 
         :param match_contexts (list): A list of dictionaries that contain the contextual
                 information used in the process of retrieving field values from the OCR output string.
+        :param field_regions (list): A list of dictionaries that describe where the field values are located
+                on ID documents with a fixed layout.
 
         """
         # Logging for debugging purposes.
         logger.debug('Initialising %s...' % type(self).__name__)
         # Initialise parent.
-        IDContext.__init__(self, match_contexts)
+        IDContext.__init__(self, match_contexts, field_regions)
 
     def _dictify(self, match_contexts, id_string, barcode_data, fuzzy_min_ratio, max_multi_line):
         """
@@ -86,6 +88,36 @@ class SAID(IDContext):
         # Return the info that was found.
         return id_info
 
+    def _dictify_fields(self, field_texts, barcode_data):
+        """
+        This function is responsible for generating a dictionary object containing the relevant ID information
+        from the OCR output of the individual field regions.
+        The information is only trusted if a valid ID number could be retrieved, either from the barcode data or
+        from the identity number field region.
+
+        :param field_texts (dict): The OCR output string of every field region, keyed by field name.
+        :param barcode_data (dict): A dictionary object containing information extracted from a barcode.
+
+        Returns:
+            - (dict): A dictionary object containing the relevant, extracted ID information.
+            - (None): If no valid ID number could be retrieved.
+
+        """
+        id_info = IDContext._dictify_fields(self, field_texts, barcode_data)
+        # The ID number embedded in the barcode is more reliable than the one retrieved through OCR.
+        if barcode_data:
+            id_info['identity_number'] = barcode_data['identity_number']
+        id_number = id_info.get('identity_number')
+        if not id_number or not id_number.isnumeric() or not self.validate_id_number(id_number):
+            logger.debug('No valid ID number found in the field regions')
+            return None
+        # It should overwrite any existing fields that can be extracted from the id number, since
+        # the information embedded within the id number is more reliable, at least theoretically.
+        self._id_number_information_extraction(self._match_contexts, id_info, id_number)
+        # Perform some custom post-processing on the information that was extracted.
+        self._post_process(id_info)
+        return id_info
+
     def _populate_id_information(self, match_contexts, id_string, id_info, fuzzy_min_ratio, max_multi_line):
         """
         This function is responsible for populating a dictionary object with information that it is able to find
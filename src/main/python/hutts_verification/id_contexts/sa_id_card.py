@@ -3,6 +3,7 @@ This file contains the logic for South African ID card context.
 """
 
 from hutts_verification.id_contexts.id_context import FieldType, LineType
+from hutts_verification.id_contexts.id_context import ALPHA_WHITELIST, NUMERIC_WHITELIST, ALPHANUMERIC_WHITELIST
 from hutts_verification.id_contexts.sa_id import SAID
 from hutts_verification.utils.hutts_logger import logger
 
@@ -86,8 +87,42 @@ class SAIDCard(SAID):
             'line_type': LineType.TITLED_NEWLINE,
             'multi_line': False
         }]
+        # Specify the regions in which the field values are located on the card.
+        field_regions = [{
+            'field': 'surname',
+            'region': (0.26, 0.275, 0.70, 0.320),
+            'whitelist': ALPHA_WHITELIST
+        }, {
+            'field': 'names',
+            'region': (0.26, 0.345, 0.70, 0.395),
+            'whitelist': ALPHA_WHITELIST
+        }, {
+            'field': 'sex',
+            'region': (0.26, 0.435, 0.34, 0.478),
+            'whitelist': ALPHA_WHITELIST
+        }, {
+            'field': 'nationality',
+            'region': (0.26, 0.520, 0.45, 0.565),
+            'whitelist': ALPHA_WHITELIST
+        }, {
+            'field': 'identity_number',
+            'region': (0.26, 0.608, 0.50, 0.650),
+            'whitelist': NUMERIC_WHITELIST
+        }, {
+            'field': 'date_of_birth',
+            'region': (0.26, 0.695, 0.50, 0.740),
+            'whitelist': ALPHANUMERIC_WHITELIST
+        }, {
+            'field': 'country_of_birth',
+            'region': (0.26, 0.786, 0.50, 0.830),
+            'whitelist': ALPHA_WHITELIST
+        }, {
+            'field': 'status',
+            'region': (0.26, 0.870, 0.50, 0.915),
+            'whitelist': ALPHA_WHITELIST
+        }]
         # Initialise parent.
-        SAID.__init__(self, match_contexts)
+        SAID.__init__(self, match_contexts, field_regions)
 
     def _get_idiosyncratic_match(self, match_context, id_string_list, current_index):
         """
@@ -5,6 +5,7 @@ card context. It is mainly intended for demonstration purposes.
 
 import re
 from hutts_verification.id_contexts.id_context import IDContext, FieldType, LineType
+from hutts_verification.id_contexts.id_context import ALPHA_WHITELIST, NUMERIC_WHITELIST
 from hutts_verification.utils.hutts_logger import logger
 
 __author__ = "Jan-Justin van Tonder"
@@ -48,8 +49,19 @@ class UPStudentCard(IDContext):
             'line_type': LineType.TITLED_NEWLINE,
             'multi_line': False,
         }]
+        # Specify the regions in which the title line (e.g. 'Mr J Smith') and the student/staff number
+        # are located on the card.
+        field_regions = [{
+            'field': 'title_line',
+            'region': (0.35, 0.62, 0.98, 0.74),
+            'whitelist': ALPHA_WHITELIST
+        }, {
+            'field': 'identity_number',
+            'region': (0.35, 0.74, 0.98, 0.86),
+            'whitelist': NUMERIC_WHITELIST
+        }]
         # Initialise parent
-        IDContext.__init__(self, match_contexts)
+        IDContext.__init__(self, match_contexts, field_regions)
 
     def _dictify(self, match_contexts, id_string, barcode_data, fuzzy_min_ratio, max_multi_line):
         """
@@ -84,26 +96,64 @@ class UPStudentCard(IDContext):
                     id_info['identity_number'] = re.sub('[^\d]', '', line)
                 # Retrieve some more information from the previous line.
                 if line_index - 1 >= 0:
-                    try:
-                        # Split the line on spaces.
-                        id_line = id_string.split('\n')[line_index - 1].split(' ')
-                        # Attempt to extrapolate sex.
-                        sex = 'M' if id_line[0] == 'Mr' else None
-                        sex = 'F' if id_line[0] == 'Mrs' or id_line[0] == 'Miss' else sex
-                        # Attempt to get initials
-                        id_line.pop(0)
-                        initials = id_line[0]
-                        # Re-combine the rest of the list to get the surname.
-                        id_line.pop(0)
-                        surname = ' '.join(id_line)
-                        # Populate the id_info list to be returned.
-                        if sex is not None:
-                            id_info['sex'] = sex
-                        id_info['names'] = initials
-                        id_info['surname'] = surname
-                    except IndexError:
-                        # Log error and return with what we have.
-                        logger.warning('Failed to extract some ID information...')
-                        return id_info
+                    self._extract_title_line(id_string.split('\n')[line_index - 1], id_info)
                 break
         return id_info
+
+    def _dictify_fields(self, field_texts, barcode_data):
+        """
+        This function is responsible for generating a dictionary object containing the relevant ID information
+        from the OCR output of the individual field regions.
+        The information is only trusted if a valid student/staff number could be retrieved.
+
+        :param field_texts (dict): The OCR output string of every field region, keyed by field name.
+        :param barcode_data (dict): A dictionary object containing information extracted from a barcode.
+
+        Returns:
+            - (dict): A dictionary object containing the relevant, extracted ID information.
+            - (None): If no valid student/staff number could be retrieved.
+
+        """
+        id_info = {}
+        # Check if barcode data is available.
+        if barcode_data and barcode_data['identity_number']:
+            id_info['identity_number'] = barcode_data['identity_number']
+        else:
+            identity_number = re.sub(r'[^\d]', '', field_texts.get('identity_number', ''))
+            if not re.fullmatch(r'[0-9]{6,10}', identity_number):
+                logger.debug('No valid student/staff number found in the field regions')
+                return None
+            id_info['identity_number'] = identity_number
+        self._extract_title_line(' '.join(field_texts.get('title_line', '').split()), id_info)
+        return id_info
+
+    @staticmethod
+    def _extract_title_line(line, id_info):
+        """
+        Extracts the sex, initials and surname from the title line of the card, e.g. 'Mr J Smith',
+        and populates a given dictionary object with the extracted information.
+
+        :param line (str): The title line of the card.
+        :param id_info (dict): A dictionary object used to house extracted ID information.
+
+        """
+        try:
+            # Split the line on spaces.
+            id_line = line.split(' ')
+            # Attempt to extrapolate sex.
+            sex = 'M' if id_line[0] == 'Mr' else None
+            sex = 'F' if id_line[0] == 'Mrs' or id_line[0] == 'Miss' else sex
+            # Attempt to get initials
+            id_line.pop(0)
+            initials = id_line[0]
+            # Re-combine the rest of the list to get the surname.
+            id_line.pop(0)
+            surname = ' '.join(id_line)
+            # Populate the id_info list to be returned.
+            if sex is not None:
+                id_info['sex'] = sex
+            id_info['names'] = initials
+            id_info['surname'] = surname
+        except IndexError:
+            # Log error and return with what we have.
+            logger.warning('Failed to extract some ID information...')
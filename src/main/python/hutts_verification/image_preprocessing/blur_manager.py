@@ -11,6 +11,9 @@ __maintainer__ = "Stephan Nell"
 __email__ = "nellstephanj@gmail.com"
 __status__ = "Development"
 
+"""The blur types that can be applied."""
+BLUR_TYPES = ("normal", "gaussian", "median")
+
 
 class BlurManager:
     """
@@ -36,11 +39,23 @@ class BlurManager:
         self.blur_type = blur_type
         self.kernel_size = kernel_size
 
-    def apply(self, image):
+    def is_linear(self):
+        """
+        Checks whether the blur is a linear filter, in which case blurring commutes with weighted sums of channels.
+
+        Returns:
+            - (bool): Whether or not the blur is a normal or Gaussian blur.
+
+        """
+        return self.blur_type in ("gaussian", "normal")
+
+    def apply(self, image, dst=None):
         """
         This performs the blurring.
 
         :param image: The image to be blurred.
+        :param dst (obj): An image of the same shape and type as the image that the result is written to,
+                instead of a new image.
 
         Raises:
             - NameError: If invalid blur type is provided i.e. Normal, Gaussian or Median.
@@ -50,20 +65,21 @@ class BlurManager:
 
         """
         if self.blur_type == "gaussian":
-            return self.gaussianBlur(image, self.kernel_size)
+            return self.gaussianBlur(image, self.kernel_size, dst)
         elif self.blur_type == "normal":
-            return self.blur(image, self.kernel_size)
+            return self.blur(image, self.kernel_size, dst)
         elif self.blur_type == "median":
-            return self.medianBlur(image, self.kernel_size)
+            return self.medianBlur(image, self.kernel_size, dst)
         else:
             raise NameError('Invalid Blur Selection! Try "normal", "gaussian" or "median" thresholding types.')
 
-    def blur(self, image, blur_kernel=[(3, 3)]):
+    def blur(self, image, blur_kernel=[(3, 3)], dst=None):
         """
         This function applies basic blurring to the image passed.
 
         :param image (obj): OpenCV image to which basic blurring should be applied to.
         :param blur_kernel (int list): Represent the kernel dimension by which basic blurring should be applied to.
+        :param dst (obj): An image that the result is written to, instead of a new image.
 
         Raises:
             - ValueError: If a blur_kernel with an invalid length is provided.
@@ -78,16 +94,17 @@ class BlurManager:
         if not len(blur_kernel[0]) == 2:
             raise ValueError('Invalid kernel size - blur_kernel list can only contain 2 items.')
         for (kX, kY) in blur_kernel:
-            blurred = cv2.blur(image, (kX, kY))
+            blurred = cv2.blur(image, (kX, kY), dst)
         return blurred
 
-    def gaussianBlur(self, image, blur_kernel=[(7, 7)]):
+    def gaussianBlur(self, image, blur_kernel=[(7, 7)], dst=None):
         """
         This function applies Gaussian blurring to the image passed.
 
         :param image (obj): OpenCV image to which Gaussian blurring should be applied to.
         :param blur_kernel (Integer list): Represent the kernel dimension by which basic blurring
                 should be applied to.
+        :param dst (obj): An image that the result is written to, instead of a new image.
 
         Raises:
             - ValueError: If a blur_kernel with an invalid length is provided.
@@ -101,15 +118,16 @@ class BlurManager:
         if not len(blur_kernel[0]) == 2:
             raise ValueError('Invalid kernel size - blur_kernel list can only contain 2 items.')
         for (kX, kY) in blur_kernel:
-            blurred = cv2.GaussianBlur(image, (kX, kY), 0)
+            blurred = cv2.GaussianBlur(image, (kX, kY), 0, dst)
         return blurred
 
-    def medianBlur(self, image, blur_kernel=[3]):
+    def medianBlur(self, image, blur_kernel=[3], dst=None):
         """
         This function applies Median blurring to the image passed.
 
         :param image (obj): OpenCV image to which Median blurring should be applied to.
         :param blur_kernel (int list): Represent the kernel dimension by which median blurring should be applied to.
+        :param dst (obj): An image that the result is written to, instead of a new image.
 
         Raises:
             - TypeError: If  a blur_kernel is not of type list.
@@ -124,5 +142,5 @@ class BlurManager:
         if not len(blur_kernel) == 1:
             raise ValueError('Invalid kernel size only one integer value should be provided')
         for k in blur_kernel:
-            blurred = cv2.medianBlur(image, k)
+            blurred = cv2.medianBlur(image, k, dst)
         return blurred
@@ -1,15 +1,35 @@
 """
 This class is responsible for controlling the PipelineBuilder.
+
+Text extraction pipelines are built once per combination of ID type and preferences, and the frozen pipelines are
+shared by all the requests (and threads) that use the same combination. Since different combinations often result
+in the same techniques, every distinct pipeline is only built once. The techniques are validated before a pipeline is
+built, so invalid preferences raise without being kept, and the least recently used pipelines are discarded once more
+than PIPELINE_CACHE_MAX_KEYS combinations are kept.
+
+Example usage:
+
+First import the build director module...
+from hutts_verification.image_preprocessing.build_director import BuildDirector
+then optionally build the pipelines of the default ID types ahead of the first requests...
+
+``BuildDirector.warm_up()``
+
+and retrieve the pipeline for a request.
+
+``pipeline = BuildDirector.construct_text_extract_pipeline(preferences, 'idcard')``
+
 """
 
-import os
-from hutts_verification.image_preprocessing.blur_manager import BlurManager
-from hutts_verification.image_preprocessing.color_manager import ColorManager
-from hutts_verification.image_preprocessing.face_manager import FaceDetector
+import threading
+from collections import OrderedDict
+from hutts_verification.image_preprocessing.blur_manager import BLUR_TYPES, BlurManager
+from hutts_verification.image_preprocessing.color_manager import EXTRACTED_CHANNELS, ColorManager
+from hutts_verification.image_preprocessing.face_manager import FaceDetector, get_detection_mode
 from hutts_verification.image_preprocessing.pipeline_builder import PipelineBuilder
-from hutts_verification.image_preprocessing.thresholding_manager import ThresholdingManager
+from hutts_verification.image_preprocessing.thresholding_manager import THRESHOLDING_TYPES, ThresholdingManager
 from hutts_verification.utils.hutts_logger import logger
-from hutts_verification.utils.pypath import correct_path
+from hutts_verification.utils.model_registry import SHAPE_PREDICTOR_PATH
 
 __authors__ = "Nicolai van Niekerk, Marno Hermann, Stephan Nell"
 __copyright__ = "Copyright 2017, Java the Hutts"
@@ -18,9 +38,22 @@ __maintainer__ = "Nicolai van Niekerk"
 __email__ = "nicvaniek@gmail.com"
 __status__ = "Development"
 
-# Constants path to trained data for Shape Predictor.
-SHAPE_PREDICTOR_PATH = correct_path("{base_path}/trained_data/shape_predictor_face_landmarks.dat".format(
-    base_path=os.path.abspath(os.path.dirname(__file__))))
+"""Specifies the ID types whose text extraction pipelines are built by warm_up ('None' is used for unknown IDs)."""
+PIPELINE_DEFAULT_ID_TYPES = ('idcard', 'idbook', 'studentcard', 'None')
+"""Specifies the preferences that determine the techniques of a text extraction pipeline."""
+PIPELINE_PREFERENCES = ('blur_method', 'threshold_method', 'color')
+"""Specifies the maximum number of combinations of ID type and preferences, and of distinct techniques, whose
+pipelines are kept."""
+PIPELINE_CACHE_MAX_KEYS = 256
+
+"""Holds the pipelines keyed by ID type and preferences, from least to most recently used."""
+_pipelines = OrderedDict()
+"""Holds the distinct pipelines keyed by their techniques, from least to most recently used."""
+_distinct_pipelines = OrderedDict()
+"""Holds the number of pipelines that were found and that had to be looked up by their techniques."""
+_pipeline_stats = {'hit': 0, 'miss': 0}
+"""Guards the pipelines and their statistics."""
+_pipeline_lock = threading.Lock()
 
 
 class BuildDirector:
@@ -33,6 +66,8 @@ class BuildDirector:
         This function constructs the pipeline for text extraction.
         This includes building different managers with their specific parameters.
         These managers will be called within the pipeline when executed.
+        Pipelines are only built the first time they are used, after which the same frozen pipeline is returned
+        for the same ID type and preferences.
 
         :param preferences (dict): User-specified techniques to use in pipeline.
         :param identification_type (str): Contains the type of identification, this is used
@@ -41,10 +76,63 @@ class BuildDirector:
         Returns:
             - (obj): Pipeline used for text extraction.
 
+        Raises:
+            - TypeError: If the ID type or a technique is not a string.
+            - NameError: If a technique is not known.
+
         """
-        builder = PipelineBuilder()
-        # Use template matching to identify type here
+        if not isinstance(identification_type, str):
+            raise TypeError(
+                'Bad type for arg identification_type - expected string. Received type "%s".' %
+                type(identification_type).__name__
+            )
+        for preference in PIPELINE_PREFERENCES:
+            if preference in preferences and not isinstance(preferences[preference], str):
+                raise TypeError(
+                    'Bad type for preference %s - expected string. Received type "%s".' %
+                    (preference, type(preferences[preference]).__name__)
+                )
+        key = (identification_type, get_detection_mode()) + tuple(
+            preferences.get(preference, None) for preference in PIPELINE_PREFERENCES
+        )
+        with _pipeline_lock:
+            pipeline = _pipelines.get(key)
+            if pipeline is not None:
+                _pipelines.move_to_end(key)
+            _pipeline_stats['hit' if pipeline is not None else 'miss'] += 1
+        if pipeline is not None:
+            return pipeline
+
+        techniques = BuildDirector._text_extract_techniques(preferences, identification_type)
+        BuildDirector._check_text_extract_techniques(*techniques)
+        techniques += key[1:2]
+        with _pipeline_lock:
+            pipeline = _distinct_pipelines.get(techniques)
+        if pipeline is None:
+            pipeline = BuildDirector._build_text_extract_pipeline(*techniques[:-1])
+        with _pipeline_lock:
+            # Another thread may have built the same pipeline in the meantime, in which case theirs is kept.
+            pipeline = _distinct_pipelines.setdefault(techniques, pipeline)
+            _distinct_pipelines.move_to_end(techniques)
+            _pipelines[key] = pipeline
+            for pipelines in (_pipelines, _distinct_pipelines):
+                while len(pipelines) > PIPELINE_CACHE_MAX_KEYS:
+                    pipelines.popitem(last=False)
+        return pipeline
+
+    @staticmethod
+    def _text_extract_techniques(preferences, identification_type):
+        """
+        This function determines the techniques of the pipeline for text extraction.
 
+        :param preferences (dict): User-specified techniques to use in pipeline.
+        :param identification_type (str): Contains the type of identification, this is used
+                to determine which techniques are used.
+
+        Returns:
+            - (tuple): The blur method, blur kernel size, color extraction type, color and threshold method.
+
+        """
         if 'blur_method' in preferences:
             blur_method = preferences['blur_method']
         elif identification_type == 'idcard':
@@ -101,8 +189,49 @@ class BuildDirector:
         logger.debug("ColorXType: " + color_extraction_type)
         logger.debug("Color: " + color)
         logger.debug("Threshold Method: " + threshold_method)
+        return blur_method, tuple(blur_kernel_size), color_extraction_type, color, threshold_method
+
+    @staticmethod
+    def _check_text_extract_techniques(blur_method, blur_kernel_size, color_extraction_type, color,
+                                       threshold_method):
+        """
+        This function checks that the techniques of a pipeline for text extraction are known, so that pipelines
+        with invalid techniques are neither built nor kept.
+
+        :param blur_method (str): The blur method.
+        :param blur_kernel_size (tuple): The blur kernel sizes.
+        :param color_extraction_type (str): The color extraction type.
+        :param color (str): The color that is extracted.
+        :param threshold_method (str): The threshold method.
+
+        Raises:
+            - NameError: If the blur method, color or threshold method is not known.
+
+        """
+        if blur_method not in BLUR_TYPES:
+            raise NameError('Invalid Blur Selection! Try "normal", "gaussian" or "median" thresholding types.')
+        if color_extraction_type == 'extract' and color not in EXTRACTED_CHANNELS:
+            raise NameError('Invalid Colour Selection! Try "%s".' % '", "'.join(EXTRACTED_CHANNELS))
+        if threshold_method not in THRESHOLDING_TYPES:
+            raise NameError('Invalid Thresholding Selection! Try "adaptive" or "otsu" thresholding types.')
 
-        blur_manager = BlurManager(blur_method, blur_kernel_size)
+    @staticmethod
+    def _build_text_extract_pipeline(blur_method, blur_kernel_size, color_extraction_type, color, threshold_method):
+        """
+        This function builds a frozen pipeline for text extraction from its techniques.
+
+        :param blur_method (str): The blur method.
+        :param blur_kernel_size (tuple): The blur kernel sizes.
+        :param color_extraction_type (str): The color extraction type.
+        :param color (str): The color that is extracted.
+        :param threshold_method (str): The threshold method.
+
+        Returns:
+            - (obj): Pipeline used for text extraction.
+
+        """
+        builder = PipelineBuilder()
+        blur_manager = BlurManager(blur_method, list(blur_kernel_size))
         color_manager = ColorManager(color_extraction_type, color)
         threshold_manager = ThresholdingManager(threshold_method)
         face_detector = FaceDetector(SHAPE_PREDICTOR_PATH)
@@ -112,7 +241,9 @@ class BuildDirector:
         builder.set_face_detector(face_detector)
         builder.set_threshold_manager(threshold_manager)
 
-        return builder.get_result()
+        pipeline = builder.get_result()
+        pipeline.freeze()
+        return pipeline
 
     @staticmethod
     def construct_face_extract_pipeline():
@@ -125,10 +256,50 @@ class BuildDirector:
             - (obj): Pipeline for facial extraction.
 
         """
-        logger.debug("Shape Predictor path: " + SHAPE_PREDICTOR_PATH)
+        logger.debug("Shape Predictor path: " + str(SHAPE_PREDICTOR_PATH))
         builder = PipelineBuilder()
 
         face_detector = FaceDetector(SHAPE_PREDICTOR_PATH)
         builder.set_face_detector(face_detector)
 
         return builder.get_result()
+
+    @staticmethod
+    def warm_up(id_types=PIPELINE_DEFAULT_ID_TYPES):
+        """
+        Builds the text extraction pipelines of ID types with their default techniques, so that the first requests
+        do not have to build them.
+
+        :param id_types (tuple): The ID types whose pipelines should be built.
+
+        """
+        logger.info('Building text extraction pipelines...')
+        for identification_type in id_types:
+            BuildDirector.construct_text_extract_pipeline({}, identification_type)
+
+    @staticmethod
+    def stats():
+        """
+        Returns the statistics of the text extraction pipelines.
+
+        Returns:
+            - (dict): The number of distinct pipelines ("pipelines"), the number of combinations of ID type and
+                preferences they are kept for ("keys"), and the number of lookups that found a pipeline ("hit")
+                and that did not ("miss").
+
+        """
+        with _pipeline_lock:
+            stats = dict(_pipeline_stats)
+            stats['pipelines'] = len(_distinct_pipelines)
+            stats['keys'] = len(_pipelines)
+        return stats
+
+    @staticmethod
+    def clear():
+        """
+        Discards all of the text extraction pipelines, causing them to be built again the next time they are used.
+        """
+        with _pipeline_lock:
+            _pipelines.clear()
+            _distinct_pipelines.clear()
+            _pipeline_stats.update(hit=0, miss=0)
@@ -12,6 +12,18 @@ __maintainer__ = "Stephan Nell"
 __email__ = "nellstephanj@gmail.com"
 __status__ = "Development"
 
+"""The weights of the blue, green and red channels in the grayscale conversion of OpenCV."""
+GRAY_WEIGHTS = (0.114, 0.587, 0.299)
+"""The channels (blue, green and red) that are kept when a color is extracted."""
+EXTRACTED_CHANNELS = {
+    'green': (True, False, True),
+    'blue': (False, True, True),
+    'red': (True, True, False),
+    'red_blue': (False, True, False),
+    'green_blue': (False, False, True),
+    'green_red': (True, False, False)
+}
+
 
 class ColorManager:
     """
@@ -34,11 +46,13 @@ class ColorManager:
         self.channel = channel
         self.kernel_size = kernel_size
 
-    def apply(self, image):
+    def apply(self, image, dst=None):
         """
         This performs the specified processing technique.
 
         :param image: The image to which the technique must be applied.
+        :param dst (obj): An image with the shape of the image passed to write the result to, or None to allocate
+                a new image. It is ignored by histogram equalisation, which produces a grayscale image.
 
         Raises:
             - NameError: If an invalid color extraction type is provided (other than
@@ -49,19 +63,34 @@ class ColorManager:
 
         """
         if self.color_extraction_type == "extract":
-            return self.extractChannel(image, self.channel)
+            return self.extractChannel(image, self.channel, dst)
         elif self.color_extraction_type == "histogram":
             return self.histEqualisation(image)
         elif self.color_extraction_type == "blackHat":
-            return self.blackHat(image, self.kernel_size)
+            return self.blackHat(image, self.kernel_size, dst)
         elif self.color_extraction_type == "topHat":
-            return self.topHat(image, self.kernel_size)
+            return self.topHat(image, self.kernel_size, dst)
         elif self.color_extraction_type == "whiteHat":
-            return self.topHat(image, self.kernel_size)
+            return self.topHat(image, self.kernel_size, dst)
         else:
             raise NameError('Invalid Color extraction type! \n'
                             'Try: "histrogram", "extract", "blackhat", "topHat" or "whiteHat"')
 
+    def gray_weights(self):
+        """
+        Returns the weights with which the channels of an image contribute to the grayscale conversion of the
+        image once this manager has been applied to it. Extracting a color and converting the result to grayscale
+        is a weighted sum of the channels that are kept.
+
+        Returns:
+            - (tuple): The weights of the blue, green and red channels.
+            - (None): If this manager does not extract a color.
+
+        """
+        if self.color_extraction_type != "extract" or self.channel not in EXTRACTED_CHANNELS:
+            return None
+        return tuple(weight if kept else 0.0 for (weight, kept) in zip(GRAY_WEIGHTS, EXTRACTED_CHANNELS[self.channel]))
+
     @staticmethod
     def histEqualisation(image):
         """
@@ -76,12 +105,16 @@ class ColorManager:
         image_grey = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         return cv2.equalizeHist(image_grey)
 
-    def extractChannel(self, image, image_channel="green"):
+    def extractChannel(self, image, image_channel="green", dst=None):
         """
         This function extracts a selected color channel from an image.
+        The channels that are kept are copied and the others zeroed in a single pass, rather than splitting the
+        image into its channels and merging them with a zeroed image.
 
         :param image (obj): OpenCV image for which the image channel should be removed.
         :param image_channel (str): Color that should be removed (valid colors: 'red', 'green', 'blue').
+        :param dst (obj): An image with the shape of the image passed to write the result to, or None to allocate
+                a new image.
 
         Raises:
             - NameError: If invalid colour is selected (not red, green, blue).
@@ -90,25 +123,14 @@ class ColorManager:
             - (obj): A copy of the image passed but with a color channel removed.
 
         """
-        (B, G, R) = cv2.split(image)
-        zeros = np.zeros(image.shape[:2], dtype="uint8")
-
-        if image_channel == "green":
-            return cv2.merge([B, zeros, R])
-        elif image_channel == "blue":
-            return cv2.merge([zeros, G, R])
-        elif image_channel == "red":
-            return cv2.merge([B, G, zeros])
-        elif image_channel == "red_blue":
-            return cv2.merge([zeros, G, zeros])
-        elif image_channel == "green_blue":
-            return cv2.merge([zeros, zeros, R])
-        elif image_channel == "green_red":
-            return cv2.merge([B, zeros, zeros])
-        else:
+        if image_channel not in EXTRACTED_CHANNELS:
             raise NameError('Invalid Colour Selection! Only red, green, blue are valid colour selections')
+        mask = np.array(EXTRACTED_CHANNELS[image_channel], dtype="uint8")
+        if dst is None or dst.shape != image.shape or dst.dtype != image.dtype:
+            dst = np.empty_like(image)
+        return np.multiply(image, mask, out=dst)
 
-    def blackHat(self, image, rect_kernel_size=(13, 7)):
+    def blackHat(self, image, rect_kernel_size=(13, 7), dst=None):
         """
         This function applies blackhat color changes to the image passed.
 
@@ -116,6 +138,7 @@ class ColorManager:
                 applied to.
         :param rect_kernel_size (list): Represents the kernel dimensions by which blackHat morphology
                 changes should be applied to.
+        :param dst (obj): An image to write the result to, or None to allocate a new image.
 
         Raises:
             - TypeError: If the kernel size type is not a tuple.
@@ -130,15 +153,16 @@ class ColorManager:
         if not len(rect_kernel_size) == 2:
             raise ValueError('Invalid kernel size - rect_kernel_size list can only contain 2 items.')
         rectangle_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, rect_kernel_size)
-        return cv2.morphologyEx(image.copy(), cv2.MORPH_BLACKHAT, rectangle_kernel)
+        return cv2.morphologyEx(image, cv2.MORPH_BLACKHAT, rectangle_kernel, dst)
 
-    def topHat(self, image, rect_kernel_size=(13, 7)):
+    def topHat(self, image, rect_kernel_size=(13, 7), dst=None):
         """
         This function applies tophat color changes to the image passed.
 
         :param image (obj): Image to which top hat color changes should be applied to.
         :param rect_kernel_size (list): Represents the kernel dimension by which topHat morphology
                 changes should be applied to.
+        :param dst (obj): An image to write the result to, or None to allocate a new image.
 
         Raises:
             - TypeError: If the kernel size type is not a tuple.
@@ -153,4 +177,4 @@ class ColorManager:
         if not len(rect_kernel_size) == 2:
             raise ValueError('Invalid kernel Size - rect_kernel_size list can only contain 2 items.')
         rectangle_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, rect_kernel_size)
-        return cv2.morphologyEx(image, cv2.MORPH_TOPHAT, rectangle_kernel)
+        return cv2.morphologyEx(image, cv2.MORPH_TOPHAT, rectangle_kernel, dst)
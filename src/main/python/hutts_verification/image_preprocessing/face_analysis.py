@@ -0,0 +1,284 @@
+"""
+Wraps the functionality required to share the face analysis of the images processed by a single request.
+
+A request such as /verifyID looks for faces in the same images from more than one place: the face is blurred
+out before OCR, extracted from the ID and the profile picture, and located once more on the aligned faces to
+compute their descriptors. A face analysis caches the detections and aligned faces of every image, keyed by
+the identity of the image, so that every image is passed through the face detector at most once per request.
+
+Images that were derived from another image by a known transformation, such as the perspective transformation
+of an ID, share the detections of their source image, which are mapped onto the derived image.
+
+Example usage:
+
+First import the face analysis module...
+from hutts_verification.image_preprocessing import face_analysis
+then activate an analysis for the current thread while the images of a request are processed.
+
+``with face_analysis.analysing(face_analysis.FaceAnalysis()):``
+    ``face = face_detector.extract_face(image)``
+
+If no analysis has been activated for the current thread, the face detector works on every image as before.
+
+"""
+
+import threading
+from contextlib import contextmanager
+import cv2
+import dlib
+import numpy as np
+
+__author__ = "Stephan Nell"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Stephan Nell"
+__email__ = "nellstephanj@gmail.com"
+__status__ = "Development"
+
+"""Holds the face analysis of the current thread."""
+_local = threading.local()
+
+
+def image_key(image):
+    """
+    Returns the key that identifies an image within a face analysis.
+    The address of the pixel data is included, so that a view on a different part of the same array is
+    not mistaken for the image itself.
+
+    :param image (obj): The numpy image.
+
+    Returns:
+        - (tuple): The identity of the image.
+
+    """
+    return id(image), image.__array_interface__['data'][0], image.shape
+
+
+def transform_rectangle(rectangle, matrix):
+    """
+    Maps a rectangle onto another image using the matrix of the transformation between the images.
+    A rectangle that is rotated and scaled by an affine matrix keeps its centre and its (scaled) size, whereas
+    the bounding box of a rectangle that is transformed by a perspective matrix is returned.
+
+    :param rectangle (rectangle): The dlib rectangle in the coordinates of the original image.
+    :param matrix (obj): The 2x3 affine or 3x3 perspective transformation matrix (numpy array).
+
+    Returns:
+        - (rectangle): The dlib rectangle in the coordinates of the other image.
+
+    """
+    if matrix.shape == (2, 3):
+        (center_x, center_y) = matrix.dot([rectangle.center().x, rectangle.center().y, 1.0])
+        scale = np.sqrt(abs(np.linalg.det(matrix[:, :2])))
+        (half_width, half_height) = (rectangle.width() * scale / 2, rectangle.height() * scale / 2)
+        return dlib.rectangle(int(round(center_x - half_width)), int(round(center_y - half_height)),
+                              int(round(center_x + half_width)), int(round(center_y + half_height)))
+    corners = np.array([[
+        [rectangle.left(), rectangle.top()],
+        [rectangle.right(), rectangle.top()],
+        [rectangle.right(), rectangle.bottom()],
+        [rectangle.left(), rectangle.bottom()]
+    ]], dtype='float32')
+    corners = cv2.perspectiveTransform(corners, matrix)[0]
+    (left, top) = np.round(corners.min(axis=0)).astype(int)
+    (right, bottom) = np.round(corners.max(axis=0)).astype(int)
+    return dlib.rectangle(int(left), int(top), int(right), int(bottom))
+
+
+class _Entry:
+    """
+    A single cached result of a face analysis, which is computed by the first thread that asks for it.
+
+    :image (obj): The image the result belongs to, which is kept so that its identity can not be reused.
+    :value (obj): The result, once it has been computed.
+    :error (Exception): The error raised while computing the result, if any.
+
+    """
+    __slots__ = ('image', 'value', 'error', '_done')
+
+    def __init__(self, image):
+        """
+        Responsible for initialising the _Entry object.
+
+        :param image (obj): The image the result belongs to.
+
+        """
+        self.image = image
+        self.value = None
+        self.error = None
+        self._done = threading.Event()
+
+    def resolve(self, compute):
+        """
+        Computes the result and wakes up the threads waiting for it.
+
+        :param compute (function): Computes the result.
+
+        """
+        try:
+            self.value = compute()
+        except Exception as error:
+            self.error = error
+        finally:
+            self._done.set()
+
+    def result(self):
+        """
+        Waits for the result to be computed and returns it.
+
+        Returns:
+            - (obj): The result.
+
+        Raises:
+            - Exception: The error raised while computing the result.
+
+        """
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class FaceAnalysis:
+    """
+    Caches the face detections and aligned faces of the images processed by a single request.
+    A face analysis may be shared by the threads of the request: a result that is being computed by one
+    thread is waited for by the others instead of being computed twice.
+
+    :_entries (dict): The cached results, keyed by the kind of result and the identity of the image.
+    :_derived (dict): The source image and transformation matrix of every derived image, keyed by the identity
+            of the derived image.
+    :_faces (dict): The rectangle of the face within every aligned face, keyed by the identity of the aligned face.
+    :_lock (Lock): Guards the dictionaries.
+
+    """
+    def __init__(self):
+        """
+        Responsible for initialising the FaceAnalysis object.
+        """
+        self._entries = {}
+        self._derived = {}
+        self._faces = {}
+        self._lock = threading.Lock()
+
+    def derive(self, derived, source, matrix):
+        """
+        Records that an image was derived from another image, so that the detections of the source image are
+        reused for the derived image.
+
+        :param derived (obj): The derived image.
+        :param source (obj): The image from which it was derived.
+        :param matrix (obj): The 2x3 affine or 3x3 perspective matrix (numpy array) that maps the coordinates of
+                the source image onto the derived image.
+
+        """
+        with self._lock:
+            self._derived[image_key(derived)] = (derived, source, matrix)
+
+    def detection(self, image, detect):
+        """
+        Returns the face detected in an image, detecting it only if it has not been detected during the
+        request yet.
+
+        :param image (obj): The image containing the face.
+        :param detect (function): Detects the face in an image, returning its dlib rectangle or None.
+
+        Returns:
+            - (rectangle): The dlib rectangle of the face.
+            - (None): If no face was found.
+
+        """
+        derivation = self._derived.get(image_key(image))
+        if derivation is not None:
+            (_, source, matrix) = derivation
+            rectangle = self.detection(source, detect)
+            return None if rectangle is None else transform_rectangle(rectangle, matrix)
+        return self._memoise('detection', image, lambda: detect(image))
+
+    def alignment(self, image, align):
+        """
+        Returns the aligned face of an image, aligning it only if it has not been aligned during the request yet.
+        The rectangle of the face within the aligned face is recorded, so that it can be looked up by face_rectangle.
+
+        :param image (obj): The image containing the face.
+        :param align (function): Aligns the face in an image, returning the aligned face and the dlib rectangle
+                of the face within the aligned face (or None if no face was found).
+
+        Returns:
+            - (obj): The aligned face.
+
+        """
+        def compute():
+            (face, rectangle) = align(image)
+            if rectangle is not None:
+                with self._lock:
+                    self._faces[image_key(face)] = (face, rectangle)
+            return face
+        return self._memoise('alignment', image, compute)
+
+    def face_rectangle(self, face):
+        """
+        Returns the rectangle of the face within an aligned face that was produced during the request.
+
+        :param face (obj): The aligned face.
+
+        Returns:
+            - (rectangle): The dlib rectangle of the face.
+            - (None): If the face was not aligned during the request.
+
+        """
+        record = self._faces.get(image_key(face))
+        return None if record is None else record[1]
+
+    def _memoise(self, kind, image, compute):
+        """
+        Returns a cached result, computing it if no thread has done so yet.
+
+        :param kind (str): The kind of result.
+        :param image (obj): The image the result belongs to.
+        :param compute (function): Computes the result.
+
+        Returns:
+            - (obj): The result.
+
+        """
+        key = (kind,) + image_key(image)
+        with self._lock:
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = _Entry(image)
+        if owner:
+            entry.resolve(compute)
+        return entry.result()
+
+
+def current_analysis():
+    """
+    Returns the face analysis of the current thread.
+
+    Returns:
+        - (FaceAnalysis): The face analysis of the current thread.
+        - (None): If no face analysis has been activated for the current thread.
+
+    """
+    return getattr(_local, 'analysis', None)
+
+
+@contextmanager
+def analysing(analysis):
+    """
+    Activates a face analysis for the current thread within the context.
+
+    :param analysis (FaceAnalysis): The face analysis to activate, or None to deactivate the face analysis.
+
+    Returns:
+        - (FaceAnalysis): The activated face analysis.
+
+    """
+    previous = current_analysis()
+    _local.analysis = analysis
+    try:
+        yield analysis
+    finally:
+        _local.analysis = previous
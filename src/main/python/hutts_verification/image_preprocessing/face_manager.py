@@ -6,9 +6,13 @@ import os
 from pathlib import Path
 import cv2
 import dlib
-from imutils.face_utils import FaceAligner
-from imutils.face_utils import rect_to_bb
+import numpy as np
+from imutils.face_utils import FACIAL_LANDMARKS_IDXS
+from imutils.face_utils import rect_to_bb, shape_to_np
+from hutts_verification.image_preprocessing.face_analysis import current_analysis, transform_rectangle
 from hutts_verification.utils.hutts_logger import logger
+from hutts_verification.utils.metrics import face_detections
+from hutts_verification.utils.model_registry import model_registry
 from hutts_verification.utils.pypath import correct_path
 
 __authors__ = "Stephan Nell, Nicolai van Niekerk"
@@ -20,6 +24,85 @@ __status__ = "Development"
 
 TEMPLATE_DIR = correct_path(Path(os.path.abspath(os.path.dirname(__file__)), 'templates'))
 FACE_NOT_FOUND_PLACE_HOLDER = cv2.imread(TEMPLATE_DIR + "/profile.jpg")
+# The width and height of an aligned face.
+ALIGNED_FACE_SIZE = 256
+# The position of the left eye within an aligned face, as a fraction of its width and height.
+ALIGNED_LEFT_EYE = (0.35, 0.35)
+# The number of times the image is upsampled before detection when no upsample policy is given.
+FACE_DETECTION_DEFAULT_UPSAMPLE = 1
+# The upsample policy that upsamples the working copy once if its longest side is at most this size.
+FACE_DETECTION_AUTO_UPSAMPLE_MAX_SIDE = 800
+
+# The longest side of the working copy used for detection when none is given (None uses the full resolution).
+_detection_max_side = None
+# The upsample policy used for detection when none is given.
+_detection_upsample = FACE_DETECTION_DEFAULT_UPSAMPLE
+
+
+def set_detection_mode(max_side=None, upsample=FACE_DETECTION_DEFAULT_UPSAMPLE):
+    """
+    Sets the detection mode used by face detectors that are not given one explicitly.
+
+    :param max_side (int): The longest side of the working copy of the image that faces are detected in.
+            Images are detected at full resolution if None is given.
+    :param upsample (int or str): The number of times the working copy is upsampled before detection, or 'auto'
+            to upsample it once if its longest side is at most FACE_DETECTION_AUTO_UPSAMPLE_MAX_SIDE.
+
+    Raises:
+        - ValueError: If the maximum side is not positive or the upsample policy is not recognised.
+
+    """
+    global _detection_max_side, _detection_upsample
+    _check_detection_mode(max_side, upsample)
+    _detection_max_side = max_side
+    _detection_upsample = upsample
+
+
+def get_detection_mode():
+    """
+    Returns the detection mode used by face detectors that are not given one explicitly.
+
+    Returns:
+        - (int): The longest side of the working copy of the image, or None for the full resolution.
+        - (int or str): The upsample policy.
+
+    """
+    return _detection_max_side, _detection_upsample
+
+
+def upsample_policy(value):
+    """
+    Parses an upsample policy given as a string, e.g. on the command line.
+
+    :param value (str): The number of times to upsample or 'auto'.
+
+    Returns:
+        - (int or str): The upsample policy.
+
+    Raises:
+        - ValueError: If the value is not 'auto' or a non-negative integer.
+
+    """
+    policy = value if value == 'auto' else int(value)
+    _check_detection_mode(None, policy)
+    return policy
+
+
+def _check_detection_mode(max_side, upsample):
+    """
+    Checks whether a detection mode is valid.
+
+    :param max_side (int): The longest side of the working copy of the image.
+    :param upsample (int or str): The upsample policy.
+
+    Raises:
+        - ValueError: If the maximum side is not positive or the upsample policy is not recognised.
+
+    """
+    if max_side is not None and (not isinstance(max_side, int) or max_side < 1):
+        raise ValueError('The maximum side of the working copy must be a positive integer.')
+    if upsample != 'auto' and (not isinstance(upsample, int) or upsample < 0):
+        raise ValueError('The upsample policy must be "auto" or a non-negative integer.')
 
 
 class FaceDetector:
@@ -31,17 +114,30 @@ class FaceDetector:
     3. Applying blurring on a detected face in an image.
 
     """
-    def __init__(self, shape_predictor_path):
+    def __init__(self, shape_predictor_path, max_side=None, upsample=None):
         """
         Initialise Face Detector Manager.
+        The dlib models are retrieved from the model registry, so that they are only loaded once per process.
 
         :param shape_predictor_path (str): Describes the path to the Shape Predictor trained data.
+        :param max_side (int): The longest side of the working copy of the image that faces are detected in.
+                The detection mode set by set_detection_mode is used if neither max_side nor upsample is given.
+        :param upsample (int or str): The number of times the working copy is upsampled before detection,
+                or 'auto'.
+
+        Raises:
+            - ValueError: If the maximum side is not positive or the upsample policy is not recognised.
 
         """
+        if max_side is None and upsample is None:
+            (max_side, upsample) = (_detection_max_side, _detection_upsample)
+        elif upsample is None:
+            upsample = FACE_DETECTION_DEFAULT_UPSAMPLE
+        _check_detection_mode(max_side, upsample)
+        self.max_side = max_side
+        self.upsample = upsample
         self.shape_predictor_path = shape_predictor_path
-        self.predictor = dlib.shape_predictor(self.shape_predictor_path)
-        self.detector = dlib.get_frontal_face_detector()
-        self.face_aligner = FaceAligner(self.predictor, desiredFaceWidth=256)
+        self.predictor = model_registry.shape_predictor(self.shape_predictor_path)
 
     def detect(self, image):
         """
@@ -50,11 +146,17 @@ class FaceDetector:
         we are able to detect the face with less false-positive results and without a major time penalty.
         More Information dlib frontal_face detection: http://dlib.net/imaging.html#get_frontal_face_detector
 
+        If a maximum side has been set, the face is detected in a copy of the image that is scaled down to fit
+        within it, after which the location of the face is scaled back up to the full resolution.
+
         A check will be done to see if a face is present in the image.
         If a face is not detected in the image the execution should log that the face was not found and continue
         with execution. This is due to the fact that face detection might not be critical to
         a function (like with text extraction) and rather be used to increase accuracy.
 
+        If a face analysis has been activated for the current thread, the face is only detected if it has not
+        been detected in the image during the request yet.
+
         :param image (obj): OpenCV image containing the face we need to detect.
 
         Raises:
@@ -64,15 +166,51 @@ class FaceDetector:
             - list(int): This list contains the box coordinates for the region in which the face resides.
 
         """
-        rectangles = self.detector(image, 1)
+        analysis = current_analysis()
+        if analysis is not None:
+            return analysis.detection(image, self._detect)
+        return self._detect(image)
+
+    def _detect(self, image):
+        """
+        Runs the face detector on the working copy of the image passed.
+
+        :param image (obj): OpenCV image containing the face we need to detect.
+
+        Returns:
+            - (rectangle): The dlib rectangle of the first face found, in the coordinates of the image passed.
+            - (None): If no face was found.
+
+        """
+        longest_side = max(image.shape[:2])
+        scale = 1.0
+        if self.max_side is not None and longest_side > self.max_side:
+            scale = self.max_side / longest_side
+            image = cv2.resize(image, (max(int(round(image.shape[1] * scale)), 1),
+                                       max(int(round(image.shape[0] * scale)), 1)), interpolation=cv2.INTER_AREA)
+        upsample = self.upsample
+        if upsample == 'auto':
+            upsample = 1 if max(image.shape[:2]) <= FACE_DETECTION_AUTO_UPSAMPLE_MAX_SIDE else 0
+        # Face detectors are shared by threads (e.g. through frozen pipelines), so every thread runs its own dlib
+        # detector.
+        rectangles = model_registry.frontal_face_detector()(image, upsample)
         if len(rectangles) == 0:
             logger.warning('No valid face found. Returning None')
-        return rectangles[0] if rectangles else None
+            face_detections.labels('miss').inc()
+            return None
+        face_detections.labels('hit').inc()
+        rectangle = rectangles[0]
+        if scale != 1.0:
+            rectangle = dlib.rectangle(int(round(rectangle.left() / scale)), int(round(rectangle.top() / scale)),
+                                       int(round(rectangle.right() / scale)), int(round(rectangle.bottom() / scale)))
+        return rectangle
 
     def extract_face(self, image):
         """
         This function finds a face in the image passed and is optimised
         to align the face before being returned.
+        If a face analysis has been activated for the current thread, the aligned face is reused if the face
+        in the image has already been extracted during the request.
 
         :param image (obj): Image containing the face we need to detect and extract.
 
@@ -82,12 +220,63 @@ class FaceDetector:
         Returns:
             - (obj): An image of the aligned face.
 
+        """
+        analysis = current_analysis()
+        if analysis is not None:
+            return analysis.alignment(image, self._extract_face)
+        return self._extract_face(image)[0]
+
+    def _extract_face(self, image):
+        """
+        Detects and aligns the face in the image passed.
+
+        :param image (obj): Image containing the face we need to detect and extract.
+
+        Returns:
+            - (obj): An image of the aligned face, or a placeholder if no face was found.
+            - (rectangle): The dlib rectangle of the face within the aligned face, or None if no face was found.
+
         """
         rectangle = self.detect(image)
         if rectangle is None:
-            return FACE_NOT_FOUND_PLACE_HOLDER
-        face_aligned = self.face_aligner.align(image, image, rectangle)
-        return face_aligned
+            return FACE_NOT_FOUND_PLACE_HOLDER, None
+        (face_aligned, matrix) = self.align(image, rectangle)
+        return face_aligned, transform_rectangle(rectangle, matrix)
+
+    def align(self, image, rectangle):
+        """
+        This function rotates and scales the face in the image passed so that the eyes of the face are
+        level and lie at a fixed position within the aligned face.
+
+        :param image (obj): Image containing the face.
+        :param rectangle (rectangle): The dlib rectangle of the face within the image.
+
+        Returns:
+            - (obj): An image of the aligned face.
+            - (obj): The 2x3 affine matrix (numpy array) that maps the image onto the aligned face.
+
+        """
+        shape = shape_to_np(self.predictor(image, rectangle))
+        (left_start, left_end) = FACIAL_LANDMARKS_IDXS['left_eye']
+        (right_start, right_end) = FACIAL_LANDMARKS_IDXS['right_eye']
+        left_eye_center = shape[left_start:left_end].mean(axis=0).astype('int')
+        right_eye_center = shape[right_start:right_end].mean(axis=0).astype('int')
+
+        # Rotate the face so that the eyes are level and scale it so that they are a fixed distance apart.
+        d_y = right_eye_center[1] - left_eye_center[1]
+        d_x = right_eye_center[0] - left_eye_center[0]
+        angle = np.degrees(np.arctan2(d_y, d_x)) - 180
+        desired_distance = (1.0 - 2 * ALIGNED_LEFT_EYE[0]) * ALIGNED_FACE_SIZE
+        scale = desired_distance / np.sqrt((d_x ** 2) + (d_y ** 2))
+        eyes_center = (float((left_eye_center[0] + right_eye_center[0]) // 2),
+                       float((left_eye_center[1] + right_eye_center[1]) // 2))
+        matrix = cv2.getRotationMatrix2D(eyes_center, angle, scale)
+
+        # Move the point between the eyes to its position within the aligned face.
+        matrix[0, 2] += ALIGNED_FACE_SIZE * 0.5 - eyes_center[0]
+        matrix[1, 2] += ALIGNED_FACE_SIZE * ALIGNED_LEFT_EYE[1] - eyes_center[1]
+        face_aligned = cv2.warpAffine(image, matrix, (ALIGNED_FACE_SIZE, ALIGNED_FACE_SIZE), flags=cv2.INTER_CUBIC)
+        return face_aligned, matrix
 
     def blur_face(self, image):
         """
@@ -4,7 +4,9 @@ from a high-level perspective.
 """
 
 import cv2
-import os
+import numpy as np
+from hutts_verification.utils.buffer_pool import get_buffer_pool
+from hutts_verification.utils.debug_sink import debug_enabled, debug_image
 from hutts_verification.utils.hutts_logger import logger
 
 __authors__ = "Nicolai van Niekerk, Stephan Nell"
@@ -14,8 +16,6 @@ __maintainer__ = "Nicolai van Niekerk"
 __email__ = "nicvaniek@gmail.com"
 __status__ = "Development"
 
-DESKTOP = os.path.join(os.path.join(os.path.expanduser('~')), 'Desktop')
-
 
 class Pipeline:
     """
@@ -26,6 +26,9 @@ class Pipeline:
     :param face_detector (FaceDetector): The FaceDetector that is used in this pipeline.
     :param threshold_manager (ThresholdManager): The ThresholdManager that is used in this pipeline.
 
+    A pipeline can be frozen once it has been built, after which its managers can no longer be replaced, so that it
+    can be shared by several threads.
+
     """
     def __init__(self, blur_manager=None, color_manager=None, face_detector=None, threshold_manager=None):
         """
@@ -42,14 +45,47 @@ class Pipeline:
         self.face_detector = face_detector
         self.threshold_manager = threshold_manager
 
-    def process_text_extraction(self, useIO, image, remove_face=False):
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_frozen', False):
+            raise AttributeError('The pipeline is frozen. Its "%s" can not be replaced.' % name)
+        super().__setattr__(name, value)
+
+    def freeze(self):
+        """
+        Freezes the pipeline, so that its managers can no longer be replaced.
+        """
+        self._frozen = True
+
+    def fused_weights(self):
+        """
+        Determines whether the blurring, color extraction and grayscale conversion of this pipeline can be fused
+        into a single pass. Extracting a color and converting the result to grayscale is a weighted sum of the
+        channels of the image, which can be taken before blurring if the blur is linear, or if only one channel is
+        kept (since a median commutes with scaling a single channel).
+
+        Returns:
+            - (tuple): The weights of the blue, green and red channels in the grayscale image.
+            - (None): If the steps can not be fused.
+
+        """
+        weights = self.color_manager.gray_weights()
+        if weights is None:
+            return None
+        if not self.blur_manager.is_linear() and sum(1 for weight in weights if weight) != 1:
+            return None
+        return weights
+
+    def process_text_extraction(self, useIO, image, remove_face=False, fused=True):
         """
         This function applies all the processing needed to extract text from a image.
 
-        :param useIO (boolean): Whether or not to write images to disk.
+        :param useIO (boolean): Whether or not to hand the intermediate images to the debug sink.
         :param image (obj): Image that should be processed.
         :param remove_face (boolean): If the remove face flag is set to true, extra processes will
                 be activated during the pre-processing phase to remove the face from the image.
+        :param fused (boolean): Whether or not the blurring, color extraction and grayscale conversion may be
+                fused into a single pass. They are performed separately if the intermediate images are recorded,
+                since the fused pass does not produce them.
 
         Returns:
             - (obj): The processed image.
@@ -61,34 +97,66 @@ class Pipeline:
             logger.info("Removing face: " + str(remove_face))
             image = self.face_detector.blur_face(image)
             if useIO:
-                cv2.imwrite(DESKTOP + "/output/4.png", image)
-
-        # Blur image.
-        logger.info("Blurring image...")
-        blur_image = self.blur_manager.apply(image)
-        if useIO:
-            cv2.imwrite(DESKTOP + "/output/5.png", blur_image)
-
-        # Apply channel image_processing, tophat, blackhat or histogram equalization.
-        logger.info("Removing color channel...")
-        color_image = self.color_manager.apply(blur_image)
-        if useIO:
-            cv2.imwrite(DESKTOP + "/output/6.png", color_image)
-
-        # Convert image to grayscale.
-        logger.info("Converting image to grayscale...")
-        gray_image = cv2.cvtColor(color_image, cv2.COLOR_BGR2GRAY)
-        if useIO:
-            cv2.imwrite(DESKTOP + "/output/7.png", gray_image)
-
-        # Apply thresholding.
-        logger.info("Applying thresholding...")
-        thresholded_image = self.threshold_manager.apply(gray_image)
-        if useIO:
-            cv2.imwrite(DESKTOP + "/output/8.png", thresholded_image)
+                debug_image('4_face_removed', image)
+
+        # The intermediate images are only recorded if a debug sink records them.
+        useIO = useIO and debug_enabled()
+        weights = self.fused_weights() if fused and not useIO else None
+        if weights is not None:
+            return self._process_fused(image, weights)
+
+        # The intermediate images are borrowed from the buffer pool, since only the thresholded image is returned.
+        pool = get_buffer_pool()
+        with pool.borrow(image.shape) as blur_buffer, pool.borrow(image.shape) as color_buffer, \
+                pool.borrow(image.shape[:2]) as gray_buffer:
+            # Blur image.
+            logger.info("Blurring image...")
+            blur_image = self.blur_manager.apply(image, blur_buffer)
+            if useIO:
+                debug_image('5_blurred', blur_image)
+
+            # Apply channel image_processing, tophat, blackhat or histogram equalization.
+            logger.info("Removing color channel...")
+            color_image = self.color_manager.apply(blur_image, color_buffer)
+            if useIO:
+                debug_image('6_color', color_image)
+
+            # Convert image to grayscale.
+            logger.info("Converting image to grayscale...")
+            gray_image = cv2.cvtColor(color_image, cv2.COLOR_BGR2GRAY, gray_buffer)
+            if useIO:
+                debug_image('7_gray', gray_image)
+
+            # Apply thresholding.
+            logger.info("Applying thresholding...")
+            thresholded_image = self.threshold_manager.apply(gray_image)
+            if useIO:
+                debug_image('8_thresholded', thresholded_image)
 
         return thresholded_image
 
+    def _process_fused(self, image, weights):
+        """
+        This function applies the preprocessing needed to extract text from an image in a single pass: the
+        grayscale image is computed directly as the weighted sum of the channels that are kept, after which only
+        that plane is blurred and thresholded. The intermediate images are borrowed from the buffer pool.
+
+        :param image (obj): Image that should be processed.
+        :param weights (tuple): The weights of the blue, green and red channels, as returned by fused_weights.
+
+        Returns:
+            - (obj): The processed image.
+
+        """
+        pool = get_buffer_pool()
+        with pool.borrow(image.shape[:2]) as gray_buffer, pool.borrow(image.shape[:2]) as blur_buffer:
+            logger.info("Converting image to grayscale with weights %s..." % (weights,))
+            gray_image = cv2.transform(image, np.array([weights]), gray_buffer)
+            logger.info("Blurring image...")
+            blur_image = self.blur_manager.apply(gray_image, blur_buffer)
+            logger.info("Applying thresholding...")
+            return self.threshold_manager.apply(blur_image)
+
     def process_face_extraction(self, image):
         """
         This function applies all the processing needed to extract a face from a image.
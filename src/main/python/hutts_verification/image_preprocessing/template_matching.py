@@ -1,14 +1,30 @@
 """
 Wraps the functionality required to dynamically deduce the type of identification
 documentation that has been provided in an image.
+
+The templates are described by manifests in the templates directory. ``manifest.json`` describes the bundled
+templates, and further templates can be added by dropping them into the templates directory along with a
+manifest of their own (any other ``.json`` file, read in alphabetical order after ``manifest.json``), e.g.::
+
+    {
+        "templates": [
+            {"file": "my_flag.jpg", "id_type": "mycard", "document_width": 1000, "threshold": 0.7}
+        ]
+    }
+
+Where ``document_width`` is the width (in pixels) of the document the template was taken from and ``threshold``
+is the score a match must exceed. Templates are searched for in the order in which they are described.
 """
 
+import json
+import sys
+from collections import namedtuple
 import cv2
 import os
 import numpy as np
-import imutils
 from pathlib import Path
 from hutts_verification.utils.hutts_logger import logger
+from hutts_verification.utils.metrics import template_matches
 from hutts_verification.utils.pypath import correct_path
 
 __author__ = "Marno Hermann"
@@ -19,6 +35,117 @@ __email__ = "marno@barnton-consulting.co.za"
 __status__ = "Development"
 
 TEMPLATE_DIR = correct_path(Path(os.path.abspath(os.path.dirname(__file__)), 'templates'))
+"""Specifies the smallest side (in pixels) a template may have at the coarsest level of its pyramid."""
+PYRAMID_MIN_TEMPLATE_SIZE = 16
+"""Specifies the maximum number of times a template is halved to build its pyramid."""
+PYRAMID_MAX_LEVEL = 3
+"""Specifies how much lower than the threshold of a template a coarse match may score to still be refined."""
+PYRAMID_COARSE_MARGIN = 0.25
+"""Specifies the maximum number of coarse matches of a template that are refined."""
+PYRAMID_MAX_CANDIDATES = 3
+"""Specifies the scales at which the source is searched if it could not be identified at the template's scale."""
+SEARCH_SCALES = np.linspace(0.8, 1.8, 10)[::-1]
+"""Specifies the name of the manifest that describes the bundled templates."""
+TEMPLATE_MANIFEST = 'manifest.json'
+
+"""
+A template that has been loaded and preprocessed.
+
+:id_type (str): The type of ID the template identifies.
+:document_width (int): The width of the document the template was taken from.
+:threshold (float): The score a match must exceed.
+:image (obj): The colour template.
+:coarse_image (obj): The coarsest grayscale version of the template.
+:level (int): The number of times the coarse template was halved.
+
+"""
+Template = namedtuple('Template', ['id_type', 'document_width', 'threshold', 'image', 'coarse_image', 'level'])
+
+
+class TemplateBank:
+    """
+    Loads, converts and pre-scales all of the templates described by the manifests in a directory.
+    The templates are read-only, so that a bank loaded before worker processes are forked is shared by
+    them through copy-on-write instead of being copied.
+
+    :templates (tuple): The loaded templates, in the order in which they should be searched for.
+
+    """
+    def __init__(self, templates):
+        """
+        Responsible for initialising the TemplateBank object.
+
+        :param templates (list): The loaded templates.
+
+        """
+        self.templates = tuple(templates)
+
+    @classmethod
+    def load(cls, directory=TEMPLATE_DIR):
+        """
+        Loads all of the templates described by the manifests in a directory.
+
+        :param directory (str): The directory containing the templates and their manifests.
+
+        Returns:
+            - (TemplateBank): The template bank.
+
+        Raises:
+            - ValueError: If a manifest is invalid or a template described by it could not be read.
+
+        """
+        logger.debug("Looking for the templates in directory: " + str(directory))
+        manifests = sorted(file_name for file_name in os.listdir(directory) if file_name.endswith('.json'))
+        if TEMPLATE_MANIFEST in manifests:
+            manifests.remove(TEMPLATE_MANIFEST)
+            manifests.insert(0, TEMPLATE_MANIFEST)
+        templates = []
+        for manifest in manifests:
+            try:
+                with open(os.path.join(directory, manifest)) as manifest_file:
+                    descriptions = json.load(manifest_file)['templates']
+                for description in descriptions:
+                    templates.append(cls._load_template(directory, description))
+            except (KeyError, TypeError, ValueError) as error:
+                raise ValueError('Invalid template manifest "%s": %s' % (manifest, error))
+        logger.debug('Loaded %d templates' % len(templates))
+        return cls(templates)
+
+    @staticmethod
+    def _load_template(directory, description):
+        """
+        Loads and preprocesses a single template.
+
+        :param directory (str): The directory containing the template.
+        :param description (dict): The description of the template in its manifest.
+
+        Returns:
+            - (Template): The loaded template.
+
+        Raises:
+            - ValueError: If the template could not be read.
+
+        """
+        image = cv2.imread(os.path.join(directory, description['file']))
+        if image is None:
+            raise ValueError('Template "%s" could not be read' % description['file'])
+        coarse_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        level = 0
+        while level < PYRAMID_MAX_LEVEL and min(coarse_image.shape[:2]) // 2 >= PYRAMID_MIN_TEMPLATE_SIZE:
+            coarse_image = cv2.resize(coarse_image, (coarse_image.shape[1] // 2, coarse_image.shape[0] // 2),
+                                      interpolation=cv2.INTER_AREA)
+            level += 1
+        image.flags.writeable = False
+        coarse_image.flags.writeable = False
+        return Template(
+            # Interned so that the ID type can be compared with the literals used throughout the code.
+            sys.intern(str(description['id_type'])),
+            int(description['document_width']),
+            float(description['threshold']),
+            image,
+            coarse_image,
+            level
+        )
 
 
 class TemplateMatching:
@@ -26,12 +153,24 @@ class TemplateMatching:
     The TemplateMatching class receives template images to identify the type of identification
     that is used in the image.
     Thus you provide it with templates and it will identify whether you used an ID card, ID book etc.
+
+    The search is performed coarse-to-fine: every template is first matched against a grayscale, downscaled
+    version of the source and only the regions of the best coarse matches are matched against the full
+    resolution colour source to determine whether the template was found.
     """
-    def __init__(self):
-        logger.debug("Looking for the templates in directory: " + str(TEMPLATE_DIR))
-        self.template = [(1034, cv2.imread(TEMPLATE_DIR + "/temp_flag.jpg"), 0.75, "idcard"),
-                         (875, cv2.imread(TEMPLATE_DIR + "/wap.jpg"), 0.60, "idbook"),
-                         (1280, cv2.imread(TEMPLATE_DIR + "/pp2.jpg"), 0.60, "studentcard")]
+    def __init__(self, bank=None):
+        """
+        Initialise the TemplateMatching object.
+
+        :param bank (TemplateBank): The templates to search for. The templates loaded when the module was imported
+                are used if none are given.
+
+        """
+        bank = bank if bank is not None else template_bank
+        self.template = [(template.document_width, template.image, template.threshold, template.id_type)
+                         for template in bank.templates]
+        # The coarsest grayscale version of every template, along with the number of times it was halved.
+        self._coarse_templates = [(template.coarse_image, template.level) for template in bank.templates]
 
     def identify(self, source):
         """
@@ -45,41 +184,159 @@ class TemplateMatching:
         """
         if hasattr(source, 'shape') is False:
             raise TypeError("Must be an image")
-        # load the source and template image
-        for (original_template_image_width, template_image, threshold, object_identifier) in self.template:
-            ratio = original_template_image_width / source.shape[1]
-            dimension = (original_template_image_width, int(source.shape[0] * ratio))
-            resized = cv2.resize(source, dimension, interpolation=cv2.INTER_AREA)
-            if resized.shape[0] < template_image.shape[0] or resized.shape[1] < template_image.shape[1]:
-                return 'None'
-            # find the template in the source image
-            result = cv2.matchTemplate(resized, template_image, cv2.TM_CCOEFF_NORMED)
+        identification_type = self._match(source)
+        template_matches.labels(identification_type).inc()
+        return identification_type
 
-            (_, maximum_value, _, _) = cv2.minMaxLoc(result)
+    def _match(self, source):
+        """
+        This function searches the src image for the templates provided.
+        Every template is first searched for with the source resized to the width of the document the template
+        was taken from, after which all of the templates are searched for at a range of scales of the source.
 
-            if maximum_value > threshold:
+        :param source (obj) : The image that needs to be identified.
+
+        Returns:
+            - (str) : Either type of the image or None if the type could not be identified.
+
+        """
+        search = _PyramidSearch(source)
+        for (index, (original_template_image_width, template_image, threshold, object_identifier)) in \
+                enumerate(self.template):
+            dimension = (original_template_image_width,
+                         int(source.shape[0] * (original_template_image_width / source.shape[1])))
+            if dimension[1] < template_image.shape[0] or dimension[0] < template_image.shape[1]:
+                return 'None'
+            # find the template in the source image
+            if search.find(dimension, template_image, self._coarse_templates[index], threshold):
                 logger.info(object_identifier)
                 return object_identifier
         # first two parameters create a range of [0.8;1.8]. 10 specifies that we want to split the
         # range in 20 equal sizes. Each of them is used as a ratio value to get different image sizes.
         # [::-1] just reverses the np array to start from 1.8 and down to 0.8.
-        for scale in np.linspace(0.8, 1.8, 10)[::-1]:
-            # resize the image according to the scale, and keep track
-            # of the ratio of the resizing
-            resized = imutils.resize(source, width=int(source.shape[1] * scale))
-            for (original_template_image_width, template_image, threshold, object_identifier) in self.template:
-
-                # if the resized image is smaller than the template, then break
-                # from the loop
-                if resized.shape[0] < template_image.shape[0] or resized.shape[1] < template_image.shape[1]:
+        for scale in SEARCH_SCALES:
+            width = int(source.shape[1] * scale)
+            dimension = (width, int(source.shape[0] * (width / float(source.shape[1]))))
+            for (index, (_, template_image, threshold, object_identifier)) in enumerate(self.template):
+                # if the resized image is smaller than the template, then stop searching
+                if dimension[1] < template_image.shape[0] or dimension[0] < template_image.shape[1]:
                     return 'None'
-
-                result = cv2.matchTemplate(resized, template_image, cv2.TM_CCOEFF_NORMED)
-                (_, maximum_value, _, _) = cv2.minMaxLoc(result)
-
-                if (maximum_value > threshold):
+                if search.find(dimension, template_image, self._coarse_templates[index], threshold):
                     logger.info(object_identifier)
                     return object_identifier
 
         logger.warning('Unsuccessful template matching attempt')
         return 'None'
+
+
+class _PyramidSearch:
+    """
+    Searches a single source image for templates at different scales.
+    A grayscale pyramid of the source is built once, from which the coarse versions of the source are derived, and
+    the full resolution colour versions of the source are only created for the scales at which a coarse match
+    was found.
+
+    :_source (obj): The source image.
+    :_pyramid (list): The grayscale source, halved at every level.
+    :_resized (dict): The full resolution colour versions of the source, keyed by dimension.
+
+    """
+    def __init__(self, source):
+        """
+        Responsible for initialising the _PyramidSearch object and building the pyramid of the source.
+
+        :param source (obj): The source image.
+
+        """
+        self._source = source
+        gray = cv2.cvtColor(source, cv2.COLOR_BGR2GRAY) if len(source.shape) == 3 else source
+        self._pyramid = [gray]
+        for _ in range(PYRAMID_MAX_LEVEL):
+            (height, width) = self._pyramid[-1].shape[:2]
+            if min(height, width) < 2:
+                break
+            self._pyramid.append(cv2.resize(self._pyramid[-1], (width // 2, height // 2), interpolation=cv2.INTER_AREA))
+        self._resized = {}
+
+    def find(self, dimension, template_image, coarse_template, threshold):
+        """
+        Determines whether a template can be found in the source resized to the given dimension.
+
+        :param dimension (tuple): The width and height the source is resized to.
+        :param template_image (obj): The full resolution colour template.
+        :param coarse_template (tuple): The coarse grayscale template and the number of times it was halved.
+        :param threshold (float): The score a match must exceed.
+
+        Returns:
+            - (bool): Whether or not the template was found.
+
+        """
+        (coarse, level) = coarse_template
+        factor = 2 ** level
+        coarse_source = self._coarse_source(dimension, factor)
+        if coarse_source.shape[0] < coarse.shape[0] or coarse_source.shape[1] < coarse.shape[1]:
+            # The coarse source is too small to search, so the full resolution source is searched instead.
+            result = cv2.matchTemplate(self._resize(dimension), template_image, cv2.TM_CCOEFF_NORMED)
+            return cv2.minMaxLoc(result)[1] > threshold
+        result = cv2.matchTemplate(coarse_source, coarse, cv2.TM_CCOEFF_NORMED)
+        resized = None
+        (template_height, template_width) = template_image.shape[:2]
+        for _ in range(PYRAMID_MAX_CANDIDATES):
+            (_, maximum_value, _, (x, y)) = cv2.minMaxLoc(result)
+            if maximum_value <= threshold - PYRAMID_COARSE_MARGIN:
+                return False
+            # Suppress the coarse match so that the next candidate is a different region.
+            result[max(y - coarse.shape[0] // 2, 0):y + coarse.shape[0] // 2 + 1,
+                   max(x - coarse.shape[1] // 2, 0):x + coarse.shape[1] // 2 + 1] = -1
+            if resized is None:
+                resized = self._resize(dimension)
+            # Refine the match within a region around the coarse match, allowing for the loss of precision.
+            padding = 2 * factor
+            top = max(y * factor - padding, 0)
+            left = max(x * factor - padding, 0)
+            region = resized[top:min(y * factor + template_height + padding, resized.shape[0]),
+                             left:min(x * factor + template_width + padding, resized.shape[1])]
+            if region.shape[0] < template_height or region.shape[1] < template_width:
+                continue
+            if cv2.minMaxLoc(cv2.matchTemplate(region, template_image, cv2.TM_CCOEFF_NORMED))[1] > threshold:
+                return True
+        return False
+
+    def _coarse_source(self, dimension, factor):
+        """
+        Derives the grayscale source resized to the given dimension and reduced by the given factor from the
+        smallest level of the pyramid that is still larger than it.
+
+        :param dimension (tuple): The width and height the source is resized to.
+        :param factor (int): The factor by which the resized source is reduced.
+
+        Returns:
+            - (obj): The coarse grayscale source.
+
+        """
+        coarse_dimension = (max(dimension[0] // factor, 1), max(dimension[1] // factor, 1))
+        level = self._pyramid[0]
+        for pyramid_level in self._pyramid[1:]:
+            if pyramid_level.shape[1] < coarse_dimension[0] or pyramid_level.shape[0] < coarse_dimension[1]:
+                break
+            level = pyramid_level
+        return cv2.resize(level, coarse_dimension, interpolation=cv2.INTER_AREA)
+
+    def _resize(self, dimension):
+        """
+        Returns the full resolution colour source resized to the given dimension.
+
+        :param dimension (tuple): The width and height the source is resized to.
+
+        Returns:
+            - (obj): The resized source.
+
+        """
+        resized = self._resized.get(dimension)
+        if resized is None:
+            resized = self._resized[dimension] = cv2.resize(self._source, dimension, interpolation=cv2.INTER_AREA)
+        return resized
+
+
+"""The templates that are shared by every TemplateMatching object in the process."""
+template_bank = TemplateBank.load()
@@ -12,6 +12,9 @@ __maintainer__ = "Stephan Nell"
 __email__ = "nellstephanj@gmail.com"
 __status__ = "Development"
 
+"""The thresholding types that can be applied."""
+THRESHOLDING_TYPES = ("adaptive", "otsu")
+
 
 class ThresholdingManager:
     """
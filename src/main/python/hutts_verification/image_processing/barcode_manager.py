@@ -6,6 +6,8 @@ from said barcode.
 import numpy as np
 import cv2
 import zbar.misc
+from hutts_verification.utils.buffer_pool import get_buffer_pool
+from hutts_verification.utils.metrics import barcode_decodes
 
 __author__ = "Stephan Nell"
 __copyright__ = "Copyright 2017, Java the Hutts"
@@ -62,24 +64,30 @@ class BarCodeManager:
                 'Bad type for arg image - expected image in numpy array. Received type "%s".' %
                 type(image).__name__
             )
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-        grad_x = cv2.Sobel(gray, ddepth=cv2.CV_32F, dx=1, dy=0, ksize=-1)
-        grad_y = cv2.Sobel(gray, ddepth=cv2.CV_32F, dx=0, dy=1, ksize=-1)
-
-        gradient = cv2.subtract(grad_x, grad_y)
-        gradient = cv2.convertScaleAbs(gradient)
-
-        blurred = cv2.blur(gradient, (7, 7))
-        (_, thresh) = cv2.threshold(blurred, 225, 255, cv2.THRESH_BINARY)
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (27, 7))
-        closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-
-        eroded = cv2.erode(closed, None, iterations=4)
-        dilated = cv2.dilate(eroded, None, iterations=4)
-
-        (_, contours, _) = cv2.findContours(dilated.copy(), cv2.RETR_EXTERNAL,
-                                            cv2.CHAIN_APPROX_SIMPLE)
+        # The intermediate images are borrowed from the buffer pool and every step writes into one of them, since
+        # only the contours of the final image are kept.
+        pool = get_buffer_pool()
+        shape = image.shape[:2]
+        with pool.borrow(shape) as gray, pool.borrow(shape) as scratch, \
+                pool.borrow(shape, np.float32) as grad_x, pool.borrow(shape, np.float32) as grad_y:
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, gray)
+
+            cv2.Sobel(gray, ddepth=cv2.CV_32F, dx=1, dy=0, dst=grad_x, ksize=-1)
+            cv2.Sobel(gray, ddepth=cv2.CV_32F, dx=0, dy=1, dst=grad_y, ksize=-1)
+
+            gradient = cv2.subtract(grad_x, grad_y, grad_x)
+            gradient = cv2.convertScaleAbs(gradient, gray)
+
+            blurred = cv2.blur(gradient, (7, 7), scratch)
+            (_, thresh) = cv2.threshold(blurred, 225, 255, cv2.THRESH_BINARY, gray)
+            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (27, 7))
+            closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, scratch)
+
+            eroded = cv2.erode(closed, None, gray, iterations=4)
+            dilated = cv2.dilate(eroded, None, scratch, iterations=4)
+
+            (_, contours, _) = cv2.findContours(dilated, cv2.RETR_EXTERNAL,
+                                                cv2.CHAIN_APPROX_SIMPLE)
         c = sorted(contours, key=cv2.contourArea, reverse=True)[0]
 
         rectangle = cv2.minAreaRect(c)
@@ -103,19 +111,23 @@ class BarCodeManager:
         Returns:
             - (boolean): Whether the function was able to extract information from the barcode.
             - (str): A UTF-8 String of the data extracted from the barcode (empty if nothing was extracted).
-            - (obj): A copy of the original image.
+            - (obj): The image passed, with blurring applied to the barcode if it was decoded.
 
         """
-        (detection, detected_image, box) = self.detect(image.copy())
+        # Detection does not modify the image, so it is not copied first.
+        (detection, detected_image, box) = self.detect(image)
         if detection:
             gray = cv2.cvtColor(detected_image, cv2.COLOR_BGR2GRAY)
             results = self.scanner.scan(gray)
             if not results:
+                barcode_decodes.labels('failure').inc()
                 return False, "", image
             else:
+                barcode_decodes.labels('success').inc()
                 image = self.apply_barcode_blur(image, box)
                 return True, results[0].data, image
         else:
+            barcode_decodes.labels('not_found').inc()
             return False, "", image
 
     def apply_barcode_blur(self, image, box, dilation_intensity=2):
@@ -0,0 +1,271 @@
+"""
+Wraps the functionality required to extract information from an archive of ID images without the server.
+
+The images are spread over a pool of worker processes, each of which loads the trained models and the
+OCR engine once. The result of every image is appended to a JSONL file as soon as it is available, which
+doubles as a checkpoint: images that already have a result in the output file are skipped, so a run that was
+killed can simply be started again with the same arguments to resume where it left off.
+
+Example usage:
+
+``summary = run_batch(collect_images('scans/'), 'results.jsonl')``
+
+"""
+
+import json
+import math
+import multiprocessing
+import os
+import time
+import zlib
+import cv2
+from hutts_verification.image_preprocessing.face_manager import set_detection_mode
+from hutts_verification.image_processing.ocr_engine import create_ocr_engine, set_ocr_engine
+from hutts_verification.image_processing.sample_extract import TextExtractor, FaceExtractor
+from hutts_verification.utils.hutts_logger import logger
+from hutts_verification.utils.model_registry import model_registry
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""Specifies the file extensions of the images that are collected from a directory."""
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+"""Specifies the stages of the extraction of an image that are timed."""
+BATCH_STAGES = ('load', 'text', 'face')
+
+"""The options used by the current worker process."""
+_worker_options = {}
+
+
+def collect_images(source):
+    """
+    Collects the paths of the images to process from a directory or a manifest.
+    A directory is searched recursively for image files, whereas a manifest is a text file listing one
+    image path per line. Relative paths in a manifest are relative to the directory of the manifest, and empty
+    lines as well as lines starting with '#' are ignored.
+
+    :param source (str): The path to the directory or manifest.
+
+    Returns:
+        - (list): The paths of the images, in a stable order.
+
+    Raises:
+        - TypeError: If a string value is not passed for source.
+        - ValueError: If the source does not exist.
+
+    """
+    if not isinstance(source, str):
+        raise TypeError(
+            'Bad type for arg source - expected string. Received type "%s".' %
+            type(source).__name__
+        )
+    if os.path.isdir(source):
+        paths = []
+        for (directory, _, file_names) in os.walk(source):
+            paths.extend(
+                os.path.join(directory, file_name) for file_name in file_names
+                if file_name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        return sorted(paths)
+    if os.path.isfile(source):
+        manifest_directory = os.path.dirname(os.path.abspath(source))
+        with open(source) as manifest:
+            lines = [line.strip() for line in manifest]
+        return [
+            os.path.join(manifest_directory, line) for line in lines
+            if line and not line.startswith('#')
+        ]
+    raise ValueError('No directory or manifest could be found at "%s".' % source)
+
+
+def read_checkpoint(output_path, retry_failed=False):
+    """
+    Reads the paths of the images that already have a result in the output file of an earlier run.
+    An incomplete last line, left behind by a run that was killed while writing, is removed from the file.
+
+    :param output_path (str): The path to the JSONL output file.
+    :param retry_failed (bool): Whether or not images that failed in an earlier run should be processed again.
+
+    Returns:
+        - (set): The paths of the images that do not have to be processed again.
+
+    """
+    done = set()
+    if not os.path.isfile(output_path):
+        return done
+    with open(output_path, 'rb+') as output_file:
+        content = output_file.read()
+        complete_length = content.rfind(b'\n') + 1
+        if complete_length < len(content):
+            logger.warning('Removing incomplete result from "%s"' % output_path)
+            output_file.truncate(complete_length)
+    for line in content[:complete_length].decode('utf-8').splitlines():
+        try:
+            result = json.loads(line)
+        except ValueError:
+            logger.warning('Skipping unreadable result in "%s"' % output_path)
+            continue
+        if result.get('success') or not retry_failed:
+            done.add(result['path'])
+    return done
+
+
+def percentile(values, fraction):
+    """
+    Calculates a percentile of the given values using the nearest-rank method.
+
+    :param values (list): The values.
+    :param fraction (float): The percentile as a fraction between 0 and 1, e.g. 0.95 for the 95th percentile.
+
+    Returns:
+        - (float): The percentile of the values.
+        - (None): If no values were given.
+
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(max(math.ceil(fraction * len(ordered)), 1), len(ordered))
+    return ordered[rank - 1]
+
+
+def summarise(results, elapsed, skipped=0):
+    """
+    Summarises the throughput and stage timings of a batch run.
+
+    :param results (list): The results of the images processed during the run.
+    :param elapsed (float): The number of seconds the run took.
+    :param skipped (int): The number of images skipped because they were processed in an earlier run.
+
+    Returns:
+        - (dict): The number of processed, failed and skipped images, the throughput in images per second
+            and the 50th and 95th percentile (in seconds) of every stage.
+
+    """
+    stages = {}
+    for stage in BATCH_STAGES:
+        timings = [result['timings'][stage] for result in results if stage in result.get('timings', {})]
+        stages[stage] = {
+            'count': len(timings),
+            'p50': percentile(timings, 0.5),
+            'p95': percentile(timings, 0.95)
+        }
+    return {
+        'processed': len(results),
+        'failed': sum(1 for result in results if not result['success']),
+        'skipped': skipped,
+        'elapsed': elapsed,
+        'images_per_second': len(results) / elapsed if elapsed > 0 else None,
+        'stages': stages
+    }
+
+
+def run_batch(paths, output_path, processes=None, preferences=None, face_directory=None, engine_name=None,
+              retry_failed=False, face_detection_mode=None):
+    """
+    Extracts the information from the given images using a pool of worker processes and appends the result of
+    every image to the output file as soon as it is available.
+
+    :param paths (list): The paths of the images to process.
+    :param output_path (str): The path to the JSONL output file.
+    :param processes (int): The number of worker processes. Defaults to the number of CPUs.
+    :param preferences (dict): User-specified CV techniques used for text extraction.
+    :param face_directory (str): The directory to which the extracted faces are written. Faces are not
+            extracted if no directory is given.
+    :param engine_name (str): The name of the OCR engine used by the workers, i.e. 'memory' or 'pytesseract'.
+    :param retry_failed (bool): Whether or not images that failed in an earlier run should be processed again.
+    :param face_detection_mode (tuple): The maximum side and upsample policy used by the workers to detect faces,
+            as accepted by set_detection_mode. The default detection mode is used if none is given.
+
+    Returns:
+        - (dict): The summary of the run, as returned by summarise.
+
+    """
+    done = read_checkpoint(output_path, retry_failed)
+    pending = [path for path in paths if path not in done]
+    skipped = len(paths) - len(pending)
+    if skipped:
+        logger.info('Skipping %d images that were processed in an earlier run' % skipped)
+    if face_directory is not None:
+        os.makedirs(face_directory, exist_ok=True)
+    options = {
+        'preferences': dict(preferences or {}, useIO=False),
+        'face_directory': face_directory,
+        'engine_name': engine_name,
+        'face_detection_mode': face_detection_mode
+    }
+    processes = min(processes or os.cpu_count() or 1, max(len(pending), 1))
+    logger.info('Processing %d images with %d worker processes...' % (len(pending), processes))
+    results = []
+    start = time.perf_counter()
+    # Spawn rather than fork, since the models and OCR engines of the parent should not be shared.
+    context = multiprocessing.get_context('spawn')
+    with open(output_path, 'a') as output_file, \
+            context.Pool(processes, initializer=_initialise_worker, initargs=(options,)) as pool:
+        for result in pool.imap_unordered(process_image, pending):
+            output_file.write(json.dumps(result) + '\n')
+            # Flush every result so that it survives the run being killed.
+            output_file.flush()
+            results.append(result)
+            if not result['success']:
+                logger.warning('Could not process "%s": %s' % (result['path'], result['error']))
+    return summarise(results, time.perf_counter() - start, skipped)
+
+
+def _initialise_worker(options):
+    """
+    Prepares a worker process by creating its OCR engine and loading the trained models once.
+
+    :param options (dict): The preferences, face directory, OCR engine name and face detection mode used by the
+            worker.
+
+    """
+    _worker_options.update(options)
+    set_ocr_engine(create_ocr_engine(options['engine_name']))
+    if options.get('face_detection_mode') is not None:
+        set_detection_mode(*options['face_detection_mode'])
+    if options['face_directory'] is not None:
+        model_registry.warm_up()
+
+
+def process_image(path):
+    """
+    Extracts the information from a single image within a worker process.
+
+    :param path (str): The path to the image.
+
+    Returns:
+        - (dict): The result of the image, containing the path, whether the extraction succeeded, the time taken
+            by every stage and either the extracted information or the error that occurred.
+
+    """
+    result = {'path': path, 'success': False, 'timings': {}}
+    try:
+        stage_start = time.perf_counter()
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError('No image could be read from "%s".' % path)
+        result['timings']['load'] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        text_extractor = TextExtractor(dict(_worker_options.get('preferences', {'useIO': False})))
+        result['text_extract_result'] = text_extractor.extract(image)
+        result['timings']['text'] = time.perf_counter() - stage_start
+
+        face_directory = _worker_options.get('face_directory')
+        if face_directory is not None:
+            stage_start = time.perf_counter()
+            face = FaceExtractor().extract(image, False)
+            # Images in different directories may share a name, so the name of the face includes a checksum of the path.
+            face_name = '%s_%08x.jpg' % (os.path.splitext(os.path.basename(path))[0], zlib.crc32(path.encode('utf-8')))
+            result['extracted_face'] = os.path.join(face_directory, face_name)
+            cv2.imwrite(result['extracted_face'], face)
+            result['timings']['face'] = time.perf_counter() - stage_start
+        result['success'] = True
+    except Exception as error:
+        result['error'] = '%s: %s' % (type(error).__name__, error)
+    return result
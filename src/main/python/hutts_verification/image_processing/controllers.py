@@ -2,12 +2,22 @@
 Handles all requests relevant to the extraction service of the API.
 """
 import base64
+import json
+import time
 import cv2
+from concurrent.futures import as_completed, TimeoutError as FutureTimeoutError
 from hutts_verification.image_processing.sample_extract import TextExtractor
-from flask import Blueprint, jsonify, request, make_response
+from hutts_verification.image_preprocessing.face_analysis import FaceAnalysis, analysing
+from flask import Blueprint, Response, jsonify, request, make_response
 from hutts_verification.utils.image_handling import grab_image
+from hutts_verification.utils.request_handling import request_data, request_image
 from hutts_verification.image_processing.sample_extract import FaceExtractor
+from hutts_verification.image_processing.result_cache import RESULT_CACHE_HEADER, cached_extraction
 from hutts_verification.utils.hutts_logger import logger
+from hutts_verification.utils import tracing
+from hutts_verification.utils.debug_sink import debugging, request_debug_id
+from hutts_verification.utils.stage_pools import STAGE_FACE, STAGE_TEXT, DeadlineExceeded, Overloaded, \
+    get_stage_pool, register_error_handlers, request_deadline, run_stage, wait
 
 __authors__ = "Nicolai van Niekerk, Stephan Nell"
 __copyright__ = "Copyright 2017, Java the Hutts"
@@ -18,6 +28,9 @@ __status__ = "Development"
 
 
 extract = Blueprint('extract', __name__)
+register_error_handlers(extract)
+"""Specifies the maximum number of images that may be sent in a single batch request."""
+BATCH_MAX_SIZE = 512
 
 
 @extract.route('/extractText', methods=['POST'])
@@ -33,45 +46,28 @@ def extract_text():
 
     # Check to see if this is a post request.
     if request.method == "POST":
-        # Check to see if an image was uploaded.
-        if request.get_json().get("idPhoto", None) is not None:
-            # Grab the uploaded image.
-            image = grab_image(string=request.get_json()["idPhoto"])
-        # Otherwise, assume that a URL was passed in.
-        else:
-            # Grab the URL from the request.
-            url = request.get_json().get("url", None)
-            # If the URL is None, then return an error.
-            if url is None:
-                data["error"] = "No URL provided."
-                return jsonify(data)
-                # Load the image and convert.
-            image = grab_image(url=url)
+        # Grab the image, which is uploaded, sent as the body of the request or sent as a URL.
+        image = request_image("idPhoto", raw=True)
+        # If no image was sent, then return an error.
+        if image is None:
+            data["error"] = "No URL provided."
+            return jsonify(data)
 
         # Grab additional parameters specifying techniques
-        preferences = {}
-
-        if 'blur_technique' in request.get_json():
-            preferences['blur_method'] = request.get_json()['blur_technique']
-        if 'threshold_technique' in request.get_json():
-            preferences['threshold_method'] = request.get_json()['threshold_technique']
-        if 'remove_face' in request.get_json():
-            preferences['remove_face'] = request.get_json()['remove_face']
-        if 'remove_barcode' in request.get_json():
-            preferences['remove_barcode'] = request.get_json()['remove_barcode']
-        if 'color' in request.get_json():
-            preferences['color'] = request.get_json()['color']
-        if 'id_type' in request.get_json():
-            preferences['id_type'] = request.get_json()['id_type']
-        if 'useIO' in request.get_json():
-            preferences['useIO'] = request.get_json()['useIO'] == 'true'
-        else:
-            preferences['useIO'] = False
+        preferences = text_extraction_preferences(request_data())
+        timings_requested = request_data().get('timings', 'false') == 'true'
 
-        # Extract text from image
-        extractor = TextExtractor(preferences)
-        result = extractor.extract(image)
-    return jsonify(result)
+        # Extract text from image, unless the result has been cached
+        (result, cache_status) = cached_extraction(
+            image, preferences, False, timings_requested,
+            lambda: run_stage(STAGE_TEXT, extract_image, image, preferences, False, timings_requested)
+        )
+        text_extract_result = result['text_extract_result']
+        if timings_requested:
+            text_extract_result['timings'] = result['timings']
+    response = jsonify(text_extract_result)
+    response.headers[RESULT_CACHE_HEADER] = cache_status
+    return response
 
 
 @extract.route('/extractFace', methods=['POST'])
@@ -87,28 +83,24 @@ def extract_face():
 
     # check to see if this is a post request
     if request.method == "POST":
-        # check to see if an image was uploaded
-        if request.get_json().get("idPhoto", None) is not None:
-            # grab the uploaded image
-            image = grab_image(string=request.get_json()["idPhoto"])
-        # otherwise, assume that a URL was passed in
-        else:
-            # grab the URL from the request
-            url = request.get_json().get("url", None)
-            # if the URL is None, then return an error
-            if url is None:
-                data["error"] = "No URL provided."
-                return jsonify(data)
-            # load the image and convert
-            image = grab_image(url=url)
+        # grab the image, which is uploaded, sent as the body of the request or sent as a URL
+        image = request_image("idPhoto", raw=True)
+        # if no image was sent, then return an error
+        if image is None:
+            data["error"] = "No URL provided."
+            return jsonify(data)
 
     # Add preferences
     preferences = {}
-    if 'useIO' in request.get_json():
-        preferences['useIO'] = request.get_json()['useIO'] == 'true'
+    if 'useIO' in request_data():
+        preferences['useIO'] = request_data()['useIO'] == 'true'
+        debug_id = request_debug_id(preferences['useIO'])
+        if debug_id is not None:
+            preferences['debug_id'] = debug_id
+    timings_requested = request_data().get('timings', 'false') == 'true'
     # Call open CV commands here with the extracted image
-    response = face_extraction_response(preferences['useIO'], image)
-    return response
+    result = run_stage(STAGE_FACE, extract_image, image, preferences, True, timings_requested, False)
+    return face_extraction_response(result)
 
 
 @extract.route('/extractAll', methods=['POST'])
@@ -123,63 +115,248 @@ def extract_all():
     data = {"success": False}
     # check to see if this is a post request
     if request.method == "POST":
-        # check to see if an image was uploaded
-        if request.get_json().get("idPhoto", None) is not None:
-            # grab the uploaded image
-            image = grab_image(string=request.get_json()["idPhoto"])
-        # otherwise, assume that a URL was passed in
-        else:
-            # grab the URL from the request
-            url = request.get_json().get("url", None)
-            # if the URL is None, then return an error
-            if url is None:
-                data["error"] = "No URL provided."
-                return jsonify(data)
-            # load the image and convert
-            image = grab_image(url=url)
+        # grab the image, which is uploaded, sent as the body of the request or sent as a URL
+        image = request_image("idPhoto", raw=True)
+        # if no image was sent, then return an error
+        if image is None:
+            data["error"] = "No URL provided."
+            return jsonify(data)
         # Call open CV commands here with the extracted image
         # Grab additional parameters specifying techniques
-        preferences = {}
-
-        if 'blur_technique' in request.get_json():
-            preferences['blur_method'] = request.get_json()['blur_technique']
-        if 'threshold_technique' in request.get_json():
-            preferences['threshold_method'] = request.get_json()['threshold_technique']
-        if 'remove_face' in request.get_json():
-            preferences['remove_face'] = request.get_json()['remove_face']
-        if 'remove_barcode' in request.get_json():
-            preferences['remove_barcode'] = request.get_json()['remove_barcode']
-        if 'color' in request.get_json():
-            preferences['color'] = request.get_json()['color']
-        if 'id_type' in request.get_json():
-            preferences['id_type'] = request.get_json()['id_type']
-        if 'useIO' in request.get_json():
-            preferences['useIO'] = request.get_json()['useIO'] == 'true'
+        preferences = text_extraction_preferences(request_data())
+        timings_requested = request_data().get('timings', 'false') == 'true'
+
+        # Extract text and face from image, unless the result has been cached
+        (result, cache_status) = cached_extraction(
+            image, preferences, True, timings_requested,
+            lambda: run_stage(STAGE_TEXT, extract_image, image, preferences, True, timings_requested)
+        )
+        response = face_extraction_response(result)
+        response.headers[RESULT_CACHE_HEADER] = cache_status
+        return response
+
+
+@extract.route('/extractBatch', methods=['POST'])
+def extract_batch():
+    """
+    Sample function to extract text (and optionally faces) from a batch of images received.
+    The images are processed concurrently on the text stage pool and share the preferences and the deadline of the
+    request. Images that the pool can not admit, or that are not processed before the deadline, are reported as
+    errors in their results; the request is rejected as a whole if none of its images can be admitted.
+    If streaming is requested, the result of every image is sent back as a line of JSON (NDJSON) as soon as
+    the image has been processed, otherwise the results of all the images are returned in the order in which
+    the images were received.
+
+    URL: http://localhost:5000/extractBatch.
+
+    """
+    # Initialize the data dictionary to be returned by the request.
+    data = {"success": False}
+    fields = request_data()
+    items = fields.get("images", None)
+    # Check to see if a list of images was sent.
+    if not isinstance(items, list) or not items:
+        data["error"] = "No images provided."
+        return jsonify(data), 400
+    if len(items) > BATCH_MAX_SIZE:
+        data["error"] = "Too many images provided. At most %d images may be sent at a time." % BATCH_MAX_SIZE
+        return jsonify(data), 400
+
+    preferences = text_extraction_preferences(fields)
+    extract_face = fields.get("extract_face", "false") == "true"
+    timings_requested = fields.get("timings", "false") == "true"
+    logger.info("Extracting batch of %d images" % len(items))
+    deadline = request_deadline()
+    stage_pool = get_stage_pool(STAGE_TEXT)
+    # The futures of the admitted images and the results of the images that were rejected, keyed by index.
+    (futures, rejected) = ({}, {})
+    for (index, item) in enumerate(items):
+        try:
+            future = stage_pool.submit(extract_batch_item, index, item, preferences, extract_face, timings_requested,
+                                       deadline=deadline)
+            futures[future] = index
+        except Overloaded as error:
+            rejected[index] = _batch_error(index, error)
+    if not futures:
+        raise Overloaded('The %s stage pool can not admit any images of the batch.' % STAGE_TEXT)
+
+    if fields.get("stream", "false") == "true":
+        return Response(_stream_batch_results(futures, rejected, deadline), mimetype='application/x-ndjson')
+    results = dict(rejected)
+    for (future, index) in futures.items():
+        results[index] = _batch_item_result(index, future, deadline)
+    data["success"] = True
+    data["results"] = [results[index] for index in range(len(items))]
+    return jsonify(data)
+
+
+def _stream_batch_results(futures, rejected, deadline):
+    """
+    Yields the results of a batch request as lines of JSON in the order in which the images finish processing.
+    Images that have not started processing are cancelled if the client stops reading the results or the deadline
+    of the request passes.
+
+    :param futures (dict): The indices of the admitted images in the batch, keyed by their futures.
+    :param rejected (dict): The results of the images that were rejected, keyed by their indices.
+    :param deadline (float): The time (as given by time.monotonic) by which the batch should have finished.
+
+    Returns:
+        - (str): A line of JSON containing the result of an image.
+
+    """
+    remaining = dict(futures)
+    try:
+        for result in rejected.values():
+            yield json.dumps(result) + "\n"
+        try:
+            for future in as_completed(futures, timeout=max(deadline - time.monotonic(), 0)):
+                yield json.dumps(_batch_item_result(remaining.pop(future), future, deadline)) + "\n"
+        except FutureTimeoutError:
+            while remaining:
+                (future, index) = remaining.popitem()
+                future.cancel()
+                error = DeadlineExceeded('The request did not finish before its deadline.')
+                yield json.dumps(_batch_error(index, error)) + "\n"
+    finally:
+        for future in remaining:
+            future.cancel()
+
+
+def _batch_item_result(index, future, deadline):
+    """
+    Waits for the result of an image of a batch request until the deadline of the request.
+
+    :param index (int): The position of the image in the batch.
+    :param future (Future): The future of the result of the image.
+    :param deadline (float): The time (as given by time.monotonic) by which the batch should have finished.
+
+    Returns:
+        - (dict): The result of the image, as returned by extract_batch_item, or the error if the image was not
+            processed before the deadline.
+
+    """
+    try:
+        return wait(future, deadline)
+    except DeadlineExceeded as error:
+        return _batch_error(index, error)
+
+
+def _batch_error(index, error):
+    """
+    Reports an error that occurred while processing an image of a batch request.
+
+    :param index (int): The position of the image in the batch.
+    :param error (Exception): The error.
+
+    Returns:
+        - (dict): The result of the image, containing the index of the image and the error that occurred.
+
+    """
+    logger.error("Could not extract image %d of batch: %s" % (index, error))
+    return {"index": index, "success": False, "error": str(error)}
+
+
+def extract_batch_item(index, item, preferences, extract_face=False, timings_requested=False):
+    """
+    Extracts the text (and optionally the face) from a single image of a batch request.
+    Errors are reported in the result of the image so that they do not affect the other images in the batch.
+
+    :param index (int): The position of the image in the batch.
+    :param item (dict): The image, given as a base64 string ("idPhoto") or a URL ("url").
+    :param preferences (dict): User-specified CV techniques shared by all the images in the batch.
+    :param extract_face (boolean): Whether or not the face should be extracted as well.
+    :param timings_requested (boolean): Whether or not the time spent in every stage should be returned.
+
+    Returns:
+        - (dict): The result of the image, containing the index of the image, whether the extraction succeeded
+            and either the extracted information or the error that occurred.
+
+    """
+    try:
+        if not isinstance(item, dict):
+            raise ValueError('Expected an object containing "idPhoto" or "url".')
+        if item.get("idPhoto", None) is not None:
+            image = grab_image(string=item["idPhoto"])
+        elif item.get("url", None) is not None:
+            image = grab_image(url=item["url"])
         else:
-            preferences['useIO'] = False
+            raise ValueError("No image or URL provided.")
+        if image is None:
+            raise ValueError("The image could not be decoded.")
+        if preferences.get('debug_id') is not None:
+            # The images of every item of the batch are recorded separately.
+            preferences = dict(preferences, debug_id='%s-%d' % (preferences['debug_id'], index))
+        result = {"index": index, "success": True}
+        result.update(extract_image(image, preferences, extract_face, timings_requested))
+        return result
+    except Exception as error:
+        return _batch_error(index, error)
 
-        # Extract test from image
-        extractor = TextExtractor(preferences)
-        result = extractor.extract(image)
 
-        response = face_extraction_response(preferences['useIO'], image, result)
+def extract_image(image, preferences, extract_face=False, timings_requested=False, extract_text=True):
+    """
+    Extracts the text and/or the face from an image.
+    It does not depend on the Flask request, so that it can be run on a stage pool. The text and face extraction
+    share a face analysis, so that the face is only detected once.
 
-        return response
+    :param image (obj): The cv2 (numpy) image.
+    :param preferences (dict): User-specified CV techniques.
+    :param extract_face (boolean): Whether or not the face should be extracted.
+    :param timings_requested (boolean): Whether or not the time spent in every stage should be returned.
+    :param extract_text (boolean): Whether or not the text should be extracted.
 
+    Returns:
+        - (dict): The extracted text ("text_extract_result"), the Base64 jpg data URI of the extracted face
+            ("extracted_face") and the time spent in every stage ("timings"), as far as they were requested.
 
-def face_extraction_response(use_io, image, text_extract_result=None):
     """
-    This function converts the extracted cv2 image and converts it
-    to a jpg image. Furthermore, the jpg image is converted to
-    Base64 jpg type and returned. If text extraction results are provided
-    the response will contain the data of text extraction result as well.
+    result = {}
+    with tracing.traced(timings_requested) as trace, analysing(FaceAnalysis()), \
+            debugging(preferences.get('debug_id')):
+        if extract_text:
+            # Every extraction gets its own copy of the preferences, since extractions are performed concurrently.
+            result["text_extract_result"] = TextExtractor(dict(preferences)).extract(image)
+        if extract_face:
+            result["extracted_face"] = encode_face(preferences['useIO'], image)
+    if timings_requested:
+        result["timings"] = trace.timings()
+    return result
 
-    :param use_io (boolean): Whether or not images should be written to disk.
-    :param image (obj): The cv2 (numpy) image that should be converted to jpg.
-    :param text_extract_result (dict): The extracted text results.
+
+def text_extraction_preferences(request_data):
+    """
+    Grabs the parameters that specify the techniques used during text extraction from the data of a request.
+
+    :param request_data (dict): The fields of the request, as returned by request_data.
 
     Returns:
-        - (obj): The response object that contains the information for HTTP transmission.
+        - (dict): User-specified CV techniques.
+
+    """
+    preferences = {}
+    if 'blur_technique' in request_data:
+        preferences['blur_method'] = request_data['blur_technique']
+    if 'threshold_technique' in request_data:
+        preferences['threshold_method'] = request_data['threshold_technique']
+    for preference in ['remove_face', 'remove_barcode', 'color', 'id_type', 'field_ocr']:
+        if preference in request_data:
+            preferences[preference] = request_data[preference]
+    preferences['useIO'] = request_data.get('useIO', 'false') == 'true'
+    debug_id = request_debug_id(preferences['useIO'])
+    if debug_id is not None:
+        preferences['debug_id'] = debug_id
+    return preferences
+
+
+def encode_face(use_io, image):
+    """
+    Extracts the face from an image and encodes it as a Base64 jpg data URI.
+
+    :param use_io (boolean): Whether or not to hand the intermediate images to the debug sink.
+    :param image (obj): The cv2 (numpy) image containing the face.
+
+    Returns:
+        - (str): The Base64 jpg data URI of the extracted face.
 
     """
     extractor = FaceExtractor()
@@ -187,11 +364,22 @@ def face_extraction_response(use_io, image, text_extract_result=None):
     _, buffer = cv2.imencode('.jpg', result)
     # replace base64 indicator for the first occurrence and apply apply base64 jpg encoding
     logger.info("Converting to Base64")
-    jpg_img = ('data:image/jpg;base64' + str(base64.b64encode(buffer)).replace("b", ",", 1)).replace("'", "")
-    temp_dict = {"extracted_face": jpg_img}
-    if text_extract_result:
-        temp_dict["text_extract_result"] = text_extract_result
-    data = jsonify(temp_dict)
+    return ('data:image/jpg;base64' + str(base64.b64encode(buffer)).replace("b", ",", 1)).replace("'", "")
+
+
+def face_extraction_response(result):
+    """
+    This function prepares the response containing the Base64 jpg data URI of an extracted face.
+    If text extraction results or timings are provided the response will contain them as well.
+
+    :param result (dict): The result of extract_image, containing the extracted face and possibly the extracted
+            text and timings.
+
+    Returns:
+        - (obj): The response object that contains the information for HTTP transmission.
+
+    """
+    data = jsonify(result)
     # prepare response
     logger.info("Preparing Response")
     response = make_response(data)
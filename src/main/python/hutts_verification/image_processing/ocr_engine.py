@@ -0,0 +1,278 @@
+"""
+Wraps the OCR engines that can be used to extract text from an image.
+
+Two engines are available:
+
+    - ``InMemoryOCREngine`` hands the pixel buffer of the image straight to the Tesseract API through the
+      tesserocr package, without encoding the image or touching the filesystem.
+    - ``PytesseractOCREngine`` runs the tesseract command line tool through pytesseract for every call.
+
+The in-memory engine is used by default when tesserocr is installed, otherwise the pytesseract engine is used.
+"""
+
+import queue
+import shlex
+import threading
+import cv2
+import pytesseract
+from abc import ABC, abstractmethod
+from PIL import Image
+from hutts_verification.utils.hutts_logger import logger
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""Specifies the language used by the OCR engines."""
+OCR_LANGUAGE = 'eng'
+"""Specifies the Tesseract page segmentation mode used when no mode is given (fully automatic)."""
+OCR_DEFAULT_PAGE_SEGMENTATION_MODE = 3
+
+
+class OCREngine(ABC):
+    """
+    An abstraction of all OCR engines.
+    """
+    @abstractmethod
+    def image_to_string(self, image, page_segmentation_mode=None, whitelist=None):
+        """
+        Abstract method for subclasses to implement.
+        Meant to extract and return the text found in an image.
+
+        :param image (obj): OpenCV (numpy) image containing the text to be extracted.
+        :param page_segmentation_mode (int): The Tesseract page segmentation mode to use. The engine's default is
+                used if none is given.
+        :param whitelist (str): The characters that may be recognised. All characters may be recognised if none
+                are given.
+
+        """
+        pass
+
+    def close(self):
+        """
+        Releases the resources held by the engine.
+        """
+        pass
+
+    @staticmethod
+    def _check_image(image):
+        """
+        Checks whether the image passed can be used by an OCR engine.
+
+        :param image (obj): The image to check.
+
+        Raises:
+            - TypeError: If the image is not a numpy array.
+
+        """
+        if not hasattr(image, 'shape'):
+            raise TypeError(
+                'Bad type for arg image - expected image in numpy array. Received type "%s".' %
+                type(image).__name__
+            )
+
+
+class PytesseractOCREngine(OCREngine):
+    """
+    An OCR engine that runs the tesseract command line tool through pytesseract.
+    """
+    def image_to_string(self, image, page_segmentation_mode=None, whitelist=None):
+        """
+        Extracts and returns the text found in an image by running the tesseract command line tool.
+
+        :param image (obj): OpenCV (numpy) image containing the text to be extracted.
+        :param page_segmentation_mode (int): The Tesseract page segmentation mode to use.
+        :param whitelist (str): The characters that may be recognised.
+
+        Returns:
+            - (str): The extracted text.
+
+        Raises:
+            - TypeError: If the image is not a numpy array.
+
+        """
+        self._check_image(image)
+        config = []
+        if page_segmentation_mode is not None:
+            config.append('-c tessedit_pageseg_mode=%d' % page_segmentation_mode)
+        if whitelist:
+            # pytesseract splits the configuration like a shell would, so the whitelist is quoted to keep quotes and
+            # spaces in it from ending the argument early.
+            config.append('-c tessedit_char_whitelist=%s' % shlex.quote(whitelist))
+        # OpenCV stores colour images as BGR, whereas PIL expects RGB.
+        if len(image.shape) == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return pytesseract.image_to_string(Image.fromarray(image), lang=OCR_LANGUAGE, config=' '.join(config))
+
+
+class InMemoryOCREngine(OCREngine):
+    """
+    An OCR engine that passes the pixel buffer of an image straight to the Tesseract API.
+    Tesseract API instances are expensive to create, since each one loads the language data, and are not
+    safe for concurrent use, which is why idle instances are kept for reuse by later calls.
+
+    :_language (str): The language used by Tesseract.
+    :_idle (LifoQueue): The Tesseract API instances that are not in use.
+
+    """
+    def __init__(self, language=OCR_LANGUAGE, max_idle=4):
+        """
+        Initialise the in-memory OCR engine.
+
+        :param language (str): The language used by Tesseract.
+        :param max_idle (int): The maximum number of idle Tesseract API instances kept for reuse.
+
+        Raises:
+            - ImportError: If tesserocr is not installed.
+
+        """
+        if tesserocr is None:
+            raise ImportError('The in-memory OCR engine requires tesserocr to be installed.')
+        self._language = language
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+
+    def image_to_string(self, image, page_segmentation_mode=None, whitelist=None):
+        """
+        Extracts and returns the text found in an image without encoding the image or writing it to disk.
+
+        :param image (obj): OpenCV (numpy) image containing the text to be extracted.
+        :param page_segmentation_mode (int): The Tesseract page segmentation mode to use.
+        :param whitelist (str): The characters that may be recognised.
+
+        Returns:
+            - (str): The extracted text.
+
+        Raises:
+            - TypeError: If the image is not a numpy array.
+
+        """
+        self._check_image(image)
+        # OpenCV stores colour images as BGR, whereas Tesseract expects RGB.
+        if len(image.shape) == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        (height, width) = image.shape[:2]
+        bytes_per_pixel = 1 if len(image.shape) == 2 else image.shape[2]
+        api = self._acquire()
+        try:
+            api.SetPageSegMode(
+                page_segmentation_mode if page_segmentation_mode is not None else OCR_DEFAULT_PAGE_SEGMENTATION_MODE
+            )
+            api.SetVariable('tessedit_char_whitelist', whitelist if whitelist else '')
+            # tobytes copies the pixels in row-major order, so regions of larger images need not be copied first.
+            api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+            self._release(api)
+
+    def close(self):
+        """
+        Ends all of the idle Tesseract API instances.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().End()
+            except queue.Empty:
+                return
+
+    def _acquire(self):
+        """
+        Retrieves an idle Tesseract API instance, or creates a new one if none are idle.
+
+        Returns:
+            - (obj): A Tesseract API instance.
+
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            logger.debug('Creating Tesseract API instance')
+            return tesserocr.PyTessBaseAPI(lang=self._language)
+
+    def _release(self, api):
+        """
+        Returns a Tesseract API instance to the idle instances, or ends it if enough instances are idle.
+
+        :param api (obj): The Tesseract API instance that is no longer in use.
+
+        """
+        try:
+            self._idle.put_nowait(api)
+        except queue.Full:
+            api.End()
+
+
+"""The OCR engine used when no engine is specified."""
+_default_engine = None
+"""Guards the creation of the default OCR engine."""
+_default_engine_lock = threading.Lock()
+
+
+def create_ocr_engine(name=None):
+    """
+    Creates an OCR engine.
+
+    :param name (str): The name of the engine, i.e. 'memory' or 'pytesseract'. The in-memory engine is created
+            if tesserocr is installed and no name is given, otherwise the pytesseract engine is created.
+
+    Returns:
+        - (OCREngine): The created OCR engine.
+
+    Raises:
+        - NameError: If the name of the engine is not recognised.
+
+    """
+    if name is None:
+        name = 'memory' if tesserocr is not None else 'pytesseract'
+    if name == 'memory':
+        return InMemoryOCREngine()
+    elif name == 'pytesseract':
+        return PytesseractOCREngine()
+    raise NameError('Invalid OCR engine selection! Try "memory" or "pytesseract".')
+
+
+def get_ocr_engine():
+    """
+    Returns the OCR engine used when no engine is specified, creating it if necessary.
+
+    Returns:
+        - (OCREngine): The default OCR engine.
+
+    """
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            _default_engine = create_ocr_engine()
+            logger.info('Using OCR engine: ' + type(_default_engine).__name__)
+        return _default_engine
+
+
+def set_ocr_engine(engine):
+    """
+    Sets the OCR engine used when no engine is specified.
+
+    :param engine (OCREngine): The new default OCR engine.
+
+    Raises:
+        - TypeError: If the engine is not an OCREngine.
+
+    """
+    global _default_engine
+    if not isinstance(engine, OCREngine):
+        raise TypeError(
+            'Bad type for arg engine - expected OCREngine. Received type "%s".' %
+            type(engine).__name__
+        )
+    with _default_engine_lock:
+        previous_engine = _default_engine
+        _default_engine = engine
+    if previous_engine is not None and previous_engine is not engine:
+        previous_engine.close()
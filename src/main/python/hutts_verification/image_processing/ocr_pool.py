@@ -0,0 +1,263 @@
+"""
+Wraps the functionality required to keep a pool of long-lived OCR worker processes.
+
+Every worker process creates its own OCR engine once and then serves OCR requests that are sent to it
+over a pipe, so that Tesseract does not have to be started and reload its language data for every image.
+Workers that crash or exceed the timeout of a request are replaced by fresh workers.
+Large images are handed to the workers through shared memory, so that only a handle to the image is sent over
+the pipe instead of a pickled copy of its pixels.
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import numpy as np
+from hutts_verification.image_processing.ocr_engine import OCREngine, create_ocr_engine
+from hutts_verification.utils.hutts_logger import logger
+from hutts_verification.utils.shared_image import SharedImage
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""Specifies the default number of seconds an OCR request may take, including waiting for a worker."""
+OCR_POOL_DEFAULT_TIMEOUT = 30.0
+"""Specifies the size (in bytes) from which images are handed to the workers through shared memory."""
+OCR_POOL_SHARED_MIN_BYTES = 64 * 1024
+
+
+def _serve(connection, engine_name):
+    """
+    The main loop of an OCR worker process.
+    It creates an OCR engine and then serves OCR requests until it receives None or the pipe is closed.
+
+    :param connection (Connection): The worker's end of the pipe.
+    :param engine_name (str): The name of the OCR engine used by the worker.
+
+    """
+    engine = create_ocr_engine(engine_name)
+    # Run the engine once so that the language data is loaded before the first request arrives.
+    engine.image_to_string(np.zeros((8, 8), dtype='uint8'))
+    while True:
+        try:
+            request = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if request is None:
+            break
+        (image, page_segmentation_mode, whitelist) = request
+        shared_image = image if isinstance(image, SharedImage) else None
+        try:
+            if shared_image is not None:
+                image = shared_image.array()
+            connection.send(('ok', engine.image_to_string(image, page_segmentation_mode, whitelist)))
+        except Exception as error:
+            connection.send(('error', '%s: %s' % (type(error).__name__, error)))
+        finally:
+            if shared_image is not None:
+                del image
+                shared_image.close()
+    engine.close()
+
+
+class _OCRWorker:
+    """
+    A handle to a single OCR worker process.
+
+    :process (Process): The worker process.
+    :connection (Connection): The pool's end of the pipe to the worker process.
+
+    """
+    def __init__(self, context, engine_name):
+        """
+        Starts an OCR worker process.
+
+        :param context (obj): The multiprocessing context used to start the process.
+        :param engine_name (str): The name of the OCR engine used by the worker.
+
+        """
+        (self.connection, worker_connection) = context.Pipe()
+        self.process = context.Process(target=_serve, args=(worker_connection, engine_name), daemon=True)
+        self.process.start()
+        worker_connection.close()
+
+    def request(self, image, page_segmentation_mode, whitelist, timeout):
+        """
+        Sends an OCR request to the worker and waits for the result.
+
+        :param image (obj): OpenCV (numpy) image containing the text to be extracted.
+        :param page_segmentation_mode (int): The Tesseract page segmentation mode to use.
+        :param whitelist (str): The characters that may be recognised.
+        :param timeout (float): The number of seconds to wait for the result.
+
+        Returns:
+            - (str): The extracted text.
+
+        Raises:
+            - TimeoutError: If the result was not received in time.
+            - EOFError: If the worker process died.
+            - RuntimeError: If the OCR engine of the worker failed.
+
+        """
+        if image.nbytes < OCR_POOL_SHARED_MIN_BYTES:
+            self.connection.send((image, page_segmentation_mode, whitelist))
+            if not self.connection.poll(timeout):
+                raise TimeoutError('OCR request timed out after %.2f seconds' % timeout)
+        else:
+            # The worker is done with the image once it has replied, or is replaced if it does not reply in time.
+            with SharedImage.share(image) as shared_image:
+                self.connection.send((shared_image, page_segmentation_mode, whitelist))
+                if not self.connection.poll(timeout):
+                    raise TimeoutError('OCR request timed out after %.2f seconds' % timeout)
+        (status, result) = self.connection.recv()
+        if status != 'ok':
+            raise RuntimeError(result)
+        return result
+
+    def stop(self, timeout=1.0):
+        """
+        Stops the worker process, terminating it if it does not stop in time.
+
+        :param timeout (float): The number of seconds to wait for the worker to stop.
+
+        """
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.connection.close()
+
+
+class OCRWorkerPool(OCREngine):
+    """
+    An OCR engine that dispatches images to a pool of long-lived OCR worker processes.
+
+    :size (int): The number of worker processes.
+    :timeout (float): The default number of seconds an OCR request may take.
+    :_engine_name (str): The name of the OCR engine used by the workers.
+    :_idle (Queue): The workers that are waiting for a request.
+    :_workers (list): All of the workers in the pool.
+
+    """
+    def __init__(self, size=None, engine_name=None, timeout=OCR_POOL_DEFAULT_TIMEOUT):
+        """
+        Initialise the OCR worker pool and start its workers.
+
+        :param size (int): The number of worker processes. Defaults to the number of CPUs.
+        :param engine_name (str): The name of the OCR engine used by the workers, i.e. 'memory' or 'pytesseract'.
+                The in-memory engine is used if tesserocr is installed and no name is given.
+        :param timeout (float): The default number of seconds an OCR request may take.
+
+        Raises:
+            - TypeError: If the size is not an integer.
+            - ValueError: If the size is smaller than 1.
+
+        """
+        if size is None:
+            size = os.cpu_count() or 1
+        if not isinstance(size, int):
+            raise TypeError(
+                'Bad type for arg size - expected int. Received type "%s".' %
+                type(size).__name__
+            )
+        if size < 1:
+            raise ValueError('An OCR worker pool requires at least one worker.')
+        self.size = size
+        self.timeout = timeout
+        self._engine_name = engine_name
+        # Spawn rather than fork, since forking a multi-threaded server process is not safe.
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._closed = False
+        logger.info('Starting %d OCR workers...' % size)
+        for _ in range(size):
+            worker = _OCRWorker(self._context, self._engine_name)
+            self._workers.append(worker)
+            self._idle.put(worker)
+
+    def image_to_string(self, image, page_segmentation_mode=None, whitelist=None, timeout=None):
+        """
+        Extracts and returns the text found in an image by dispatching it to an idle worker.
+        If the worker crashed, it is replaced and the request is retried once on the new worker.
+
+        :param image (obj): OpenCV (numpy) image containing the text to be extracted.
+        :param page_segmentation_mode (int): The Tesseract page segmentation mode to use.
+        :param whitelist (str): The characters that may be recognised.
+        :param timeout (float): The number of seconds the request may take. The pool's timeout is used if
+                none is given.
+
+        Returns:
+            - (str): The extracted text.
+
+        Raises:
+            - TypeError: If the image is not a numpy array.
+            - TimeoutError: If no worker became available or the worker did not respond in time.
+            - RuntimeError: If the pool has been closed, the OCR engine of the worker failed or the
+                worker crashed twice.
+
+        """
+        self._check_image(image)
+        if self._closed:
+            raise RuntimeError('The OCR worker pool has been closed.')
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        for attempt in range(2):
+            try:
+                worker = self._idle.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise TimeoutError('No OCR worker became available in time')
+            try:
+                result = worker.request(image, page_segmentation_mode, whitelist,
+                                        max(deadline - time.monotonic(), 0))
+            except TimeoutError:
+                # The worker is still busy with the request, so it can not be reused.
+                logger.warning('OCR worker timed out. Replacing worker...')
+                self._replace(worker)
+                raise
+            except (EOFError, OSError):
+                logger.warning('OCR worker crashed. Replacing worker...')
+                self._replace(worker)
+                continue
+            except RuntimeError:
+                self._idle.put(worker)
+                raise
+            self._idle.put(worker)
+            return result
+        raise RuntimeError('OCR workers crashed while processing the image')
+
+    def close(self):
+        """
+        Stops all of the workers in the pool.
+        """
+        with self._lock:
+            self._closed = True
+            workers = self._workers
+            self._workers = []
+        for worker in workers:
+            worker.stop()
+
+    def _replace(self, worker):
+        """
+        Stops the given worker and replaces it with a fresh worker.
+
+        :param worker (_OCRWorker): The worker to replace.
+
+        """
+        worker.stop(timeout=0)
+        with self._lock:
+            if self._closed:
+                return
+            self._workers.remove(worker)
+            new_worker = _OCRWorker(self._context, self._engine_name)
+            self._workers.append(new_worker)
+        self._idle.put(new_worker)
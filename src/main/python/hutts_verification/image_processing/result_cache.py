@@ -0,0 +1,148 @@
+"""
+Wraps the functionality required to cache the results of text extraction.
+
+Mobile clients retry uploads and test tooling replays the same images many times, so the result of extracting an
+image can be cached. Results are keyed by a hash of the decoded pixels of the image along with the preferences that
+affect the extraction, and are stored in a ContentCache, which keeps the most recently used results in memory and
+can optionally store them in a directory on disk with a time to live. Since the results contain the personal
+information of the holder of the ID, the cache can scrub the results it removes from disk.
+
+The cache is disabled by default. Requests that ask for timings or whose intermediate images are recorded by the
+debug sink always run the extraction. Whether a result came from the cache is reported in the ``X-Hutts-Cache``
+header of the response ("HIT", "MISS" or "BYPASS").
+
+Example usage:
+
+First import the result cache module...
+from hutts_verification.image_processing.result_cache import cached_extraction, set_result_cache
+then enable the cache...
+
+``set_result_cache(ContentCache('results', 256, ttl=600))``
+
+and look up the result of an extraction, running the extraction if it is missing.
+
+``(result, status) = cached_extraction(image, preferences, False, False, lambda: extract_image(image, preferences))``
+
+"""
+
+import json
+import numpy as np
+from hutts_verification.utils.content_cache import ContentCache, content_hash
+from hutts_verification.utils.hutts_logger import logger
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""Specifies the header of the response that reports whether the result came from the cache."""
+RESULT_CACHE_HEADER = 'X-Hutts-Cache'
+"""Reported when the result was found in the cache."""
+RESULT_CACHE_HIT = 'HIT'
+"""Reported when the result was not found in the cache and has been stored in it."""
+RESULT_CACHE_MISS = 'MISS'
+"""Reported when the cache was not used, because it is disabled or the request can not be cached."""
+RESULT_CACHE_BYPASS = 'BYPASS'
+"""Specifies the preferences that affect the result of an extraction, and therefore distinguish cached results."""
+RESULT_CACHE_PREFERENCES = ('blur_method', 'threshold_method', 'color', 'id_type', 'remove_face', 'remove_barcode',
+                            'field_ocr')
+
+"""Caches the results of text extraction (None disables caching)."""
+_result_cache = None
+
+
+def get_result_cache():
+    """
+    Returns the cache used for the results of text extraction.
+
+    Returns:
+        - (ContentCache): The result cache.
+        - (None): If the results are not cached.
+
+    """
+    return _result_cache
+
+
+def set_result_cache(cache):
+    """
+    Sets the cache used for the results of text extraction.
+
+    :param cache (ContentCache): The new result cache, or None to disable caching.
+
+    Raises:
+        - TypeError: If the cache is not a ContentCache.
+
+    """
+    global _result_cache
+    if cache is not None and not isinstance(cache, ContentCache):
+        raise TypeError(
+            'Bad type for arg cache - expected ContentCache. Received type "%s".' %
+            type(cache).__name__
+        )
+    _result_cache = cache
+
+
+def normalise_preferences(preferences):
+    """
+    Reduces the preferences of a request to those that affect the result of an extraction, in a canonical form.
+
+    :param preferences (dict): User-specified CV techniques, as returned by text_extraction_preferences.
+
+    Returns:
+        - (str): The preferences that affect the result, as JSON with sorted keys.
+
+    """
+    relevant = {
+        name: str(preferences[name]).strip() for name in RESULT_CACHE_PREFERENCES
+        if preferences.get(name, None) is not None
+    }
+    return json.dumps(relevant, sort_keys=True)
+
+
+def result_key(image, preferences, extract_face):
+    """
+    Calculates the key of the result of extracting an image.
+
+    :param image (obj): The cv2 (numpy) image.
+    :param preferences (dict): User-specified CV techniques.
+    :param extract_face (boolean): Whether or not the face is extracted as well.
+
+    Returns:
+        - (str): The hexadecimal key of the result.
+
+    """
+    return content_hash(image, 'all' if extract_face else 'text', normalise_preferences(preferences))
+
+
+def cached_extraction(image, preferences, extract_face, timings_requested, extraction):
+    """
+    Returns the cached result of extracting an image, running the extraction and caching its result if it is
+    missing. Failed extractions raise their error and are not cached.
+
+    :param image (obj): The cv2 (numpy) image.
+    :param preferences (dict): User-specified CV techniques.
+    :param extract_face (boolean): Whether or not the face is extracted as well.
+    :param timings_requested (boolean): Whether or not the time spent in every stage was requested, in which case
+            the extraction is always run. It is also always run if the preferences have a debug ID.
+    :param extraction (function): Runs the extraction and returns its (JSON serialisable) result.
+
+    Returns:
+        - (dict): The result of the extraction.
+        - (str): Whether the result was found in the cache (RESULT_CACHE_HIT), stored in it (RESULT_CACHE_MISS) or
+            the cache was not used (RESULT_CACHE_BYPASS).
+
+    """
+    cache = _result_cache
+    if cache is None or timings_requested or preferences.get('debug_id') is not None:
+        return extraction(), RESULT_CACHE_BYPASS
+    key = result_key(image, preferences, extract_face)
+    value = cache.get(key)
+    if value is not None:
+        logger.info('Returning cached extraction result')
+        return json.loads(value.tobytes().decode('utf-8')), RESULT_CACHE_HIT
+    result = extraction()
+    # The result is stored as the bytes of its JSON, since the cache only stores numpy arrays.
+    cache.put(key, np.frombuffer(json.dumps(result).encode('utf-8'), dtype=np.uint8))
+    return result, RESULT_CACHE_MISS
@@ -2,17 +2,18 @@
 This class wraps all the functionality required to extract text from an image.
 """
 
-import os
-import cv2
-import pytesseract
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 from hutts_verification.image_preprocessing.build_director import BuildDirector
 from hutts_verification.image_processing.text_cleaner import TextCleaner
 from hutts_verification.image_processing.simplification_manager import SimplificationManager
 from hutts_verification.image_processing.barcode_manager import BarCodeManager
 from hutts_verification.image_preprocessing.template_matching import TemplateMatching
 from hutts_verification.image_processing.context_manager import ContextManager
+from hutts_verification.image_processing.ocr_engine import get_ocr_engine
 from hutts_verification.utils.hutts_logger import logger, prettify_json_message
+from hutts_verification.utils import tracing
+from hutts_verification.utils.debug_sink import debug_image
+from hutts_verification.utils.metrics import ocr_calls, ocr_duration
 
 __author__ = "Nicolai van Niekerk"
 __copyright__ = "Copyright 2017, Java the Hutts"
@@ -21,7 +22,12 @@ __maintainer__ = "Nicolai van Niekerk"
 __email__ = "nicvaniek@gmail.com"
 __status__ = "Development"
 
-DESKTOP = os.path.join(os.path.join(os.path.expanduser('~')), 'Desktop')
+# The Tesseract page segmentation mode used for field regions (treat the region as a single line of text).
+FIELD_PAGE_SEGMENTATION_MODE = 7
+# The maximum number of field regions that are passed through OCR at the same time.
+FIELD_OCR_WORKERS = 4
+# Executes the OCR of the field regions in parallel.
+field_ocr_executor = ThreadPoolExecutor(max_workers=FIELD_OCR_WORKERS)
 
 
 class TextExtractor:
@@ -29,15 +35,19 @@ class TextExtractor:
     The TextExtractor extracts text from the ID image.
     """
 
-    def __init__(self, preferences):
+    def __init__(self, preferences, ocr_engine=None):
         """
         Initialise Text Extractor.
 
         :param preferences (dict): User-specified CV techniques.
+        :param ocr_engine (OCREngine): The OCR engine used to extract text. The default OCR engine is used
+                if none is given.
 
         """
         self.preferences = preferences
+        self._ocr_engine = ocr_engine if ocr_engine is not None else get_ocr_engine()
         self.remove_face = 'false'
+        self.field_ocr = False
         self._context_manager = ContextManager()
         self._text_cleaner = TextCleaner()
 
@@ -54,6 +64,8 @@ class TextExtractor:
         if 'remove_face' in self.preferences:
             self.remove_face = self.preferences['remove_face'] == 'true'
         logger.debug('self.remove_face: ' + str(self.remove_face))
+        if 'field_ocr' in self.preferences:
+            self.field_ocr = self.preferences['field_ocr'] == 'true'
 
         simplification_manager = SimplificationManager()
         barcode_manager = BarCodeManager()
@@ -61,10 +73,12 @@ class TextExtractor:
 
         # Perform perspective transformation and read from barcode.
         logger.info('Performing perspective transformation...')
-        image = simplification_manager.perspectiveTransformation(img, self.preferences['useIO'])
+        with tracing.stage('perspective_transformation'):
+            image = simplification_manager.perspectiveTransformation(img, self.preferences['useIO'])
         if self.preferences['useIO']:
-            cv2.imwrite(DESKTOP + "/output/3.png", image)
-        barcode_data_found, barcode_scan_data, barcoded_image = barcode_manager.get_barcode_info(image)
+            debug_image('3_perspective', image)
+        with tracing.stage('barcode'):
+            barcode_data_found, barcode_scan_data, barcoded_image = barcode_manager.get_barcode_info(image)
         if barcode_data_found:
             logger.info('Barcode successfully scanned')
             data = {
@@ -79,18 +93,34 @@ class TextExtractor:
         else:
             template_match = TemplateMatching()
             logger.info('Performing template matching...')
-            identification_type = template_match.identify(barcoded_image)
+            with tracing.stage('template_matching'):
+                identification_type = template_match.identify(barcoded_image)
+        tracing.set_id_type(identification_type)
 
         logger.info('Constructing text extraction pipeline')
-        pipeline = BuildDirector.construct_text_extract_pipeline(self.preferences, identification_type)
-        image = pipeline.process_text_extraction(self.preferences['useIO'], barcoded_image, self.remove_face)
+        with tracing.stage('pipeline'):
+            pipeline = BuildDirector.construct_text_extract_pipeline(self.preferences, identification_type)
+            image = pipeline.process_text_extraction(self.preferences['useIO'], barcoded_image, self.remove_face)
 
-        # Extract and return text
-        filename = "{}.png".format(os.getpid())
-        cv2.imwrite(filename, image)
+        id_context = self._context_manager.get_id_context(identification_type)
+        # Check if context was found.
+        if id_context is None:
+            # Log the error and raise it for handling.
+            logger.error('Could not find ID context for ID type "%s"' % identification_type)
+            raise ValueError('Could not identify ID type')
 
-        text = pytesseract.image_to_string(Image.open(filename))
-        os.remove(filename)
+        # Only pass the field regions through OCR if the ID document has a fixed layout.
+        if self.field_ocr and id_context.get_field_regions():
+            logger.info('Extracting text from field regions...')
+            with tracing.stage('field_ocr'):
+                id_details = self._extract_fields(image, id_context, data)
+            if id_details is not None:
+                return self._log_id_details(id_details)
+            logger.info('Field regions were inconclusive. Extracting text from the entire image...')
+
+        # Extract and return text
+        with tracing.stage('ocr'):
+            text = self._image_to_string(image)
 
         # Log the uncleaned string to terminal.
         # This is for demonstration purposes.
@@ -101,7 +131,8 @@ class TextExtractor:
         logger.debug('-' * 50)
         logger.info('Cleaning up text...')
         # Clean the OCR output text.
-        clean_text = self._text_cleaner.clean_up(text)
+        with tracing.stage('text_cleaning'):
+            clean_text = self._text_cleaner.clean_up(text)
         # Log the cleaned string to terminal.
         # This is for demonstration purposes.
         logger.debug('-' * 50)
@@ -111,15 +142,71 @@ class TextExtractor:
         logger.debug('-' * 50)
         # Get ID information from cleaned text.
         logger.info('Placing extracted text in a dictionary...')
-        id_context = self._context_manager.get_id_context(identification_type)
-        # Check if context was found.
-        if id_context is None:
-            # Log the error and raise it for handling.
-            logger.error('Could not find ID context for ID type "%s"' % identification_type)
-            raise ValueError('Could not identify ID type')
-        id_details = id_context.get_id_info(clean_text, barcode_data=data)
-        # Log the retrieved ID information extracted text to terminal.
-        # This is for demonstration purposes.
+        with tracing.stage('id_context'):
+            id_details = id_context.get_id_info(clean_text, barcode_data=data)
+        return self._log_id_details(id_details)
+
+    def _extract_fields(self, image, id_context, barcode_data):
+        """
+        This function extracts text from the field regions of an ID document with a fixed layout.
+        The field regions are passed through OCR in parallel and with the character whitelist of the field.
+
+        :param image (obj): The processed image of the ID.
+        :param id_context (IDContext): The ID context that defines the field regions.
+        :param barcode_data (dict): The information extracted from the barcode.
+
+        Returns:
+            - (dict): The extracted information.
+            - (None): If the information extracted from the field regions is not trustworthy.
+
+        """
+        (height, width) = image.shape[:2]
+        field_regions = id_context.get_field_regions()
+        futures = []
+        for field_region in field_regions:
+            (left, top, right, bottom) = field_region['region']
+            region = image[int(top * height):int(bottom * height), int(left * width):int(right * width)]
+            futures.append(field_ocr_executor.submit(
+                self._image_to_string,
+                region,
+                FIELD_PAGE_SEGMENTATION_MODE,
+                field_region.get('whitelist')
+            ))
+        field_texts = {}
+        for (field_region, future) in zip(field_regions, futures):
+            field_texts[field_region['field']] = self._text_cleaner.clean_up(future.result())
+            logger.debug('Field "%s": %s' % (field_region['field'], field_texts[field_region['field']]))
+        return id_context.get_id_info_from_fields(field_texts, barcode_data=barcode_data)
+
+    def _image_to_string(self, image, page_segmentation_mode=None, whitelist=None):
+        """
+        Extracts the text found in an image with the OCR engine and records the duration of the call.
+
+        :param image (obj): OpenCV (numpy) image containing the text to be extracted.
+        :param page_segmentation_mode (int): The Tesseract page segmentation mode to use.
+        :param whitelist (str): The characters that may be recognised.
+
+        Returns:
+            - (str): The extracted text.
+
+        """
+        engine_name = type(self._ocr_engine).__name__
+        ocr_calls.labels(engine_name).inc()
+        with ocr_duration.labels(engine_name).time():
+            return self._ocr_engine.image_to_string(image, page_segmentation_mode, whitelist)
+
+    @staticmethod
+    def _log_id_details(id_details):
+        """
+        Logs the retrieved ID information to the terminal.
+        This is for demonstration purposes.
+
+        :param id_details (dict): The extracted information.
+
+        Returns:
+            - (dict): The extracted information.
+
+        """
         logger.debug('-' * 50)
         logger.debug('Extracted ID details:')
         logger.debug('-' * 50)
@@ -138,7 +225,7 @@ class FaceExtractor:
         This function is a sample that demonstrates how the face would be extracted.
 
         :param img (obj): The image of the ID that contains the face that must be extracted.
-        :param use_io (boolean): Whether or not images should be written to disk.
+        :param use_io (boolean): Whether or not to hand the intermediate images to the debug sink.
 
         Returns:
             - (obj): The extracted and aligned facial image.
@@ -148,13 +235,15 @@ class FaceExtractor:
 
         # Perform perspective transformation
         logger.info('Performing perspective transformation...')
-        perspective_image = simplification_manager.perspectiveTransformation(img, use_io)
+        with tracing.stage('face_perspective_transformation'):
+            perspective_image = simplification_manager.perspectiveTransformation(img, use_io)
         if use_io:
-            cv2.imwrite(DESKTOP + "/output/10.png", perspective_image)
+            debug_image('10_face_perspective', perspective_image)
 
         # Process image
         logger.info('Constructing facial extraction pipeline...')
-        pipeline = BuildDirector.construct_face_extract_pipeline()
-        image = pipeline.process_face_extraction(perspective_image)
+        with tracing.stage('face_extraction'):
+            pipeline = BuildDirector.construct_face_extract_pipeline()
+            image = pipeline.process_face_extraction(perspective_image)
 
         return image
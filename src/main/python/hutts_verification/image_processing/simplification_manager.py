@@ -3,10 +3,12 @@ Wraps functions that are used to simplify or ease the image processing process.
 """
 
 import cv2
-import os
 import imutils
 import numpy as np
-from imutils.perspective import four_point_transform
+from imutils.perspective import order_points
+from hutts_verification.image_preprocessing.face_analysis import current_analysis
+from hutts_verification.utils.buffer_pool import get_buffer_pool
+from hutts_verification.utils.debug_sink import debug_image
 from hutts_verification.utils.hutts_logger import logger
 
 __author__ = "Nicolai van Niekerk, Stephan Nell"
@@ -16,7 +18,6 @@ __maintainer__ = "Nicolai van Niekerk"
 __email__ = "nicvaniek@gmail.com"
 __status__ = "Development"
 
-DESKTOP = os.path.join(os.path.join(os.path.expanduser('~')), 'Desktop')
 # The minimum contour area must be to be transformed.
 CONTOUR_AREA_THRESHOLD = 150000
 
@@ -35,7 +36,7 @@ class SimplificationManager:
         to a perspective view.
 
         :param image (obj): Image containing a identification document.
-        :param use_io (boolean): Whether or not to write images to disk.
+        :param use_io (boolean): Whether or not to hand the intermediate images to the debug sink.
 
         Returns:
             - (obj): The transformed image.
@@ -50,18 +51,24 @@ class SimplificationManager:
                 type(image).__name__
             )
 
+        source = image
         ratio = image.shape[0] / 500.0
-        orig = image.copy()
+        # Only the resized copy is drawn on, so the source is warped directly rather than being copied first.
         image = imutils.resize(image, height=500)
 
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (5, 5), 0)
-        edged = cv2.Canny(gray, 75, 200)
-        if use_io:
-            cv2.imwrite(DESKTOP + "/output/1.png", edged)
-        (_, contours, _) = cv2.findContours(edged.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        pool = get_buffer_pool()
+        with pool.borrow(image.shape[:2]) as gray, pool.borrow(image.shape[:2]) as blurred:
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, gray)
+            cv2.GaussianBlur(gray, (5, 5), 0, blurred)
+            # The edges overwrite the grayscale image, which is no longer needed.
+            edged = cv2.Canny(blurred, 75, 200, gray)
+            if use_io:
+                debug_image('1_edges', edged)
+            # Contours are found without modifying the image, so the edges are not copied first.
+            (_, contours, _) = cv2.findContours(edged, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
         contours = sorted(contours, key=cv2.contourArea, reverse=True)[:5]
-        warped = orig
+        warped = None
+        matrix = np.eye(3)
         # Used to prevent false positive detection
         logger.debug('Contour area Threshold: ' + str(cv2.contourArea(contours[0])))
         if cv2.contourArea(contours[0]) > CONTOUR_AREA_THRESHOLD:
@@ -75,7 +82,34 @@ class SimplificationManager:
 
             cv2.drawContours(image, [screen_contours], -1, (0, 255, 0), 2)
             if use_io:
-                cv2.imwrite(DESKTOP + "/output/2.png", image)
+                debug_image('2_contours', image)
             logger.debug('Performing four point simplification')
-            warped = four_point_transform(orig, screen_contours.reshape(4, 2) * ratio)
+            (warped, matrix) = self._four_point_transform(source, screen_contours.reshape(4, 2) * ratio)
+        if warped is None:
+            # Later stages write into the result, so the source is only copied when it is returned as is.
+            warped = source.copy()
+        analysis = current_analysis()
+        if analysis is not None:
+            analysis.derive(warped, source, matrix)
         return warped
+
+    @staticmethod
+    def _four_point_transform(image, points):
+        """
+        Transforms the quadrilateral region of the image within the four points passed to a top-down view.
+
+        :param image (obj): Image containing the region.
+        :param points (obj): The four corners (numpy array) of the region, in any order.
+
+        Returns:
+            - (obj): The transformed region.
+            - (obj): The 3x3 perspective matrix (numpy array) that maps the image onto the transformed region.
+
+        """
+        corners = order_points(points)
+        (top_left, top_right, bottom_right, bottom_left) = corners
+        width = max(int(np.linalg.norm(bottom_right - bottom_left)), int(np.linalg.norm(top_right - top_left)))
+        height = max(int(np.linalg.norm(top_right - bottom_right)), int(np.linalg.norm(top_left - bottom_left)))
+        destination = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype='float32')
+        matrix = cv2.getPerspectiveTransform(corners, destination)
+        return cv2.warpPerspective(image, matrix, (width, height)), matrix
@@ -0,0 +1,269 @@
+"""
+Wraps the functionality required to reuse the intermediate images of the preprocessing stages.
+
+Every preprocessing stage produces full-size intermediate images (a blurred copy, a grayscale copy, gradients and so
+on) that are discarded as soon as the next stage has read them. Rather than allocating them anew for every request,
+the stages borrow them from a buffer pool and hand them to OpenCV through its ``dst`` arguments. Every worker thread
+keeps its own free buffers, keyed by shape and data type, so borrowing a buffer never waits on another thread. The
+number of bytes of free buffers a thread keeps is bounded; the least recently returned buffers are dropped first.
+
+A borrowed buffer is uninitialised and must not be used once it has been returned, so stages only borrow buffers for
+images that do not outlive them.
+
+Example usage:
+
+First import the buffer pool module...
+from hutts_verification.utils.buffer_pool import get_buffer_pool
+then borrow a buffer for an intermediate image.
+
+``with get_buffer_pool().borrow(image.shape[:2]) as gray:``
+    ``cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, gray)``
+
+The number of buffers that were reused and the largest number of bytes the pool held at once are reported by
+``get_buffer_pool().stats()``.
+
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from hutts_verification.utils.metrics import buffer_pool_bytes, buffer_pool_requests
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""Specifies the default number of bytes of free buffers that every thread keeps (64 MiB)."""
+BUFFER_POOL_DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class _ThreadBuffers:
+    """
+    The free buffers of a single thread.
+
+    :free (OrderedDict): Lists of free buffers keyed by shape and data type, from least to most recently returned.
+    :free_bytes (int): The number of bytes of the free buffers.
+
+    """
+    __slots__ = ('free', 'free_bytes', '__weakref__')
+
+    def __init__(self):
+        self.free = OrderedDict()
+        self.free_bytes = 0
+
+
+class BufferPool:
+    """
+    A pool of reusable numpy buffers, of which every thread keeps its own free buffers.
+
+    :max_bytes (int): The number of bytes of free buffers that every thread keeps.
+    :_local (local): Holds the free buffers of every thread.
+    :_lock (Lock): Guards the statistics of the pool.
+    :_requests (int): The number of buffers that were borrowed.
+    :_reuses (int): The number of borrowed buffers that were free buffers rather than newly allocated ones.
+    :_held_bytes (int): The number of bytes of the buffers that are borrowed or free.
+    :_peak_bytes (int): The largest number of bytes the pool has held at once.
+
+    """
+    def __init__(self, max_bytes=BUFFER_POOL_DEFAULT_MAX_BYTES):
+        """
+        Responsible for initialising the BufferPool object.
+
+        :param max_bytes (int): The number of bytes of free buffers that every thread keeps (0 disables reuse).
+
+        Raises:
+            - TypeError: If the maximum number of bytes is not an integer.
+            - ValueError: If the maximum number of bytes is negative.
+
+        """
+        if not isinstance(max_bytes, int) or isinstance(max_bytes, bool):
+            raise TypeError(
+                'Bad type for arg max_bytes - expected int. Received type "%s".' %
+                type(max_bytes).__name__
+            )
+        if max_bytes < 0:
+            raise ValueError('The maximum number of bytes of a buffer pool can not be negative.')
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._reuses = 0
+        self._held_bytes = 0
+        self._peak_bytes = 0
+
+    @contextmanager
+    def borrow(self, shape, dtype=np.uint8):
+        """
+        Borrows a buffer for the duration of a with statement, returning it to the pool afterwards.
+
+        :param shape (tuple): The shape of the buffer.
+        :param dtype (obj): The data type of the buffer.
+
+        Returns:
+            - (obj): The uninitialised buffer (numpy array).
+
+        """
+        buffer = self.acquire(shape, dtype)
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+    def acquire(self, shape, dtype=np.uint8):
+        """
+        Takes a free buffer of the current thread with the given shape and data type, or allocates one if there is
+        none. The buffer should be returned with release once it is no longer used.
+
+        :param shape (tuple): The shape of the buffer.
+        :param dtype (obj): The data type of the buffer.
+
+        Returns:
+            - (obj): The uninitialised buffer (numpy array).
+
+        """
+        buffers = self._buffers()
+        key = (tuple(shape), np.dtype(dtype).str)
+        free = buffers.free.get(key)
+        if free:
+            buffer = free.pop()
+            if not free:
+                del buffers.free[key]
+            buffers.free_bytes -= buffer.nbytes
+            buffer_pool_requests.labels('reuse').inc()
+            with self._lock:
+                self._requests += 1
+                self._reuses += 1
+            return buffer
+        buffer = np.empty(shape, dtype=dtype)
+        buffer_pool_requests.labels('allocate').inc()
+        self._hold(buffer.nbytes, requested=True)
+        return buffer
+
+    def release(self, buffer):
+        """
+        Returns a buffer to the free buffers of the current thread, dropping the least recently returned buffers
+        if the thread keeps more bytes than allowed.
+
+        :param buffer (obj): The buffer, as returned by acquire.
+
+        """
+        if buffer.nbytes > self.max_bytes:
+            self._hold(-buffer.nbytes)
+            return
+        buffers = self._buffers()
+        key = (buffer.shape, buffer.dtype.str)
+        buffers.free.setdefault(key, []).append(buffer)
+        buffers.free.move_to_end(key)
+        buffers.free_bytes += buffer.nbytes
+        dropped = 0
+        while buffers.free_bytes > self.max_bytes:
+            (oldest, free) = next(iter(buffers.free.items()))
+            nbytes = free.pop(0).nbytes
+            if not free:
+                del buffers.free[oldest]
+            buffers.free_bytes -= nbytes
+            dropped += nbytes
+        if dropped:
+            self._hold(-dropped)
+
+    def stats(self):
+        """
+        Returns the statistics of the pool.
+
+        Returns:
+            - (dict): The number of bytes of free buffers every thread keeps ("max_bytes"), the number of buffers that
+                were borrowed ("requests") and reused ("reuses"), the fraction of borrowed buffers that were reused
+                ("reuse_rate"), the number of bytes the pool holds ("held_bytes") and the largest number of bytes it
+                has held at once ("peak_bytes").
+
+        """
+        with self._lock:
+            return {
+                'max_bytes': self.max_bytes,
+                'requests': self._requests,
+                'reuses': self._reuses,
+                'reuse_rate': self._reuses / self._requests if self._requests else 0.0,
+                'held_bytes': self._held_bytes,
+                'peak_bytes': self._peak_bytes
+            }
+
+    def _buffers(self):
+        """
+        Returns the free buffers of the current thread, creating them on first use. The bytes of the free buffers
+        of a thread are no longer counted as held once the thread has finished.
+
+        Returns:
+            - (_ThreadBuffers): The free buffers.
+
+        """
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = _ThreadBuffers()
+            self._local.buffers = buffers
+            weakref.finalize(buffers, self._forget, buffers.free)
+        return buffers
+
+    def _forget(self, free):
+        """
+        Stops counting the free buffers of a thread that has finished.
+
+        :param free (OrderedDict): The free buffers of the thread.
+
+        """
+        nbytes = sum(buffer.nbytes for buffers in free.values() for buffer in buffers)
+        if nbytes:
+            self._hold(-nbytes)
+
+    def _hold(self, nbytes, requested=False):
+        """
+        Updates the number of bytes held by the pool.
+
+        :param nbytes (int): The number of bytes allocated (positive) or dropped (negative).
+        :param requested (bool): Whether or not the bytes were allocated for a borrowed buffer.
+
+        """
+        with self._lock:
+            if requested:
+                self._requests += 1
+            self._held_bytes += nbytes
+            self._peak_bytes = max(self._peak_bytes, self._held_bytes)
+            buffer_pool_bytes.set(self._held_bytes)
+
+
+"""The buffer pool used by the preprocessing stages."""
+_buffer_pool = BufferPool()
+
+
+def get_buffer_pool():
+    """
+    Returns the buffer pool used by the preprocessing stages.
+
+    Returns:
+        - (BufferPool): The buffer pool.
+
+    """
+    return _buffer_pool
+
+
+def set_buffer_pool(pool):
+    """
+    Sets the buffer pool used by the preprocessing stages.
+
+    :param pool (BufferPool): The new buffer pool.
+
+    Raises:
+        - TypeError: If the pool is not a BufferPool.
+
+    """
+    global _buffer_pool
+    if not isinstance(pool, BufferPool):
+        raise TypeError(
+            'Bad type for arg pool - expected BufferPool. Received type "%s".' %
+            type(pool).__name__
+        )
+    _buffer_pool = pool
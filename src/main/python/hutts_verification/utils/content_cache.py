@@ -0,0 +1,374 @@
+"""
+Wraps the functionality required to cache values that are derived from the content of an image.
+
+Values are keyed by a hash of the decoded pixels of the image, so that an image that is submitted more than once
+(for example when a client retries a request, or verifies the same selfie through /verifyFaces and then /verifyID)
+is recognised regardless of how it was encoded or sent. The most recently used values are kept in memory, and the
+cache can optionally be backed by a directory on the local disk, so that values survive a restart of the server
+and are shared by all the processes using the same directory.
+
+Example usage:
+
+First import the content cache module...
+from hutts_verification.utils.content_cache import ContentCache, content_hash
+then look up a value and store it if it is missing.
+
+``cache = ContentCache('embeddings', max_entries=1024)``
+``key = content_hash(image)``
+``descriptor = cache.get(key)``
+``if descriptor is None:``
+    ``descriptor = cache.put(key, compute_descriptor(image))``
+
+Only numpy arrays can be stored, since they are written to disk without pickling.
+
+Caches of sensitive values (such as the personal information extracted from an ID) can be created with
+``scrub=True``, in which case the values stored on disk are overwritten before their files are removed, whether
+they expire, are evicted or are cleared.
+
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from hutts_verification.utils.hutts_logger import logger
+from hutts_verification.utils.metrics import cache_lookups
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""Specifies the file extension of the values stored on disk."""
+CONTENT_CACHE_EXTENSION = '.npy'
+
+
+def content_hash(image, *salt):
+    """
+    Calculates a hash of the decoded pixels of an image.
+
+    :param image (obj): The numpy image.
+    :param salt (str): Additional values that distinguish the cached values, e.g. the model used to compute them.
+
+    Returns:
+        - (str): The hexadecimal hash of the image.
+
+    Raises:
+        - TypeError: If the image is not a numpy array.
+
+    """
+    if not isinstance(image, np.ndarray):
+        raise TypeError(
+            'Bad type for arg image - expected image in numpy array. Received type "%s".' %
+            type(image).__name__
+        )
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(('%s|%s|%s' % (image.shape, image.dtype.str, '|'.join(salt))).encode('utf-8'))
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+class ContentCache:
+    """
+    A size-bounded, least-recently-used cache of numpy arrays keyed by content hash, optionally backed by
+    a directory on disk. Values older than the time to live are treated as missing and removed.
+
+    :name (str): The name of the cache, used to label its metrics.
+    :max_entries (int): The maximum number of values kept in memory.
+    :directory (str): The directory in which values are stored on disk, if any.
+    :ttl (float): The number of seconds a value remains valid, or None if values do not expire.
+    :max_disk_entries (int): The maximum number of values stored on disk.
+    :scrub (bool): Whether or not values stored on disk are overwritten before their files are removed.
+    :_entries (OrderedDict): The values kept in memory and the time they were stored, from least to most
+            recently used.
+    :_disk_entries (int): The number of values stored on disk, as far as this cache knows.
+    :_lock (Lock): Guards the values kept in memory and the statistics.
+
+    """
+    def __init__(self, name, max_entries=1024, directory=None, ttl=None, max_disk_entries=100000, scrub=False):
+        """
+        Responsible for initialising the ContentCache object.
+
+        :param name (str): The name of the cache, used to label its metrics.
+        :param max_entries (int): The maximum number of values kept in memory.
+        :param directory (str): The directory in which values are stored on disk. Values are only kept in memory
+                if no directory is given.
+        :param ttl (float): The number of seconds a value remains valid. Values do not expire if none is given.
+        :param max_disk_entries (int): The maximum number of values stored on disk.
+        :param scrub (bool): Whether or not values stored on disk should be overwritten before their files are
+                removed, so that sensitive values can not be recovered from the disk.
+
+        Raises:
+            - TypeError: If the maximum number of entries is not an integer.
+            - ValueError: If the maximum number of entries is negative.
+
+        """
+        for (arg_name, value) in (('max_entries', max_entries), ('max_disk_entries', max_disk_entries)):
+            if not isinstance(value, int):
+                raise TypeError(
+                    'Bad type for arg %s - expected int. Received type "%s".' %
+                    (arg_name, type(value).__name__)
+                )
+            if value < 0:
+                raise ValueError('The maximum number of entries of a cache can not be negative.')
+        self.name = name
+        self.max_entries = max_entries
+        self.directory = directory
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.scrub = scrub
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hit': 0, 'disk_hit': 0, 'miss': 0}
+        self._disk_entries = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_entries = len(self._disk_files())
+
+    def get(self, key):
+        """
+        Looks up the value stored under a key, first in memory and then on disk.
+        A value found on disk is kept in memory for subsequent lookups.
+
+        :param key (str): The content hash.
+
+        Returns:
+            - (obj): The value (numpy array).
+            - (None): If no valid value is stored under the key.
+
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                (value, stored) = entry
+                if not self._expired(stored, now):
+                    self._entries.move_to_end(key)
+                    self._record('memory_hit')
+                    return value
+                del self._entries[key]
+        value = self._load(key, now)
+        with self._lock:
+            if value is None:
+                self._record('miss')
+                return None
+            self._remember(key, value, now)
+            self._record('disk_hit')
+        return value
+
+    def put(self, key, value):
+        """
+        Stores a value under a key, evicting the least recently used values if the cache is full.
+
+        :param key (str): The content hash.
+        :param value (obj): The value (numpy array).
+
+        Returns:
+            - (obj): The stored value, which is a read-only copy of the value passed.
+
+        Raises:
+            - TypeError: If the value can not be converted to a numpy array of numbers.
+
+        """
+        value = np.array(value)
+        if value.dtype.kind not in 'biuf':
+            raise TypeError(
+                'Bad type for arg value - expected numeric array. Received type "%s".' %
+                value.dtype.name
+            )
+        value.setflags(write=False)
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+        if self.directory is not None:
+            self._store(key, value)
+        return value
+
+    def stats(self):
+        """
+        Returns the lookup statistics of the cache.
+
+        Returns:
+            - (dict): The number of lookups that were found in memory, found on disk and missed, along with the
+                hit rate and the number of values kept in memory.
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['memory_hit'] + stats['disk_hit'] + stats['miss']
+        stats['hit_rate'] = (stats['memory_hit'] + stats['disk_hit']) / lookups if lookups else None
+        return stats
+
+    def clear(self):
+        """
+        Discards all of the values kept in memory and stored on disk.
+        """
+        with self._lock:
+            self._entries.clear()
+        if self.directory is not None:
+            for path in self._disk_files():
+                self._remove(path)
+            self._disk_entries = 0
+
+    def _expired(self, stored, now):
+        """
+        Checks whether a value has outlived the time to live.
+
+        :param stored (float): The time at which the value was stored.
+        :param now (float): The current time.
+
+        Returns:
+            - (bool): Whether or not the value has expired.
+
+        """
+        return self.ttl is not None and now - stored > self.ttl
+
+    def _record(self, result):
+        """
+        Records the result of a lookup. The lock should be held.
+
+        :param result (str): The result of the lookup, i.e. 'memory_hit', 'disk_hit' or 'miss'.
+
+        """
+        self._stats[result] += 1
+        cache_lookups.labels(self.name, result).inc()
+
+    def _remember(self, key, value, stored):
+        """
+        Keeps a value in memory, evicting the least recently used values if necessary. The lock should be held.
+
+        :param key (str): The content hash.
+        :param value (obj): The value.
+        :param stored (float): The time at which the value was stored.
+
+        """
+        if self.max_entries == 0:
+            return
+        self._entries[key] = (value, stored)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key):
+        """
+        Returns the path of the file in which the value of a key is stored.
+
+        :param key (str): The content hash.
+
+        Returns:
+            - (str): The path of the file.
+
+        """
+        return os.path.join(self.directory, key + CONTENT_CACHE_EXTENSION)
+
+    def _disk_files(self):
+        """
+        Lists the files of the values stored on disk.
+
+        Returns:
+            - (list): The paths of the files.
+
+        """
+        return [
+            entry.path for entry in os.scandir(self.directory)
+            if entry.is_file() and entry.name.endswith(CONTENT_CACHE_EXTENSION)
+        ]
+
+    def _load(self, key, now):
+        """
+        Loads the value of a key from disk, removing it if it has expired.
+
+        :param key (str): The content hash.
+        :param now (float): The current time.
+
+        Returns:
+            - (obj): The value (numpy array).
+            - (None): If no valid value is stored on disk.
+
+        """
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            if self._expired(os.path.getmtime(path), now):
+                self._remove(path)
+                return None
+            value = np.load(path, allow_pickle=False)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as error:
+            logger.warning('Discarding unreadable cache entry "%s": %s' % (path, error))
+            self._remove(path)
+            return None
+        value.setflags(write=False)
+        return value
+
+    def _store(self, key, value):
+        """
+        Stores a value on disk, evicting the oldest values if the disk store is full.
+        The value is written to a temporary file first, so that other processes never read a partial value.
+
+        :param key (str): The content hash.
+        :param value (obj): The value (numpy array).
+
+        """
+        path = self._path(key)
+        temporary_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        try:
+            with open(temporary_path, 'wb') as temporary_file:
+                np.save(temporary_file, value, allow_pickle=False)
+            os.replace(temporary_path, path)
+        except OSError as error:
+            logger.warning('Could not store cache entry "%s": %s' % (path, error))
+            self._remove(temporary_path)
+            return
+        self._disk_entries += 1
+        if self._disk_entries > self.max_disk_entries:
+            self._evict()
+
+    def _evict(self):
+        """
+        Removes expired values from disk, followed by the oldest values until the disk store is within its bounds.
+        """
+        now = time.time()
+        files = []
+        for path in self._disk_files():
+            try:
+                files.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                continue
+        files.sort()
+        # Make room for a tenth of the maximum, so that the directory is not scanned on every store.
+        keep = self.max_disk_entries - self.max_disk_entries // 10
+        for (index, (stored, path)) in enumerate(files):
+            if len(files) - index > keep or self._expired(stored, now):
+                self._remove(path)
+            else:
+                files = files[index:]
+                break
+        else:
+            files = []
+        self._disk_entries = len(files)
+
+    def _remove(self, path):
+        """
+        Removes a file, ignoring files that have already been removed. The file is overwritten with zeros first
+        if the cache scrubs its values.
+
+        :param path (str): The path of the file.
+
+        """
+        try:
+            if self.scrub:
+                with open(path, 'r+b') as scrubbed_file:
+                    scrubbed_file.write(bytes(os.fstat(scrubbed_file.fileno()).st_size))
+                    scrubbed_file.flush()
+                    os.fsync(scrubbed_file.fileno())
+            os.remove(path)
+        except FileNotFoundError:
+            pass
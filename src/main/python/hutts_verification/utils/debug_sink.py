@@ -0,0 +1,498 @@
+"""
+Wraps the functionality required to record the intermediate images of requests for debugging.
+
+Requests that set ``useIO`` have their intermediate images (the edges and contours found during the perspective
+transformation, the blurred, color extracted, grayscale and thresholded images of the text extraction pipeline and
+so on) handed to the debug sink of the process. Four sinks are available:
+
+    - ``DebugSink``     -   Discards the images. This is the default, so requests never write to disk by accident.
+    - ``DirectorySink`` -   Writes the images of every request to a directory of its own.
+    - ``MemorySink``    -   Keeps the most recent images in memory, where they are served over HTTP.
+    - ``AsyncSink``     -   Hands the images to another sink on a writer thread, so that PNG compression and disk
+                            I/O do not hold up the request. Images are dropped rather than waited for if the writer
+                            falls behind.
+
+Images are compressed with a fast PNG compression level. Every request that records images is given a debug ID,
+which is returned in the ``X-Hutts-Debug-Id`` header of the response.
+
+Example usage:
+
+First import the debug sink module...
+from hutts_verification.utils.debug_sink import AsyncSink, DirectorySink, debug_image, debugging, set_debug_sink
+then set the sink of the process...
+
+``set_debug_sink(AsyncSink(DirectorySink('/tmp/hutts-debug')))``
+
+and record images within a debugging session, which is given the debug ID of the request.
+
+``with debugging(preferences.get('debug_id')):``
+    ``debug_image('5_blurred', blurred_image)``
+
+The images kept by a MemorySink are listed at ``/debugImages`` and can be downloaded from
+``/debugImages/<debug_id>/<name>`` by the debug_images blueprint.
+
+"""
+
+import os
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+import cv2
+from flask import Blueprint, Response, g, jsonify
+from hutts_verification.utils.hutts_logger import logger
+from hutts_verification.utils.metrics import debug_image_records
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""Specifies the header of the response that holds the debug ID of the request."""
+DEBUG_ID_HEADER = 'X-Hutts-Debug-Id'
+"""Specifies the PNG compression level (0-9) of the recorded images. Low levels trade size for speed."""
+DEBUG_SINK_PNG_COMPRESSION = 1
+"""Specifies the default number of images kept by a MemorySink."""
+DEBUG_SINK_DEFAULT_CAPACITY = 64
+"""Specifies the default number of images that may wait for the writer thread of an AsyncSink."""
+DEBUG_SINK_DEFAULT_QUEUE_SIZE = 64
+"""Specifies the kinds of sink that can be created with create_debug_sink."""
+DEBUG_SINK_KINDS = ('null', 'directory', 'memory')
+
+"""Holds the debugging session of the current thread."""
+_local = threading.local()
+
+
+class DebugSink:
+    """
+    Receives the intermediate images of requests. The base sink discards them.
+
+    :enabled (bool): Whether or not the sink records images. Requests are only given a debug ID if it does.
+
+    """
+    enabled = False
+
+    def record(self, debug_id, name, image):
+        """
+        Records an intermediate image of a request.
+
+        :param debug_id (str): The debug ID of the request.
+        :param name (str): The name of the image, unique within the request.
+        :param image (obj): The image (numpy array). It may be reused by the caller once the call returns.
+
+        """
+        pass
+
+    def close(self):
+        """
+        Releases the resources of the sink.
+        """
+        pass
+
+
+class DirectorySink(DebugSink):
+    """
+    Writes the images of every request to a directory of its own, named after the debug ID of the request.
+
+    :directory (str): The directory that holds the directories of the requests.
+
+    """
+    enabled = True
+
+    def __init__(self, directory):
+        """
+        Responsible for initialising the DirectorySink object.
+
+        :param directory (str): The directory that holds the directories of the requests. It is created if it does
+                not exist.
+
+        Raises:
+            - TypeError: If the directory is not a string.
+
+        """
+        if not isinstance(directory, str):
+            raise TypeError(
+                'Bad type for arg directory - expected string. Received type "%s".' %
+                type(directory).__name__
+            )
+        self.directory = directory
+
+    def record(self, debug_id, name, image):
+        request_directory = os.path.join(self.directory, debug_id)
+        os.makedirs(request_directory, exist_ok=True)
+        cv2.imwrite(os.path.join(request_directory, name + '.png'), image,
+                    [cv2.IMWRITE_PNG_COMPRESSION, DEBUG_SINK_PNG_COMPRESSION])
+
+
+class MemorySink(DebugSink):
+    """
+    Keeps the most recently recorded images in memory as PNG images.
+
+    :capacity (int): The number of images that are kept.
+    :_images (OrderedDict): The PNG images (bytes), keyed by debug ID and name, from oldest to newest.
+    :_lock (Lock): Guards the images.
+
+    """
+    enabled = True
+
+    def __init__(self, capacity=DEBUG_SINK_DEFAULT_CAPACITY):
+        """
+        Responsible for initialising the MemorySink object.
+
+        :param capacity (int): The number of images that are kept.
+
+        Raises:
+            - TypeError: If the capacity is not an integer.
+            - ValueError: If the capacity is not positive.
+
+        """
+        if not isinstance(capacity, int) or isinstance(capacity, bool):
+            raise TypeError(
+                'Bad type for arg capacity - expected int. Received type "%s".' %
+                type(capacity).__name__
+            )
+        if capacity < 1:
+            raise ValueError('The capacity of a memory sink must be positive.')
+        self.capacity = capacity
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, debug_id, name, image):
+        (_, png) = cv2.imencode('.png', image, [cv2.IMWRITE_PNG_COMPRESSION, DEBUG_SINK_PNG_COMPRESSION])
+        with self._lock:
+            self._images.pop((debug_id, name), None)
+            self._images[(debug_id, name)] = png.tobytes()
+            while len(self._images) > self.capacity:
+                self._images.popitem(last=False)
+
+    def debug_ids(self):
+        """
+        Returns the debug IDs of the requests whose images are kept.
+
+        Returns:
+            - (list): The debug IDs, from the oldest to the most recent request.
+
+        """
+        with self._lock:
+            return list(OrderedDict.fromkeys(debug_id for (debug_id, _) in self._images))
+
+    def names(self, debug_id):
+        """
+        Returns the names of the images of a request that are kept.
+
+        :param debug_id (str): The debug ID of the request.
+
+        Returns:
+            - (list): The names of the images, in the order in which they were recorded.
+
+        """
+        with self._lock:
+            return [name for (image_debug_id, name) in self._images if image_debug_id == debug_id]
+
+    def get(self, debug_id, name):
+        """
+        Returns an image of a request.
+
+        :param debug_id (str): The debug ID of the request.
+        :param name (str): The name of the image.
+
+        Returns:
+            - (bytes): The PNG image.
+            - (None): If the image is not kept.
+
+        """
+        with self._lock:
+            return self._images.get((debug_id, name))
+
+
+class AsyncSink(DebugSink):
+    """
+    Hands images to another sink on a writer thread.
+
+    :sink (DebugSink): The sink that records the images.
+    :dropped (int): The number of images that were dropped because the writer thread fell behind.
+    :_queue (Queue): The images waiting for the writer thread.
+    :_thread (Thread): The writer thread.
+
+    """
+    def __init__(self, sink, queue_size=DEBUG_SINK_DEFAULT_QUEUE_SIZE):
+        """
+        Responsible for initialising the AsyncSink object and starting its writer thread.
+
+        :param sink (DebugSink): The sink that records the images.
+        :param queue_size (int): The number of images that may wait for the writer thread.
+
+        Raises:
+            - TypeError: If the sink is not a DebugSink.
+
+        """
+        if not isinstance(sink, DebugSink):
+            raise TypeError(
+                'Bad type for arg sink - expected DebugSink. Received type "%s".' %
+                type(sink).__name__
+            )
+        self.sink = sink
+        self.enabled = sink.enabled
+        self.dropped = 0
+        self._queue = queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self._write, name='debug-sink', daemon=True)
+        self._thread.start()
+
+    def record(self, debug_id, name, image):
+        # The image is copied, since the caller may reuse it as soon as the call returns.
+        try:
+            self._queue.put_nowait((debug_id, name, image.copy()))
+        except queue.Full:
+            self.dropped += 1
+            debug_image_records.labels('dropped').inc()
+            logger.warning('Dropped debug image %s of %s, since the debug sink fell behind' % (name, debug_id))
+
+    def flush(self):
+        """
+        Waits until the writer thread has recorded all the images handed to the sink.
+        """
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self.sink.close()
+
+    def _write(self):
+        """
+        Records the images handed to the sink until the sink is closed.
+        """
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                _record(self.sink, *item)
+            finally:
+                self._queue.task_done()
+
+
+"""The sink that receives the intermediate images of requests."""
+_debug_sink = DebugSink()
+
+
+def get_debug_sink():
+    """
+    Returns the sink that receives the intermediate images of requests.
+
+    Returns:
+        - (DebugSink): The debug sink.
+
+    """
+    return _debug_sink
+
+
+def set_debug_sink(sink):
+    """
+    Sets the sink that receives the intermediate images of requests.
+
+    :param sink (DebugSink): The new debug sink.
+
+    Raises:
+        - TypeError: If the sink is not a DebugSink.
+
+    """
+    global _debug_sink
+    if not isinstance(sink, DebugSink):
+        raise TypeError(
+            'Bad type for arg sink - expected DebugSink. Received type "%s".' %
+            type(sink).__name__
+        )
+    _debug_sink = sink
+
+
+def create_debug_sink(kind, directory=None, capacity=DEBUG_SINK_DEFAULT_CAPACITY, asynchronous=False):
+    """
+    Creates a debug sink.
+
+    :param kind (str): The kind of sink ("null", "directory" or "memory").
+    :param directory (str): The directory of a directory sink.
+    :param capacity (int): The number of images kept by a memory sink.
+    :param asynchronous (bool): Whether or not images are recorded on a writer thread.
+
+    Returns:
+        - (DebugSink): The debug sink.
+
+    Raises:
+        - ValueError: If the kind of sink is unknown, or no directory is given for a directory sink.
+
+    """
+    if kind == 'null':
+        return DebugSink()
+    if kind == 'directory':
+        if directory is None:
+            raise ValueError('A directory must be given for a directory debug sink.')
+        sink = DirectorySink(directory)
+    elif kind == 'memory':
+        sink = MemorySink(capacity)
+    else:
+        raise ValueError('Unknown debug sink "%s". Try: %s' % (kind, ', '.join(DEBUG_SINK_KINDS)))
+    return AsyncSink(sink) if asynchronous else sink
+
+
+def request_debug_id(use_io):
+    """
+    Returns the debug ID of the current request, creating it the first time it is requested. The debug ID is
+    returned in the X-Hutts-Debug-Id header of the response.
+
+    :param use_io (bool): Whether or not the request asked for its intermediate images to be recorded.
+
+    Returns:
+        - (str): The debug ID.
+        - (None): If the request did not ask for its images to be recorded, or the debug sink does not record them.
+
+    """
+    if not use_io or not _debug_sink.enabled:
+        return None
+    if '_debug_id' not in g:
+        g._debug_id = uuid.uuid4().hex
+    return g._debug_id
+
+
+@contextmanager
+def debugging(debug_id):
+    """
+    Records the intermediate images of the current thread under a debug ID within the context.
+
+    :param debug_id (str): The debug ID of the request, or None to discard the images.
+
+    Returns:
+        - (str): The debug ID.
+
+    """
+    previous = getattr(_local, 'debug_id', None)
+    _local.debug_id = debug_id
+    try:
+        yield debug_id
+    finally:
+        _local.debug_id = previous
+
+
+def debug_enabled():
+    """
+    Checks whether the intermediate images of the current thread are recorded.
+
+    Returns:
+        - (bool): Whether or not a debugging session is active and the debug sink records images.
+
+    """
+    return getattr(_local, 'debug_id', None) is not None and _debug_sink.enabled
+
+
+def debug_image(name, image):
+    """
+    Hands an intermediate image of the current thread to the debug sink, if a debugging session is active.
+    Failures are logged rather than raised, so that debugging never fails a request.
+
+    :param name (str): The name of the image, unique within the request.
+    :param image (obj): The image (numpy array).
+
+    """
+    debug_id = getattr(_local, 'debug_id', None)
+    if debug_id is not None and _debug_sink.enabled:
+        _record(_debug_sink, debug_id, name, image)
+
+
+def _record(sink, debug_id, name, image):
+    """
+    Records an image with a sink, logging rather than raising failures.
+
+    :param sink (DebugSink): The sink.
+    :param debug_id (str): The debug ID of the request.
+    :param name (str): The name of the image.
+    :param image (obj): The image (numpy array).
+
+    """
+    try:
+        sink.record(debug_id, name, image)
+    except Exception as error:
+        logger.warning('Could not record debug image %s of %s: %s' % (name, debug_id, error))
+        return
+    if not isinstance(sink, AsyncSink):
+        debug_image_records.labels('recorded').inc()
+
+
+def _memory_sink():
+    """
+    Returns the memory sink that keeps the images of requests, if the debug sink is one.
+
+    Returns:
+        - (MemorySink): The memory sink.
+        - (None): If the images are not kept in memory.
+
+    """
+    sink = _debug_sink.sink if isinstance(_debug_sink, AsyncSink) else _debug_sink
+    return sink if isinstance(sink, MemorySink) else None
+
+
+"""Serves the images kept by a memory sink and returns the debug IDs of requests."""
+debug_images = Blueprint('debug_images', __name__)
+
+
+@debug_images.after_app_request
+def add_debug_id_header(response):
+    """
+    Adds the debug ID of the request, if it has one, to the headers of the response.
+
+    :param response (Response): The response.
+
+    Returns:
+        - (Response): The response.
+
+    """
+    debug_id = g.get('_debug_id', None)
+    if debug_id is not None:
+        response.headers[DEBUG_ID_HEADER] = debug_id
+    return response
+
+
+@debug_images.route('/debugImages', methods=['GET'])
+def list_debug_ids():
+    """
+    Lists the debug IDs of the requests whose images are kept in memory.
+
+    URL: http://localhost:5000/debugImages.
+
+    """
+    sink = _memory_sink()
+    if sink is None:
+        return jsonify({"error": "Debug images are not kept in memory."}), 404
+    return jsonify({"debug_ids": sink.debug_ids()})
+
+
+@debug_images.route('/debugImages/<debug_id>', methods=['GET'])
+def list_debug_images(debug_id):
+    """
+    Lists the names of the images of a request that are kept in memory.
+
+    URL: http://localhost:5000/debugImages/<debug_id>.
+
+    """
+    sink = _memory_sink()
+    names = sink.names(debug_id) if sink is not None else []
+    if not names:
+        return jsonify({"error": "No debug images are kept for %s." % debug_id}), 404
+    return jsonify({"names": names})
+
+
+@debug_images.route('/debugImages/<debug_id>/<name>', methods=['GET'])
+def get_debug_image(debug_id, name):
+    """
+    Serves an image of a request that is kept in memory as a PNG image.
+
+    URL: http://localhost:5000/debugImages/<debug_id>/<name>.
+
+    """
+    sink = _memory_sink()
+    png = sink.get(debug_id, name) if sink is not None else None
+    if png is None:
+        return jsonify({"error": "The debug image %s of %s is not kept." % (name, debug_id)}), 404
+    return Response(png, mimetype='image/png')
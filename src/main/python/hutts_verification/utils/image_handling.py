@@ -1,11 +1,37 @@
 """
 Utility functions to manage image handling from given parameters.
+
+Images are decoded at full resolution by default. Optionally they can be decoded at a working resolution: uploads
+whose longest side is at least twice the maximum working dimension are then decoded at a half, quarter or eighth of
+their size (JPEG images are scaled down while they are being decoded, so the full resolution image is never held in
+memory), and the factor by which the image was scaled down can be requested along with the image so that
+coordinates found in the working image can be mapped back onto the original. The extraction stages do not map
+their regions back yet, so a working resolution also lowers the resolution of the extracted face, barcode and
+fields, which is why it is not used by default.
+
+Example usage:
+
+First import the image handling module...
+from hutts_verification.utils.image_handling import grab_image, set_max_dimension
+then optionally set a maximum working dimension for the process (0 decodes images at full resolution)...
+
+``set_max_dimension(1600)``
+
+and grab an image along with the factor by which it was scaled down.
+
+``(image, scale) = grab_image(string=request_data['idPhoto'], return_scale=True)``
+
+A region found in the working image can then be read from the original image by decoding it again at full
+resolution with ``grab_image(string=request_data['idPhoto'], max_dimension=0)`` and multiplying the coordinates
+of the region by the scale.
+
 """
 
+import binascii
+import struct
+import urllib.request
 import cv2
 import numpy as np
-import base64
-from imutils.convenience import url_to_image
 from hutts_verification.utils.hutts_logger import logger
 
 __authors__ = "Stephan Nell, Andreas Nel"
@@ -15,8 +41,72 @@ __maintainer__ = "Stephan Nell"
 __email__ = "nellstephanj@gmail.com"
 __status__ = "Development"
 
+"""The longest side, in pixels, of the working copy of an image when none is configured (0 is full resolution)."""
+IMAGE_DEFAULT_MAX_DIMENSION = 0
+"""The reduced decoding modes of OpenCV, keyed by the factor by which they scale the image down."""
+IMAGE_REDUCED_MODES = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+"""The markers of the JPEG segments that start a frame and hold its dimensions."""
+_JPEG_FRAME_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+"""The signature that every PNG image starts with."""
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+"""The longest side of the working copy of an image when none is given (0 decodes at full resolution)."""
+_max_dimension = IMAGE_DEFAULT_MAX_DIMENSION
+
+
+def set_max_dimension(max_dimension):
+    """
+    Sets the longest side of the working copy of the images grabbed without giving one explicitly.
+
+    :param max_dimension (int): The longest side of the working copy, in pixels. Images are only scaled down by
+            a factor that keeps their longest side at least this long. 0 decodes images at full resolution.
+
+    Raises:
+        - TypeError: If the maximum dimension is not an integer.
+        - ValueError: If the maximum dimension is negative.
+
+    """
+    global _max_dimension
+    _check_max_dimension(max_dimension)
+    _max_dimension = max_dimension
+
+
+def get_max_dimension():
+    """
+    Returns the longest side of the working copy of the images grabbed without giving one explicitly.
+
+    Returns:
+        - (int): The longest side of the working copy, in pixels (0 if images are decoded at full resolution).
+
+    """
+    return _max_dimension
 
-def grab_image(path=None, stream=None, url=None, string=None):
+
+def _check_max_dimension(max_dimension):
+    """
+    Checks whether a maximum working dimension is valid.
+
+    :param max_dimension (int): The maximum dimension to check.
+
+    Raises:
+        - TypeError: If the maximum dimension is not an integer.
+        - ValueError: If the maximum dimension is negative.
+
+    """
+    if not isinstance(max_dimension, int) or isinstance(max_dimension, bool):
+        raise TypeError(
+            'Bad type for arg max_dimension - expected int. Received type "%s".' %
+            type(max_dimension).__name__
+        )
+    if max_dimension < 0:
+        raise ValueError('The maximum dimension of images can not be negative.')
+
+
+def grab_image(path=None, stream=None, url=None, string=None, max_dimension=None, return_scale=False, length=None):
     """
     This function grabs the image from URL, or image path and applies necessary changes to the grabbed
     images so that the image is compatible with OpenCV operation.
@@ -25,46 +115,179 @@ def grab_image(path=None, stream=None, url=None, string=None):
     :param str (stream): A stream of text representing an image upload.
     :param str (url): URL representing a path to where an image should be fetched.
     :param str (string): A base64 encoded string of the image.
+    :param max_dimension (int): The longest side of the working copy of the image. The maximum dimension of the
+            process is used if none is given, and 0 decodes the image at full resolution.
+    :param return_scale (bool): Whether or not to also return the factor by which the image was scaled down.
+    :param length (int): The number of bytes of the image in the stream, if it is known. The stream is then read
+            straight into a buffer of that size.
 
     Raises:
         - ValueError: If no path, stream, URL or Base64 string was found.
 
     Returns:
         - (obj): Image that is now compatible with OpenCV operations.
+        - (float): The longest side of the original image divided by the longest side of the returned image (only
+            returned if return_scale is True).
 
     """
+    if max_dimension is None:
+        max_dimension = _max_dimension
+    else:
+        _check_max_dimension(max_dimension)
     # If the path is not None, then load the image from disk. Example: payload = {"image": open("id.jpg", "rb")}
     if path is not None:
         logger.debug("Grabbing from Disk")
-        image = cv2.imread(path)
-
-        if image is None:
-            raise ValueError('Invalid Path. No image could be found.'
-                             ' Either path is incorrect or image does not exist')
-    # otherwise, the image does not reside on disk
+        try:
+            with open(path, 'rb') as image_file:
+                data = image_file.read()
+        except OSError:
+            data = b''
+    # If the URL is not None, then download the image
+    # Example: "http://www.pyimagesearch.com/wp-content/uploads/2015/05/obama.jpg"
+    elif url is not None:
+        logger.debug("Downloading image from URL")
+        with urllib.request.urlopen(url) as response:
+            data = response.read()
+    # If string is not None, then the image was transmitted with base64 encoding.
+    elif string is not None:
+        logger.debug("Decoding base64 string")
+        data = decode_base64(string)
+    # if the stream is not None, then the image has been uploaded
+    elif stream is not None:
+        logger.debug("Downloading from image stream")
+        data = read_stream(stream, length)
     else:
-        # If the URL is not None, then download the image
-        if url is not None:
-            # Example: "http://www.pyimagesearch.com/wp-content/uploads/2015/05/obama.jpg"
-            # If URL is incorrect Urllib in imutils library will catch the error.
-            logger.debug("Downloading image from URL")
-            return url_to_image(url)
-        # If string is not None, then the image was transmitted with base64 encoding.
-        elif string is not None:
-            logger.debug("Decoding base64 string")
-            encoded_data = string.split(',')[1]
-            nparr = np.fromstring(base64.b64decode(encoded_data), np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        # if the stream is not None, then the image has been uploaded
-        elif stream is not None:
-            logger.debug("Downloading from image stream")
-            data = stream.read()
-            image = np.asarray(bytearray(data), dtype="uint8")
-            image = cv2.imdecode(image, cv2.IMREAD_COLOR)
-            if image is None:
-                raise ValueError('Invalid Path. No image could be found.'
-                                 ' Either path is incorrect or image does not exist')
-        else:
-            raise ValueError('No valid method was found to grab image.'
-                             ' Either path is incorrect or image does not exist')
+        raise ValueError('No valid method was found to grab image.'
+                         ' Either path is incorrect or image does not exist')
+    (image, scale) = decode_image(data, max_dimension)
+    if image is None:
+        raise ValueError('Invalid Path. No image could be found.'
+                         ' Either path is incorrect or image does not exist')
+    if return_scale:
+        return image, scale
     return image
+
+
+def read_stream(stream, length=None):
+    """
+    Reads an encoded image from a stream. If the length of the image is known, the stream is read straight into a
+    buffer of that size rather than being read in chunks that are joined afterwards.
+
+    :param stream (obj): The stream (file-like object) to read from.
+    :param length (int): The number of bytes of the image, if it is known.
+
+    Returns:
+        - (obj): The encoded image (bytes-like object).
+
+    """
+    if not length or not hasattr(stream, 'readinto'):
+        return stream.read()
+    buffer = memoryview(bytearray(length))
+    received = 0
+    while received < length:
+        count = stream.readinto(buffer[received:])
+        if not count:
+            break
+        received += count
+    return buffer[:received]
+
+
+def decode_base64(string):
+    """
+    Decodes a base64 encoded image, which may be given as a data URI (e.g. "data:image/jpg;base64,...").
+    The encoded characters are decoded in place rather than being split off into a copy of the string first.
+
+    :param string (str): The base64 encoded image.
+
+    Returns:
+        - (bytes): The encoded image.
+
+    """
+    encoded = string.encode('ascii') if isinstance(string, str) else string
+    return binascii.a2b_base64(memoryview(encoded)[encoded.find(b',') + 1:])
+
+
+def decode_image(data, max_dimension=None):
+    """
+    Decodes an encoded image at its working resolution.
+
+    :param data (bytes): The encoded image (e.g. the contents of a JPEG or PNG file).
+    :param max_dimension (int): The longest side of the working copy of the image. The maximum dimension of the
+            process is used if none is given, and 0 decodes the image at full resolution.
+
+    Returns:
+        - (obj): The decoded image, or None if the data could not be decoded.
+        - (float): The longest side of the original image divided by the longest side of the decoded image.
+
+    """
+    if max_dimension is None:
+        max_dimension = _max_dimension
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    dimensions = encoded_dimensions(buffer)
+    factor = reduction_factor(dimensions, max_dimension)
+    mode = IMAGE_REDUCED_MODES[factor] if factor > 1 else cv2.IMREAD_COLOR
+    image = cv2.imdecode(buffer, mode) if buffer.size > 0 else None
+    if image is None:
+        return None, 1.0
+    if factor > 1:
+        logger.debug('Decoded %dx%d image at 1/%d of its size' % (dimensions[1], dimensions[0], factor))
+        # The decoded size is rounded (and the image may have been rotated according to its orientation), so the
+        # scale is taken from the longest sides rather than the factor.
+        return image, max(dimensions) / max(image.shape[:2])
+    return image, 1.0
+
+
+def reduction_factor(dimensions, max_dimension):
+    """
+    Determines the factor by which an image can be scaled down while it is being decoded.
+
+    :param dimensions (tuple): The height and width of the encoded image, or None if they are not known.
+    :param max_dimension (int): The longest side of the working copy of the image (0 for full resolution).
+
+    Returns:
+        - (int): The largest of 2, 4 and 8 that keeps the longest side of the image at least max_dimension long,
+            or 1 if the image should be decoded at full resolution.
+
+    """
+    if dimensions is None or max_dimension == 0:
+        return 1
+    longest_side = max(dimensions)
+    for factor in sorted(IMAGE_REDUCED_MODES, reverse=True):
+        if longest_side >= factor * max_dimension:
+            return factor
+    return 1
+
+
+def encoded_dimensions(buffer):
+    """
+    Reads the dimensions of a JPEG or PNG image from its header without decoding it.
+
+    :param buffer (obj): The encoded image (numpy array of bytes).
+
+    Returns:
+        - (tuple): The height and width of the image, or None if the image is not a JPEG or PNG image or its
+            header could not be read.
+
+    """
+    data = buffer.data
+    if data[:8] == _PNG_SIGNATURE and len(data) >= 24:
+        (width, height) = struct.unpack('>II', data[16:24])
+        return height, width
+    if data[:2] != b'\xff\xd8':
+        return None
+    # Walk the segments of the JPEG image up to the frame header.
+    position = 2
+    while position + 9 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Markers may be preceded by any number of fill bytes.
+            position += 1
+            continue
+        if marker in _JPEG_FRAME_MARKERS:
+            (height, width) = struct.unpack('>HH', data[position + 5:position + 9])
+            return height, width
+        (length,) = struct.unpack('>H', data[position + 2:position + 4])
+        position += 2 + length
+    return None
@@ -0,0 +1,640 @@
+"""
+Wraps the functionality required to collect metrics on the service and expose them in the Prometheus text format.
+
+Three types of metrics are available:
+
+    - ``Counter``   -   A value that only goes up, e.g. the number of requests.
+    - ``Gauge``     -   A value that can go up and down, e.g. the number of requests in flight.
+    - ``Histogram`` -   Counts observations in buckets, e.g. the duration of requests.
+
+Example usage:
+
+First import the metric from the metrics module...
+from hutts_verification.utils.metrics import barcode_decodes
+then update it.
+
+``barcode_decodes.labels('success').inc()``
+
+Every combination of label values has its own child with its own lock, so updates to different children never
+contend with one another, and updating a child only takes an uncontended lock for the duration of an addition.
+Looking up an existing child does not take a lock at all.
+
+The metrics are served at ``/metrics`` by the metrics blueprint, which also records the number, duration and
+status of all the requests made to the application it is registered with.
+
+"""
+
+import bisect
+import threading
+import time
+from flask import Blueprint, Response, g, request
+from hutts_verification.utils import tracing
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""Specifies the default upper bounds (in seconds) of the buckets of histograms."""
+METRICS_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+"""Specifies the MIME-type of the Prometheus text format."""
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+"""Specifies the route label used for requests that do not match any route."""
+METRICS_UNMATCHED_ROUTE = 'unmatched'
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics that are exposed together.
+
+    :_metrics (list): The registered metrics, in the order in which they were registered.
+    :_names (set): The names of the registered metrics.
+    :_lock (Lock): Guards the registration of metrics.
+
+    """
+    def __init__(self):
+        """
+        Responsible for initialising the MetricsRegistry object.
+        """
+        self._metrics = []
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Registers a metric so that it is exposed along with the other metrics in the registry.
+
+        :param metric (obj): The metric to register. It should have a name and be able to render itself.
+
+        Raises:
+            - ValueError: If a metric with the same name has already been registered.
+
+        """
+        with self._lock:
+            if metric.name in self._names:
+                raise ValueError('A metric named "%s" has already been registered.' % metric.name)
+            self._names.add(metric.name)
+            self._metrics.append(metric)
+
+    def render(self):
+        """
+        Renders all of the registered metrics in the Prometheus text format.
+
+        Returns:
+            - (str): The metrics in the Prometheus text format.
+
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        return ''.join(metric.render() for metric in metrics)
+
+
+"""The global metrics registry that is shared by the entire process."""
+registry = MetricsRegistry()
+
+
+class _Metric:
+    """
+    An abstraction of all metrics, which keeps a child per combination of label values.
+
+    :name (str): The name of the metric.
+    :documentation (str): A description of the metric.
+    :label_names (tuple): The names of the labels of the metric.
+    :_children (dict): The children of the metric, keyed by label values.
+    :_lock (Lock): Guards the creation of children.
+
+    """
+    type = None
+
+    def __init__(self, name, documentation, label_names=(), metrics_registry=registry):
+        """
+        Responsible for initialising the metric and registering it.
+
+        :param name (str): The name of the metric.
+        :param documentation (str): A description of the metric.
+        :param label_names (tuple): The names of the labels of the metric.
+        :param metrics_registry (MetricsRegistry): The registry the metric is registered with. The metric is not
+                registered if None is given.
+
+        Raises:
+            - TypeError: If a string value is not passed for name.
+
+        """
+        if not isinstance(name, str):
+            raise TypeError(
+                'Bad type for arg name - expected string. Received type "%s".' %
+                type(name).__name__
+            )
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children = {}
+        self._lock = threading.Lock()
+        if metrics_registry is not None:
+            metrics_registry.register(self)
+
+    def labels(self, *label_values):
+        """
+        Returns the child of the metric for the given label values, creating it if necessary.
+
+        :param label_values (str): The values of the labels, in the order of the label names.
+
+        Returns:
+            - (obj): The child of the metric.
+
+        Raises:
+            - ValueError: If the number of label values does not match the number of label names.
+
+        """
+        child = self._children.get(label_values)
+        if child is not None:
+            return child
+        if len(label_values) != len(self.label_names):
+            raise ValueError(
+                'Metric "%s" expects %d label values, but received %d.' %
+                (self.name, len(self.label_names), len(label_values))
+            )
+        with self._lock:
+            child = self._children.get(label_values)
+            if child is None:
+                child = self._children[label_values] = self._create_child()
+            return child
+
+    def render(self):
+        """
+        Renders the metric in the Prometheus text format.
+
+        Returns:
+            - (str): The metric in the Prometheus text format.
+
+        """
+        lines = [
+            '# HELP %s %s' % (self.name, _escape(self.documentation, quote=False)),
+            '# TYPE %s %s' % (self.name, self.type)
+        ]
+        with self._lock:
+            children = [
+                (tuple(str(value) for value in label_values), child)
+                for (label_values, child) in self._children.items()
+            ]
+        children.sort(key=lambda item: item[0])
+        for (label_values, child) in children:
+            labels = list(zip(self.label_names, label_values))
+            for (suffix, extra_labels, value) in child.samples():
+                lines.append('%s%s%s %s' % (self.name, suffix, _format_labels(labels + extra_labels),
+                                            _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def _create_child(self):
+        """
+        Abstract method for subclasses to implement.
+        Meant to create a child of the metric.
+        """
+        pass
+
+
+class _CounterChild:
+    """
+    A single counter.
+    """
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        Increments the counter.
+
+        :param amount (float): The amount to increment the counter by.
+
+        Raises:
+            - ValueError: If the amount is negative.
+
+        """
+        if amount < 0:
+            raise ValueError('A counter can only be incremented by a non-negative amount.')
+        with self._lock:
+            self._value += amount
+
+    def get(self):
+        """
+        Returns the value of the counter.
+
+        Returns:
+            - (float): The value of the counter.
+
+        """
+        return self._value
+
+    def samples(self):
+        return [('', [], self._value)]
+
+
+class Counter(_Metric):
+    """
+    A metric whose value only goes up.
+    """
+    type = 'counter'
+
+    def inc(self, amount=1):
+        """
+        Increments the counter of a metric without labels.
+
+        :param amount (float): The amount to increment the counter by.
+
+        """
+        self.labels().inc(amount)
+
+    def _create_child(self):
+        return _CounterChild()
+
+
+class _GaugeChild:
+    """
+    A single gauge.
+    """
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        Increments the gauge.
+
+        :param amount (float): The amount to increment the gauge by.
+
+        """
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        """
+        Decrements the gauge.
+
+        :param amount (float): The amount to decrement the gauge by.
+
+        """
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        """
+        Sets the value of the gauge.
+
+        :param value (float): The new value of the gauge.
+
+        """
+        self._value = value
+
+    def get(self):
+        """
+        Returns the value of the gauge.
+
+        Returns:
+            - (float): The value of the gauge.
+
+        """
+        return self._value
+
+    def samples(self):
+        return [('', [], self._value)]
+
+
+class Gauge(_Metric):
+    """
+    A metric whose value can go up and down.
+    """
+    type = 'gauge'
+
+    def inc(self, amount=1):
+        """
+        Increments the gauge of a metric without labels.
+
+        :param amount (float): The amount to increment the gauge by.
+
+        """
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        """
+        Decrements the gauge of a metric without labels.
+
+        :param amount (float): The amount to decrement the gauge by.
+
+        """
+        self.labels().dec(amount)
+
+    def set(self, value):
+        """
+        Sets the value of the gauge of a metric without labels.
+
+        :param value (float): The new value of the gauge.
+
+        """
+        self.labels().set(value)
+
+    def _create_child(self):
+        return _GaugeChild()
+
+
+class _HistogramChild:
+    """
+    A single histogram.
+    """
+    __slots__ = ('_upper_bounds', '_counts', '_sum', '_lock')
+
+    def __init__(self, upper_bounds):
+        self._upper_bounds = upper_bounds
+        # The last count holds the observations that exceed the largest upper bound.
+        self._counts = [0] * (len(upper_bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Adds an observation to the histogram.
+
+        :param value (float): The observed value.
+
+        """
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self):
+        """
+        Returns a context manager that observes the number of seconds spent within it.
+
+        Returns:
+            - (obj): The context manager.
+
+        """
+        return _Timer(self)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        samples = []
+        cumulative = 0
+        for (upper_bound, count) in zip(self._upper_bounds + (float('inf'),), counts):
+            cumulative += count
+            samples.append(('_bucket', [('le', _format_value(upper_bound))], cumulative))
+        samples.append(('_sum', [], total))
+        samples.append(('_count', [], cumulative))
+        return samples
+
+
+class Histogram(_Metric):
+    """
+    A metric that counts observations in buckets.
+
+    :buckets (tuple): The upper bounds of the buckets.
+
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=METRICS_DEFAULT_BUCKETS,
+                 metrics_registry=registry):
+        """
+        Responsible for initialising the histogram and registering it.
+
+        :param name (str): The name of the metric.
+        :param documentation (str): A description of the metric.
+        :param label_names (tuple): The names of the labels of the metric.
+        :param buckets (tuple): The upper bounds of the buckets.
+        :param metrics_registry (MetricsRegistry): The registry the metric is registered with.
+
+        """
+        self.buckets = tuple(sorted(buckets))
+        _Metric.__init__(self, name, documentation, label_names, metrics_registry)
+
+    def observe(self, value):
+        """
+        Adds an observation to the histogram of a metric without labels.
+
+        :param value (float): The observed value.
+
+        """
+        self.labels().observe(value)
+
+    def time(self):
+        """
+        Returns a context manager that observes the number of seconds spent within it for a metric without labels.
+
+        Returns:
+            - (obj): The context manager.
+
+        """
+        return self.labels().time()
+
+    def _create_child(self):
+        return _HistogramChild(self.buckets)
+
+
+class _Timer:
+    """
+    Observes the number of seconds spent within the context in a histogram.
+    """
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+class _StageHistograms:
+    """
+    Exposes the stage histograms kept by the tracing module as a histogram metric.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, stage_histograms, metrics_registry=registry):
+        """
+        Responsible for initialising the _StageHistograms object and registering it.
+
+        :param name (str): The name of the metric.
+        :param documentation (str): A description of the metric.
+        :param stage_histograms (StageHistograms): The stage histograms to expose.
+        :param metrics_registry (MetricsRegistry): The registry the metric is registered with.
+
+        """
+        self.name = name
+        self.documentation = documentation
+        self._stage_histograms = stage_histograms
+        metrics_registry.register(self)
+
+    def render(self):
+        """
+        Renders the stage histograms in the Prometheus text format.
+
+        Returns:
+            - (str): The stage histograms in the Prometheus text format.
+
+        """
+        lines = [
+            '# HELP %s %s' % (self.name, _escape(self.documentation, quote=False)),
+            '# TYPE %s %s' % (self.name, self.type)
+        ]
+        for (stage, id_types) in sorted(self._stage_histograms.snapshot().items()):
+            for (id_type, histogram) in sorted(id_types.items()):
+                labels = [('stage', stage), ('id_type', id_type)]
+                for (upper_bound, count) in histogram['buckets']:
+                    lines.append('%s_bucket%s %s' % (
+                        self.name, _format_labels(labels + [('le', _format_value(upper_bound))]), count
+                    ))
+                lines.append('%s_sum%s %s' % (self.name, _format_labels(labels), _format_value(histogram['sum'])))
+                lines.append('%s_count%s %d' % (self.name, _format_labels(labels), histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value, quote=True):
+    """
+    Escapes a value for use in the Prometheus text format.
+
+    :param value (str): The value to escape.
+    :param quote (bool): Whether or not double quotes should be escaped as well.
+
+    Returns:
+        - (str): The escaped value.
+
+    """
+    value = value.replace('\\', '\\\\').replace('\n', '\\n')
+    return value.replace('"', '\\"') if quote else value
+
+
+def _format_labels(labels):
+    """
+    Formats labels for use in the Prometheus text format.
+
+    :param labels (list): The names and values of the labels.
+
+    Returns:
+        - (str): The formatted labels, or an empty string if there are no labels.
+
+    """
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for (name, value) in labels)
+
+
+def _format_value(value):
+    """
+    Formats a value for use in the Prometheus text format.
+
+    :param value (float): The value to format.
+
+    Returns:
+        - (str): The formatted value.
+
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if isinstance(value, int) or float(value).is_integer():
+        return '%d' % value
+    return repr(float(value))
+
+
+"""The number of requests handled, per method, route and status code."""
+http_requests = Counter('hutts_http_requests_total', 'The number of HTTP requests handled.',
+                        ('method', 'route', 'status'))
+"""The duration of requests, per route."""
+http_request_duration = Histogram('hutts_http_request_duration_seconds', 'The duration of HTTP requests in seconds.',
+                                  ('route',))
+"""The number of requests that are being handled."""
+http_requests_in_flight = Gauge('hutts_http_requests_in_flight', 'The number of HTTP requests being handled.')
+"""The number of face detections, per result (hit or miss)."""
+face_detections = Counter('hutts_face_detections_total', 'The number of face detections, per result.', ('result',))
+"""The number of barcode decoding attempts, per result (success, failure or not_found if no barcode was detected)."""
+barcode_decodes = Counter('hutts_barcode_decodes_total', 'The number of barcode decoding attempts, per result.',
+                          ('result',))
+"""The number of template matching attempts, per identified ID type."""
+template_matches = Counter('hutts_template_matches_total', 'The number of template matching attempts, per ID type.',
+                           ('id_type',))
+"""The number of OCR calls, per OCR engine."""
+ocr_calls = Counter('hutts_ocr_calls_total', 'The number of OCR calls, per OCR engine.', ('engine',))
+"""The duration of OCR calls, per OCR engine."""
+ocr_duration = Histogram('hutts_ocr_duration_seconds', 'The duration of OCR calls in seconds, per OCR engine.',
+                         ('engine',))
+"""The number of lookups in the content caches, per cache and result (memory_hit, disk_hit or miss)."""
+cache_lookups = Counter('hutts_cache_lookups_total', 'The number of content cache lookups, per cache and result.',
+                        ('cache', 'result'))
+"""The number of stages that have been admitted to a stage pool and have not finished yet, per pool."""
+stage_pool_pending = Gauge('hutts_stage_pool_pending',
+                           'The number of stages admitted to a pool that have not finished, per pool.', ('pool',))
+"""The number of stages that were rejected because their stage pool was full, per pool."""
+stage_pool_rejections = Counter('hutts_stage_pool_rejections_total',
+                                'The number of stages rejected because their pool was full, per pool.', ('pool',))
+"""The number of buffers borrowed from the buffer pool, per result (reuse or allocate)."""
+buffer_pool_requests = Counter('hutts_buffer_pool_requests_total',
+                               'The number of buffers borrowed from the buffer pool, per result.', ('result',))
+"""The number of bytes of the buffers held by the buffer pool, whether they are borrowed or free."""
+buffer_pool_bytes = Gauge('hutts_buffer_pool_bytes', 'The number of bytes of the buffers held by the buffer pool.')
+"""The number of intermediate images handed to the debug sink, per result (recorded or dropped)."""
+debug_image_records = Counter('hutts_debug_images_total',
+                              'The number of intermediate images handed to the debug sink, per result.', ('result',))
+"""The time spent in the stages of traced requests, per stage and ID type."""
+stage_duration = _StageHistograms('hutts_stage_duration_seconds',
+                                  'The time spent in the stages of traced requests in seconds.',
+                                  tracing.stage_histograms)
+
+"""Serves the metrics and records the metrics of all the requests made to the application."""
+metrics = Blueprint('metrics', __name__)
+
+
+@metrics.route('/metrics', methods=['GET'])
+def serve_metrics():
+    """
+    Serves all of the metrics in the Prometheus text format.
+
+    URL: http://localhost:5000/metrics.
+
+    """
+    return Response(registry.render(), mimetype=METRICS_CONTENT_TYPE)
+
+
+@metrics.before_app_request
+def start_request():
+    """
+    Records the start of a request.
+    """
+    http_requests_in_flight.inc()
+    g.metrics_start = time.perf_counter()
+
+
+@metrics.after_app_request
+def finish_request(response):
+    """
+    Records the number and duration of requests per route.
+    """
+    start = g.get('metrics_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else METRICS_UNMATCHED_ROUTE
+        http_requests.labels(request.method, route, str(response.status_code)).inc()
+        http_request_duration.labels(route).observe(time.perf_counter() - start)
+    return response
+
+
+@metrics.teardown_app_request
+def end_request(error=None):
+    """
+    Records the end of a request, regardless of whether or not it succeeded.
+    """
+    if g.pop('metrics_start', None) is not None:
+        http_requests_in_flight.dec()
@@ -0,0 +1,301 @@
+"""
+A process-wide registry for the trained models (dlib shape predictor, frontal face detector and
+face recognition model) used throughout Hutts Verification.
+
+Loading these models from disk is expensive, both in time and in memory churn, which is why every
+model is only loaded once per process and then shared by everything that requires it.
+
+Example usage:
+
+First import the registry from the model_registry module...
+from hutts_verification.utils.model_registry import model_registry
+then request a model.
+
+``predictor = model_registry.shape_predictor()``
+
+The dlib frontal face detector is not safe for concurrent use, but it is cheap to create, so every thread
+is given a detector of its own rather than sharing one.
+
+``detector = model_registry.frontal_face_detector()``
+
+The shape predictor can be shared freely. The face recognition model is not safe for concurrent use either and
+is too large to copy for every thread, which is why the registry also supplies a lock that should be held while
+a shared model is in use.
+
+``recogniser = model_registry.face_recognition_model(FACE_RECOGNITION_PATH)``
+``with model_registry.lock(MODEL_FACE_RECOGNITION, FACE_RECOGNITION_PATH):``
+    ``descriptor = recogniser.compute_face_descriptor(image, shape)``
+
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+import dlib
+from hutts_verification.utils.hutts_logger import logger
+from hutts_verification.utils.pypath import correct_path
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""Specifies the directory containing the trained data."""
+TRAINED_DATA_DIR = Path(os.path.abspath(os.path.dirname(__file__))).parent.joinpath(
+    'image_preprocessing', 'trained_data'
+)
+"""Specifies the path to the trained data for the shape predictor."""
+SHAPE_PREDICTOR_PATH = correct_path(TRAINED_DATA_DIR.joinpath('shape_predictor_face_landmarks.dat'))
+"""Specifies the path to the trained data for the face recognition model."""
+FACE_RECOGNITION_PATH = correct_path(TRAINED_DATA_DIR.joinpath('dlib_face_recognition_resnet_model_v1.dat'))
+
+"""Specifies the name of the dlib shape predictor model."""
+MODEL_SHAPE_PREDICTOR = 'shape_predictor'
+"""Specifies the name of the dlib frontal face detector model."""
+MODEL_FACE_DETECTOR = 'frontal_face_detector'
+"""Specifies the name of the dlib face recognition model."""
+MODEL_FACE_RECOGNITION = 'face_recognition_model'
+
+
+class ModelRegistry:
+    """
+    A thread-safe registry that loads every model at most once per process (or once per thread, for models
+    that are cheap to load but not safe for concurrent use) and records statistics on how long each model took
+    to load and how much memory it occupies.
+
+    :_models (dict): The loaded models, keyed by model name and path.
+    :_locks (dict): The usage locks of the models, keyed by model name and path.
+    :_stats (dict): The load statistics of the loaded models, keyed by model name and path.
+    :_lock (Lock): Guards the loading of models.
+    :_local (local): Holds the models that were loaded for the current thread, along with the generation of
+            the registry they were loaded in.
+    :_generation (int): The number of times the registry has been cleared.
+
+    """
+    def __init__(self):
+        """
+        Responsible for initialising the ModelRegistry object.
+        """
+        self._models = {}
+        self._locks = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._generation = 0
+
+    def get(self, name, loader, path=None):
+        """
+        Returns the model identified by the given name and path, loading it with the given loader if it
+        has not been loaded before in this process.
+
+        :param name (str): The name of the model.
+        :param loader (callable): A function that loads and returns the model. It receives the path as its
+                only argument if a path is given, otherwise it receives no arguments.
+        :param path (str): The path to the trained data of the model, if any.
+
+        Returns:
+            - (obj): The loaded model.
+
+        Raises:
+            - TypeError: If a string value is not passed for name.
+
+        """
+        if not isinstance(name, str):
+            raise TypeError(
+                'Bad type for arg name - expected string. Received type "%s".' %
+                type(name).__name__
+            )
+        key = self._key(name, path)
+        # Avoid taking the lock if the model has already been loaded.
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        with self._lock:
+            # Another thread may have loaded the model while we were waiting for the lock.
+            model = self._models.get(key)
+            if model is not None:
+                return model
+            logger.info('Loading model "%s"...' % key)
+            rss_before = _resident_memory()
+            start = time.perf_counter()
+            model = loader(path) if path is not None else loader()
+            load_time = time.perf_counter() - start
+            rss_after = _resident_memory()
+            self._stats[key] = {
+                'load_time': load_time,
+                'memory': max(rss_after - rss_before, 0) if rss_before is not None else None,
+                'file_size': os.path.getsize(path) if path is not None and os.path.isfile(path) else None,
+            }
+            self._models[key] = model
+            logger.info('Loaded model "%s" in %.3f seconds' % (key, load_time))
+            return model
+
+    def get_local(self, name, loader):
+        """
+        Returns the copy of the model identified by the given name that belongs to the current thread, loading it
+        with the given loader if the thread has not loaded it before. This is meant for models that are cheap to
+        load but not safe for concurrent use, so that threads do not have to take turns using them.
+
+        :param name (str): The name of the model.
+        :param loader (callable): A function that loads and returns the model. It receives no arguments.
+
+        Returns:
+            - (obj): The model of the current thread.
+
+        Raises:
+            - TypeError: If a string value is not passed for name.
+
+        """
+        if not isinstance(name, str):
+            raise TypeError(
+                'Bad type for arg name - expected string. Received type "%s".' %
+                type(name).__name__
+            )
+        models = getattr(self._local, 'models', None)
+        if models is None or self._local.generation != self._generation:
+            # The models of the thread were loaded before the registry was last cleared.
+            models = self._local.models = {}
+            self._local.generation = self._generation
+        model = models.get(name)
+        if model is None:
+            model = models[name] = loader()
+        return model
+
+    def lock(self, name, path=None):
+        """
+        Returns the lock that should be held while using the shared model identified by the given name and path.
+        The lock is created the first time it is requested, whether or not the model has been loaded yet, and
+        outlives clearing the registry.
+
+        :param name (str): The name of the model.
+        :param path (str): The path to the trained data of the model, if any.
+
+        Returns:
+            - (Lock): The usage lock of the model.
+
+        """
+        key = self._key(name, path)
+        lock = self._locks.get(key)
+        if lock is not None:
+            return lock
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def shape_predictor(self, path=SHAPE_PREDICTOR_PATH):
+        """
+        Returns the dlib shape predictor.
+
+        :param path (str): The path to the trained data of the shape predictor.
+
+        Returns:
+            - (obj): The dlib shape predictor.
+
+        Raises:
+            - ValueError: If no path to the trained data is available.
+
+        """
+        if path is None:
+            raise ValueError('No trained data could be found for model "%s".' % MODEL_SHAPE_PREDICTOR)
+        return self.get(MODEL_SHAPE_PREDICTOR, dlib.shape_predictor, path)
+
+    def frontal_face_detector(self):
+        """
+        Returns the dlib HOG frontal face detector of the current thread. The detector keeps state while it scans
+        an image, so every thread has a detector of its own.
+
+        Returns:
+            - (obj): The dlib frontal face detector.
+
+        """
+        return self.get_local(MODEL_FACE_DETECTOR, dlib.get_frontal_face_detector)
+
+    def face_recognition_model(self, path=FACE_RECOGNITION_PATH):
+        """
+        Returns the dlib ResNet face recognition model.
+
+        :param path (str): The path to the trained data of the face recognition model.
+
+        Returns:
+            - (obj): The dlib face recognition model.
+
+        Raises:
+            - ValueError: If no path to the trained data is available.
+
+        """
+        if path is None:
+            raise ValueError('No trained data could be found for model "%s".' % MODEL_FACE_RECOGNITION)
+        return self.get(MODEL_FACE_RECOGNITION, dlib.face_recognition_model_v1, path)
+
+    def warm_up(self):
+        """
+        Eagerly loads all of the models used by Hutts Verification so that the first requests
+        do not have to pay the cost of loading them.
+        Models for which no trained data could be found are skipped.
+        """
+        logger.info('Warming up model registry...')
+        self.frontal_face_detector()
+        for (name, loader, path) in [(MODEL_SHAPE_PREDICTOR, self.shape_predictor, SHAPE_PREDICTOR_PATH),
+                                     (MODEL_FACE_RECOGNITION, self.face_recognition_model, FACE_RECOGNITION_PATH)]:
+            if path is None:
+                logger.warning('No trained data found for model "%s". Skipping warm up.' % name)
+                continue
+            loader(path)
+
+    def stats(self):
+        """
+        Returns the load statistics of all the models loaded so far.
+
+        Returns:
+            - (dict): The load time (in seconds), the change in resident memory (in bytes) and the size
+                of the trained data (in bytes) for each loaded model, keyed by model name and path.
+
+        """
+        with self._lock:
+            return {key: dict(value) for (key, value) in self._stats.items()}
+
+    def clear(self):
+        """
+        Discards all of the loaded models, causing them to be reloaded the next time they are requested.
+        The usage locks are kept, since threads may still be using the models they guard.
+        """
+        with self._lock:
+            self._models.clear()
+            self._stats.clear()
+            self._generation += 1
+
+    @staticmethod
+    def _key(name, path):
+        """
+        Creates the key used to identify a model.
+
+        :param name (str): The name of the model.
+        :param path (str): The path to the trained data of the model, if any.
+
+        Returns:
+            - (str): The key of the model.
+
+        """
+        return name if path is None else '%s:%s' % (name, path)
+
+
+def _resident_memory():
+    """
+    Returns the resident memory of the current process.
+
+    Returns:
+        - (int): The resident memory in bytes.
+        - (None): If the resident memory could not be determined on this platform.
+
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+"""The global model registry that is shared by the entire process."""
+model_registry = ModelRegistry()
@@ -0,0 +1,109 @@
+"""
+Wraps the functionality required to read the fields and images of a request, regardless of how they were sent.
+
+Requests can be sent in one of three ways:
+
+    - As JSON, with images given as base64 data URIs or as URLs ("url").
+    - As multipart/form-data, with images uploaded as files and the other fields given as form fields.
+    - As a raw image/* body, holding the ID image (or the only image of endpoints that take a single image), with the
+      other fields given in the query string.
+
+The body of a request is only parsed once, and uploaded images are decoded straight from the request stream instead
+of being base64 encoded, which inflates the payload by a third.
+
+Example usage:
+
+First import the request handling module...
+from hutts_verification.utils.request_handling import request_data, request_image
+then grab the fields and images of the current request within a route.
+
+``preferences = text_extraction_preferences(request_data())``
+``image = request_image('idPhoto', raw=True)``
+
+With curl, an image can for example be sent as a raw body...
+
+``curl -X POST -H "Content-Type: image/jpeg" --data-binary @id.jpg "http://localhost:5000/extractText?id_type=idcard"``
+
+or along with a second image as multipart/form-data.
+
+``curl -X POST -F id_img=@id.jpg -F face_img=@face.jpg http://localhost:5000/verifyFaces``
+
+"""
+
+from flask import g, request
+from hutts_verification.utils.image_handling import grab_image
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""The prefix of the content types of requests whose body is an image."""
+REQUEST_IMAGE_CONTENT_TYPE = 'image/'
+"""The field holding the URL of an image that was not uploaded."""
+REQUEST_URL_FIELD = 'url'
+
+
+def is_raw_image():
+    """
+    Checks whether the body of the current request is an image.
+
+    Returns:
+        - (bool): Whether or not the content type of the request is image/*.
+
+    """
+    return request.mimetype.startswith(REQUEST_IMAGE_CONTENT_TYPE)
+
+
+def request_data():
+    """
+    Returns the fields of the current request, parsing its body the first time they are requested.
+    The fields are read from the JSON body, from the form fields of a multipart/form-data or urlencoded body, or
+    from the query string if the body is an image.
+
+    Returns:
+        - (dict): The fields of the request.
+
+    """
+    if '_request_data' not in g:
+        if request.is_json:
+            data = request.get_json()
+        elif request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+            data = request.form.to_dict()
+        else:
+            data = request.args.to_dict()
+        g._request_data = data if isinstance(data, dict) else {}
+    return g._request_data
+
+
+def request_image(field, raw=False, url_field=REQUEST_URL_FIELD):
+    """
+    Grabs an image from the current request. The image is read from an uploaded file, from the body of the request
+    (if it is an image), from a base64 data URI or from a URL, in that order.
+
+    :param field (str): The name of the field or uploaded file that holds the image.
+    :param raw (bool): Whether or not the image may be sent as the body of the request.
+    :param url_field (str): The name of the field that holds the URL of the image, or None if the image can not
+            be given as a URL.
+
+    Returns:
+        - (obj): The image.
+        - (None): If the request does not contain the image.
+
+    Raises:
+        - ValueError: If the image could not be decoded.
+
+    """
+    if request.mimetype == 'multipart/form-data' and field in request.files:
+        upload = request.files[field]
+        return grab_image(stream=upload.stream, length=upload.content_length or None)
+    if raw and is_raw_image():
+        return grab_image(stream=request.stream, length=request.content_length)
+    data = request_data()
+    if data.get(field, None) is not None:
+        return grab_image(string=data[field])
+    if url_field is not None and data.get(url_field, None) is not None:
+        return grab_image(url=data[url_field])
+    return None
@@ -0,0 +1,314 @@
+"""
+Wraps the functionality required to hand images to other processes through shared memory.
+
+An image is placed in a named shared memory segment once, after which a SharedImage handle to it can be sent to
+any number of worker processes. Only the descriptor of the image (the name of the segment along with the offset,
+shape, strides and data type of the image within it) is pickled, and every process maps the same pixels instead
+of receiving its own copy of the image.
+
+Segments are reference counted by the process that created them. Every handle returned by create, empty or share
+holds a reference that should be released once the handle is no longer needed (leaving a with block does so),
+and every consumer that holds on to a handle, such as a stage pool that runs a stage in a worker process, retains
+its own reference until it is done. The segment is removed once the last reference is released.
+
+Example usage:
+
+First import the shared image module...
+from hutts_verification.utils.shared_image import SharedImage
+then share an image and send it to a worker process.
+
+``with SharedImage.share(image) as shared_image:``
+    ``future = stage_pool.submit(detect_faces, shared_image)``
+
+where the worker reads the pixels of the image through ``shared_image.array()``.
+
+Producers can write their results straight into shared memory by making use of ``SharedImage.empty``, and
+sharing an image (or a region of an image) that already lies within a segment refers to that segment instead of
+copying the pixels again. This means that an intermediate result, such as the warped ID card, can be read by
+several consumers without being copied.
+
+"""
+
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""Holds the live segments created by this process, keyed by name."""
+_segments = {}
+"""Guards the live segments and their reference counts."""
+_segments_lock = threading.Lock()
+
+
+def _byte_bounds(image):
+    """
+    Calculates the range of memory addresses spanned by an image.
+
+    :param image (obj): The numpy image.
+
+    Returns:
+        - (int): The address of the first byte of the image.
+        - (int): The address one past the last byte of the image.
+
+    """
+    low = high = image.__array_interface__['data'][0]
+    if image.size == 0:
+        return low, high
+    for (size, stride) in zip(image.shape, image.strides):
+        extent = (size - 1) * stride
+        if extent < 0:
+            low += extent
+        else:
+            high += extent
+    return low, high + image.itemsize
+
+
+class _Segment:
+    """
+    A shared memory segment created by this process, along with its reference count.
+
+    :memory (SharedMemory): The segment.
+    :address (int): The address at which the segment is mapped in this process.
+    :references (int): The number of references to the segment that have not been released.
+
+    """
+    def __init__(self, size):
+        """
+        Creates a new segment.
+
+        :param size (int): The size of the segment in bytes.
+
+        """
+        # Segments can not be empty, so empty images still get a byte.
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.address = np.frombuffer(self.memory.buf, dtype='uint8').__array_interface__['data'][0]
+        self.references = 1
+
+    def contains(self, image):
+        """
+        Checks whether an image lies within the segment.
+
+        :param image (obj): The numpy image.
+
+        Returns:
+            - (bool): Whether or not all of the pixels of the image lie within the segment.
+
+        """
+        (low, high) = _byte_bounds(image)
+        return self.address <= low and high <= self.address + self.memory.size
+
+
+class SharedImage:
+    """
+    A handle to a numpy image held in a named shared memory segment.
+
+    :name (str): The name of the shared memory segment.
+    :shape (tuple): The shape of the image.
+    :dtype (str): The data type of the image.
+    :offset (int): The offset of the first pixel of the image within the segment, in bytes.
+    :strides (tuple): The strides of the image, or None if the image is C-contiguous.
+    :_segment (_Segment): The segment, if it was created by this process.
+    :_memory (SharedMemory): The segment, once it has been attached to by another process.
+
+    """
+    def __init__(self, name, shape, dtype, offset=0, strides=None):
+        """
+        Responsible for initialising the SharedImage object, which refers to an existing segment.
+        The segment is only attached to once the image is read.
+
+        :param name (str): The name of the shared memory segment.
+        :param shape (tuple): The shape of the image.
+        :param dtype (str): The data type of the image.
+        :param offset (int): The offset of the first pixel of the image within the segment, in bytes.
+        :param strides (tuple): The strides of the image. The image is C-contiguous if none are given.
+
+        """
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+        self.offset = offset
+        self.strides = tuple(strides) if strides is not None else None
+        self._segment = None
+        self._memory = None
+
+    @classmethod
+    def empty(cls, shape, dtype='uint8'):
+        """
+        Allocates an image in a new shared memory segment, so that a producer can write its result straight into
+        shared memory (e.g. by passing the array as the dst of an OpenCV function).
+
+        :param shape (tuple): The shape of the image.
+        :param dtype (str): The data type of the image.
+
+        Returns:
+            - (SharedImage): The shared image, holding one reference to the new segment.
+
+        """
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        segment = _Segment(size)
+        with _segments_lock:
+            _segments[segment.memory.name] = segment
+        shared_image = cls(segment.memory.name, shape, dtype)
+        shared_image._segment = segment
+        return shared_image
+
+    @classmethod
+    def create(cls, image):
+        """
+        Copies an image into a new shared memory segment.
+
+        :param image (obj): The numpy image.
+
+        Returns:
+            - (SharedImage): The shared image, holding one reference to the new segment.
+
+        Raises:
+            - TypeError: If the image is not a numpy array.
+
+        """
+        cls._check_image(image)
+        shared_image = cls.empty(image.shape, image.dtype)
+        np.copyto(shared_image.array(), image)
+        return shared_image
+
+    @classmethod
+    def share(cls, image):
+        """
+        Returns a handle to an image, without copying it if it already lies within a live segment created by this
+        process (e.g. if it is, or is a region of, an image returned by the array method). Otherwise the image is
+        copied into a new segment.
+
+        :param image (obj): The numpy image.
+
+        Returns:
+            - (SharedImage): The shared image, holding one reference to its segment.
+
+        Raises:
+            - TypeError: If the image is not a numpy array.
+
+        """
+        cls._check_image(image)
+        with _segments_lock:
+            for segment in _segments.values():
+                if segment.contains(image):
+                    segment.references += 1
+                    break
+            else:
+                segment = None
+        if segment is None:
+            return cls.create(image)
+        strides = image.strides if not image.flags['C_CONTIGUOUS'] else None
+        shared_image = cls(segment.memory.name, image.shape, image.dtype,
+                           image.__array_interface__['data'][0] - segment.address, strides)
+        shared_image._segment = segment
+        return shared_image
+
+    def array(self):
+        """
+        Returns the image, attaching to the segment if necessary. The image is a view of the segment, so
+        changes to it are seen by all processes.
+
+        Returns:
+            - (obj): The numpy image.
+
+        Raises:
+            - FileNotFoundError: If the segment has been removed.
+
+        """
+        if self._segment is not None:
+            memory = self._segment.memory
+        else:
+            if self._memory is None:
+                self._memory = shared_memory.SharedMemory(name=self.name)
+            memory = self._memory
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=memory.buf, offset=self.offset, strides=self.strides)
+
+    def retain(self):
+        """
+        Adds a reference to the segment, which keeps it alive until the reference is released.
+        References are only counted by the process that created the segment.
+
+        Returns:
+            - (SharedImage): The shared image.
+
+        """
+        if self._segment is not None:
+            with _segments_lock:
+                self._segment.references += 1
+        return self
+
+    def release(self):
+        """
+        Releases a reference to the segment. The segment is removed once its last reference has been released.
+        Processes that are attached to the segment at that point keep their mapping of it.
+        """
+        segment = self._segment
+        if segment is None:
+            return
+        with _segments_lock:
+            segment.references -= 1
+            if segment.references > 0:
+                return
+            _segments.pop(segment.memory.name, None)
+        try:
+            segment.memory.close()
+        except BufferError:
+            # An array still refers to the mapping, which is released along with the array.
+            pass
+        try:
+            segment.memory.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """
+        Detaches a process that did not create the segment from it. Arrays returned by array() should no longer
+        be in use; if they are, the segment stays mapped until they are garbage collected.
+        """
+        if self._memory is None:
+            return
+        try:
+            self._memory.close()
+        except BufferError:
+            # An array still refers to the mapping, which is released along with the array.
+            pass
+        self._memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def __getstate__(self):
+        """
+        Only the descriptor of the image is pickled, so that other processes attach to the same segment.
+        """
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype, 'offset': self.offset,
+                'strides': self.strides}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], state['shape'], state['dtype'], state['offset'], state['strides'])
+
+    @staticmethod
+    def _check_image(image):
+        """
+        Checks whether an image can be shared.
+
+        :param image (obj): The image to check.
+
+        Raises:
+            - TypeError: If the image is not a numpy array.
+
+        """
+        if not isinstance(image, np.ndarray):
+            raise TypeError(
+                'Bad type for arg image - expected image in numpy array. Received type "%s".' %
+                type(image).__name__
+            )
@@ -0,0 +1,448 @@
+"""
+Wraps the functionality required to run the CPU-heavy stages of requests on bounded worker pools.
+
+Every kind of stage has its own pool of worker threads, so that requests that are busy with one kind of stage
+(e.g. face matching) do not hold up requests that are busy with another (e.g. text extraction), and the number
+of images processed at the same time is bounded regardless of the number of requests the server accepts.
+The stages release the GIL for most of their work (dlib, OpenCV and Tesseract all do), and OCR can be moved to
+separate processes altogether by making use of an OCR worker pool. Face stages overlap because every worker thread
+runs a dlib face detector of its own (see the model registry); only the computation of face descriptors, whose
+network is shared, is serialised.
+
+Three kinds of stages are available:
+
+    - ``face``      -   Face detection, alignment and matching.
+    - ``text``      -   Preprocessing of the ID image and text extraction.
+    - ``branch``    -   The face and text branches of /verifyID, run in worker processes so that they do not
+                        contend for the GIL. This pool only exists if it was configured with processes.
+
+Every pool admits a bounded number of waiting stages. When a pool is full, submitting a stage raises an
+Overloaded error, which the controllers turn into a 503 (Service Unavailable) response so that clients back off
+instead of queueing without bound. Every request also has a deadline: stages that have not started by the
+deadline are skipped, and a request that is still waiting for a stage at its deadline is answered with a 504
+(Gateway Timeout) response.
+
+Example usage:
+
+First import the stage pools module...
+from hutts_verification.utils.stage_pools import STAGE_FACE, get_stage_pool, request_deadline, wait
+then run a stage on its pool and wait for its result.
+
+``deadline = request_deadline()``
+``future = get_stage_pool(STAGE_FACE).submit(match_faces, image_of_id, face, deadline=deadline)``
+``(is_match, distance) = wait(future, deadline)``
+
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor, \
+    TimeoutError as FutureTimeoutError
+from flask import jsonify, request
+from hutts_verification.utils.hutts_logger import logger
+from hutts_verification.utils.metrics import stage_pool_pending, stage_pool_rejections
+from hutts_verification.utils.shared_image import SharedImage
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""Specifies the name of the pool that runs face detection, alignment and matching."""
+STAGE_FACE = 'face'
+"""Specifies the name of the pool that runs preprocessing and text extraction."""
+STAGE_TEXT = 'text'
+"""Specifies the name of the pool of processes that runs the branches of /verifyID."""
+STAGE_BRANCH = 'branch'
+"""Specifies the default number of workers of every pool."""
+STAGE_POOL_DEFAULT_WORKERS = os.cpu_count() or 1
+"""Specifies the default number of seconds a request may take."""
+STAGE_POOL_DEFAULT_TIMEOUT = 7200.0
+"""Specifies the number of seconds clients are asked to wait before retrying a request that was rejected."""
+STAGE_POOL_RETRY_AFTER = 1
+"""Specifies the header with which a client may shorten the deadline of its request (in seconds)."""
+STAGE_POOL_TIMEOUT_HEADER = 'X-Request-Timeout'
+
+
+class Overloaded(RuntimeError):
+    """
+    Raised when a stage is submitted to a pool that can not admit any more stages.
+    """
+    pass
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a stage does not finish before the deadline of its request.
+    """
+    pass
+
+
+def _run_stage(name, function, args, deadline):
+    """
+    Runs a stage, unless its deadline has already passed.
+    This is a module-level function so that it can be sent to worker processes. The deadline is comparable
+    across processes, since the monotonic clock is shared by all the processes of a machine.
+
+    :param name (str): The name of the pool, used for the error message.
+    :param function (callable): The stage.
+    :param args (tuple): The arguments of the stage.
+    :param deadline (float): The time by which the stage should have finished, if any.
+
+    Returns:
+        - (obj): The result of the stage.
+
+    Raises:
+        - DeadlineExceeded: If the deadline passed before the stage started.
+
+    """
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded('The deadline passed before the %s stage started.' % name)
+    return function(*args)
+
+
+class StagePool:
+    """
+    A pool of worker threads (or processes) that runs stages of a single kind, admitting a bounded number of
+    waiting stages.
+
+    :name (str): The name of the pool, used to label its metrics.
+    :workers (int): The number of workers.
+    :max_queue (int): The maximum number of stages that may wait for a worker, or None if the number of waiting
+            stages is not bounded.
+    :processes (bool): Whether the workers are processes rather than threads.
+    :_pending (int): The number of stages that have been admitted and have not finished yet.
+    :_executor (Executor): Runs the stages.
+    :_lock (Lock): Guards the number of pending stages and the executor.
+
+    """
+    def __init__(self, name, workers=STAGE_POOL_DEFAULT_WORKERS, max_queue=None, processes=False,
+                 initializer=None, initargs=()):
+        """
+        Responsible for initialising the StagePool object.
+
+        :param name (str): The name of the pool, used to label its metrics.
+        :param workers (int): The number of workers.
+        :param max_queue (int): The maximum number of stages that may wait for a worker. The number of waiting
+                stages is not bounded if none is given.
+        :param processes (bool): Whether the workers should be processes rather than threads. The stages and
+                their arguments and results are then pickled.
+        :param initializer (callable): A function that is called in every worker process when it starts.
+        :param initargs (tuple): The arguments of the initializer.
+
+        Raises:
+            - TypeError: If the number of workers or the maximum queue size is not an integer.
+            - ValueError: If there are no workers or the maximum queue size is negative.
+
+        """
+        if not isinstance(workers, int):
+            raise TypeError(
+                'Bad type for arg workers - expected int. Received type "%s".' %
+                type(workers).__name__
+            )
+        if max_queue is not None and not isinstance(max_queue, int):
+            raise TypeError(
+                'Bad type for arg max_queue - expected int. Received type "%s".' %
+                type(max_queue).__name__
+            )
+        if workers < 1:
+            raise ValueError('A stage pool requires at least one worker.')
+        if max_queue is not None and max_queue < 0:
+            raise ValueError('The maximum queue size of a stage pool can not be negative.')
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.processes = processes
+        self._initializer = initializer
+        self._initargs = initargs
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = self._create_executor()
+
+    def submit(self, function, *args, deadline=None):
+        """
+        Submits a stage to the pool.
+
+        :param function (callable): The stage.
+        :param args (obj): The arguments of the stage.
+        :param deadline (float): The time (as given by time.monotonic) by which the stage should have finished.
+                The stage is skipped if it has not started by then. Stages have no deadline if none is given.
+
+        Shared images among the arguments are retained until the stage has finished, so that their segments
+        outlive the stage even if the caller releases them (e.g. because its request timed out) first.
+
+        Returns:
+            - (Future): The future of the result of the stage.
+
+        Raises:
+            - Overloaded: If the pool can not admit any more stages.
+
+        """
+        with self._lock:
+            if self.max_queue is not None and self._pending >= self.workers + self.max_queue:
+                stage_pool_rejections.labels(self.name).inc()
+                raise Overloaded('The %s stage pool is full.' % self.name)
+            self._pending += 1
+        stage_pool_pending.labels(self.name).inc()
+        shared_images = [arg.retain() for arg in args if isinstance(arg, SharedImage)]
+        try:
+            try:
+                future = self._executor.submit(_run_stage, self.name, function, args, deadline)
+            except BrokenExecutor:
+                # A worker process died, which breaks the executor, so it is replaced by a fresh one.
+                logger.warning('The %s stage pool is broken. Replacing its workers...' % self.name)
+                with self._lock:
+                    self._executor = self._create_executor()
+                future = self._executor.submit(_run_stage, self.name, function, args, deadline)
+        except BaseException:
+            self._finish(shared_images)
+            raise
+        future.add_done_callback(lambda _: self._finish(shared_images))
+        return future
+
+    def stats(self):
+        """
+        Returns the number of workers and pending stages of the pool.
+
+        Returns:
+            - (dict): The number of workers, the maximum queue size and the number of stages that have been
+                admitted and have not finished yet.
+
+        """
+        with self._lock:
+            return {'workers': self.workers, 'max_queue': self.max_queue, 'pending': self._pending}
+
+    def close(self):
+        """
+        Stops the workers of the pool once the stages that have been admitted have finished.
+        """
+        self._executor.shutdown(wait=True)
+
+    def _create_executor(self):
+        """
+        Creates the executor that runs the stages.
+
+        Returns:
+            - (Executor): A pool of threads, or a pool of processes if the pool was configured with processes.
+
+        """
+        if self.processes:
+            # Spawn rather than fork, since forking a multi-threaded server process is not safe.
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=self._initializer, initargs=self._initargs)
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hutts-%s' % self.name)
+
+    def _finish(self, shared_images=()):
+        """
+        Records that an admitted stage has finished (or was cancelled) and releases its shared images.
+
+        :param shared_images (list): The shared images that were retained for the stage.
+
+        """
+        for shared_image in shared_images:
+            shared_image.release()
+        with self._lock:
+            self._pending -= 1
+        stage_pool_pending.labels(self.name).dec()
+
+
+"""Holds the pools of the stages, keyed by the name of the stage."""
+_stage_pools = {name: StagePool(name) for name in (STAGE_FACE, STAGE_TEXT)}
+"""Specifies the number of seconds a request may take."""
+_request_timeout = STAGE_POOL_DEFAULT_TIMEOUT
+
+
+def configure_stage_pools(face_workers=STAGE_POOL_DEFAULT_WORKERS, text_workers=STAGE_POOL_DEFAULT_WORKERS,
+                          max_queue=None, timeout=STAGE_POOL_DEFAULT_TIMEOUT, branch_processes=0,
+                          branch_initializer=None, branch_initargs=()):
+    """
+    Replaces the stage pools with pools of the given sizes and sets the number of seconds a request may take.
+    The previous pools finish the stages they have admitted in the background.
+
+    :param face_workers (int): The number of workers that run face stages.
+    :param text_workers (int): The number of workers that run text stages.
+    :param max_queue (int): The maximum number of stages that may wait for a worker in each pool, or None if the
+            number of waiting stages should not be bounded.
+    :param timeout (float): The number of seconds a request may take.
+    :param branch_processes (int): The number of worker processes that run the branches of /verifyID. The
+            branches run on the face and text pools if this is 0.
+    :param branch_initializer (callable): A function that is called in every branch worker process when it starts.
+    :param branch_initargs (tuple): The arguments of the branch initializer.
+
+    Raises:
+        - TypeError: If a number of workers or the maximum queue size is not an integer.
+        - ValueError: If a pool has no workers, the maximum queue size is negative or the timeout is not positive.
+
+    """
+    global _stage_pools, _request_timeout
+    if timeout <= 0:
+        raise ValueError('The timeout of a request should be positive.')
+    stage_pools = {
+        STAGE_FACE: StagePool(STAGE_FACE, face_workers, max_queue),
+        STAGE_TEXT: StagePool(STAGE_TEXT, text_workers, max_queue)
+    }
+    if branch_processes > 0:
+        stage_pools[STAGE_BRANCH] = StagePool(STAGE_BRANCH, branch_processes, max_queue, processes=True,
+                                              initializer=branch_initializer, initargs=branch_initargs)
+    (previous_pools, _stage_pools) = (_stage_pools, stage_pools)
+    _request_timeout = timeout
+    for stage_pool in previous_pools.values():
+        stage_pool._executor.shutdown(wait=False)
+    logger.info('Stage pools: %s' % ', '.join(
+        '%s=%d %s' % (name, stage_pool.workers, 'processes' if stage_pool.processes else 'threads')
+        for (name, stage_pool) in stage_pools.items()))
+
+
+def has_stage_pool(name):
+    """
+    Checks whether a pool has been configured for the stages of the given kind.
+
+    :param name (str): The name of the stage, i.e. STAGE_FACE, STAGE_TEXT or STAGE_BRANCH.
+
+    Returns:
+        - (bool): Whether or not the pool exists.
+
+    """
+    return name in _stage_pools
+
+
+def get_stage_pool(name):
+    """
+    Returns the pool that runs the stages of the given kind.
+
+    :param name (str): The name of the stage, i.e. STAGE_FACE, STAGE_TEXT or STAGE_BRANCH.
+
+    Returns:
+        - (StagePool): The stage pool.
+
+    Raises:
+        - ValueError: If there is no pool for the stage.
+
+    """
+    stage_pool = _stage_pools.get(name)
+    if stage_pool is None:
+        raise ValueError('There is no stage pool named "%s".' % name)
+    return stage_pool
+
+
+def get_request_timeout():
+    """
+    Returns the number of seconds a request may take.
+
+    Returns:
+        - (float): The request timeout.
+
+    """
+    return _request_timeout
+
+
+def request_deadline():
+    """
+    Calculates the deadline of the current Flask request. A client may shorten (but not extend) the timeout of
+    its request with the X-Request-Timeout header.
+
+    Returns:
+        - (float): The time (as given by time.monotonic) by which the request should have finished.
+
+    """
+    timeout = _request_timeout
+    requested = request.headers.get(STAGE_POOL_TIMEOUT_HEADER, None)
+    if requested is not None:
+        try:
+            timeout = min(timeout, max(float(requested), 0.0))
+        except ValueError:
+            logger.warning('Ignoring invalid %s header "%s"' % (STAGE_POOL_TIMEOUT_HEADER, requested))
+    return time.monotonic() + timeout
+
+
+def wait(future, deadline):
+    """
+    Waits for the result of a stage until the deadline of its request.
+    A stage that has not started by the deadline is cancelled.
+
+    :param future (Future): The future of the result of the stage.
+    :param deadline (float): The time (as given by time.monotonic) by which the stage should have finished.
+
+    Returns:
+        - (obj): The result of the stage.
+
+    Raises:
+        - DeadlineExceeded: If the stage did not finish before the deadline.
+
+    """
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0))
+    except FutureTimeoutError:
+        future.cancel()
+        raise DeadlineExceeded('The request did not finish before its deadline.')
+
+
+def run_stage(name, function, *args, deadline=None):
+    """
+    Runs a stage on its pool and waits for its result.
+
+    :param name (str): The name of the stage, i.e. STAGE_FACE or STAGE_TEXT.
+    :param function (callable): The stage.
+    :param args (obj): The arguments of the stage.
+    :param deadline (float): The time by which the stage should have finished. The deadline of the current Flask
+            request is used if none is given.
+
+    Returns:
+        - (obj): The result of the stage.
+
+    Raises:
+        - Overloaded: If the pool can not admit any more stages.
+        - DeadlineExceeded: If the stage did not finish before the deadline.
+
+    """
+    if deadline is None:
+        deadline = request_deadline()
+    return wait(get_stage_pool(name).submit(function, *args, deadline=deadline), deadline)
+
+
+def overloaded_response(error):
+    """
+    Turns an Overloaded error into a 503 (Service Unavailable) response that asks the client to retry later.
+
+    :param error (Overloaded): The error.
+
+    Returns:
+        - (obj): The response.
+
+    """
+    logger.warning('Rejecting request: %s' % error)
+    response = jsonify({"success": False, "error": str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(STAGE_POOL_RETRY_AFTER)
+    return response
+
+
+def deadline_exceeded_response(error):
+    """
+    Turns a DeadlineExceeded error into a 504 (Gateway Timeout) response.
+
+    :param error (DeadlineExceeded): The error.
+
+    Returns:
+        - (obj): The response.
+
+    """
+    logger.warning('Abandoning request: %s' % error)
+    response = jsonify({"success": False, "error": str(error)})
+    response.status_code = 504
+    return response
+
+
+def register_error_handlers(blueprint):
+    """
+    Registers the handlers that turn Overloaded and DeadlineExceeded errors into responses with a blueprint.
+
+    :param blueprint (Blueprint): The blueprint whose routes run stages on the stage pools.
+
+    """
+    blueprint.register_error_handler(Overloaded, overloaded_response)
+    blueprint.register_error_handler(DeadlineExceeded, deadline_exceeded_response)
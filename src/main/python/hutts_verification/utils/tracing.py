@@ -0,0 +1,334 @@
+"""
+A lightweight facility to trace the time spent in the stages of processing a request.
+
+A trace is started for the current thread, after which the stages of the request are timed by wrapping them
+in a stage. Both the wall time and the CPU time of the thread are recorded. When the trace is finished, its stage
+timings are added to cumulative histograms per stage and per ID type, provided tracing has been enabled.
+
+Example usage:
+
+First import the tracing module...
+from hutts_verification.utils import tracing
+then trace a request and time its stages.
+
+``with tracing.traced() as trace:``
+    ``with tracing.stage('ocr'):``
+        ``text = ocr_engine.image_to_string(image)``
+
+If no trace has been started for the current thread, stages do nothing, which means that the overhead
+of tracing is negligible when it is not in use.
+
+"""
+
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+__author__ = "Nicolai van Niekerk"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Nicolai van Niekerk"
+__email__ = "nicvaniek@gmail.com"
+__status__ = "Development"
+
+"""Specifies the upper bounds (in seconds) of the buckets of the stage histograms."""
+TRACING_HISTOGRAM_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+"""Specifies the name used for the ID type of traces that did not identify an ID type."""
+TRACING_UNKNOWN_ID_TYPE = 'unknown'
+"""Specifies the name of the stage that covers the entire trace."""
+TRACING_TOTAL_STAGE = 'total'
+
+"""Returns the CPU time of the current thread, or of the process if the platform does not support the former."""
+_cpu_time = getattr(time, 'thread_time', time.process_time)
+"""Holds the trace of the current thread."""
+_local = threading.local()
+"""Indicates whether or not finished traces are added to the stage histograms."""
+_enabled = False
+
+
+class Trace:
+    """
+    Records the time spent in the stages of processing a single request.
+
+    :id_type (str): The type of ID that was processed, if known.
+    :_stages (OrderedDict): The wall time, CPU time and number of calls of every stage, keyed by stage name.
+    :_total (dict): The wall time and CPU time of the entire trace, once it has finished.
+
+    """
+    def __init__(self):
+        """
+        Responsible for initialising the Trace object and starting the clock of the trace.
+        """
+        self.id_type = None
+        self._stages = OrderedDict()
+        self._total = None
+        self._start_wall = time.perf_counter()
+        self._start_cpu = _cpu_time()
+
+    def add(self, name, wall, cpu):
+        """
+        Adds the time spent in a stage to the trace. Time spent in a stage that was entered more than once
+        is accumulated.
+
+        :param name (str): The name of the stage.
+        :param wall (float): The wall time (in seconds) spent in the stage.
+        :param cpu (float): The CPU time (in seconds) spent in the stage.
+
+        """
+        record = self._stages.get(name)
+        if record is None:
+            record = self._stages[name] = {'wall': 0.0, 'cpu': 0.0, 'calls': 0}
+        record['wall'] += wall
+        record['cpu'] += cpu
+        record['calls'] += 1
+
+    def finish(self):
+        """
+        Stops the clock of the trace.
+        """
+        self._total = self._elapsed()
+
+    def timings(self):
+        """
+        Returns the timings of the stages recorded so far, along with the time spent in the entire trace as the
+        total stage. If the trace has not finished yet, the total is the time spent in the trace up to now.
+
+        Returns:
+            - (dict): The wall time, CPU time (both in seconds) and number of calls of every stage, keyed by
+                stage name.
+
+        """
+        timings = OrderedDict((name, dict(record)) for (name, record) in self._stages.items())
+        timings[TRACING_TOTAL_STAGE] = dict(self._total if self._total is not None else self._elapsed())
+        return timings
+
+    def _elapsed(self):
+        """
+        Returns the time spent in the trace since it was started.
+
+        Returns:
+            - (dict): The wall time and CPU time (both in seconds) spent in the trace.
+
+        """
+        return {'wall': time.perf_counter() - self._start_wall, 'cpu': _cpu_time() - self._start_cpu, 'calls': 1}
+
+
+class _Stage:
+    """
+    Times a single stage of the trace of the current thread.
+    """
+    __slots__ = ('_trace', '_name', '_wall', '_cpu')
+
+    def __init__(self, trace, name):
+        """
+        Responsible for initialising the _Stage object.
+
+        :param trace (Trace): The trace to which the stage belongs.
+        :param name (str): The name of the stage.
+
+        """
+        self._trace = trace
+        self._name = name
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = _cpu_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._trace.add(self._name, time.perf_counter() - self._wall, _cpu_time() - self._cpu)
+        return False
+
+
+class _NullStage:
+    """
+    A stage that does nothing, used when no trace has been started for the current thread.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class StageHistograms:
+    """
+    Cumulative histograms of the wall time spent in every stage, per stage and per ID type.
+
+    :buckets (tuple): The upper bounds (in seconds) of the buckets of the histograms.
+    :_histograms (dict): The count of every bucket, the number of observations and their sum, keyed by stage
+            name and ID type.
+    :_lock (Lock): Guards the histograms.
+
+    """
+    def __init__(self, buckets=TRACING_HISTOGRAM_BUCKETS):
+        """
+        Responsible for initialising the StageHistograms object.
+
+        :param buckets (tuple): The upper bounds (in seconds) of the buckets of the histograms.
+
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        """
+        Adds the stage timings of a finished trace to the histograms.
+
+        :param trace (Trace): The finished trace.
+
+        """
+        id_type = trace.id_type or TRACING_UNKNOWN_ID_TYPE
+        timings = trace.timings()
+        with self._lock:
+            for (name, record) in timings.items():
+                histogram = self._histograms.get((name, id_type))
+                if histogram is None:
+                    histogram = self._histograms[(name, id_type)] = {
+                        'buckets': [0] * (len(self.buckets) + 1),
+                        'count': 0,
+                        'sum': 0.0
+                    }
+                # The last bucket counts the observations that exceed the largest upper bound.
+                histogram['buckets'][bisect.bisect_left(self.buckets, record['wall'])] += 1
+                histogram['count'] += 1
+                histogram['sum'] += record['wall']
+
+    def snapshot(self):
+        """
+        Returns a copy of the histograms.
+
+        Returns:
+            - (dict): The histogram of every stage and ID type, keyed by stage name and then by ID type. Every
+                histogram contains the cumulative count per upper bound ('buckets', with the last upper bound
+                being infinity), the number of observations ('count') and their sum in seconds ('sum').
+
+        """
+        snapshot = {}
+        with self._lock:
+            for ((name, id_type), histogram) in self._histograms.items():
+                cumulative = 0
+                buckets = []
+                for (upper_bound, count) in zip(self.buckets + (float('inf'),), histogram['buckets']):
+                    cumulative += count
+                    buckets.append((upper_bound, cumulative))
+                snapshot.setdefault(name, {})[id_type] = {
+                    'buckets': buckets,
+                    'count': histogram['count'],
+                    'sum': histogram['sum']
+                }
+        return snapshot
+
+    def clear(self):
+        """
+        Discards all of the recorded timings.
+        """
+        with self._lock:
+            self._histograms.clear()
+
+
+"""The global stage histograms that are shared by the entire process."""
+stage_histograms = StageHistograms()
+
+
+def enable(enabled=True):
+    """
+    Enables or disables the tracing of every request, i.e. whether requests are traced even if they did not
+    ask for their timings, so that the stage histograms are kept up to date.
+
+    :param enabled (bool): Whether or not tracing should be enabled.
+
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    """
+    Returns whether or not the tracing of every request is enabled.
+
+    Returns:
+        - (bool): Whether or not tracing is enabled.
+
+    """
+    return _enabled
+
+
+def current_trace():
+    """
+    Returns the trace of the current thread.
+
+    Returns:
+        - (Trace): The trace of the current thread.
+        - (None): If no trace has been started for the current thread.
+
+    """
+    return getattr(_local, 'trace', None)
+
+
+def stage(name):
+    """
+    Returns a context manager that times a stage of the trace of the current thread.
+
+    :param name (str): The name of the stage.
+
+    Returns:
+        - (obj): The context manager that times the stage. It does nothing if no trace has been started.
+
+    """
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NULL_STAGE
+    return _Stage(trace, name)
+
+
+def set_id_type(id_type):
+    """
+    Sets the ID type of the trace of the current thread, if any.
+
+    :param id_type (str): The type of ID that is being processed.
+
+    """
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.id_type = id_type
+
+
+@contextmanager
+def traced(force=False):
+    """
+    Traces the code within the context on the current thread.
+    A trace is only started if tracing is enabled or if it is forced. If a trace has already been started for
+    the current thread, the code within the context is added to it instead.
+
+    :param force (bool): Whether or not to trace even if tracing is disabled, e.g. because the timings of the
+            request were asked for.
+
+    Returns:
+        - (Trace): The trace of the current thread.
+        - (None): If no trace was started.
+
+    """
+    trace = current_trace()
+    if trace is not None:
+        yield trace
+        return
+    if not (force or _enabled):
+        yield None
+        return
+    trace = _local.trace = Trace()
+    try:
+        yield trace
+    finally:
+        _local.trace = None
+        trace.finish()
+        if _enabled:
+            stage_histograms.record(trace)
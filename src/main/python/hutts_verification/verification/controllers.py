@@ -3,16 +3,23 @@ Handles all requests relevant to the verification service of the API.
 """
 
 from hutts_verification.image_processing.sample_extract import TextExtractor
-from hutts_verification.image_preprocessing.face_manager import FaceDetector
+from hutts_verification.image_preprocessing.face_manager import FaceDetector, set_detection_mode
+from hutts_verification.image_processing.ocr_engine import create_ocr_engine, set_ocr_engine
+from hutts_verification.image_preprocessing.face_analysis import FaceAnalysis, analysing
 from hutts_verification.verification.text_verify import TextVerify
-from hutts_verification.verification.face_verify import FaceVerify
-from flask import jsonify, request, Blueprint
+from hutts_verification.verification.face_verify import FaceVerify, set_embedding_cache
+from hutts_verification.verification.face_index import get_face_index
+from flask import jsonify, Blueprint
 from hutts_verification.utils.hutts_logger import logger
-from hutts_verification.utils.image_handling import grab_image
-from hutts_verification.utils.pypath import correct_path
-from pathlib import Path
-from multiprocessing.pool import ThreadPool
-import os
+from hutts_verification.utils import tracing
+from hutts_verification.utils.buffer_pool import BufferPool, set_buffer_pool
+from hutts_verification.utils.debug_sink import create_debug_sink, debugging, request_debug_id, set_debug_sink
+from hutts_verification.utils.content_cache import ContentCache
+from hutts_verification.utils.request_handling import request_data, request_image
+from hutts_verification.utils.model_registry import model_registry, SHAPE_PREDICTOR_PATH, FACE_RECOGNITION_PATH
+from hutts_verification.utils.shared_image import SharedImage
+from hutts_verification.utils.stage_pools import STAGE_BRANCH, STAGE_FACE, STAGE_TEXT, DeadlineExceeded, \
+    get_stage_pool, has_stage_pool, register_error_handlers, request_deadline, run_stage, wait
 
 __authors__ = "Nicolai van Niekerk, Stephan Nell, Marno Hermann, Andreas Nel"
 __copyright__ = "Copyright 2017, Java the Hutts"
@@ -23,26 +30,7 @@ __status__ = "Development"
 
 
 verify = Blueprint('verify', __name__)
-pool = ThreadPool(processes=1)
-THREAD_TIME_OUT = 7200
-
-# Constants path to trained data for Shape Predictor.
-CURRENT_LOCATION = os.path.abspath(os.path.dirname(__file__))
-SHAPE_PREDICTOR_PATH = correct_path(Path(
-                                            Path(CURRENT_LOCATION),
-                                            Path(CURRENT_LOCATION).parent,
-                                            'image_preprocessing',
-                                            'trained_data',
-                                            'shape_predictor_face_landmarks.dat'
-                                        )
-                                    )
-FACE_RECOGNITION_PATH = correct_path(Path(
-                                            Path(CURRENT_LOCATION),
-                                            Path(CURRENT_LOCATION).parent,
-                                            'image_preprocessing',
-                                            'trained_data',
-                                            'dlib_face_recognition_resnet_model_v1.dat'
-                                         ))
+register_error_handlers(verify)
 
 
 @verify.route('/verifyID', methods=['POST'])
@@ -56,15 +44,22 @@ def verify_id():
     """
     image_of_id, face = receive_faces(match_face=True)
     entered_details = receive_details()
-
-    match_face_thread = pool.apply_async(match_faces, args=(image_of_id, face))
-
-    # is_match, distance = match_faces(image_of_id, face)
-    extracted_text, preferences = manage_text_extractor(image_of_id)
-    text_match_percentage, text_match, is_pass = manage_text_verification(preferences, extracted_text, entered_details)
-
-    logger.debug("Receiving match face thread results")
-    is_match, distance = match_face_thread.get(THREAD_TIME_OUT)
+    preferences = text_verification_preferences(request_data())
+
+    deadline = request_deadline()
+    ((face_result, face_error), (extracted_text, text_error)) = run_branches(image_of_id, face, preferences, deadline)
+    # If only one of the branches failed, the other still contributes to the result.
+    if face_error is not None and text_error is not None:
+        raise face_error
+    if face_error is None:
+        is_match, distance = face_result
+    else:
+        is_match, distance = False, 0.0
+    if text_error is None:
+        text_match_percentage, text_match, is_pass = manage_text_verification(preferences, extracted_text,
+                                                                              entered_details)
+    else:
+        text_match_percentage, text_match, is_pass = 0.0, 0.0, False
 
     logger.info("Preparing Results...")
     result = {
@@ -75,6 +70,10 @@ def verify_id():
         "is_match": is_match,
         "is_pass": is_pass
     }
+    errors = {branch: str(error) for (branch, error) in (('face', face_error), ('text', text_error))
+              if error is not None}
+    if errors:
+        result["errors"] = errors
     return jsonify(result)
 
 
@@ -88,7 +87,7 @@ def verify_faces():
 
     """
     image_of_id, face = receive_faces(match_face=True)
-    (is_match, distance) = match_faces(image_of_id, face)
+    (is_match, distance) = run_stage(STAGE_FACE, match_faces, image_of_id, face)
 
     logger.info("Preparing Results...")
     result = {
@@ -106,8 +105,9 @@ def verify_info():
     """
     image_of_id, _ = receive_faces(match_face=False)
     entered_details = receive_details()
+    preferences = text_verification_preferences(request_data())
 
-    extracted_text, preferences = manage_text_extractor(image_of_id)
+    extracted_text = run_stage(STAGE_TEXT, manage_text_extractor, image_of_id, preferences)
     text_match_percentage, text_match, is_pass = manage_text_verification(preferences, extracted_text, entered_details)
 
     logger.info("Preparing Results...")
@@ -119,7 +119,228 @@ def verify_info():
     return jsonify(result)
 
 
-def match_faces(image_of_id, face):
+@verify.route('/enrollFace', methods=['POST'])
+def enroll_face():
+    """
+    Sample function to enroll the face in an image under an ID, so that it can be found by /searchFace.
+
+    URL: http://localhost:5000/enrollFace.
+
+    """
+    identifier = request_data().get("id", None)
+    if not isinstance(identifier, str) or not identifier:
+        return jsonify({"success": False, "error": "No ID provided."}), 400
+    face = receive_face()
+    if face is None:
+        return jsonify({"success": False, "error": "No image or URL provided."}), 400
+    try:
+        enrolled_faces = get_face_index().enroll(identifier, run_stage(STAGE_FACE, describe_face, face))
+    except ValueError as error:
+        return jsonify({"success": False, "error": str(error)}), 400
+
+    logger.info("Preparing Results...")
+    result = {
+        "success": True,
+        "id": identifier,
+        "enrolled_faces": enrolled_faces
+    }
+    return jsonify(result)
+
+
+@verify.route('/searchFace', methods=['POST'])
+def search_face():
+    """
+    Sample function to return the enrolled faces that are closest to the face in an image, along with their
+    match percentages.
+
+    URL: http://localhost:5000/searchFace.
+
+    """
+    try:
+        top_k = int(request_data().get("top_k", 5))
+        threshold = float(request_data().get("threshold", 0.55))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "Invalid top_k or threshold."}), 400
+    face = receive_face()
+    if face is None:
+        return jsonify({"success": False, "error": "No image or URL provided."}), 400
+    try:
+        matches = get_face_index().search(run_stage(STAGE_FACE, describe_face, face), top_k, threshold)
+    except ValueError as error:
+        return jsonify({"success": False, "error": str(error)}), 400
+
+    logger.info("Preparing Results...")
+    result = {
+        "success": True,
+        "matches": matches
+    }
+    return jsonify(result)
+
+
+def run_branches(image_of_id, face, preferences, deadline):
+    """
+    This function matches the faces and extracts the text of an ID at the same time.
+    If a pool of branch processes has been configured, both branches run in worker processes, to which the images
+    are handed through shared memory. Otherwise the branches run on the face and text stage pools of this process
+    and share a face analysis, so that every image is only passed through the face detector once.
+
+    :param image_of_id (obj): An image of an ID.
+    :param face (obj): An image of a face that needs to be verified.
+    :param preferences (dict): Prepared list of preferences, as returned by text_verification_preferences.
+    :param deadline (float): The time by which the branches should have finished.
+
+    Returns:
+        - (tuple): The result of match_faces and the error of the face branch (None if it succeeded).
+        - (tuple): The text extracted from the ID and the error of the text branch (None if it succeeded).
+
+    Raises:
+        - Overloaded: If a stage pool can not admit the branches.
+        - DeadlineExceeded: If the branches did not finish before the deadline.
+
+    """
+    if not has_stage_pool(STAGE_BRANCH):
+        analysis = FaceAnalysis()
+        face_future = get_stage_pool(STAGE_FACE).submit(match_faces, image_of_id, face, analysis, deadline=deadline)
+        try:
+            text_future = get_stage_pool(STAGE_TEXT).submit(manage_text_extractor, image_of_id, preferences,
+                                                            analysis, deadline=deadline)
+        except Exception:
+            face_future.cancel()
+            raise
+        return branch_result('face', face_future, deadline), branch_result('text', text_future, deadline)
+
+    branch_pool = get_stage_pool(STAGE_BRANCH)
+    # The branch pool retains the shared images until the branches have finished, so they can be released as soon
+    # as the branches have been submitted.
+    with SharedImage.share(image_of_id) as shared_id, SharedImage.share(face) as shared_face:
+        face_future = branch_pool.submit(match_shared_faces, shared_id, shared_face, deadline=deadline)
+        try:
+            text_future = branch_pool.submit(extract_shared_text, shared_id, preferences, deadline=deadline)
+        except Exception:
+            face_future.cancel()
+            raise
+    return branch_result('face', face_future, deadline), branch_result('text', text_future, deadline)
+
+
+def branch_result(branch, future, deadline):
+    """
+    This function waits for the result of a branch of a verification, catching the error if the branch failed.
+
+    :param branch (str): The name of the branch, used for logging.
+    :param future (Future): The future of the result of the branch.
+    :param deadline (float): The time by which the branch should have finished.
+
+    Returns:
+        - (obj): The result of the branch, or None if it failed.
+        - (Exception): The error that occurred, or None if the branch succeeded.
+
+    Raises:
+        - DeadlineExceeded: If the branch did not finish before the deadline.
+
+    """
+    try:
+        return wait(future, deadline), None
+    except DeadlineExceeded:
+        raise
+    except Exception as error:
+        logger.error('The %s branch of the verification failed: %s' % (branch, error))
+        return None, error
+
+
+def initialise_branch_worker(options):
+    """
+    Prepares a branch worker process by applying the settings of the server and loading the trained models once.
+
+    :param options (dict): The OCR engine name ("ocr_engine"), face detection mode ("face_detection_mode"), size of
+            the buffer pool in bytes ("buffer_pool_bytes"), debug sink arguments ("debug_sink", as taken by
+            create_debug_sink) and embedding cache arguments ("embedding_cache", or None to disable the cache) used
+            by the worker.
+
+    """
+    set_ocr_engine(create_ocr_engine(options.get('ocr_engine')))
+    if options.get('face_detection_mode') is not None:
+        set_detection_mode(*options['face_detection_mode'])
+    if options.get('buffer_pool_bytes') is not None:
+        set_buffer_pool(BufferPool(options['buffer_pool_bytes']))
+    if options.get('debug_sink') is not None:
+        set_debug_sink(create_debug_sink(*options['debug_sink']))
+    if 'embedding_cache' in options:
+        cache_arguments = options['embedding_cache']
+        set_embedding_cache(ContentCache('embeddings', *cache_arguments) if cache_arguments is not None else None)
+    model_registry.warm_up()
+
+
+def match_shared_faces(shared_id, shared_face):
+    """
+    This function matches the faces in two shared images within a branch worker process.
+
+    :param shared_id (SharedImage): An image of an ID that contains a face that needs to be verified.
+    :param shared_face (SharedImage): An image of a face that needs to be verified.
+
+    Returns:
+        - boolean: Whether the two faces match.
+        - float: The percentage with which the faces match.
+
+    """
+    try:
+        return match_faces(shared_id.array(), shared_face.array())
+    finally:
+        shared_id.close()
+        shared_face.close()
+
+
+def extract_shared_text(shared_id, preferences):
+    """
+    This function extracts the text from a shared image of an ID within a branch worker process.
+
+    :param shared_id (SharedImage): An image of an ID that text must be extracted from.
+    :param preferences (dict): Prepared list of preferences, as returned by text_verification_preferences.
+
+    Returns:
+        - (json object): A collection of text extracted from the ID.
+
+    """
+    try:
+        return manage_text_extractor(shared_id.array(), preferences)
+    finally:
+        shared_id.close()
+
+
+def describe_face(image):
+    """
+    This function extracts the face in an image and computes its descriptor.
+
+    :param image (obj): An image containing a face.
+
+    Returns:
+        - (obj): The 128-dimensional descriptor of the face (numpy array).
+
+    Raises:
+        - ValueError: If no face can be detected.
+
+    """
+    with analysing(FaceAnalysis()):
+        face_detector = FaceDetector(SHAPE_PREDICTOR_PATH)
+        if face_detector.detect(image) is None:
+            raise ValueError('No face could be found in the image.')
+        face = face_detector.extract_face(image)
+        return FaceVerify(SHAPE_PREDICTOR_PATH, FACE_RECOGNITION_PATH).describe(face)
+
+
+def receive_face():
+    """
+    This function receives the image of a single face from the flask handler, either as an uploaded file or
+    base64 string ("face_img"), as the body of the request or as a URL ("url").
+
+    Returns:
+        - (obj): An image of a face.
+        - (None): If no image or URL was provided.
+
+    """
+    return request_image("face_img", raw=True)
+
+
+def match_faces(image_of_id, face, analysis=None):
     """
     This function receives two images that receive images of faces that need to be verified.
     It is expected that an image of an ID and an image of a Profile picture will be received.
@@ -127,20 +348,23 @@ def match_faces(image_of_id, face):
 
     :param image_of_id (obj): An image of an ID that contains a face that needs to be verified.
     :param face (obj): A image of a face that needs to be verified.
+    :param analysis (FaceAnalysis): The face analysis of the request, if it is shared with other stages
+            of the request. A new face analysis is used if none is given.
 
     Returns:
         - boolean: Whether the two faces match (the distance between them is above the threshold value).
         - float: Return Euclidean distance between the vector representations of the two faces.
 
     """
-    # Extract face
-    face_detector = FaceDetector(SHAPE_PREDICTOR_PATH)
-    extracted_face1 = face_detector.extract_face(image_of_id)
-    extracted_face2 = face_detector.extract_face(face)
+    with analysing(analysis if analysis is not None else FaceAnalysis()):
+        # Extract face
+        face_detector = FaceDetector(SHAPE_PREDICTOR_PATH)
+        extracted_face1 = face_detector.extract_face(image_of_id)
+        extracted_face2 = face_detector.extract_face(face)
 
-    # Verify faces
-    face_verifier = FaceVerify(SHAPE_PREDICTOR_PATH, FACE_RECOGNITION_PATH)
-    return face_verifier.verify(extracted_face1, extracted_face2)
+        # Verify faces
+        face_verifier = FaceVerify(SHAPE_PREDICTOR_PATH, FACE_RECOGNITION_PATH)
+        return face_verifier.verify(extracted_face1, extracted_face2)
 
 
 def receive_faces(match_face=True):
@@ -148,9 +372,10 @@ def receive_faces(match_face=True):
     This function receives faces/ID from request flask handler.
     The function checks for multiple means of receiving the faces/ID. These include
 
-        - Receiving image by file path
+        - Receiving image by base64 string
         - Receiving image by URL
-        - Receiving image by file Stream
+        - Receiving image by file upload (multipart/form-data)
+        - Receiving the image of the ID as the body of the request (image/*)
 
     It is expected that an image of a face and an image of an ID will be sent.
     However, if the order is not followed that system will still be able to return the best effort result without
@@ -166,80 +391,80 @@ def receive_faces(match_face=True):
     """
     data = {"success": False}
     # Get id image as numpy array
-    # Check to see if an image was uploaded.
-    if request.get_json().get("id_img", None) is not None:
-        # Grab the uploaded image.
-        image_of_id = grab_image(string=request.get_json()["id_img"])
-    # Otherwise, assume that a URL was passed in.
-    else:
-        # Grab the URL from the request.
-        url = request.get_json().get("url", None)
-        # If the URL is None, then return an error.
-        if url is None:
-            data["error"] = "No URL provided."
-            return jsonify(data)
-            # Load the image and convert.
-        image_of_id = grab_image(url=url)
+    # The image is uploaded, sent as the body of the request or sent as a URL.
+    image_of_id = request_image("id_img", raw=True)
+    if image_of_id is None:
+        data["error"] = "No URL provided."
+        return jsonify(data)
 
     if not match_face:
         return image_of_id
 
     # Get face image as numpy array
-    # Check to see if an image was uploaded.
-    if request.get_json().get("face_img", None) is not None:
-        # Grab the uploaded image.
-        face = grab_image(string=request.get_json()["face_img"])
-    # Otherwise, assume that a URL was passed in.
-    else:
-        # Grab the URL from the request.
-        url = request.get_json().get("url", None)
-        # If the URL is None, then return an error.
-        if url is None:
-            data["error"] = "No URL provided."
-            return jsonify(data)
-            # Load the image and convert.
-        face = grab_image(url=url)
+    face = request_image("face_img")
+    if face is None:
+        data["error"] = "No URL provided."
+        return jsonify(data)
 
     return image_of_id, face
 
 
-def manage_text_extractor(image_of_id):
+def text_verification_preferences(request_data):
     """
-    This function manages the text extraction from an ID images.
-    Management includes preparing text extraction preferences and receiving extracted text.
+    This function prepares the text extraction preferences from the data of a request.
 
-    :param image_of_id (obj): An image of an ID that text must be extracted from.
+    :param request_data (dict): The fields of the request, as returned by request_data.
 
     Returns:
        - preferences (dict): Prepared list of preferences. May contain additional text extraction or logger preferences.
-       - extracted_text (json object): A collection of text extracted from the ID.
 
     """
     preferences = {}
-    # Grab additional parameters specifying techniques. Extract text
+    # Grab additional parameters specifying techniques.
     logger.info("Setting Preferences")
-    if 'blur_technique' in request.get_json():
-        preferences['blur_method'] = request.get_json()['blur_technique']
-    if 'threshold_technique' in request.get_json():
-        preferences['threshold_method'] = request.get_json()['threshold_technique']
-    if 'remove_face' in request.get_json():
-        preferences['remove_face'] = request.get_json()['remove_face']
-    if 'remove_barcode' in request.get_json():
-        preferences['remove_barcode'] = request.get_json()['remove_barcode']
-    if 'color' in request.get_json():
-        preferences['color'] = request.get_json()['color']
-    if 'id_type' in request.get_json():
-        preferences['id_type'] = request.get_json()['id_type']
-    if 'verbose_verify' in request.get_json():
-        preferences['verbose_verify'] = True if request.get_json()['verbose_verify'] == 'true' else False
+    if 'blur_technique' in request_data:
+        preferences['blur_method'] = request_data['blur_technique']
+    if 'threshold_technique' in request_data:
+        preferences['threshold_method'] = request_data['threshold_technique']
+    if 'remove_face' in request_data:
+        preferences['remove_face'] = request_data['remove_face']
+    if 'remove_barcode' in request_data:
+        preferences['remove_barcode'] = request_data['remove_barcode']
+    if 'color' in request_data:
+        preferences['color'] = request_data['color']
+    if 'id_type' in request_data:
+        preferences['id_type'] = request_data['id_type']
+    if 'verbose_verify' in request_data:
+        preferences['verbose_verify'] = True if request_data['verbose_verify'] == 'true' else False
     else:
         preferences['verbose_verify'] = False
-    if 'useIO' in request.get_json():
-        preferences['useIO'] = request.get_json()['useIO'] == 'true'
+    if 'useIO' in request_data:
+        preferences['useIO'] = request_data['useIO'] == 'true'
+        debug_id = request_debug_id(preferences['useIO'])
+        if debug_id is not None:
+            preferences['debug_id'] = debug_id
+    return preferences
+
+
+def manage_text_extractor(image_of_id, preferences, analysis=None):
+    """
+    This function manages the text extraction from an ID images.
+    It does not depend on the Flask request, so that it can be run on a stage pool.
 
-    extractor = TextExtractor(preferences)
-    extracted_text = extractor.extract(image_of_id)
-    return extracted_text, preferences
+    :param image_of_id (obj): An image of an ID that text must be extracted from.
+    :param preferences (dict): Prepared list of preferences, as returned by text_verification_preferences.
+    :param analysis (FaceAnalysis): The face analysis of the request, if it is shared with other stages
+            of the request. A new face analysis is used if none is given.
+
+    Returns:
+       - extracted_text (json object): A collection of text extracted from the ID.
+
+    """
+    with tracing.traced(), analysing(analysis if analysis is not None else FaceAnalysis()), \
+            debugging(preferences.get('debug_id')):
+        extractor = TextExtractor(dict(preferences))
+        extracted_text = extractor.extract(image_of_id)
+    return extracted_text
 
 
 def manage_text_verification(preferences, extracted_text, entered_details):
@@ -274,14 +499,15 @@ def receive_details():
         - (dict): Details that need to be verified with that extracted from image.
 
     """
+    details = request_data()
     entered_details = {
-        "names": request.get_json()['names'],
-        "surname": request.get_json()['surname'],
-        "identity_number": request.get_json()['idNumber'],
-        "nationality": request.get_json()['nationality'],
-        "country_of_birth": request.get_json()['cob'],
-        "status": request.get_json()['status'],
-        "sex": request.get_json()['gender'],
-        "date_of_birth": request.get_json()['dob']
+        "names": details['names'],
+        "surname": details['surname'],
+        "identity_number": details['idNumber'],
+        "nationality": details['nationality'],
+        "country_of_birth": details['cob'],
+        "status": details['status'],
+        "sex": details['gender'],
+        "date_of_birth": details['dob']
     }
     return entered_details
@@ -0,0 +1,423 @@
+"""
+Wraps the functionality required to search for a face among a set of enrolled faces (1:N matching).
+
+Faces are enrolled as the 128-dimensional descriptors computed by FaceVerify.describe, each under the ID of the
+person it belongs to. Searching for a face returns the enrolled faces closest to it, along with the same match
+percentage that FaceVerify.verify reports for a pair of faces.
+
+Small indexes are searched exhaustively, with all of the distances computed in one vectorised operation.
+Once an index grows beyond FACE_INDEX_APPROXIMATE_MIN_SIZE faces, it is searched approximately instead: the
+descriptors are clustered with k-means into inverted lists and only the lists whose centroids lie closest to the
+face are searched.
+
+An index can be persisted to a directory, to which every enrolled face is appended as it is enrolled. The
+descriptors are stored as raw float32 rows, so that restarting only requires memory-mapping the file.
+
+Example usage:
+
+First import the face index module...
+from hutts_verification.verification.face_index import FaceIndex
+then enroll faces and search for a face.
+
+``face_index = FaceIndex.load('face_index/')``
+``face_index.enroll('8001015009087', descriptor)``
+``matches = face_index.search(other_descriptor, top_k=5)``
+
+"""
+
+import os
+import threading
+import numpy as np
+from hutts_verification.utils.hutts_logger import logger
+from hutts_verification.verification.face_verify import match_percentages, FACE_DESCRIPTOR_SIZE
+
+__author__ = "Stephan Nell"
+__copyright__ = "Copyright 2017, Java the Hutts"
+__license__ = "BSD"
+__maintainer__ = "Stephan Nell"
+__email__ = "nellstephanj@gmail.com"
+__status__ = "Development"
+
+"""Specifies the number of enrolled faces from which the index is searched approximately."""
+FACE_INDEX_APPROXIMATE_MIN_SIZE = 20000
+"""Specifies the number of inverted lists that are searched by an approximate search."""
+FACE_INDEX_PROBES = 8
+"""Specifies the number of iterations of k-means used to cluster the descriptors into inverted lists."""
+FACE_INDEX_KMEANS_ITERATIONS = 10
+"""Specifies the number of descriptors per inverted list that are sampled to train the clustering."""
+FACE_INDEX_TRAINING_SAMPLES_PER_LIST = 64
+"""Specifies the fraction of faces that may be enrolled after clustering before the clustering is repeated."""
+FACE_INDEX_RETRAIN_FRACTION = 0.2
+"""Specifies the name of the file in which the descriptors of a persisted index are stored."""
+FACE_INDEX_DESCRIPTORS_FILE = 'descriptors.f32'
+"""Specifies the name of the file in which the IDs of a persisted index are stored."""
+FACE_INDEX_IDS_FILE = 'ids.txt'
+
+
+class _InvertedLists:
+    """
+    The clustering of the descriptors of an index into inverted lists, used for approximate searches.
+
+    :centroids (obj): The centroids of the lists (numpy array).
+    :order (obj): The rows of the indexed descriptors, sorted by list (numpy array).
+    :offsets (obj): The position in order at which every list starts, followed by the number of rows (numpy array).
+    :size (int): The number of descriptors that were clustered.
+
+    """
+    def __init__(self, descriptors):
+        """
+        Clusters the descriptors with k-means.
+
+        :param descriptors (obj): The descriptors to cluster (numpy array).
+
+        """
+        self.size = len(descriptors)
+        list_count = max(int(np.sqrt(self.size)), 1)
+        random = np.random.RandomState(0)
+        sample_size = min(self.size, list_count * FACE_INDEX_TRAINING_SAMPLES_PER_LIST)
+        sample = np.asarray(descriptors[np.sort(random.choice(self.size, sample_size, replace=False))])
+        self.centroids = sample[random.choice(sample_size, list_count, replace=False)].copy()
+        for _ in range(FACE_INDEX_KMEANS_ITERATIONS):
+            assignments = self.assign(sample)
+            counts = np.bincount(assignments, minlength=list_count)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, sample)
+            # Lists that lost all of their samples keep their previous centroid.
+            filled = counts > 0
+            self.centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+        assignments = np.concatenate([
+            self.assign(np.asarray(descriptors[start:start + 65536])) for start in range(0, self.size, 65536)
+        ])
+        self.order = np.argsort(assignments, kind='stable')
+        self.offsets = np.searchsorted(assignments[self.order], np.arange(list_count + 1))
+
+    def assign(self, descriptors):
+        """
+        Finds the list whose centroid lies closest to every descriptor.
+
+        :param descriptors (obj): The descriptors (numpy array).
+
+        Returns:
+            - (obj): The list of every descriptor (numpy array).
+
+        """
+        return np.argmin(_squared_distances(descriptors, self.centroids), axis=1)
+
+    def candidates(self, descriptor, probes):
+        """
+        Returns the rows in the lists whose centroids lie closest to a descriptor.
+
+        :param descriptor (obj): The descriptor (numpy array).
+        :param probes (int): The number of lists to search.
+
+        Returns:
+            - (obj): The rows of the candidate descriptors (numpy array).
+
+        """
+        distances = _squared_distances(descriptor[np.newaxis], self.centroids)[0]
+        probes = min(probes, len(self.centroids))
+        closest = np.argpartition(distances, probes - 1)[:probes]
+        return np.concatenate([self.order[self.offsets[index]:self.offsets[index + 1]] for index in closest])
+
+
+def _squared_distances(first, second):
+    """
+    Computes the squared Euclidean distance between every pair of rows of two matrices.
+
+    :param first (obj): The first matrix (numpy array).
+    :param second (obj): The second matrix (numpy array).
+
+    Returns:
+        - (obj): The squared distances, with a row for every row of the first matrix (numpy array).
+
+    """
+    distances = -2 * first.dot(second.T)
+    distances += np.einsum('ij,ij->i', first, first)[:, np.newaxis]
+    distances += np.einsum('ij,ij->i', second, second)[np.newaxis]
+    return np.maximum(distances, 0)
+
+
+class FaceIndex:
+    """
+    An index of enrolled face descriptors that can be searched for the faces closest to a given face.
+
+    :directory (str): The directory to which the index is persisted, if any.
+    :approximate_min_size (int): The number of enrolled faces from which the index is searched approximately.
+    :probes (int): The number of inverted lists searched by an approximate search.
+    :_mapped (obj): The descriptors that were persisted when the index was loaded (memory-mapped numpy array).
+    :_appended (obj): The storage of the descriptors enrolled since, which grows as needed (numpy array).
+    :_appended_count (int): The number of rows of _appended in use.
+    :_ids (list): The ID of every enrolled face, in the order in which the faces were enrolled.
+    :_lists (_InvertedLists): The clustering used for approximate searches, once the index is large enough.
+    :_lock (Lock): Guards enrollment and the clustering.
+
+    """
+    def __init__(self, directory=None, approximate_min_size=FACE_INDEX_APPROXIMATE_MIN_SIZE,
+                 probes=FACE_INDEX_PROBES):
+        """
+        Responsible for initialising the FaceIndex object.
+        Use FaceIndex.load to open an index that was persisted before.
+
+        :param directory (str): The directory to which enrolled faces are appended. The index is only kept in
+                memory if no directory is given.
+        :param approximate_min_size (int): The number of enrolled faces from which the index is searched
+                approximately.
+        :param probes (int): The number of inverted lists searched by an approximate search.
+
+        """
+        self.directory = directory
+        self.approximate_min_size = approximate_min_size
+        self.probes = probes
+        self._mapped = np.zeros((0, FACE_DESCRIPTOR_SIZE), dtype='float32')
+        self._appended = np.zeros((64, FACE_DESCRIPTOR_SIZE), dtype='float32')
+        self._appended_count = 0
+        self._ids = []
+        self._lists = None
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def load(cls, directory, **kwargs):
+        """
+        Opens the index persisted to a directory, creating an empty index if the directory does not contain one.
+        The persisted descriptors are memory-mapped rather than read. A face whose enrollment was interrupted
+        is discarded.
+
+        :param directory (str): The directory of the index.
+        :param kwargs (dict): The other arguments passed to the constructor.
+
+        Returns:
+            - (FaceIndex): The index.
+
+        """
+        face_index = cls(directory, **kwargs)
+        descriptors_path = os.path.join(directory, FACE_INDEX_DESCRIPTORS_FILE)
+        ids_path = os.path.join(directory, FACE_INDEX_IDS_FILE)
+        ids = []
+        if os.path.isfile(ids_path):
+            with open(ids_path, encoding='utf-8') as ids_file:
+                ids = ids_file.read().split('\n')[:-1]
+        row_size = FACE_DESCRIPTOR_SIZE * 4
+        rows = os.path.getsize(descriptors_path) // row_size if os.path.isfile(descriptors_path) else 0
+        count = min(rows, len(ids))
+        if count < max(rows, len(ids)) or (rows and os.path.getsize(descriptors_path) % row_size):
+            logger.warning('Discarding incomplete enrollments from the face index in "%s"' % directory)
+            face_index._truncate(count)
+        if count:
+            face_index._mapped = np.memmap(descriptors_path, dtype='float32', mode='r',
+                                           shape=(count, FACE_DESCRIPTOR_SIZE))
+        face_index._ids = ids[:count]
+        logger.info('Loaded %d faces from the face index in "%s"' % (count, directory))
+        return face_index
+
+    def __len__(self):
+        return len(self._ids)
+
+    def enroll(self, identifier, descriptor):
+        """
+        Adds a face to the index.
+
+        :param identifier (str): The ID of the person to whom the face belongs.
+        :param descriptor (obj): The 128-dimensional descriptor of the face (numpy array or list).
+
+        Returns:
+            - (int): The number of faces in the index.
+
+        Raises:
+            - TypeError: If a string value is not passed for identifier.
+            - ValueError: If the identifier is empty or contains a line break, or the descriptor has the wrong size.
+
+        """
+        if not isinstance(identifier, str):
+            raise TypeError(
+                'Bad type for arg identifier - expected string. Received type "%s".' %
+                type(identifier).__name__
+            )
+        if not identifier or '\n' in identifier or '\r' in identifier:
+            raise ValueError('The ID of an enrolled face may not be empty or contain line breaks.')
+        descriptor = self._check_descriptor(descriptor)
+        with self._lock:
+            if self.directory is not None:
+                self._persist(identifier, descriptor)
+            if self._appended_count == len(self._appended):
+                grown = np.zeros((2 * len(self._appended), FACE_DESCRIPTOR_SIZE), dtype='float32')
+                grown[:self._appended_count] = self._appended
+                self._appended = grown
+            self._appended[self._appended_count] = descriptor
+            self._appended_count += 1
+            self._ids.append(identifier)
+            return len(self._ids)
+
+    def search(self, descriptor, top_k=5, threshold=0.55):
+        """
+        Finds the enrolled faces closest to a face.
+
+        :param descriptor (obj): The 128-dimensional descriptor of the face (numpy array or list).
+        :param top_k (int): The maximum number of faces to return.
+        :param threshold (float): The distance below which faces are considered a match, as used by
+                FaceVerify.verify.
+
+        Returns:
+            - (list): The closest faces, from closest to furthest, each containing the ID it was enrolled under,
+                its distance to the face and the match percentage and result that FaceVerify.verify would report.
+
+        Raises:
+            - ValueError: If the descriptor has the wrong size or top_k is smaller than 1.
+
+        """
+        descriptor = self._check_descriptor(descriptor)
+        if top_k < 1:
+            raise ValueError('At least one face should be returned by a search.')
+        with self._lock:
+            (mapped, appended, ids) = (self._mapped, self._appended[:self._appended_count], list(self._ids))
+            lists = self._inverted_lists(mapped, appended) if len(ids) >= self.approximate_min_size else None
+        rows = None
+        if lists is not None:
+            # Faces enrolled since the clustering are not in any list, so they are always searched.
+            rows = np.sort(np.concatenate([lists.candidates(descriptor, self.probes),
+                                           np.arange(lists.size, len(ids))]))
+        distances = self._distances(descriptor, mapped, appended, rows)
+        top_k = min(top_k, len(distances))
+        if top_k == 0:
+            return []
+        closest = np.argpartition(distances, top_k - 1)[:top_k]
+        closest = closest[np.argsort(distances[closest], kind='stable')]
+        (is_match, percentage_match) = match_percentages(distances[closest], threshold)
+        matches = []
+        for (index, position) in enumerate(closest):
+            row = int(position if rows is None else rows[position])
+            matches.append({
+                'id': ids[row],
+                'distance': float(distances[position]),
+                'face_match': float(percentage_match[index]),
+                'is_match': bool(is_match[index])
+            })
+        return matches
+
+    @staticmethod
+    def _check_descriptor(descriptor):
+        """
+        Converts a face descriptor to a float32 numpy array and checks its size.
+
+        :param descriptor (obj): The descriptor (numpy array or list).
+
+        Returns:
+            - (obj): The descriptor (numpy array).
+
+        Raises:
+            - ValueError: If the descriptor has the wrong size.
+
+        """
+        descriptor = np.asarray(descriptor, dtype='float32').ravel()
+        if descriptor.shape != (FACE_DESCRIPTOR_SIZE,):
+            raise ValueError('A face descriptor should have %d values.' % FACE_DESCRIPTOR_SIZE)
+        return descriptor
+
+    @staticmethod
+    def _distances(descriptor, mapped, appended, rows=None):
+        """
+        Computes the distances between a face and the enrolled faces.
+
+        :param descriptor (obj): The descriptor of the face (numpy array).
+        :param mapped (obj): The memory-mapped descriptors (numpy array).
+        :param appended (obj): The descriptors enrolled since the index was loaded (numpy array).
+        :param rows (obj): The sorted rows of the faces to compute the distances of (numpy array). The distances of
+                all the faces are computed if no rows are given.
+
+        Returns:
+            - (obj): The distance to every face (numpy array).
+
+        """
+        if rows is None:
+            parts = [np.asarray(mapped), appended]
+        else:
+            split = np.searchsorted(rows, len(mapped))
+            parts = [mapped[rows[:split]], appended[rows[split:] - len(mapped)]]
+        distances = [_squared_distances(descriptor[np.newaxis], part)[0] for part in parts if len(part)]
+        return np.sqrt(np.concatenate(distances)) if distances else np.zeros(0, dtype='float32')
+
+    def _inverted_lists(self, mapped, appended):
+        """
+        Returns the clustering used for approximate searches, clustering the descriptors again if too many faces
+        were enrolled since they were last clustered. The lock should be held.
+
+        :param mapped (obj): The memory-mapped descriptors (numpy array).
+        :param appended (obj): The descriptors enrolled since the index was loaded (numpy array).
+
+        Returns:
+            - (_InvertedLists): The clustering.
+
+        """
+        size = len(mapped) + len(appended)
+        if self._lists is None or size > self._lists.size * (1 + FACE_INDEX_RETRAIN_FRACTION):
+            logger.info('Clustering %d faces of the face index...' % size)
+            self._lists = _InvertedLists(np.concatenate([mapped, appended]) if len(appended) else mapped)
+        return self._lists
+
+    def _persist(self, identifier, descriptor):
+        """
+        Appends an enrolled face to the files of the index.
+        The descriptor is written before the ID, so that an interrupted enrollment leaves a descriptor without
+        an ID behind, which is discarded when the index is loaded.
+
+        :param identifier (str): The ID of the person to whom the face belongs.
+        :param descriptor (obj): The descriptor of the face (numpy array).
+
+        """
+        with open(os.path.join(self.directory, FACE_INDEX_DESCRIPTORS_FILE), 'ab') as descriptors_file:
+            descriptors_file.write(descriptor.tobytes())
+        with open(os.path.join(self.directory, FACE_INDEX_IDS_FILE), 'a', encoding='utf-8') as ids_file:
+            ids_file.write(identifier + '\n')
+
+    def _truncate(self, count):
+        """
+        Truncates the files of the index to the given number of faces.
+
+        :param count (int): The number of faces to keep.
+
+        """
+        descriptors_path = os.path.join(self.directory, FACE_INDEX_DESCRIPTORS_FILE)
+        if os.path.isfile(descriptors_path):
+            with open(descriptors_path, 'rb+') as descriptors_file:
+                descriptors_file.truncate(count * FACE_DESCRIPTOR_SIZE * 4)
+        ids_path = os.path.join(self.directory, FACE_INDEX_IDS_FILE)
+        if os.path.isfile(ids_path):
+            with open(ids_path, encoding='utf-8') as ids_file:
+                ids = ids_file.read().split('\n')[:count]
+            with open(ids_path, 'w', encoding='utf-8') as ids_file:
+                ids_file.write(''.join(identifier + '\n' for identifier in ids))
+
+
+"""The face index used by the server, which is only kept in memory unless it is replaced by a persisted index."""
+_face_index = FaceIndex()
+
+
+def get_face_index():
+    """
+    Returns the face index used by the server.
+
+    Returns:
+        - (FaceIndex): The face index.
+
+    """
+    return _face_index
+
+
+def set_face_index(face_index):
+    """
+    Sets the face index used by the server.
+
+    :param face_index (FaceIndex): The new face index.
+
+    Raises:
+        - TypeError: If the face index is not a FaceIndex.
+
+    """
+    global _face_index
+    if not isinstance(face_index, FaceIndex):
+        raise TypeError(
+            'Bad type for arg face_index - expected FaceIndex. Received type "%s".' %
+            type(face_index).__name__
+        )
+    _face_index = face_index
@@ -2,9 +2,12 @@
 A class that is used to extract and compare two images of faces and calculate the resulting match.
 """
 
-import dlib
+import numpy as np
 from scipy.spatial import distance
+from hutts_verification.image_preprocessing.face_analysis import current_analysis
+from hutts_verification.utils.content_cache import ContentCache, content_hash
 from hutts_verification.utils.hutts_logger import logger
+from hutts_verification.utils.model_registry import model_registry, MODEL_FACE_RECOGNITION
 
 __author__ = "Stephan Nell"
 __copyright__ = "Copyright 2017, Java the Hutts"
@@ -13,6 +16,93 @@ __maintainer__ = "Stephan Nell"
 __email__ = "nellstephanj@gmail.com"
 __status__ = "Development"
 
+"""Specifies the number of dimensions of a face descriptor."""
+FACE_DESCRIPTOR_SIZE = 128
+
+"""Specifies the number of face descriptors kept in memory by the default embedding cache."""
+EMBEDDING_CACHE_SIZE = 1024
+
+"""Caches the descriptors of faces, keyed by the content of the face image (None disables caching)."""
+_embedding_cache = ContentCache('embeddings', EMBEDDING_CACHE_SIZE)
+
+
+def get_embedding_cache():
+    """
+    Returns the cache used for the descriptors of faces.
+
+    Returns:
+        - (ContentCache): The embedding cache.
+        - (None): If the descriptors are not cached.
+
+    """
+    return _embedding_cache
+
+
+def set_embedding_cache(cache):
+    """
+    Sets the cache used for the descriptors of faces.
+
+    :param cache (ContentCache): The new embedding cache, or None to disable caching.
+
+    Raises:
+        - TypeError: If the cache is not a ContentCache.
+
+    """
+    global _embedding_cache
+    if cache is not None and not isinstance(cache, ContentCache):
+        raise TypeError(
+            'Bad type for arg cache - expected ContentCache. Received type "%s".' %
+            type(cache).__name__
+        )
+    _embedding_cache = cache
+
+
+def match_percentage(match_distance, threshold=0.55):
+    """
+    This function maps the Euclidean distance between the descriptors of two faces to a match percentage
+    and decides whether the faces match.
+
+    :param match_distance (float): The Euclidean distance between the descriptors of the two faces.
+    :param threshold (float): The distance below which the faces are considered a match.
+
+    Returns:
+        - (boolean): Represents if two face indeed match.
+        - (float): The percentage with which the faces match.
+
+    """
+    (is_match, percentage_match) = match_percentages(match_distance, threshold)
+    return bool(is_match), float(percentage_match)
+
+
+def match_percentages(match_distances, threshold=0.55):
+    """
+    This function maps an array of Euclidean distances between the descriptors of faces to match percentages
+    and decides whether the faces match, in the same way as match_percentage but for all distances at once.
+
+    :param match_distances (obj): The Euclidean distances (numpy array of any shape).
+    :param threshold (float): The distance below which faces are considered a match.
+
+    Returns:
+        - (obj): Represents if the faces indeed match (boolean numpy array of the same shape).
+        - (obj): The percentages with which the faces match (numpy array of the same shape).
+
+    """
+    match_distances = np.asarray(match_distances, dtype='float64')
+    # Any distance below our threshold of 0.55 is a very good match.
+    # We map 0.55 to 85% and 0 to 100%.
+    shifted_distances = 1 - match_distances
+    shifted_threshold = 1 - threshold + 0.05
+    close_percentages = ((shifted_distances-shifted_threshold)*15/((1-shifted_threshold)*100))*100 + 85
+    # In (0.55-0.60] we map 0.549 to 70% match
+    near_percentages = ((shifted_distances-shifted_threshold)*30/55)*100 + 70
+    # If the distance is higher than 0.65 we map it to 60% and below
+    far_percentages = 60 - ((match_distances-threshold)*60/((1-threshold)*100))*100
+    percentage_matches = np.where(
+        match_distances < threshold, close_percentages,
+        np.where(match_distances < threshold + 0.05, near_percentages, far_percentages)
+    )
+    return match_distances < threshold + 0.05, percentage_matches
+
 
 class FaceVerify:
     """
@@ -77,54 +167,154 @@ class FaceVerify:
 
         """
 
-        logger.debug('Getting frontal face detector')
-        detector = dlib.get_frontal_face_detector()
-        logger.debug('Getting shape predictor')
-        shape_predictor = dlib.shape_predictor(self.shape_predictor_path)
-        logger.debug('Getting facial recogniser')
-        facial_recogniser = dlib.face_recognition_model_v1(self.face_recognition_path)
-
         logger.info('Getting face in first image')
-        face_detections = detector(face1, 1)
-        if len(face_detections) == 0:
-            logger.error('Could not find a face in the first image')
-            raise ValueError('Face could not be detected')
-        logger.debug('Getting the shape')
-        shape = shape_predictor(face1, face_detections[0])
-        logger.debug('Getting the first face descriptor')
-        face_descriptor1 = facial_recogniser.compute_face_descriptor(face1, shape)
-
+        face_descriptor1 = self.describe(face1, 'first')
         logger.info('Getting face in second image')
-        face_detections = detector(face2, 1)
-        if len(face_detections) == 0:
-            logger.error('Could not find a face in the first image')
-            raise ValueError('Face could not be detected')
-        logger.debug('Getting the shape')
-        shape = shape_predictor(face2, face_detections[0])
-        logger.debug('Getting the second face descriptor')
-        face_descriptor2 = facial_recogniser.compute_face_descriptor(face2, shape)
+        face_descriptor2 = self.describe(face2, 'second')
 
         logger.info('Calculating the euclidean distance between the two faces')
         match_distance = distance.euclidean(face_descriptor1, face_descriptor2)
         logger.info('Matching distance: ' + str(match_distance))
 
-        # Any distance below our threshold of 0.55 is a very good match.
-        # We map 0.55 to 85% and 0 to 100%.
-        if match_distance < threshold:
-            match_distance = 1 - match_distance
-            threshold = 1 - threshold + 0.05
-            percentage_match = ((match_distance-threshold)*15/((1-threshold)*100))*100 + 85
-            logger.info('Matching percentage: ' + str(percentage_match) + "%")
-            return True, percentage_match
-        elif match_distance < threshold + 0.05:
-            # In this if we map (0.55-0.60] we map 0.549 to 70% match
-            match_distance = 1 - match_distance
-            threshold = 1 - threshold + 0.05
-            percentage_match = ((match_distance-threshold)*30/55)*100 + 70
-            logger.info('Matching percentage: ' + str(percentage_match) + "%")
-            return True, percentage_match
-        else:
-            # If the distance is higher than 0.65 we map it to 60% and below
-            percentage_match = 60 - ((match_distance-threshold)*60/((1-threshold)*100))*100
-            logger.info('Matching percentage: ' + str(percentage_match) + "%")
-            return False, percentage_match
+        (is_match, percentage_match) = match_percentage(match_distance, threshold)
+        logger.info('Matching percentage: ' + str(percentage_match) + "%")
+        return is_match, percentage_match
+
+    def verify_batch(self, probes, candidates, threshold=0.55):
+        """
+        This function compares every probe face with every candidate face in the same way as verify.
+        The descriptor of each distinct face is computed only once (faces are told apart by their content), and
+        all of the distances and percentages are computed with a single matrix operation, so that the cost of a
+        batch grows with the number of faces rather than the number of pairs.
+
+        :param probes (obj): The image containing the face that should be compared, or a list of such images.
+        :param candidates (list): The images containing the faces the probes should be compared with.
+        :param threshold (float): The distance below which faces are considered a match, as used by verify.
+
+        Returns:
+            - (obj): Represents if the faces indeed match (boolean numpy array). Its shape is (M,) for a single
+                probe and M candidates, or (N, M) for a list of N probes.
+            - (obj): The percentages with which the faces match (numpy array of the same shape).
+
+        Raises:
+            - TypeError: If the probes are not an image or list of images, or the candidates are not a list of
+                images.
+            - ValueError: If no face can be detected in one of the images.
+
+        """
+        single_probe = isinstance(probes, np.ndarray)
+        if single_probe:
+            probes = [probes]
+        for (arg_name, faces) in (('probes', probes), ('candidates', candidates)):
+            if not isinstance(faces, (list, tuple)) or not all(isinstance(face, np.ndarray) for face in faces):
+                raise TypeError(
+                    'Bad type for arg %s - expected list of images in numpy arrays. Received type "%s".' %
+                    (arg_name, type(faces).__name__)
+                )
+
+        logger.info('Getting the faces of %d probe and %d candidate images' % (len(probes), len(candidates)))
+        descriptors = []
+        rows = {}
+        probe_rows = self._describe_all(probes, 'probe', descriptors, rows)
+        candidate_rows = self._describe_all(candidates, 'candidate', descriptors, rows)
+        logger.info('Described %d distinct faces' % len(descriptors))
+
+        descriptors = np.array(descriptors).reshape((-1, FACE_DESCRIPTOR_SIZE))
+        match_distances = distance.cdist(descriptors[probe_rows], descriptors[candidate_rows])
+        (is_match, percentage_match) = match_percentages(match_distances, threshold)
+        if single_probe:
+            return is_match[0], percentage_match[0]
+        return is_match, percentage_match
+
+    def _describe_all(self, faces, role, descriptors, rows):
+        """
+        Computes the descriptors of a list of faces, skipping faces that were described before.
+
+        :param faces (list): The images containing the faces.
+        :param role (str): The role of the images in the batch, used for logging.
+        :param descriptors (list): The distinct descriptors computed so far, to which new descriptors are added.
+        :param rows (dict): Maps the content hash of every face described so far to its row in descriptors.
+
+        Returns:
+            - (list): The row in descriptors of each face.
+
+        Raises:
+            - ValueError: If no face can be detected in one of the images.
+
+        """
+        face_rows = []
+        for (index, face) in enumerate(faces):
+            key = content_hash(face, self.shape_predictor_path, self.face_recognition_path)
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = len(descriptors)
+                descriptors.append(self._describe(face, '%s %d' % (role, index), key))
+            face_rows.append(row)
+        return face_rows
+
+    def describe(self, face, position='first'):
+        """
+        This function computes the 128-dimensional descriptor of the face in the image passed.
+        Descriptors are cached by the content of the image, so that a face that is submitted again is not
+        described again.
+
+        If a face analysis has been activated for the current thread, faces that were aligned during the request
+        are not passed through the face detector again, since the location of the face within them is known.
+
+        :param face (obj): The image containing the face.
+        :param position (str): The position of the image in the request, used for logging.
+
+        Returns:
+            - (obj): The descriptor of the face (numpy array).
+
+        Raises:
+            - ValueError: If no face can be detected.
+
+        """
+        key = None
+        if _embedding_cache is not None:
+            key = content_hash(face, self.shape_predictor_path, self.face_recognition_path)
+        return self._describe(face, position, key)
+
+    def _describe(self, face, position, key):
+        """
+        Computes the descriptor of a face whose content hash is known.
+
+        :param face (obj): The image containing the face.
+        :param position (str): The position of the image in the request, used for logging.
+        :param key (str): The content hash of the face, salted with the models (only required when caching).
+
+        Returns:
+            - (obj): The descriptor of the face (numpy array).
+
+        Raises:
+            - ValueError: If no face can be detected.
+
+        """
+        cache = _embedding_cache
+        if cache is not None and key is not None:
+            face_descriptor = cache.get(key)
+            if face_descriptor is not None:
+                logger.debug('Found the %s face descriptor in the embedding cache' % position)
+                return face_descriptor
+
+        analysis = current_analysis()
+        face_rectangle = analysis.face_rectangle(face) if analysis is not None else None
+        if face_rectangle is None:
+            logger.debug('Getting frontal face detector')
+            detector = model_registry.frontal_face_detector()
+            face_detections = detector(face, 1)
+            if len(face_detections) == 0:
+                logger.error('Could not find a face in the %s image' % position)
+                raise ValueError('Face could not be detected')
+            face_rectangle = face_detections[0]
+        logger.debug('Getting the shape')
+        shape_predictor = model_registry.shape_predictor(self.shape_predictor_path)
+        shape = shape_predictor(face, face_rectangle)
+        logger.debug('Getting the %s face descriptor' % position)
+        facial_recogniser = model_registry.face_recognition_model(self.face_recognition_path)
+        with model_registry.lock(MODEL_FACE_RECOGNITION, self.face_recognition_path):
+            face_descriptor = np.array(facial_recogniser.compute_face_descriptor(face, shape))
+        if cache is not None and key is not None:
+            face_descriptor = cache.put(key, face_descriptor)
+        return face_descriptor
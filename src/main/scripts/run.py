@@ -11,8 +11,27 @@ import ssl
 from flask import Flask, request
 from flask_cors import CORS
 from hutts_verification.utils import hutts_logger
-from hutts_verification.verification.controllers import verify
+from hutts_verification.utils.hutts_logger import prettify_json_message
+from hutts_verification.utils.model_registry import model_registry
+from hutts_verification.utils import tracing
+from hutts_verification.utils.image_handling import IMAGE_DEFAULT_MAX_DIMENSION, set_max_dimension
+from hutts_verification.utils.buffer_pool import BUFFER_POOL_DEFAULT_MAX_BYTES, BufferPool, set_buffer_pool
+from hutts_verification.utils.debug_sink import DEBUG_SINK_DEFAULT_CAPACITY, DEBUG_SINK_KINDS, create_debug_sink, \
+    debug_images, set_debug_sink
+from hutts_verification.image_processing.ocr_engine import create_ocr_engine, set_ocr_engine
+from hutts_verification.image_processing.ocr_pool import OCRWorkerPool
+from hutts_verification.image_processing.result_cache import set_result_cache
+from hutts_verification.image_preprocessing.build_director import BuildDirector
+from hutts_verification.image_preprocessing.face_manager import FACE_DETECTION_DEFAULT_UPSAMPLE, set_detection_mode, \
+    upsample_policy
+from hutts_verification.verification.controllers import verify, initialise_branch_worker
+from hutts_verification.verification.face_verify import EMBEDDING_CACHE_SIZE, set_embedding_cache
+from hutts_verification.verification.face_index import FaceIndex, set_face_index
+from hutts_verification.utils.content_cache import ContentCache
 from hutts_verification.image_processing.controllers import extract
+from hutts_verification.utils.metrics import metrics
+from hutts_verification.utils.stage_pools import STAGE_POOL_DEFAULT_TIMEOUT, STAGE_POOL_DEFAULT_WORKERS, \
+    configure_stage_pools
 
 # Initialise flask application.
 app = Flask(__name__)
@@ -66,10 +85,102 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Starts the application server.')
     parser.add_argument('-d', '--debug', action='store_true')
     parser.add_argument('--secure', help='run the server with SSL enabled', action='store_true')
+    parser.add_argument('--lazy-models', help='load the trained models on first use instead of at start up',
+                        action='store_true')
+    parser.add_argument('--ocr-engine', help='the OCR engine used to extract text (defaults to memory if available)',
+                        choices=['memory', 'pytesseract'])
+    parser.add_argument('--ocr-workers', help='the number of long-lived OCR worker processes (0 disables the pool)',
+                        type=int, default=0)
+    parser.add_argument('--max-image-dimension', help='decode uploaded images scaled down by a power of two while their '
+                        'longest side stays at least this long (0, the default, decodes them at full resolution)',
+                        type=int, default=IMAGE_DEFAULT_MAX_DIMENSION)
+    parser.add_argument('--buffer-pool-size', help='the number of megabytes of free preprocessing buffers that every '
+                        'worker thread keeps for reuse (0 disables reuse)', type=int,
+                        default=BUFFER_POOL_DEFAULT_MAX_BYTES // (1024 * 1024))
+    parser.add_argument('--face-max-side', help='detect faces in a copy of the image scaled down to this longest side '
+                        '(defaults to the full resolution)', type=int)
+    parser.add_argument('--face-upsample', help='the number of times to upsample the image before detecting faces, or '
+                        '"auto" to only upsample small images', type=upsample_policy,
+                        default=FACE_DETECTION_DEFAULT_UPSAMPLE)
+    parser.add_argument('--embedding-cache-size', help='the number of face descriptors cached in memory (0 disables '
+                        'the cache)', type=int, default=EMBEDDING_CACHE_SIZE)
+    parser.add_argument('--embedding-cache-dir', help='also store the cached face descriptors in this directory')
+    parser.add_argument('--embedding-cache-ttl', help='the number of seconds a cached face descriptor remains valid',
+                        type=float)
+    parser.add_argument('--result-cache-size', help='the number of /extractText and /extractAll results cached in '
+                        'memory (0 disables the cache unless a directory is given)', type=int, default=0)
+    parser.add_argument('--result-cache-dir', help='also store the cached extraction results in this directory')
+    parser.add_argument('--result-cache-ttl', help='the number of seconds a cached extraction result remains valid',
+                        type=float)
+    parser.add_argument('--result-cache-scrub', help='overwrite cached extraction results on disk before removing '
+                        'them', action='store_true')
+    parser.add_argument('--face-index-dir', help='persist the faces enrolled through /enrollFace in this directory')
+    parser.add_argument('--face-workers', help='the number of threads that run face detection and matching',
+                        type=int, default=STAGE_POOL_DEFAULT_WORKERS)
+    parser.add_argument('--text-workers', help='the number of threads that run preprocessing and text extraction',
+                        type=int, default=STAGE_POOL_DEFAULT_WORKERS)
+    parser.add_argument('--verify-processes', help='the number of worker processes that run the face and text '
+                        'branches of /verifyID (0 runs them on the face and text threads)', type=int, default=0)
+    parser.add_argument('--stage-queue-size', help='the number of stages that may wait for a worker before requests '
+                        'are rejected with 503 (defaults to no limit)', type=int)
+    parser.add_argument('--request-timeout', help='the number of seconds a request may take before it is abandoned '
+                        'with 504', type=float, default=STAGE_POOL_DEFAULT_TIMEOUT)
+    parser.add_argument('--debug-sink', help='where the intermediate images of requests that set useIO are recorded '
+                        '(defaults to nowhere)', choices=DEBUG_SINK_KINDS, default='null')
+    parser.add_argument('--debug-dir', help='the directory in which the directory debug sink records the images of '
+                        'every request')
+    parser.add_argument('--debug-capacity', help='the number of images the memory debug sink keeps',
+                        type=int, default=DEBUG_SINK_DEFAULT_CAPACITY)
+    parser.add_argument('--debug-async', help='record debug images on a writer thread rather than the request thread',
+                        action='store_true')
+    parser.add_argument('--trace', help='trace every request to keep histograms of the time spent in every stage',
+                        action='store_true')
     args = vars(parser.parse_args())
+    tracing.enable(args['trace'])
+    set_max_dimension(args['max_image_dimension'])
+    set_detection_mode(args['face_max_side'], args['face_upsample'])
+    buffer_pool_bytes = args['buffer_pool_size'] * 1024 * 1024
+    set_buffer_pool(BufferPool(buffer_pool_bytes))
+    debug_sink_arguments = (args['debug_sink'], args['debug_dir'], args['debug_capacity'], args['debug_async'])
+    set_debug_sink(create_debug_sink(*debug_sink_arguments))
+    embedding_cache_arguments = None
+    if args['embedding_cache_size'] > 0 or args['embedding_cache_dir']:
+        embedding_cache_arguments = (args['embedding_cache_size'], args['embedding_cache_dir'],
+                                     args['embedding_cache_ttl'])
+        set_embedding_cache(ContentCache('embeddings', *embedding_cache_arguments))
+    else:
+        set_embedding_cache(None)
+    if args['result_cache_size'] > 0 or args['result_cache_dir']:
+        set_result_cache(ContentCache('results', args['result_cache_size'], args['result_cache_dir'],
+                                      args['result_cache_ttl'], scrub=args['result_cache_scrub']))
+    branch_options = {
+        'ocr_engine': args['ocr_engine'],
+        'face_detection_mode': (args['face_max_side'], args['face_upsample']),
+        'buffer_pool_bytes': buffer_pool_bytes,
+        # The images kept in memory by a branch worker could not be served, so only directories are shared.
+        'debug_sink': debug_sink_arguments if args['debug_sink'] == 'directory' else None,
+        'embedding_cache': embedding_cache_arguments
+    }
+    configure_stage_pools(args['face_workers'], args['text_workers'], args['stage_queue_size'],
+                          args['request_timeout'], args['verify_processes'], initialise_branch_worker,
+                          (branch_options,))
+    if args['face_index_dir']:
+        set_face_index(FaceIndex.load(args['face_index_dir']))
+    if args['ocr_workers'] > 0:
+        set_ocr_engine(OCRWorkerPool(args['ocr_workers'], args['ocr_engine']))
+    else:
+        set_ocr_engine(create_ocr_engine(args['ocr_engine']))
+    # Load the trained models before accepting requests.
+    if not args['lazy_models']:
+        model_registry.warm_up()
+        hutts_logger.logger.info('Model registry statistics:\n%s', prettify_json_message(model_registry.stats()))
+        BuildDirector.warm_up()
+        hutts_logger.logger.info('Pipeline statistics:\n%s', prettify_json_message(BuildDirector.stats()))
     # Initialise blueprints
     app.register_blueprint(verify)
     app.register_blueprint(extract)
+    app.register_blueprint(metrics)
+    app.register_blueprint(debug_images)
     # Run the server.
     hutts_logger.disable_flask_logging(app)
     hutts_logger.logger.info('* Running on https://%s:%d/', HOST, PORT)
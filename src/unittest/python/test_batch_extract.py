@@ -0,0 +1,118 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the batch extraction module.
+----------------------------------------------------------------------
+"""
+
+import json
+import os
+import pytest
+from hutts_verification.image_processing.batch_extract import collect_images, read_checkpoint, percentile, \
+    summarise, run_batch
+
+
+def test_collect_images_wrong_param():
+    """
+    Test to see if a TypeError is raised when a non-string source is given.
+    """
+    with pytest.raises(TypeError):
+        collect_images(1)
+
+
+def test_collect_images_missing(tmpdir):
+    """
+    Test to see if a ValueError is raised when the source does not exist.
+    """
+    with pytest.raises(ValueError):
+        collect_images(str(tmpdir.join('missing')))
+
+
+def test_collect_images_directory(tmpdir):
+    """
+    Test to see if only images are collected from a directory and its subdirectories.
+    """
+    tmpdir.join('b.jpg').write('')
+    tmpdir.join('notes.txt').write('')
+    tmpdir.mkdir('sub').join('a.PNG').write('')
+    assert collect_images(str(tmpdir)) == sorted([str(tmpdir.join('b.jpg')), str(tmpdir.join('sub', 'a.PNG'))])
+
+
+def test_collect_images_manifest(tmpdir):
+    """
+    Test to see if the paths in a manifest are collected relative to the manifest.
+    """
+    manifest = tmpdir.join('manifest.txt')
+    manifest.write('# scans\na.jpg\n\n/tmp/b.jpg\n')
+    assert collect_images(str(manifest)) == [str(tmpdir.join('a.jpg')), '/tmp/b.jpg']
+
+
+def test_read_checkpoint(tmpdir):
+    """
+    Test to see if processed images are read from the output file and an incomplete last line is removed.
+    """
+    output = tmpdir.join('results.jsonl')
+    output.write(
+        json.dumps({'path': 'a.jpg', 'success': True}) + '\n' +
+        json.dumps({'path': 'b.jpg', 'success': False}) + '\n' +
+        '{"path": "c.jp'
+    )
+    assert read_checkpoint(str(output)) == {'a.jpg', 'b.jpg'}
+    assert read_checkpoint(str(output), retry_failed=True) == {'a.jpg'}
+    assert output.read().endswith('}\n')
+
+
+def test_read_checkpoint_missing(tmpdir):
+    """
+    Test to see if nothing is skipped when there is no output file yet.
+    """
+    assert read_checkpoint(str(tmpdir.join('results.jsonl'))) == set()
+
+
+def test_percentile():
+    """
+    Test the nearest-rank percentile of a list of values.
+    """
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile([3], 0.95) == 3
+    assert percentile([], 0.5) is None
+
+
+def test_summarise():
+    """
+    Test the summary of a batch run.
+    """
+    summary = summarise([
+        {'path': 'a.jpg', 'success': True, 'timings': {'load': 0.1, 'text': 1.0}},
+        {'path': 'b.jpg', 'success': False, 'timings': {'load': 0.3}}
+    ], 2.0, skipped=1)
+    assert summary['processed'] == 2
+    assert summary['failed'] == 1
+    assert summary['skipped'] == 1
+    assert summary['images_per_second'] == 1.0
+    assert summary['stages']['load'] == {'count': 2, 'p50': 0.1, 'p95': 0.3}
+    assert summary['stages']['face']['count'] == 0
+
+
+def test_run_batch_resume(tmpdir):
+    """
+    Test to see if failures are written to the output file and not processed again when the run is resumed.
+    """
+    image = tmpdir.join('broken.jpg')
+    image.write('not an image')
+    output = str(tmpdir.join('results.jsonl'))
+    summary = run_batch([str(image)], output, processes=1)
+    assert summary['processed'] == 1
+    assert summary['failed'] == 1
+    with open(output) as output_file:
+        result = json.loads(output_file.readline())
+    assert result['path'] == str(image)
+    assert not result['success']
+    assert 'error' in result
+    summary = run_batch([str(image)], output, processes=1)
+    assert summary['processed'] == 0
+    assert summary['skipped'] == 1
+    assert os.path.getsize(output) > 0
@@ -8,6 +8,7 @@ Unit tests for the Blur Manager
 import pytest
 import cv2
 import os
+import numpy as np
 from hutts_verification.image_preprocessing.blur_manager import BlurManager
 
 TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
@@ -141,3 +142,16 @@ def test_apply_12():
     blur_manger = BlurManager("median", (3, 3))
     with pytest.raises(ValueError):
         blur_manger.apply(test_image_colour)
+
+
+def test_apply_dst():
+    """
+    Test apply function writing the blurred image to a given image
+    """
+    for (blur_type, kernel_size) in (("gaussian", [(3, 3)]), ("normal", [(3, 3)]), ("median", [3])):
+        blur_manager = BlurManager(blur_type, kernel_size)
+        dst = np.empty_like(test_image_colour)
+        assert blur_manager.apply(test_image_colour, dst) is dst
+        assert np.array_equal(dst, blur_manager.apply(test_image_colour))
+    assert BlurManager("gaussian", [(3, 3)]).is_linear()
+    assert not BlurManager("median", [3]).is_linear()
@@ -0,0 +1,100 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the buffer pool module.
+----------------------------------------------------------------------
+"""
+
+import gc
+import threading
+import numpy as np
+import pytest
+from hutts_verification.utils.buffer_pool import BufferPool, get_buffer_pool, set_buffer_pool
+
+
+def test_constructor_type():
+    """
+    Test to see if a TypeError is raised for a maximum number of bytes that is not an integer.
+    """
+    with pytest.raises(TypeError):
+        BufferPool(1.5)
+
+
+def test_constructor_value():
+    """
+    Test to see if a ValueError is raised for a negative maximum number of bytes.
+    """
+    with pytest.raises(ValueError):
+        BufferPool(-1)
+
+
+def test_set_buffer_pool_type():
+    """
+    Test to see if a TypeError is raised when the buffer pool is not a BufferPool.
+    """
+    with pytest.raises(TypeError):
+        set_buffer_pool(None)
+    assert isinstance(get_buffer_pool(), BufferPool)
+
+
+def test_reuse():
+    """
+    Test to see if a returned buffer is reused for the same shape and data type only, and buffers that are
+    borrowed at the same time are distinct.
+    """
+    pool = BufferPool()
+    with pool.borrow((4, 5)) as buffer:
+        assert buffer.shape == (4, 5) and buffer.dtype == np.uint8
+    with pool.borrow((4, 5)) as first, pool.borrow((4, 5)) as second:
+        assert first is buffer
+        assert second is not buffer
+    with pool.borrow((4, 5), np.float32) as other:
+        assert other.dtype == np.float32
+    stats = pool.stats()
+    assert stats['requests'] == 4
+    assert stats['reuses'] == 1
+    assert stats['reuse_rate'] == 0.25
+    assert stats['held_bytes'] == stats['peak_bytes'] == 2 * 20 + 80
+
+
+def test_bounded():
+    """
+    Test to see if the least recently returned buffers are dropped once a thread keeps more bytes than allowed.
+    """
+    pool = BufferPool(100)
+    first = pool.acquire((60,))
+    second = pool.acquire((50,))
+    large = pool.acquire((200,))
+    assert pool.stats()['peak_bytes'] == 310
+    pool.release(first)
+    pool.release(second)
+    pool.release(large)
+    assert pool.stats()['held_bytes'] == 50
+    assert pool.acquire((50,)) is second
+    assert pool.acquire((60,)) is not first
+
+
+def test_threads():
+    """
+    Test to see if every thread keeps its own buffers, which are no longer counted once the thread has finished.
+    """
+    pool = BufferPool()
+    with pool.borrow((10,)) as buffer:
+        pass
+    borrowed = []
+
+    def borrow():
+        for _ in range(2):
+            with pool.borrow((10,)) as other:
+                borrowed.append(other)
+
+    thread = threading.Thread(target=borrow)
+    thread.start()
+    thread.join()
+    assert borrowed[0] is not buffer
+    assert borrowed[1] is borrowed[0]
+    assert pool.stats()['reuses'] == 1
+    borrowed.clear()
+    gc.collect()
+    assert pool.stats()['held_bytes'] == 10
@@ -0,0 +1,137 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the build director.
+----------------------------------------------------------------------
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from hutts_verification.image_preprocessing import build_director
+from hutts_verification.image_preprocessing.build_director import BuildDirector, PIPELINE_DEFAULT_ID_TYPES
+from hutts_verification.image_preprocessing.face_manager import get_detection_mode, set_detection_mode
+
+
+@pytest.fixture(autouse=True)
+def clear():
+    """
+    Discards the pipelines built by other tests.
+    """
+    BuildDirector.clear()
+    yield
+    BuildDirector.clear()
+
+
+def test_techniques():
+    """
+    Test to see if the techniques of the pipeline are determined by the ID type and preferences.
+    """
+    pipeline = BuildDirector.construct_text_extract_pipeline({}, 'idcard')
+    assert (pipeline.blur_manager.blur_type, pipeline.blur_manager.kernel_size) == ('gaussian', [(3, 3)])
+    assert (pipeline.color_manager.color_extraction_type, pipeline.color_manager.channel) == ('extract', 'red_blue')
+    assert pipeline.threshold_manager.thresholding_type == 'adaptive'
+    pipeline = BuildDirector.construct_text_extract_pipeline({'blur_method': 'median', 'color': 'green'}, 'idcard')
+    assert (pipeline.blur_manager.blur_type, pipeline.blur_manager.kernel_size) == ('median', [3])
+    assert pipeline.color_manager.channel == 'green'
+
+
+def test_memoised():
+    """
+    Test to see if the same pipeline is returned for the same ID type and preferences.
+    """
+    pipeline = BuildDirector.construct_text_extract_pipeline({'useIO': False}, 'idcard')
+    assert BuildDirector.construct_text_extract_pipeline({'remove_face': 'true'}, 'idcard') is pipeline
+    assert BuildDirector.construct_text_extract_pipeline({'color': 'green'}, 'idcard') is not pipeline
+    assert BuildDirector.stats() == {'hit': 1, 'miss': 2, 'pipelines': 2, 'keys': 2}
+
+
+def test_distinct():
+    """
+    Test to see if combinations that result in the same techniques share a pipeline.
+    """
+    pipeline = BuildDirector.construct_text_extract_pipeline({}, 'idcard')
+    assert BuildDirector.construct_text_extract_pipeline({}, 'idbook') is pipeline
+    assert BuildDirector.construct_text_extract_pipeline({'blur_method': 'gaussian'}, 'idcard') is pipeline
+    assert BuildDirector.stats()['pipelines'] == 1
+    assert BuildDirector.stats()['keys'] == 3
+
+
+def test_detection_mode():
+    """
+    Test to see if a pipeline is built again when the face detection mode changes.
+    """
+    mode = get_detection_mode()
+    pipeline = BuildDirector.construct_text_extract_pipeline({}, 'idcard')
+    set_detection_mode(512)
+    try:
+        other = BuildDirector.construct_text_extract_pipeline({}, 'idcard')
+        assert other is not pipeline
+        assert other.face_detector.max_side == 512
+    finally:
+        set_detection_mode(*mode)
+
+
+def test_frozen():
+    """
+    Test to see if the managers of a built pipeline can not be replaced.
+    """
+    pipeline = BuildDirector.construct_text_extract_pipeline({}, 'idcard')
+    with pytest.raises(AttributeError):
+        pipeline.blur_manager = None
+
+
+def test_invalid_preferences():
+    """
+    Test to see if pipelines with invalid techniques are not kept.
+    """
+    with pytest.raises(NameError):
+        BuildDirector.construct_text_extract_pipeline({'threshold_method': 'binary'}, 'idcard')
+    for index in range(300):
+        with pytest.raises(NameError):
+            BuildDirector.construct_text_extract_pipeline({'color': 'purple%d' % index}, 'idcard')
+    with pytest.raises(NameError):
+        BuildDirector.construct_text_extract_pipeline({'blur_method': 'bilateral'}, 'idcard')
+    with pytest.raises(TypeError):
+        BuildDirector.construct_text_extract_pipeline({'color': ['red']}, 'idcard')
+    with pytest.raises(TypeError):
+        BuildDirector.construct_text_extract_pipeline({}, ['idcard'])
+    assert BuildDirector.stats()['pipelines'] == 0
+    assert BuildDirector.stats()['keys'] == 0
+
+
+def test_bounded(monkeypatch):
+    """
+    Test to see if the least recently used pipelines are discarded once too many combinations are kept.
+    """
+    monkeypatch.setattr(build_director, 'PIPELINE_CACHE_MAX_KEYS', 2)
+    first = BuildDirector.construct_text_extract_pipeline({'color': 'red'}, 'idcard')
+    BuildDirector.construct_text_extract_pipeline({'color': 'green'}, 'idcard')
+    assert BuildDirector.construct_text_extract_pipeline({'color': 'red'}, 'idcard') is first
+    BuildDirector.construct_text_extract_pipeline({'color': 'blue'}, 'idcard')
+    assert BuildDirector.stats() == {'hit': 1, 'miss': 3, 'pipelines': 2, 'keys': 2}
+    assert BuildDirector.construct_text_extract_pipeline({'color': 'red'}, 'idcard') is first
+    BuildDirector.construct_text_extract_pipeline({'color': 'green'}, 'idcard')
+    assert BuildDirector.stats()['miss'] == 4
+
+
+def test_warm_up():
+    """
+    Test to see if the pipelines of the default ID types are built ahead of time.
+    """
+    BuildDirector.warm_up()
+    assert BuildDirector.stats()['keys'] == len(PIPELINE_DEFAULT_ID_TYPES)
+    BuildDirector.construct_text_extract_pipeline({}, 'studentcard')
+    assert BuildDirector.stats()['hit'] == 1
+
+
+def test_concurrent():
+    """
+    Test to see if threads that request the same pipeline at the same time receive the same pipeline.
+    """
+    with ThreadPoolExecutor(8) as executor:
+        pipelines = list(executor.map(
+            lambda index: BuildDirector.construct_text_extract_pipeline({}, 'idcard'), range(32)
+        ))
+    assert all(pipeline is pipelines[0] for pipeline in pipelines)
+    assert BuildDirector.stats()['pipelines'] == 1
@@ -8,6 +8,7 @@ Unit tests for the Color Manager
 import pytest
 import cv2
 import os
+import numpy as np
 from hutts_verification.image_preprocessing.color_manager import ColorManager
 
 TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
@@ -220,3 +221,31 @@ def test_color_manager_apply_extract_11():
     manager = ColorManager("topHat", "blue", (1, 3, 4, 5))
     with pytest.raises(ValueError):
         manager.apply(test_image_colour)
+
+
+def test_gray_weights():
+    """
+    Test to see if converting an image with an extracted color to grayscale is a weighted sum of its channels
+    """
+    for channel in ("green", "blue", "red", "red_blue", "green_blue", "green_red"):
+        manager = ColorManager("extract", channel)
+        weights = np.array([manager.gray_weights()])
+        expected = cv2.cvtColor(manager.apply(thanks_obama), cv2.COLOR_BGR2GRAY)
+        assert np.abs(cv2.transform(thanks_obama, weights).astype(int) - expected).max() <= 1
+    assert ColorManager("histogram").gray_weights() is None
+    assert ColorManager("extract", "purple").gray_weights() is None
+
+
+def test_apply_dst():
+    """
+    Test apply function writing the extracted channels and morphology to a given image
+    """
+    (B, G, R) = cv2.split(thanks_obama)
+    zeros = np.zeros(thanks_obama.shape[:2], dtype="uint8")
+    dst = np.empty_like(thanks_obama)
+    assert ColorManager("extract", "green").apply(thanks_obama, dst) is dst
+    assert np.array_equal(dst, cv2.merge([B, zeros, R]))
+    assert ColorManager("extract", "green_blue").apply(thanks_obama, dst) is dst
+    assert np.array_equal(dst, cv2.merge([zeros, zeros, R]))
+    manager = ColorManager("blackHat", kernel_size=(13, 7))
+    assert np.array_equal(manager.apply(thanks_obama, dst), manager.apply(thanks_obama))
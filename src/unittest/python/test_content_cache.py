@@ -0,0 +1,198 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the content cache module.
+----------------------------------------------------------------------
+"""
+
+import os
+import numpy as np
+import pytest
+from hutts_verification.utils import content_cache
+from hutts_verification.utils.content_cache import ContentCache, content_hash
+from hutts_verification.utils.metrics import cache_lookups
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Replaces the clock of the content cache module with one that only moves when told to.
+    """
+    now = [1000.0]
+
+    class Clock:
+        @staticmethod
+        def time():
+            return now[0]
+
+        @staticmethod
+        def advance(seconds):
+            now[0] += seconds
+
+    monkeypatch.setattr(content_cache, 'time', Clock)
+    return Clock
+
+
+def test_content_hash():
+    """
+    Test to see if the hash depends on the pixels, shape and salt of an image rather than its identity.
+    """
+    image = np.arange(48, dtype='uint8').reshape((4, 4, 3))
+    assert content_hash(image) == content_hash(image.copy())
+    assert content_hash(image) == content_hash(np.asfortranarray(image))
+    assert content_hash(image) != content_hash(image.reshape((4, 12)))
+    assert content_hash(image) != content_hash(image, 'model')
+    changed = image.copy()
+    changed[0, 0, 0] = 1
+    assert content_hash(image) != content_hash(changed)
+
+
+def test_content_hash_type():
+    """
+    Test to see if a TypeError is raised for images that are not numpy arrays.
+    """
+    with pytest.raises(TypeError):
+        content_hash([1, 2, 3])
+
+
+def test_constructor_types():
+    """
+    Test to see if invalid bounds are rejected.
+    """
+    with pytest.raises(TypeError):
+        ContentCache('test', max_entries='10')
+    with pytest.raises(ValueError):
+        ContentCache('test', max_entries=-1)
+
+
+def test_get_put():
+    """
+    Test to see if stored values are returned as read-only arrays.
+    """
+    cache = ContentCache('test')
+    assert cache.get('a') is None
+    stored = cache.put('a', [1.0, 2.0])
+    assert cache.get('a') is stored
+    assert not stored.flags.writeable
+    with pytest.raises(TypeError):
+        cache.put('b', np.array(['text']))
+
+
+def test_least_recently_used_eviction():
+    """
+    Test to see if the least recently used value is evicted when the cache is full.
+    """
+    cache = ContentCache('test', max_entries=2)
+    cache.put('a', [1])
+    cache.put('b', [2])
+    cache.get('a')
+    cache.put('c', [3])
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+def test_time_to_live(clock):
+    """
+    Test to see if values expire after the time to live.
+    """
+    cache = ContentCache('test', ttl=10)
+    cache.put('a', [1])
+    clock.advance(5)
+    assert cache.get('a') is not None
+    clock.advance(6)
+    assert cache.get('a') is None
+
+
+def test_stats():
+    """
+    Test to see if the hit rate and lookup metrics are recorded.
+    """
+    cache = ContentCache('test_stats')
+    cache.get('a')
+    cache.put('a', [1])
+    cache.get('a')
+    cache.get('a')
+    stats = cache.stats()
+    assert (stats['memory_hit'], stats['disk_hit'], stats['miss'], stats['entries']) == (2, 0, 1, 1)
+    assert stats['hit_rate'] == pytest.approx(2 / 3)
+    assert cache_lookups.labels('test_stats', 'memory_hit').get() == 2
+    assert cache_lookups.labels('test_stats', 'miss').get() == 1
+
+
+def test_disk_store(tmpdir):
+    """
+    Test to see if values stored on disk are found by another cache using the same directory.
+    """
+    directory = str(tmpdir.join('cache'))
+    ContentCache('test', directory=directory).put('a', [1.5, 2.5])
+    cache = ContentCache('test', directory=directory)
+    assert np.array_equal(cache.get('a'), [1.5, 2.5])
+    assert cache.stats()['disk_hit'] == 1
+    assert cache.get('a') is not None
+    assert cache.stats()['memory_hit'] == 1
+
+
+def test_disk_store_time_to_live(tmpdir, clock):
+    """
+    Test to see if expired values are removed from disk.
+    """
+    directory = str(tmpdir)
+    ContentCache('test', directory=directory).put('a', [1])
+    os.utime(os.path.join(directory, 'a.npy'), (900.0, 900.0))
+    assert ContentCache('test', directory=directory, ttl=50).get('a') is None
+    assert not os.path.exists(os.path.join(directory, 'a.npy'))
+
+
+def test_disk_store_eviction(tmpdir):
+    """
+    Test to see if the oldest values are evicted from disk when the disk store is full.
+    """
+    directory = str(tmpdir)
+    cache = ContentCache('test', max_entries=0, directory=directory, max_disk_entries=10)
+    for index in range(11):
+        cache.put('key%02d' % index, [index])
+        os.utime(os.path.join(directory, 'key%02d.npy' % index), (index, index))
+    remaining = sorted(os.listdir(directory))
+    assert len(remaining) <= 10
+    assert 'key10.npy' in remaining
+    assert 'key00.npy' not in remaining
+
+
+def test_disk_store_unreadable(tmpdir):
+    """
+    Test to see if unreadable values on disk are treated as missing and removed.
+    """
+    directory = str(tmpdir)
+    with open(os.path.join(directory, 'a.npy'), 'w') as broken_file:
+        broken_file.write('not an array')
+    cache = ContentCache('test', directory=directory)
+    assert cache.get('a') is None
+    assert not os.path.exists(os.path.join(directory, 'a.npy'))
+
+
+def test_clear(tmpdir):
+    """
+    Test to see if clearing the cache discards the values in memory and on disk.
+    """
+    cache = ContentCache('test', directory=str(tmpdir))
+    cache.put('a', [1])
+    cache.clear()
+    assert cache.get('a') is None
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_scrub(tmpdir):
+    """
+    Test to see if a scrubbing cache overwrites the values on disk before removing them.
+    """
+    directory = str(tmpdir.join('cache'))
+    cache = ContentCache('test', directory=directory, scrub=True)
+    cache.put('a', np.full(16, 7, dtype='uint8'))
+    # A second link to the file keeps its contents readable after it has been removed.
+    os.link(os.path.join(directory, 'a.npy'), str(tmpdir.join('a.npy')))
+    cache.clear()
+    assert not os.path.exists(os.path.join(directory, 'a.npy'))
+    with open(str(tmpdir.join('a.npy')), 'rb') as scrubbed_file:
+        assert not any(scrubbed_file.read())
@@ -0,0 +1,177 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the debug sink module.
+All the images used are from public domain and are copyright free
+----------------------------------------------------------------------
+"""
+
+import os
+import threading
+import cv2
+import numpy as np
+import pytest
+from flask import Flask, jsonify
+from hutts_verification.image_preprocessing.build_director import BuildDirector
+from hutts_verification.utils import debug_sink
+from hutts_verification.utils.debug_sink import DEBUG_ID_HEADER, AsyncSink, DebugSink, DirectorySink, MemorySink, \
+    create_debug_sink, debug_image, debug_images, debugging, request_debug_id, set_debug_sink
+
+TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
+    base_path=os.path.abspath(os.path.dirname(__file__)))
+
+image = cv2.imread(TEMPLATE_DIR + 'obama.jpg')
+
+
+@pytest.fixture
+def memory_sink():
+    """
+    Records the debug images in memory for the duration of a test.
+    """
+    sink = MemorySink(16)
+    set_debug_sink(sink)
+    yield sink
+    set_debug_sink(DebugSink())
+
+
+def test_set_debug_sink_type():
+    """
+    Test to see if a TypeError is raised when the debug sink is not a DebugSink.
+    """
+    with pytest.raises(TypeError):
+        set_debug_sink('directory')
+
+
+def test_create_debug_sink():
+    """
+    Test to see if the kinds of debug sink are created, and a ValueError is raised for invalid arguments.
+    """
+    assert not create_debug_sink('null').enabled
+    assert isinstance(create_debug_sink('memory', capacity=4), MemorySink)
+    sink = create_debug_sink('memory', asynchronous=True)
+    assert isinstance(sink, AsyncSink) and sink.enabled
+    sink.close()
+    with pytest.raises(ValueError):
+        create_debug_sink('directory')
+    with pytest.raises(ValueError):
+        create_debug_sink('desktop')
+
+
+def test_null_sink():
+    """
+    Test to see if images are discarded by default.
+    """
+    assert not debug_sink.get_debug_sink().enabled
+    with debugging('abc'):
+        assert not debug_sink.debug_enabled()
+        debug_image('1_edges', image)
+
+
+def test_directory_sink(tmpdir):
+    """
+    Test to see if the images of every request are written to a directory of their own.
+    """
+    set_debug_sink(DirectorySink(str(tmpdir)))
+    try:
+        with debugging('abc'):
+            debug_image('1_edges', image)
+        debug_image('2_contours', image)
+    finally:
+        set_debug_sink(DebugSink())
+    assert os.listdir(str(tmpdir.join('abc'))) == ['1_edges.png']
+    assert np.array_equal(cv2.imread(str(tmpdir.join('abc', '1_edges.png'))), image)
+
+
+def test_memory_sink():
+    """
+    Test to see if a memory sink keeps the most recently recorded images only.
+    """
+    sink = MemorySink(2)
+    sink.record('abc', '1_edges', image)
+    sink.record('abc', '2_contours', image[:10])
+    sink.record('def', '1_edges', image[:20])
+    assert sink.debug_ids() == ['abc', 'def']
+    assert sink.names('abc') == ['2_contours']
+    assert sink.get('abc', '1_edges') is None
+    png = np.frombuffer(sink.get('def', '1_edges'), dtype=np.uint8)
+    assert np.array_equal(cv2.imdecode(png, cv2.IMREAD_COLOR), image[:20])
+
+
+def test_async_sink():
+    """
+    Test to see if an asynchronous sink records copies of the images, and drops images when it falls behind.
+    """
+    (started, release) = (threading.Event(), threading.Event())
+    memory_sink = MemorySink(16)
+
+    class SlowSink(DebugSink):
+        enabled = True
+
+        def record(self, debug_id, name, recorded):
+            started.set()
+            release.wait()
+            memory_sink.record(debug_id, name, recorded)
+
+    sink = AsyncSink(SlowSink(), queue_size=1)
+    buffer = image.copy()
+    sink.record('abc', '1_edges', buffer)
+    buffer[:] = 0
+    assert started.wait(5)
+    sink.record('abc', '2_contours', buffer)
+    sink.record('abc', '3_perspective', buffer)
+    assert sink.dropped == 1
+    release.set()
+    sink.flush()
+    assert memory_sink.names('abc') == ['1_edges', '2_contours']
+    png = np.frombuffer(memory_sink.get('abc', '1_edges'), dtype=np.uint8)
+    assert np.array_equal(cv2.imdecode(png, cv2.IMREAD_COLOR), image)
+    sink.close()
+
+
+def test_record_failure(memory_sink, monkeypatch):
+    """
+    Test to see if a failure to record an image does not fail the request.
+    """
+    monkeypatch.setattr(memory_sink, 'record', lambda *args: 1 / 0)
+    with debugging('abc'):
+        debug_image('1_edges', image)
+
+
+def test_pipeline(memory_sink):
+    """
+    Test to see if the text extraction pipeline hands its intermediate images to the debug sink.
+    """
+    pipeline = BuildDirector.construct_text_extract_pipeline({}, 'idcard')
+    expected = pipeline.process_text_extraction(False, image)
+    assert np.array_equal(pipeline.process_text_extraction(True, image), expected)
+    assert memory_sink.debug_ids() == []
+    with debugging('abc'):
+        pipeline.process_text_extraction(True, image)
+    assert memory_sink.names('abc') == ['5_blurred', '6_color', '7_gray', '8_thresholded']
+
+
+def test_endpoints(memory_sink):
+    """
+    Test to see if the debug ID of a request is returned in its header and its images are served.
+    """
+    app = Flask(__name__)
+    app.register_blueprint(debug_images)
+
+    @app.route('/record', methods=['POST'])
+    def record():
+        with debugging(request_debug_id(True)):
+            debug_image('1_edges', image)
+        return jsonify({})
+
+    client = app.test_client()
+    debug_id = client.post('/record').headers[DEBUG_ID_HEADER]
+    assert client.get('/debugImages').get_json() == {'debug_ids': [debug_id]}
+    assert client.get('/debugImages/%s' % debug_id).get_json() == {'names': ['1_edges']}
+    response = client.get('/debugImages/%s/1_edges' % debug_id)
+    assert response.mimetype == 'image/png'
+    assert np.array_equal(cv2.imdecode(np.frombuffer(response.data, dtype=np.uint8), cv2.IMREAD_COLOR), image)
+    assert client.get('/debugImages/%s/2_contours' % debug_id).status_code == 404
+    set_debug_sink(DebugSink())
+    assert DEBUG_ID_HEADER not in client.post('/record').headers
+    assert client.get('/debugImages').status_code == 404
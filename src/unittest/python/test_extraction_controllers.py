@@ -0,0 +1,160 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the extraction controllers.
+----------------------------------------------------------------------
+"""
+
+import json
+import threading
+import pytest
+from flask import Flask
+from hutts_verification.utils import stage_pools
+from hutts_verification.utils.stage_pools import STAGE_POOL_TIMEOUT_HEADER, STAGE_TEXT
+from hutts_verification.image_processing.controllers import extract, extract_batch_item, \
+    text_extraction_preferences, BATCH_MAX_SIZE
+
+
+@pytest.fixture(scope='module')
+def client():
+    """
+    Creates a test client for an application with the extraction blueprint registered.
+    """
+    app = Flask(__name__)
+    app.register_blueprint(extract)
+    return app.test_client()
+
+
+def test_text_extraction_preferences():
+    """
+    Test to see if the techniques are correctly grabbed from the data of a request.
+    """
+    assert text_extraction_preferences({
+        'blur_technique': 'median',
+        'threshold_technique': 'adaptive',
+        'id_type': 'idcard',
+        'useIO': 'true',
+        'names': 'John'
+    }) == {
+        'blur_method': 'median',
+        'threshold_method': 'adaptive',
+        'id_type': 'idcard',
+        'useIO': True
+    }
+
+
+def test_text_extraction_preferences_default():
+    """
+    Test to see if images are not written to disk unless requested.
+    """
+    assert text_extraction_preferences({}) == {'useIO': False}
+
+
+def test_extract_batch_item_no_image():
+    """
+    Test to see if an error is reported for a batch item without an image or URL.
+    """
+    result = extract_batch_item(3, {}, {'useIO': False})
+    assert result['index'] == 3
+    assert not result['success']
+    assert 'error' in result
+
+
+def test_extract_batch_item_invalid_item():
+    """
+    Test to see if an error is reported for a batch item that is not an object.
+    """
+    result = extract_batch_item(0, 'data:image/jpeg;base64,', {'useIO': False})
+    assert not result['success']
+
+
+def test_extract_batch_no_images(client):
+    """
+    Test to see if a batch request without images is rejected.
+    """
+    response = client.post('/extractBatch', json={})
+    assert response.status_code == 400
+    assert not response.get_json()['success']
+
+
+def test_extract_batch_too_many_images(client):
+    """
+    Test to see if a batch request with too many images is rejected.
+    """
+    response = client.post('/extractBatch', json={'images': [{}] * (BATCH_MAX_SIZE + 1)})
+    assert response.status_code == 400
+
+
+def test_extract_batch_errors_in_order(client):
+    """
+    Test to see if the results of a batch request are returned in order along with the errors of every item.
+    """
+    response = client.post('/extractBatch', json={'images': [{}, 'invalid', {}]})
+    data = response.get_json()
+    assert data['success']
+    assert [result['index'] for result in data['results']] == [0, 1, 2]
+    assert not any(result['success'] for result in data['results'])
+
+
+def test_extract_batch_stream(client):
+    """
+    Test to see if the results of a batch request are streamed as NDJSON.
+    """
+    response = client.post('/extractBatch', json={'images': [{}, {}], 'stream': 'true'})
+    assert response.mimetype == 'application/x-ndjson'
+    results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(result['index'] for result in results) == [0, 1]
+
+
+@pytest.fixture
+def busy_text_pool():
+    """
+    Replaces the text stage pool with a pool of a single worker that admits a single waiting stage, and keeps its
+    worker busy until the returned event is set.
+    """
+    release = threading.Event()
+    stage_pools.configure_stage_pools(1, 1, 1, 5)
+    stage_pools.get_stage_pool(STAGE_TEXT).submit(release.wait)
+    yield release
+    release.set()
+    stage_pools.configure_stage_pools()
+
+
+def test_extract_batch_overloaded(client, busy_text_pool):
+    """
+    Test to see if the images of a batch that the text stage pool can not admit are reported as errors, and a
+    batch of which no image can be admitted is rejected as a whole.
+    """
+    stage_pools.get_stage_pool(STAGE_TEXT).submit(busy_text_pool.wait)
+    response = client.post('/extractBatch', json={'images': [{}, {}]})
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+
+def test_extract_batch_partially_admitted(client, busy_text_pool):
+    """
+    Test to see if the images of a batch that the text stage pool can not admit are reported as errors, while the
+    other images are processed.
+    """
+    threading.Timer(0.2, busy_text_pool.set).start()
+    response = client.post('/extractBatch', json={'images': [{}, {}]})
+    results = response.get_json()['results']
+    assert results[0]['error'] == 'No image or URL provided.'
+    assert 'full' in results[1]['error']
+
+
+@pytest.mark.parametrize('stream', ['false', 'true'])
+def test_extract_batch_deadline(client, busy_text_pool, stream):
+    """
+    Test to see if the images of a batch that are not processed before the deadline of the request are reported
+    as errors.
+    """
+    response = client.post('/extractBatch', json={'images': [{}], 'stream': stream},
+                           headers={STAGE_POOL_TIMEOUT_HEADER: '0.1'})
+    if stream == 'true':
+        results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    else:
+        results = response.get_json()['results']
+    assert [result['index'] for result in results] == [0]
+    assert 'deadline' in results[0]['error']
@@ -0,0 +1,235 @@
+"""
+----------------------------------------------------------------------
+Authors: Stephan Nell
+----------------------------------------------------------------------
+Unit tests for the face analysis module.
+----------------------------------------------------------------------
+"""
+
+import os
+import threading
+import cv2
+import dlib
+import numpy as np
+import pytest
+from hutts_verification.image_preprocessing import face_analysis
+from hutts_verification.image_preprocessing.face_analysis import FaceAnalysis, analysing, transform_rectangle
+from hutts_verification.image_preprocessing.face_manager import FaceDetector
+from hutts_verification.utils.metrics import face_detections
+from hutts_verification.utils.model_registry import SHAPE_PREDICTOR_PATH, FACE_RECOGNITION_PATH
+from hutts_verification.verification.face_verify import FaceVerify
+
+TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
+    base_path=os.path.abspath(os.path.dirname(__file__)))
+
+thanks_obama = cv2.imread(TEMPLATE_DIR + "obama.jpg")
+
+# Soap Joe official example for Fraud Detection for South African ID books
+soap_joe = cv2.imread(TEMPLATE_DIR + "soapJoeExample.jpg")
+
+
+class CountingDetector:
+    """
+    A stand-in for the face detector that counts how often it is run.
+    """
+    def __init__(self, rectangle=dlib.rectangle(10, 20, 50, 60)):
+        self.rectangle = rectangle
+        self.calls = 0
+
+    def __call__(self, image):
+        self.calls += 1
+        return self.rectangle
+
+
+def test_transform_rectangle_affine():
+    """
+    Test to see if a rectangle keeps its centre and is scaled by an affine matrix.
+    """
+    matrix = np.array([[2.0, 0.0, 5.0], [0.0, 2.0, -5.0]])
+    rectangle = transform_rectangle(dlib.rectangle(10, 20, 50, 60), matrix)
+    assert (rectangle.center().x, rectangle.center().y) == (65, 75)
+    assert rectangle.width() == pytest.approx(82, abs=1)
+
+
+def test_transform_rectangle_perspective():
+    """
+    Test to see if an identity perspective matrix leaves a rectangle unchanged.
+    """
+    assert transform_rectangle(dlib.rectangle(10, 20, 50, 60), np.eye(3)) == dlib.rectangle(10, 20, 50, 60)
+
+
+def test_detection_memoised():
+    """
+    Test to see if an image is only passed through the detector once.
+    """
+    analysis = FaceAnalysis()
+    detector = CountingDetector()
+    image = np.zeros((100, 100, 3), dtype='uint8')
+    assert analysis.detection(image, detector) == detector.rectangle
+    assert analysis.detection(image, detector) == detector.rectangle
+    assert detector.calls == 1
+
+
+def test_detection_distinguishes_images():
+    """
+    Test to see if equal images and views on the same image are not mistaken for each other.
+    """
+    analysis = FaceAnalysis()
+    detector = CountingDetector()
+    image = np.zeros((100, 100, 3), dtype='uint8')
+    analysis.detection(image, detector)
+    analysis.detection(image.copy(), detector)
+    analysis.detection(image[10:], detector)
+    assert detector.calls == 3
+
+
+def test_detection_derived():
+    """
+    Test to see if the detection of a derived image is mapped from the detection of its source image.
+    """
+    analysis = FaceAnalysis()
+    detector = CountingDetector()
+    source = np.zeros((100, 100, 3), dtype='uint8')
+    derived = source[10:, 10:].copy()
+    matrix = np.array([[1.0, 0.0, -10.0], [0.0, 1.0, -10.0], [0.0, 0.0, 1.0]])
+    analysis.derive(derived, source, matrix)
+    assert analysis.detection(derived, detector) == dlib.rectangle(0, 10, 40, 50)
+    assert analysis.detection(source, detector) == detector.rectangle
+    assert detector.calls == 1
+
+
+def test_detection_not_found():
+    """
+    Test to see if an image without a face is not passed through the detector again.
+    """
+    analysis = FaceAnalysis()
+    detector = CountingDetector(None)
+    source = np.zeros((100, 100, 3), dtype='uint8')
+    derived = source.copy()
+    analysis.derive(derived, source, np.eye(3))
+    assert analysis.detection(source, detector) is None
+    assert analysis.detection(derived, detector) is None
+    assert detector.calls == 1
+
+
+def test_detection_concurrent():
+    """
+    Test to see if threads asking for the same detection at the same time only run the detector once.
+    """
+    analysis = FaceAnalysis()
+    image = np.zeros((100, 100, 3), dtype='uint8')
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_detector(detected_image):
+        calls.append(detected_image)
+        started.set()
+        release.wait(5)
+        return dlib.rectangle(1, 2, 3, 4)
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(analysis.detection(image, slow_detector)))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=lambda: results.append(analysis.detection(image, slow_detector)))
+    second.start()
+    release.set()
+    first.join()
+    second.join()
+    assert len(calls) == 1
+    assert results == [dlib.rectangle(1, 2, 3, 4)] * 2
+
+
+def test_detection_error():
+    """
+    Test to see if an error raised by the detector is raised for every caller.
+    """
+    analysis = FaceAnalysis()
+    image = np.zeros((100, 100, 3), dtype='uint8')
+
+    def broken_detector(detected_image):
+        raise RuntimeError('broken')
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            analysis.detection(image, broken_detector)
+
+
+def test_alignment():
+    """
+    Test to see if aligned faces are reused and the location of their face is recorded.
+    """
+    analysis = FaceAnalysis()
+    image = np.zeros((100, 100, 3), dtype='uint8')
+    face = np.zeros((256, 256, 3), dtype='uint8')
+    calls = []
+
+    def align(aligned_image):
+        calls.append(aligned_image)
+        return face, dlib.rectangle(30, 30, 220, 220)
+
+    assert analysis.alignment(image, align) is face
+    assert analysis.alignment(image, align) is face
+    assert len(calls) == 1
+    assert analysis.face_rectangle(face) == dlib.rectangle(30, 30, 220, 220)
+    assert analysis.face_rectangle(face.copy()) is None
+
+
+def test_analysing():
+    """
+    Test to see if a face analysis is only active within its context.
+    """
+    assert face_analysis.current_analysis() is None
+    analysis = FaceAnalysis()
+    with analysing(analysis) as active:
+        assert active is analysis
+        assert face_analysis.current_analysis() is analysis
+        with analysing(None):
+            assert face_analysis.current_analysis() is None
+        assert face_analysis.current_analysis() is analysis
+    assert face_analysis.current_analysis() is None
+
+
+def test_face_detector_shares_detection():
+    """
+    Test to see if blurring and extracting the face of the same image only detects the face once.
+    """
+    face_detector = FaceDetector(SHAPE_PREDICTOR_PATH)
+    image = thanks_obama.copy()
+    hits = face_detections.labels('hit').get()
+    with analysing(FaceAnalysis()):
+        first_face = face_detector.extract_face(image)
+        second_face = face_detector.extract_face(image)
+        face_detector.blur_face(image)
+    assert face_detections.labels('hit').get() == hits + 1
+    assert second_face is first_face
+    assert first_face.shape == (256, 256, 3)
+
+
+def test_face_detector_unchanged():
+    """
+    Test to see if the aligned face is the same with and without a face analysis.
+    """
+    face_detector = FaceDetector(SHAPE_PREDICTOR_PATH)
+    with analysing(FaceAnalysis()):
+        face = face_detector.extract_face(thanks_obama)
+    assert np.array_equal(face, face_detector.extract_face(thanks_obama))
+
+
+def test_face_verify_reuses_alignment():
+    """
+    Test to see if faces aligned during the request are verified without detecting them again.
+    """
+    face_detector = FaceDetector(SHAPE_PREDICTOR_PATH)
+    face_verifier = FaceVerify(SHAPE_PREDICTOR_PATH, FACE_RECOGNITION_PATH)
+    hits = face_detections.labels('hit').get()
+    with analysing(FaceAnalysis()):
+        first_face = face_detector.extract_face(thanks_obama)
+        second_face = face_detector.extract_face(soap_joe)
+        (is_match, percentage_match) = face_verifier.verify(first_face, second_face)
+    assert face_detections.labels('hit').get() == hits + 2
+    assert not is_match
+    (expected_match, expected_percentage) = face_verifier.verify(first_face, second_face)
+    assert is_match == expected_match
+    assert percentage_match == pytest.approx(expected_percentage, abs=10)
@@ -0,0 +1,174 @@
+"""
+----------------------------------------------------------------------
+Authors: Stephan Nell
+----------------------------------------------------------------------
+Unit tests for the Face Index and the face search endpoints.
+All the images used are from public domain and are copyright free
+----------------------------------------------------------------------
+"""
+
+import base64
+import os
+import numpy as np
+import pytest
+from flask import Flask
+from hutts_verification.verification import face_index as face_index_module
+from hutts_verification.verification.controllers import verify
+from hutts_verification.verification.face_index import FaceIndex, FACE_DESCRIPTOR_SIZE, FACE_INDEX_IDS_FILE, \
+    FACE_INDEX_DESCRIPTORS_FILE
+from hutts_verification.verification.face_verify import match_percentage
+
+TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
+    base_path=os.path.abspath(os.path.dirname(__file__)))
+
+
+def random_descriptors(count, seed=0):
+    """
+    Creates random descriptors of unit length, like those of dlib.
+    """
+    descriptors = np.random.RandomState(seed).normal(size=(count, FACE_DESCRIPTOR_SIZE)).astype('float32')
+    return descriptors / np.linalg.norm(descriptors, axis=1, keepdims=True)
+
+
+def encode(file_name):
+    """
+    Encodes a template image as a base64 data URI.
+    """
+    with open(TEMPLATE_DIR + file_name, 'rb') as image_file:
+        return 'data:image/jpg;base64,' + base64.b64encode(image_file.read()).decode('ascii')
+
+
+@pytest.fixture
+def client():
+    """
+    Creates a test client for an application with the verification blueprint registered and an empty face index.
+    """
+    previous_index = face_index_module.get_face_index()
+    face_index_module.set_face_index(FaceIndex())
+    app = Flask(__name__)
+    app.register_blueprint(verify)
+    yield app.test_client()
+    face_index_module.set_face_index(previous_index)
+
+
+def test_search_empty():
+    """
+    Test to see if searching an empty index returns no faces.
+    """
+    assert FaceIndex().search(random_descriptors(1)[0]) == []
+
+
+def test_search_exact():
+    """
+    Test to see if the closest faces are returned in order with the same percentage as verify.
+    """
+    descriptors = random_descriptors(100)
+    face_index = FaceIndex()
+    for (index, descriptor) in enumerate(descriptors):
+        assert face_index.enroll('person%d' % index, descriptor) == index + 1
+    query = descriptors[42] + 0.01
+    matches = face_index.search(query, top_k=3)
+    assert [match['id'] for match in matches][0] == 'person42'
+    distances = np.linalg.norm(descriptors - query, axis=1)
+    assert [match['distance'] for match in matches] == pytest.approx(sorted(distances)[:3], abs=1e-5)
+    (is_match, percentage_match) = match_percentage(matches[0]['distance'])
+    assert (matches[0]['is_match'], matches[0]['face_match']) == (is_match, percentage_match)
+    assert len(face_index.search(query, top_k=1000)) == 100
+
+
+def test_enroll_invalid():
+    """
+    Test to see if invalid enrollments are rejected.
+    """
+    face_index = FaceIndex()
+    with pytest.raises(TypeError):
+        face_index.enroll(1, random_descriptors(1)[0])
+    with pytest.raises(ValueError):
+        face_index.enroll('a\nb', random_descriptors(1)[0])
+    with pytest.raises(ValueError):
+        face_index.enroll('a', [0.0] * 3)
+    with pytest.raises(ValueError):
+        face_index.search(random_descriptors(1)[0], top_k=0)
+
+
+def test_search_approximate():
+    """
+    Test to see if an approximate search finds faces close to enrolled faces, including faces enrolled since
+    the descriptors were clustered.
+    """
+    descriptors = random_descriptors(3000)
+    face_index = FaceIndex(approximate_min_size=1000)
+    for (index, descriptor) in enumerate(descriptors[:2000]):
+        face_index.enroll('person%d' % index, descriptor)
+    for index in range(0, 2000, 97):
+        assert face_index.search(descriptors[index] + 0.01, top_k=1)[0]['id'] == 'person%d' % index
+    face_index.enroll('latest', descriptors[2500])
+    assert face_index.search(descriptors[2500], top_k=1)[0]['id'] == 'latest'
+
+
+def test_persistence(tmpdir):
+    """
+    Test to see if enrolled faces are found after loading the index again.
+    """
+    directory = str(tmpdir)
+    descriptors = random_descriptors(10)
+    face_index = FaceIndex.load(directory)
+    for (index, descriptor) in enumerate(descriptors):
+        face_index.enroll('person%d' % index, descriptor)
+    loaded_index = FaceIndex.load(directory)
+    assert len(loaded_index) == 10
+    assert isinstance(loaded_index._mapped, np.memmap)
+    assert loaded_index.search(descriptors[7], top_k=1)[0]['id'] == 'person7'
+    loaded_index.enroll('person10', random_descriptors(1, seed=1)[0])
+    assert len(FaceIndex.load(directory)) == 11
+
+
+def test_persistence_interrupted(tmpdir):
+    """
+    Test to see if an enrollment that was interrupted is discarded when the index is loaded.
+    """
+    directory = str(tmpdir)
+    face_index = FaceIndex.load(directory)
+    face_index.enroll('complete', random_descriptors(1)[0])
+    with open(os.path.join(directory, FACE_INDEX_DESCRIPTORS_FILE), 'ab') as descriptors_file:
+        descriptors_file.write(random_descriptors(1, seed=1)[0].tobytes()[:100])
+    loaded_index = FaceIndex.load(directory)
+    assert len(loaded_index) == 1
+    assert os.path.getsize(os.path.join(directory, FACE_INDEX_DESCRIPTORS_FILE)) == FACE_DESCRIPTOR_SIZE * 4
+    with open(os.path.join(directory, FACE_INDEX_IDS_FILE)) as ids_file:
+        assert ids_file.read() == 'complete\n'
+
+
+def test_set_face_index_type():
+    """
+    Test to see if a TypeError is raised when the face index is not a FaceIndex.
+    """
+    with pytest.raises(TypeError):
+        face_index_module.set_face_index([])
+
+
+def test_enroll_and_search_face(client):
+    """
+    Test to see if an enrolled face is found by searching for the same face.
+    """
+    response = client.post('/enrollFace', json={'id': 'obama', 'face_img': encode('obama.jpg')})
+    assert response.status_code == 200
+    assert response.get_json()['enrolled_faces'] == 1
+    client.post('/enrollFace', json={'id': 'soap_joe', 'face_img': encode('soapJoeExample.jpg')})
+    response = client.post('/searchFace', json={'face_img': encode('obama.jpg'), 'top_k': 2})
+    matches = response.get_json()['matches']
+    assert [match['id'] for match in matches] == ['obama', 'soap_joe']
+    assert matches[0]['is_match']
+    assert not matches[1]['is_match']
+
+
+def test_enroll_face_invalid(client):
+    """
+    Test to see if enrollments without an ID, image or face are rejected.
+    """
+    assert client.post('/enrollFace', json={'face_img': encode('obama.jpg')}).status_code == 400
+    assert client.post('/enrollFace', json={'id': 'nobody'}).status_code == 400
+    response = client.post('/enrollFace', json={'id': 'nobody', 'face_img': encode('temp_flag.jpg')})
+    assert response.status_code == 400
+    assert not response.get_json()['success']
+    assert client.post('/searchFace', json={'face_img': encode('obama.jpg'), 'top_k': 'many'}).status_code == 400
@@ -0,0 +1,115 @@
+"""
+----------------------------------------------------------------------
+Authors: Stephan Nell
+----------------------------------------------------------------------
+Unit tests for the Face Detector
+All the images used are from public domain and are copyright free
+----------------------------------------------------------------------
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import imutils
+import pytest
+from hutts_verification.image_preprocessing import face_manager
+from hutts_verification.image_preprocessing.face_manager import FaceDetector, set_detection_mode, upsample_policy
+from hutts_verification.utils.model_registry import SHAPE_PREDICTOR_PATH
+
+TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
+    base_path=os.path.abspath(os.path.dirname(__file__)))
+
+thanks_obama = cv2.imread(TEMPLATE_DIR + "obama.jpg")
+
+
+@pytest.fixture
+def detection_mode():
+    """
+    Restores the default detection mode after a test.
+    """
+    yield
+    set_detection_mode()
+
+
+def test_detect():
+    """
+    Test to see if a face is detected at full resolution by default.
+    """
+    face_detector = FaceDetector(SHAPE_PREDICTOR_PATH)
+    assert (face_detector.max_side, face_detector.upsample) == (None, 1)
+    assert face_detector.detect(thanks_obama) is not None
+
+
+def test_detect_concurrent():
+    """
+    Test to see if a face detector that is shared by threads finds the same face in every thread.
+    """
+    face_detector = FaceDetector(SHAPE_PREDICTOR_PATH, 640, 0)
+    expected = face_detector.detect(thanks_obama)
+    with ThreadPoolExecutor(4) as executor:
+        rectangles = list(executor.map(lambda _: face_detector.detect(thanks_obama), range(8)))
+    assert all(rectangle == expected for rectangle in rectangles)
+
+
+def test_detect_downscaled():
+    """
+    Test to see if a face detected in a downscaled copy is mapped back to the full resolution.
+    """
+    large_obama = imutils.resize(thanks_obama, width=thanks_obama.shape[1] * 3)
+    expected = FaceDetector(SHAPE_PREDICTOR_PATH, upsample=0).detect(large_obama)
+    rectangle = FaceDetector(SHAPE_PREDICTOR_PATH, 512, 'auto').detect(large_obama)
+    assert rectangle is not None
+    intersection = rectangle.intersect(expected).area()
+    assert intersection / (rectangle.area() + expected.area() - intersection) > 0.6
+
+
+def test_detect_small_image_unchanged():
+    """
+    Test to see if images that fit within the maximum side are detected as before.
+    """
+    expected = FaceDetector(SHAPE_PREDICTOR_PATH).detect(thanks_obama)
+    assert FaceDetector(SHAPE_PREDICTOR_PATH, 1024, 'auto').detect(thanks_obama) == expected
+
+
+def test_detect_no_face():
+    """
+    Test to see if None is returned when the downscaled copy contains no face.
+    """
+    blank = thanks_obama.copy()
+    blank[:] = 255
+    assert FaceDetector(SHAPE_PREDICTOR_PATH, 256).detect(blank) is None
+
+
+def test_invalid_detection_mode():
+    """
+    Test to see if invalid detection modes are rejected.
+    """
+    with pytest.raises(ValueError):
+        FaceDetector(SHAPE_PREDICTOR_PATH, 0)
+    with pytest.raises(ValueError):
+        FaceDetector(SHAPE_PREDICTOR_PATH, 1024, 'sometimes')
+    with pytest.raises(ValueError):
+        set_detection_mode(1024, -1)
+
+
+def test_set_detection_mode(detection_mode):
+    """
+    Test to see if the detection mode is used by face detectors that are not given one.
+    """
+    set_detection_mode(1024, 'auto')
+    face_detector = FaceDetector(SHAPE_PREDICTOR_PATH)
+    assert (face_detector.max_side, face_detector.upsample) == (1024, 'auto')
+    face_detector = FaceDetector(SHAPE_PREDICTOR_PATH, 640)
+    assert (face_detector.max_side, face_detector.upsample) == (640, face_manager.FACE_DETECTION_DEFAULT_UPSAMPLE)
+
+
+def test_upsample_policy():
+    """
+    Test to see if upsample policies are parsed.
+    """
+    assert upsample_policy('auto') == 'auto'
+    assert upsample_policy('2') == 2
+    with pytest.raises(ValueError):
+        upsample_policy('-1')
+    with pytest.raises(ValueError):
+        upsample_policy('twice')
@@ -9,7 +9,10 @@ All the images used are from public domain and are copyright free
 import pytest
 import cv2
 import os
+import numpy as np
+from hutts_verification.verification import face_verify
 from hutts_verification.verification.face_verify import FaceVerify
+from hutts_verification.utils.content_cache import ContentCache
 from hutts_verification.image_preprocessing.blur_manager import BlurManager
 
 # Constants path to trained data for Shape Predictor.
@@ -162,3 +165,78 @@ def test_face_verify_8():
     match, percentage = face_verf.verify(thanks_obama, damaged_obama)
     assert match
     assert percentage > 85
+
+
+def test_face_verify_embedding_cache():
+    """
+    Test to see if the descriptor of a face that was described before is taken from the embedding cache.
+    """
+    previous_cache = face_verify.get_embedding_cache()
+    cache = ContentCache('test_embeddings')
+    face_verify.set_embedding_cache(cache)
+    try:
+        face_verf = FaceVerify(SHAPE_PREDICTOR_PATH, FACE_RECOGNITION_PATH)
+        descriptor = face_verf.describe(thanks_obama)
+        assert descriptor.shape == (128,)
+        assert face_verf.describe(thanks_obama.copy()) is descriptor
+        assert (cache.stats()['memory_hit'], cache.stats()['miss']) == (1, 1)
+        face_verify.set_embedding_cache(None)
+        assert np.allclose(face_verf.describe(thanks_obama), descriptor)
+    finally:
+        face_verify.set_embedding_cache(previous_cache)
+
+
+def test_face_verify_embedding_cache_type():
+    """
+    Test to see if a TypeError is raised when the embedding cache is not a ContentCache.
+    """
+    with pytest.raises(TypeError):
+        face_verify.set_embedding_cache({})
+
+
+def test_match_percentages():
+    """
+    Test to see if the vectorised mapping of distances to percentages agrees with the mapping of a single distance.
+    """
+    match_distances = np.linspace(0, 1.2, 241).reshape((-1, 1))
+    (is_match, percentage_match) = face_verify.match_percentages(match_distances)
+    assert is_match.shape == percentage_match.shape == (241, 1)
+    for (index, match_distance) in enumerate(match_distances[:, 0]):
+        expected = face_verify.match_percentage(match_distance)
+        assert (is_match[index, 0], percentage_match[index, 0]) == pytest.approx(expected)
+
+
+def test_verify_batch():
+    """
+    Test to see if a batch verification agrees with verifying each pair and describes every distinct face once.
+    """
+    previous_cache = face_verify.get_embedding_cache()
+    cache = ContentCache('test_batch_embeddings')
+    face_verify.set_embedding_cache(cache)
+    try:
+        face_verf = FaceVerify(SHAPE_PREDICTOR_PATH, FACE_RECOGNITION_PATH)
+        damaged_obama = BlurManager("median", [7]).apply(thanks_obama.copy())
+        candidates = [thanks_obama, soap_joe, damaged_obama, thanks_obama.copy()]
+        (is_match, percentage_match) = face_verf.verify_batch(thanks_obama, candidates)
+        assert is_match.tolist() == [True, False, True, True]
+        assert cache.stats()['miss'] == 3
+        for (index, candidate) in enumerate(candidates):
+            assert percentage_match[index] == pytest.approx(face_verf.verify(thanks_obama, candidate)[1])
+        (is_match, percentage_match) = face_verf.verify_batch([thanks_obama, soap_joe], candidates)
+        assert is_match.shape == percentage_match.shape == (2, 4)
+        assert is_match[1].tolist() == [False, True, False, False]
+    finally:
+        face_verify.set_embedding_cache(previous_cache)
+
+
+def test_verify_batch_invalid():
+    """
+    Test to see if invalid batches and batches containing an image without a face are rejected.
+    """
+    face_verf = FaceVerify(SHAPE_PREDICTOR_PATH, FACE_RECOGNITION_PATH)
+    with pytest.raises(TypeError):
+        face_verf.verify_batch(thanks_obama, soap_joe)
+    with pytest.raises(TypeError):
+        face_verf.verify_batch('obama', [soap_joe])
+    with pytest.raises(ValueError):
+        face_verf.verify_batch(thanks_obama, [soap_joe, test_image_colour])
@@ -8,6 +8,8 @@ Unit tests for the ID context module.
 
 import pytest
 from hutts_verification.id_contexts.sa_id_card import SAIDCard
+from hutts_verification.id_contexts.sa_id_book import SAIDBook
+from hutts_verification.id_contexts.up_student_card import UPStudentCard
 
 
 def test_get_id_info_ignore_fields():
@@ -88,3 +90,63 @@ def test_get_id_info_invalid_arg_max_multi_line():
     sa_id_card = SAIDCard()
     with pytest.raises(TypeError):
         sa_id_card.get_id_info('good so far...', max_multi_line=['...nevermind'])
+
+
+def test_get_id_info_from_fields_invalid_arg_field_texts():
+    """
+    Test the get_id_info_from_fields function's behaviour when passed an argument that is not a dictionary.
+    """
+    sa_id_card = SAIDCard()
+    with pytest.raises(TypeError):
+        sa_id_card.get_id_info_from_fields('Doe')
+
+
+def test_get_id_info_from_fields_invalid_arg_barcode_data():
+    """
+    Test the get_id_info_from_fields function's behaviour when passed barcode data that is not a dictionary.
+    """
+    sa_id_card = SAIDCard()
+    with pytest.raises(TypeError):
+        sa_id_card.get_id_info_from_fields({}, barcode_data='7101135111011')
+
+
+def test_get_id_info_from_fields_no_regions():
+    """
+    Test the get_id_info_from_fields function's behaviour for an ID context without field regions.
+    """
+    sa_id_book = SAIDBook()
+    assert sa_id_book.get_field_regions() is None
+    with pytest.raises(ValueError):
+        sa_id_book.get_id_info_from_fields({})
+
+
+def test_get_field_regions():
+    """
+    Test to see if the field regions of an ID context with a fixed layout are normalised bounding boxes.
+    """
+    for id_context in [SAIDCard(), UPStudentCard()]:
+        for field_region in id_context.get_field_regions():
+            (left, top, right, bottom) = field_region['region']
+            assert 0 <= left < right <= 1
+            assert 0 <= top < bottom <= 1
+
+
+def test_get_id_info_from_fields_up_card():
+    """
+    Test the extraction of information from the field regions of a UP student card.
+    """
+    up_card = UPStudentCard()
+    assert up_card.get_id_info_from_fields({'title_line': 'Mr  J Doe', 'identity_number': 'u 12345678'}) == {
+        'identity_number': '12345678',
+        'sex': 'M',
+        'names': 'J',
+        'surname': 'Doe'
+    }
+
+
+def test_get_id_info_from_fields_up_card_invalid():
+    """
+    Test to see if None is returned when no valid student number is found in the field regions of a UP student card.
+    """
+    up_card = UPStudentCard()
+    assert up_card.get_id_info_from_fields({'title_line': 'Mr J Doe', 'identity_number': '123'}) is None
@@ -5,11 +5,15 @@ Authors: Stephan Nell
 Unit tests for the Image Handling
 ----------------------------------------------------------------------
 """
+import base64
 import pytest
 import cv2
 import os
 import numpy as np
-from hutts_verification.utils.image_handling import grab_image
+from hutts_verification.image_preprocessing.face_manager import FaceDetector
+from hutts_verification.utils.image_handling import grab_image, encoded_dimensions, reduction_factor, \
+    set_max_dimension, get_max_dimension, IMAGE_DEFAULT_MAX_DIMENSION
+from hutts_verification.utils.model_registry import SHAPE_PREDICTOR_PATH
 
 TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
     base_path=os.path.abspath(os.path.dirname(__file__)))
@@ -70,3 +74,92 @@ def test_grab_image_6():
     with pytest.raises(AttributeError):
         grab_image(stream=test_path_image)
 
+
+def encode(image, extension='.jpg'):
+    """
+    Encodes an image as a base64 data URI.
+    """
+    return 'data:image/jpg;base64,' + base64.b64encode(cv2.imencode(extension, image)[1].tobytes()).decode('ascii')
+
+
+def test_grab_image_string():
+    """
+    Test image handling with a base64 string, with and without a data URI prefix
+    """
+    uri = encode(test_image_colour, '.png')
+    assert np.array_equal(grab_image(string=uri), test_image_colour)
+    assert np.array_equal(grab_image(string=uri.split(',')[1]), test_image_colour)
+
+
+def test_encoded_dimensions():
+    """
+    Test to see if the dimensions of JPEG and PNG images are read from their headers
+    """
+    image = np.zeros((30, 70, 3), dtype='uint8')
+    for extension in ('.jpg', '.png'):
+        buffer = cv2.imencode(extension, image)[1].ravel()
+        assert encoded_dimensions(buffer) == (30, 70)
+    assert encoded_dimensions(cv2.imencode('.bmp', image)[1].ravel()) is None
+    assert encoded_dimensions(np.frombuffer(b'\xff\xd8\xff', dtype='uint8')) is None
+
+
+def test_reduction_factor():
+    """
+    Test to see if images are only scaled down by a factor that keeps their longest side at least the maximum
+    dimension long
+    """
+    assert reduction_factor((3000, 4000), 2048) == 1
+    assert reduction_factor((3000, 4096), 2048) == 2
+    assert reduction_factor((3000, 4000), 1000) == 4
+    assert reduction_factor((3000, 4000), 100) == 8
+    assert reduction_factor((3000, 4000), 0) == 1
+    assert reduction_factor(None, 100) == 1
+
+
+def test_grab_image_reduced():
+    """
+    Test to see if large images are decoded at a reduced size and the scale factor is returned
+    """
+    image = cv2.resize(test_image_colour, (1600, 1200))
+    uri = encode(image)
+    (reduced, scale) = grab_image(string=uri, max_dimension=400, return_scale=True)
+    assert reduced.shape == (300, 400, 3)
+    assert scale == 4
+    (full, scale) = grab_image(string=uri, max_dimension=0, return_scale=True)
+    assert full.shape == image.shape
+    assert scale == 1
+    assert grab_image(string=uri, max_dimension=1000).shape == image.shape
+
+
+def test_grab_image_full_resolution_crops():
+    """
+    Test to see if large images are decoded at full resolution by default, so that the face cropped from them keeps
+    its full resolution, whereas a working resolution would have halved it
+    """
+    large = cv2.resize(obama_skew, (obama_skew.shape[1] * 4200 // max(obama_skew.shape[:2]),
+                                    obama_skew.shape[0] * 4200 // max(obama_skew.shape[:2])),
+                       interpolation=cv2.INTER_CUBIC)
+    uri = encode(large)
+    (image, scale) = grab_image(string=uri, return_scale=True)
+    assert image.shape == large.shape
+    assert scale == 1
+    face_detector = FaceDetector(SHAPE_PREDICTOR_PATH, 800, 0)
+    face = face_detector.detect(image)
+    reduced_face = face_detector.detect(grab_image(string=uri, max_dimension=2048))
+    assert image[face.top():face.bottom(), face.left():face.right()].shape[1] >= 1.9 * reduced_face.width()
+
+
+def test_max_dimension():
+    """
+    Test to see if the maximum dimension of the process is validated and used by default
+    """
+    with pytest.raises(TypeError):
+        set_max_dimension('100')
+    with pytest.raises(ValueError):
+        set_max_dimension(-1)
+    set_max_dimension(400)
+    try:
+        assert get_max_dimension() == 400
+        assert grab_image(string=encode(cv2.resize(test_image_colour, (1600, 1200)))).shape == (300, 400, 3)
+    finally:
+        set_max_dimension(IMAGE_DEFAULT_MAX_DIMENSION)
@@ -0,0 +1,139 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the metrics module.
+----------------------------------------------------------------------
+"""
+
+import threading
+import pytest
+from flask import Flask
+from hutts_verification.utils.metrics import MetricsRegistry, Counter, Gauge, Histogram, metrics, http_requests
+
+
+def test_counter():
+    """
+    Test to see if a counter is rendered in the Prometheus text format.
+    """
+    registry = MetricsRegistry()
+    counter = Counter('test_total', 'A test counter.', ('result',), metrics_registry=registry)
+    counter.labels('hit').inc()
+    counter.labels('hit').inc(2)
+    counter.labels('miss').inc()
+    assert registry.render() == (
+        '# HELP test_total A test counter.\n'
+        '# TYPE test_total counter\n'
+        'test_total{result="hit"} 3\n'
+        'test_total{result="miss"} 1\n'
+    )
+
+
+def test_counter_negative():
+    """
+    Test to see if a ValueError is raised when a counter is decremented.
+    """
+    counter = Counter('test_total', 'A test counter.', metrics_registry=None)
+    with pytest.raises(ValueError):
+        counter.inc(-1)
+
+
+def test_wrong_label_count():
+    """
+    Test to see if a ValueError is raised when the wrong number of label values is given.
+    """
+    counter = Counter('test_total', 'A test counter.', ('result',), metrics_registry=None)
+    with pytest.raises(ValueError):
+        counter.labels('hit', 'extra')
+
+
+def test_duplicate_name():
+    """
+    Test to see if a ValueError is raised when two metrics with the same name are registered.
+    """
+    registry = MetricsRegistry()
+    Counter('test_total', 'A test counter.', metrics_registry=registry)
+    with pytest.raises(ValueError):
+        Gauge('test_total', 'A test gauge.', metrics_registry=registry)
+
+
+def test_gauge():
+    """
+    Test to see if a gauge can go up and down.
+    """
+    gauge = Gauge('test_in_flight', 'A test gauge.', metrics_registry=None)
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.labels().get() == 1
+    gauge.set(5)
+    assert gauge.labels().get() == 5
+
+
+def test_histogram():
+    """
+    Test to see if a histogram is rendered with cumulative buckets, a sum and a count.
+    """
+    registry = MetricsRegistry()
+    histogram = Histogram('test_seconds', 'A test histogram.', buckets=(0.1, 1.0), metrics_registry=registry)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(2)
+    assert registry.render() == (
+        '# HELP test_seconds A test histogram.\n'
+        '# TYPE test_seconds histogram\n'
+        'test_seconds_bucket{le="0.1"} 1\n'
+        'test_seconds_bucket{le="1"} 2\n'
+        'test_seconds_bucket{le="+Inf"} 3\n'
+        'test_seconds_sum 2.55\n'
+        'test_seconds_count 3\n'
+    )
+
+
+def test_label_escaping():
+    """
+    Test to see if label values are escaped.
+    """
+    registry = MetricsRegistry()
+    Counter('test_total', 'A test counter.', ('id_type',), metrics_registry=registry).labels('a"b\\c').inc()
+    assert 'test_total{id_type="a\\"b\\\\c"} 1' in registry.render()
+
+
+def test_counter_concurrent():
+    """
+    Test to see if no increments are lost when a counter is incremented by many threads at the same time.
+    """
+    counter = Counter('test_total', 'A test counter.', metrics_registry=None)
+
+    def increment():
+        for _ in range(10000):
+            counter.inc()
+
+    threads = [threading.Thread(target=increment) for _ in range(8)]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    assert counter.labels().get() == 80000
+
+
+def test_metrics_endpoint():
+    """
+    Test to see if requests are recorded per route and the metrics are served.
+    """
+    app = Flask(__name__)
+    app.register_blueprint(metrics)
+
+    @app.route('/ping')
+    def ping():
+        return 'pong'
+
+    client = app.test_client()
+    before = http_requests.labels('GET', '/ping', '200').get()
+    client.get('/ping')
+    assert http_requests.labels('GET', '/ping', '200').get() == before + 1
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert 'hutts_http_requests_total{method="GET",route="/ping",status="200"}' in body
+    assert 'hutts_http_requests_in_flight 1' in body
+    assert '# TYPE hutts_stage_duration_seconds histogram' in body
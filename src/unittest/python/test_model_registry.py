@@ -0,0 +1,138 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the model registry module.
+----------------------------------------------------------------------
+"""
+
+import pytest
+import threading
+from hutts_verification.utils.model_registry import ModelRegistry
+
+
+def test_get_wrong_param():
+    """
+    Test to see if a TypeError is raised when a non-string name is given.
+    """
+    registry = ModelRegistry()
+    with pytest.raises(TypeError):
+        registry.get(1, object)
+
+
+def test_get_loads_once():
+    """
+    Test to see if a model is only loaded once.
+    """
+    registry = ModelRegistry()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return object()
+
+    model = registry.get('model', loader)
+    assert registry.get('model', loader) is model
+    assert len(calls) == 1
+
+
+def test_get_with_path():
+    """
+    Test to see if the path is passed to the loader and models with different paths are kept apart.
+    """
+    registry = ModelRegistry()
+    assert registry.get('model', lambda path: path, 'a') == 'a'
+    assert registry.get('model', lambda path: path, 'b') == 'b'
+
+
+def test_get_concurrent():
+    """
+    Test to see if a model is only loaded once when requested by many threads at the same time.
+    """
+    registry = ModelRegistry()
+    calls = []
+    models = []
+
+    def loader():
+        calls.append(1)
+        return object()
+
+    threads = [threading.Thread(target=lambda: models.append(registry.get('model', loader))) for _ in range(8)]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    assert len(calls) == 1
+    assert all(model is models[0] for model in models)
+
+
+def test_lock():
+    """
+    Test to see if a usage lock is available for a loaded model.
+    """
+    registry = ModelRegistry()
+    registry.get('model', object)
+    with registry.lock('model'):
+        pass
+
+
+def test_lock_not_loaded():
+    """
+    Test to see if the same usage lock is returned for a model that has not been loaded yet, and after the registry
+    has been cleared.
+    """
+    registry = ModelRegistry()
+    lock = registry.lock('model')
+    registry.get('model', object)
+    assert registry.lock('model') is lock
+    registry.clear()
+    assert registry.lock('model') is lock
+
+
+def test_get_local():
+    """
+    Test to see if every thread loads its own copy of a local model, which is loaded again after clearing the
+    registry.
+    """
+    registry = ModelRegistry()
+    model = registry.get_local('model', object)
+    assert registry.get_local('model', object) is model
+    models = []
+    thread = threading.Thread(target=lambda: models.append(registry.get_local('model', object)))
+    thread.start()
+    thread.join()
+    assert models[0] is not model
+    registry.clear()
+    assert registry.get_local('model', object) is not model
+    with pytest.raises(TypeError):
+        registry.get_local(1, object)
+
+
+def test_stats():
+    """
+    Test to see if load statistics are recorded for loaded models.
+    """
+    registry = ModelRegistry()
+    registry.get('model', object)
+    stats = registry.stats()
+    assert 'model' in stats
+    assert stats['model']['load_time'] >= 0
+    assert stats['model']['file_size'] is None
+
+
+def test_clear():
+    """
+    Test to see if models are reloaded after clearing the registry.
+    """
+    registry = ModelRegistry()
+    model = registry.get('model', object)
+    registry.clear()
+    assert registry.stats() == {}
+    assert registry.get('model', object) is not model
+
+
+def test_shape_predictor_no_path():
+    """
+    Test to see if a ValueError is raised when no trained data is available for the shape predictor.
+    """
+    registry = ModelRegistry()
+    with pytest.raises(ValueError):
+        registry.shape_predictor(None)
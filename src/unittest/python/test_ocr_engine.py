@@ -0,0 +1,130 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the OCR engine module.
+----------------------------------------------------------------------
+"""
+
+import pytest
+import cv2
+import os
+import shlex
+from hutts_verification.id_contexts.sa_id_card import SAIDCard
+from hutts_verification.id_contexts.up_student_card import UPStudentCard
+from hutts_verification.image_processing import ocr_engine
+from hutts_verification.image_processing.sample_extract import TextExtractor
+from hutts_verification.image_processing.ocr_engine import create_ocr_engine, set_ocr_engine, get_ocr_engine
+from hutts_verification.image_processing.ocr_engine import OCREngine, PytesseractOCREngine
+
+TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
+    base_path=os.path.abspath(os.path.dirname(__file__)))
+
+id_card = cv2.imread(TEMPLATE_DIR + "ID.jpg")
+
+
+def test_create_ocr_engine_wrong_name():
+    """
+    Test to see if a NameError is raised when an unknown engine is requested.
+    """
+    with pytest.raises(NameError):
+        create_ocr_engine('magic')
+
+
+def test_create_ocr_engine_pytesseract():
+    """
+    Test to see if the pytesseract engine can be created by name.
+    """
+    assert isinstance(create_ocr_engine('pytesseract'), PytesseractOCREngine)
+
+
+def test_get_ocr_engine():
+    """
+    Test to see if a default engine is available.
+    """
+    assert isinstance(get_ocr_engine(), OCREngine)
+
+
+def test_set_ocr_engine_wrong_param():
+    """
+    Test to see if a TypeError is raised when something other than an OCREngine is set as the default.
+    """
+    with pytest.raises(TypeError):
+        set_ocr_engine('pytesseract')
+
+
+def test_set_ocr_engine():
+    """
+    Test to see if the default engine can be replaced.
+    """
+    previous_engine = get_ocr_engine()
+    engine = PytesseractOCREngine()
+    set_ocr_engine(engine)
+    assert get_ocr_engine() is engine
+    set_ocr_engine(previous_engine)
+
+
+def test_pytesseract_wrong_param():
+    """
+    Test to see if a TypeError is raised when something other than an image is passed.
+    """
+    with pytest.raises(TypeError):
+        PytesseractOCREngine().image_to_string('image')
+
+
+def test_in_memory_image_to_string():
+    """
+    Test to see if the in-memory engine extracts text from an image.
+    """
+    pytest.importorskip('tesserocr')
+    engine = create_ocr_engine('memory')
+    text = engine.image_to_string(cv2.cvtColor(id_card, cv2.COLOR_BGR2GRAY))
+    engine.close()
+    assert 'Identity Number' in text
+
+
+def test_in_memory_whitelist():
+    """
+    Test to see if the in-memory engine only recognises whitelisted characters.
+    """
+    pytest.importorskip('tesserocr')
+    engine = create_ocr_engine('memory')
+    text = engine.image_to_string(id_card, whitelist='0123456789')
+    engine.close()
+    assert text.strip()
+    assert all(character.isdigit() or character.isspace() for character in text)
+
+
+def test_pytesseract_whitelist_quoted(monkeypatch):
+    """
+    Test to see if a whitelist containing quotes and spaces is passed to tesseract as a single argument.
+    """
+    arguments = []
+
+    def image_to_string(image, lang, config):
+        arguments.extend(shlex.split(config))
+        return ''
+
+    monkeypatch.setattr(ocr_engine.pytesseract, 'image_to_string', image_to_string)
+    whitelist = 'ab \'"; -c x=1'
+    PytesseractOCREngine().image_to_string(id_card, page_segmentation_mode=7, whitelist=whitelist)
+    assert arguments == ['-c', 'tessedit_pageseg_mode=7', '-c', 'tessedit_char_whitelist=%s' % whitelist]
+
+
+@pytest.mark.parametrize('id_context', [SAIDCard(), UPStudentCard()])
+def test_pytesseract_field_ocr(monkeypatch, id_context):
+    """
+    Test to see if the field regions of the ID documents with a fixed layout can be passed through the pytesseract
+    engine with their character whitelists.
+    """
+    whitelists = []
+
+    def image_to_string(image, lang, config):
+        arguments = shlex.split(config)
+        whitelists.append(arguments[arguments.index('-c', 2) + 1].split('=', 1)[1])
+        return ''
+
+    monkeypatch.setattr(ocr_engine.pytesseract, 'image_to_string', image_to_string)
+    extractor = TextExtractor({}, PytesseractOCREngine())
+    extractor._extract_fields(cv2.cvtColor(id_card, cv2.COLOR_BGR2GRAY), id_context, {})
+    assert sorted(whitelists) == sorted(region['whitelist'] for region in id_context.get_field_regions())
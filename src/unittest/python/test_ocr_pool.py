@@ -0,0 +1,98 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the OCR worker pool module.
+----------------------------------------------------------------------
+"""
+
+import pytest
+import cv2
+import os
+from hutts_verification.image_processing.ocr_pool import OCRWorkerPool, OCR_POOL_SHARED_MIN_BYTES
+from hutts_verification.utils import shared_image
+
+TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
+    base_path=os.path.abspath(os.path.dirname(__file__)))
+
+id_card = cv2.cvtColor(cv2.imread(TEMPLATE_DIR + "ID.jpg"), cv2.COLOR_BGR2GRAY)
+
+
+@pytest.fixture(scope='module')
+def pool():
+    """
+    Creates a pool with a single worker that is shared by the tests in this module.
+    """
+    pytest.importorskip('tesserocr')
+    ocr_pool = OCRWorkerPool(1, 'memory')
+    yield ocr_pool
+    ocr_pool.close()
+
+
+def test_pool_wrong_size_type():
+    """
+    Test to see if a TypeError is raised when the size is not an integer.
+    """
+    with pytest.raises(TypeError):
+        OCRWorkerPool('2')
+
+
+def test_pool_wrong_size():
+    """
+    Test to see if a ValueError is raised when the pool has no workers.
+    """
+    with pytest.raises(ValueError):
+        OCRWorkerPool(0)
+
+
+def test_pool_wrong_param(pool):
+    """
+    Test to see if a TypeError is raised when something other than an image is passed.
+    """
+    with pytest.raises(TypeError):
+        pool.image_to_string('image')
+
+
+def test_pool_image_to_string(pool):
+    """
+    Test to see if text is extracted by the workers.
+    """
+    assert 'Identity Number' in pool.image_to_string(id_card)
+
+
+def test_pool_restarts_crashed_worker(pool):
+    """
+    Test to see if a crashed worker is replaced and the request is retried.
+    """
+    pool._workers[0].process.terminate()
+    pool._workers[0].process.join()
+    assert 'Identity Number' in pool.image_to_string(id_card)
+
+
+def test_pool_timeout(pool):
+    """
+    Test to see if a TimeoutError is raised when the request takes too long and that the pool recovers.
+    """
+    with pytest.raises(TimeoutError):
+        pool.image_to_string(id_card, timeout=0.001)
+    assert 'Identity Number' in pool.image_to_string(id_card)
+
+
+def test_pool_closed():
+    """
+    Test to see if a RuntimeError is raised when a closed pool is used.
+    """
+    pytest.importorskip('tesserocr')
+    ocr_pool = OCRWorkerPool(1, 'memory')
+    ocr_pool.close()
+    with pytest.raises(RuntimeError):
+        ocr_pool.image_to_string(id_card)
+
+
+def test_pool_shared_image(pool):
+    """
+    Test to see if large images are handed to the workers through shared memory that is released afterwards.
+    """
+    assert id_card.nbytes >= OCR_POOL_SHARED_MIN_BYTES
+    pool.image_to_string(id_card)
+    assert not shared_image._segments
@@ -0,0 +1,61 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the pipeline.
+----------------------------------------------------------------------
+"""
+
+import os
+import cv2
+import pytest
+from hutts_verification.image_preprocessing.blur_manager import BlurManager
+from hutts_verification.image_preprocessing.build_director import BuildDirector
+from hutts_verification.image_preprocessing.color_manager import ColorManager
+from hutts_verification.image_preprocessing.pipeline import Pipeline
+from hutts_verification.image_preprocessing.thresholding_manager import ThresholdingManager
+
+TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
+    base_path=os.path.abspath(os.path.dirname(__file__)))
+
+id_card = cv2.imread(TEMPLATE_DIR + "ID.jpg")
+
+"""The largest fraction of pixels in which the fused and separate preprocessing may differ."""
+FUSED_TOLERANCE = 0.005
+
+
+@pytest.mark.parametrize('preferences, id_type', [
+    ({}, 'idcard'),
+    ({}, 'idbook'),
+    ({'blur_method': 'normal', 'threshold_method': 'otsu'}, 'idcard'),
+    ({'blur_method': 'median'}, 'idcard'),
+    ({'color': 'green'}, 'idcard'),
+])
+def test_fused(preferences, id_type):
+    """
+    Test to see if the fused preprocessing produces the same image as the separate steps, within tolerance.
+    """
+    pipeline = BuildDirector.construct_text_extract_pipeline(preferences, id_type)
+    assert pipeline.fused_weights() is not None
+    expected = pipeline.process_text_extraction(False, id_card, fused=False)
+    for image in (id_card, cv2.resize(id_card, (300, 190))):
+        fused = pipeline.process_text_extraction(False, image)
+        separate = pipeline.process_text_extraction(False, image, fused=False)
+        assert fused.shape == separate.shape
+        assert (fused != separate).mean() <= FUSED_TOLERANCE
+    # Later calls reuse the intermediate images, which should not affect earlier results.
+    assert (pipeline.process_text_extraction(False, id_card) != expected).mean() <= FUSED_TOLERANCE
+
+
+def test_fused_weights():
+    """
+    Test to see if the steps are only fused where the result stays the same.
+    """
+    threshold_manager = ThresholdingManager('adaptive')
+    median_two_channels = Pipeline(BlurManager('median', [3]), ColorManager('extract', 'red'), None, threshold_manager)
+    assert median_two_channels.fused_weights() is None
+    median_one_channel = Pipeline(BlurManager('median', [3]), ColorManager('extract', 'red_blue'), None,
+                                  threshold_manager)
+    assert median_one_channel.fused_weights() == (0.0, 0.587, 0.0)
+    histogram = Pipeline(BlurManager('gaussian', [(3, 3)]), ColorManager('histogram'), None, threshold_manager)
+    assert histogram.fused_weights() is None
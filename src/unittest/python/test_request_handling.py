@@ -0,0 +1,86 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the request handling module.
+All the images used are from public domain and are copyright free
+----------------------------------------------------------------------
+"""
+
+import base64
+import io
+import os
+import cv2
+import numpy as np
+import pytest
+from flask import Flask, request
+from hutts_verification.utils.request_handling import request_data, request_image
+
+TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
+    base_path=os.path.abspath(os.path.dirname(__file__)))
+
+with open(TEMPLATE_DIR + 'obama.jpg', 'rb') as image_file:
+    encoded_image = image_file.read()
+image = cv2.imread(TEMPLATE_DIR + 'obama.jpg')
+
+app = Flask(__name__)
+
+
+def test_request_data_json():
+    """
+    Test to see if the fields of a JSON request are parsed once.
+    """
+    with app.test_request_context(method='POST', json={'id_type': 'idcard'}):
+        data = request_data()
+        assert data == {'id_type': 'idcard'}
+        assert request_data() is data
+
+
+def test_request_data_form():
+    """
+    Test to see if the fields of multipart and raw image requests are read from the form and query string.
+    """
+    with app.test_request_context(method='POST', data={'id_type': 'idcard', 'id_img': (io.BytesIO(b''), 'id.jpg')}):
+        assert request_data() == {'id_type': 'idcard'}
+    with app.test_request_context(method='POST', query_string={'id_type': 'idcard'}, data=encoded_image,
+                                  content_type='image/jpeg'):
+        assert request_data() == {'id_type': 'idcard'}
+
+
+def test_request_image_json():
+    """
+    Test to see if an image is decoded from a base64 data URI.
+    """
+    uri = 'data:image/jpg;base64,' + base64.b64encode(encoded_image).decode('ascii')
+    with app.test_request_context(method='POST', json={'face_img': uri}):
+        assert np.array_equal(request_image('face_img'), image)
+        assert request_image('id_img') is None
+
+
+def test_request_image_multipart():
+    """
+    Test to see if images are decoded from uploaded files.
+    """
+    data = {'id_img': (io.BytesIO(encoded_image), 'id.jpg'), 'face_img': (io.BytesIO(encoded_image), 'face.jpg')}
+    with app.test_request_context(method='POST', data=data):
+        assert np.array_equal(request_image('id_img', raw=True), image)
+        assert np.array_equal(request_image('face_img'), image)
+
+
+def test_request_image_raw():
+    """
+    Test to see if an image is decoded from the body of the request, but only where that is allowed.
+    """
+    with app.test_request_context(method='POST', data=encoded_image, content_type='image/jpeg'):
+        assert request_image('face_img') is None
+        assert np.array_equal(request_image('id_img', raw=True), image)
+
+
+def test_request_image_invalid():
+    """
+    Test to see if a ValueError is raised for a body that is not an image.
+    """
+    with app.test_request_context(method='POST', data=b'not an image', content_type='image/jpeg'):
+        assert request.content_length == 12
+        with pytest.raises(ValueError):
+            request_image('id_img', raw=True)
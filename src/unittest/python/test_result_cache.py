@@ -0,0 +1,99 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the result cache module.
+----------------------------------------------------------------------
+"""
+
+import base64
+import os
+import numpy as np
+import pytest
+from flask import Flask
+from hutts_verification.image_processing import controllers
+from hutts_verification.image_processing import result_cache
+from hutts_verification.image_processing.result_cache import cached_extraction, result_key, set_result_cache, \
+    RESULT_CACHE_HEADER
+from hutts_verification.utils.content_cache import ContentCache
+
+TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
+    base_path=os.path.abspath(os.path.dirname(__file__)))
+
+image = np.arange(48, dtype='uint8').reshape((4, 4, 3))
+result = {'text_extract_result': {'identity_number': '8001015009087', 'names': 'Barack'}}
+
+
+@pytest.fixture
+def cache():
+    """
+    Enables a result cache for the duration of a test.
+    """
+    cache = ContentCache('test_results', 16)
+    set_result_cache(cache)
+    yield cache
+    set_result_cache(None)
+
+
+def test_set_result_cache_type():
+    """
+    Test to see if a TypeError is raised for caches that are not ContentCaches.
+    """
+    with pytest.raises(TypeError):
+        set_result_cache({})
+
+
+def test_result_key():
+    """
+    Test to see if only the preferences that affect the extraction distinguish results.
+    """
+    key = result_key(image, {'id_type': 'idcard', 'blur_method': 'median', 'useIO': False}, False)
+    assert key == result_key(image, {'blur_method': 'median ', 'id_type': 'idcard'}, False)
+    assert key != result_key(image, {'id_type': 'idcard', 'blur_method': 'gaussian'}, False)
+    assert key != result_key(image, {'id_type': 'idcard', 'blur_method': 'median'}, True)
+    assert key != result_key(image[::-1], {'id_type': 'idcard', 'blur_method': 'median'}, False)
+
+
+def test_cached_extraction(cache):
+    """
+    Test to see if an extraction is only run once for the same image and preferences.
+    """
+    calls = []
+
+    def extraction():
+        calls.append(1)
+        return result
+
+    assert cached_extraction(image, {}, False, False, extraction) == (result, 'MISS')
+    assert cached_extraction(image, {}, False, False, extraction) == (result, 'HIT')
+    assert len(calls) == 1
+    assert cached_extraction(image, {}, False, True, extraction) == (result, 'BYPASS')
+    assert cached_extraction(image, {'useIO': True, 'debug_id': 'abc'}, False, False, extraction) == (result, 'BYPASS')
+    assert len(calls) == 3
+    assert cached_extraction(image, {'useIO': True}, False, False, extraction) == (result, 'HIT')
+
+
+def test_cached_extraction_disabled():
+    """
+    Test to see if the cache is bypassed when it is disabled.
+    """
+    assert result_cache.get_result_cache() is None
+    assert cached_extraction(image, {}, False, False, lambda: result) == (result, 'BYPASS')
+
+
+def test_extract_text_header(cache, monkeypatch):
+    """
+    Test to see if the cache status of /extractText is reported in the response header.
+    """
+    monkeypatch.setattr(controllers, 'extract_image', lambda *args: result)
+    app = Flask(__name__)
+    app.register_blueprint(controllers.extract)
+    client = app.test_client()
+    with open(TEMPLATE_DIR + 'obama.jpg', 'rb') as image_file:
+        id_photo = 'data:image/jpg;base64,' + base64.b64encode(image_file.read()).decode('ascii')
+    statuses = []
+    for _ in range(2):
+        response = client.post('/extractText', json={'idPhoto': id_photo, 'id_type': 'idcard'})
+        assert response.get_json() == result['text_extract_result']
+        statuses.append(response.headers[RESULT_CACHE_HEADER])
+    assert statuses == ['MISS', 'HIT']
@@ -440,3 +440,51 @@ def test_get_id_info_invalid_date_of_birth():
         'status': None,
         'nationality': None
     }
+
+
+def test_get_id_info_from_fields():
+    """
+    Test the extraction of information from the field regions of the card and whether the ID number is used to
+    extract other information such as date of birth, status and sex.
+    """
+    sa_id_card = SAIDCard()
+    field_texts = {
+        'surname': 'DOE',
+        'names': 'JOHN-MICHAEL\nROBERT',
+        'sex': 'F',
+        'nationality': 'RSA',
+        'identity_number': '8001015009087',
+        'date_of_birth': '01 JAN 1980',
+        'country_of_birth': 'RSA',
+        'status': 'CITIZEN'
+    }
+    assert sa_id_card.get_id_info_from_fields(field_texts) == {
+        'identity_number': '8001015009087',
+        'surname': 'Doe',
+        'names': 'John-Michael Robert',
+        'sex': 'M',
+        'date_of_birth': '1980-01-01',
+        'country_of_birth': 'RSA',
+        'status': 'Citizen',
+        'nationality': 'RSA'
+    }
+
+
+def test_get_id_info_from_fields_barcode_data():
+    """
+    Test to see if the ID number from the barcode data is preferred over the one in the field regions.
+    """
+    sa_id_card = SAIDCard()
+    id_info = sa_id_card.get_id_info_from_fields(
+        {'identity_number': '0123456789012'},
+        barcode_data={'identity_number': '8001015009087'}
+    )
+    assert id_info['identity_number'] == '8001015009087'
+
+
+def test_get_id_info_from_fields_invalid_id_number():
+    """
+    Test to see if None is returned when no valid ID number is found in the field regions.
+    """
+    sa_id_card = SAIDCard()
+    assert sa_id_card.get_id_info_from_fields({'surname': 'DOE', 'identity_number': '0123456789012'}) is None
@@ -0,0 +1,135 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the shared image module.
+----------------------------------------------------------------------
+"""
+
+import multiprocessing
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+import pytest
+from hutts_verification.utils import shared_image as shared_image_module
+from hutts_verification.utils.shared_image import SharedImage
+from hutts_verification.utils.stage_pools import StagePool
+
+
+def brighten(shared_image):
+    """
+    Brightens a shared image in place within a worker process and returns the sum of its pixels.
+    """
+    image = shared_image.array()
+    image += 1
+    total = int(image.sum())
+    del image
+    shared_image.close()
+    return total
+
+
+def test_create_type():
+    """
+    Test to see if a TypeError is raised for images that are not numpy arrays.
+    """
+    with pytest.raises(TypeError):
+        SharedImage.create([1, 2, 3])
+
+
+def test_create():
+    """
+    Test to see if the shared image holds a copy of the pixels of the image.
+    """
+    image = np.arange(60, dtype='uint8').reshape((4, 5, 3))
+    with SharedImage.create(image) as shared_image:
+        assert np.array_equal(shared_image.array(), image)
+        assert shared_image.array().dtype == image.dtype
+        image[0, 0, 0] = 100
+        assert shared_image.array()[0, 0, 0] == 0
+
+
+def test_pickle():
+    """
+    Test to see if only the descriptor is pickled and an unpickled image refers to the same segment.
+    """
+    image = np.ones((200, 200), dtype='float32')
+    with SharedImage.create(image) as shared_image:
+        data = pickle.dumps(shared_image)
+        assert len(data) < 1000
+        copy = pickle.loads(data)
+        assert np.array_equal(copy.array(), image)
+        shared_image.array()[0, 0] = 5
+        assert copy.array()[0, 0] == 5
+        copy.close()
+
+
+def test_release():
+    """
+    Test to see if the segment is removed once its last reference is released, and only by its creator.
+    """
+    shared_image = SharedImage.create(np.zeros((2, 2), dtype='uint8'))
+    shared_image.retain()
+    copy = pickle.loads(pickle.dumps(shared_image))
+    copy.release()
+    shared_image.release()
+    copy.array()
+    copy.close()
+    shared_image.release()
+    assert shared_image.name not in shared_image_module._segments
+    with pytest.raises(FileNotFoundError):
+        pickle.loads(pickle.dumps(shared_image)).array()
+
+
+def test_share():
+    """
+    Test to see if sharing an image or region that already lies within a segment refers to that segment.
+    """
+    image = np.arange(300, dtype='uint8').reshape((10, 10, 3))
+    with SharedImage.create(image) as shared_image:
+        warped = shared_image.array()
+        with SharedImage.share(warped) as whole, SharedImage.share(warped[2:5, 3:8]) as region, \
+                SharedImage.share(warped[::-1, :, 0]) as flipped:
+            assert whole.name == region.name == flipped.name == shared_image.name
+            assert np.array_equal(pickle.loads(pickle.dumps(region)).array(), image[2:5, 3:8])
+            assert np.array_equal(pickle.loads(pickle.dumps(flipped)).array(), image[::-1, :, 0])
+        with SharedImage.share(image) as copy:
+            assert copy.name != shared_image.name
+    assert not shared_image_module._segments
+
+
+def test_empty():
+    """
+    Test to see if a producer can write its result straight into shared memory.
+    """
+    image = np.full((20, 30, 3), 7, dtype='uint8')
+    with SharedImage.empty((30, 20, 3)) as shared_image:
+        cv2.resize(image, (20, 30), dst=shared_image.array())
+        assert np.all(pickle.loads(pickle.dumps(shared_image)).array() == 7)
+
+
+def test_stage_pool_retains():
+    """
+    Test to see if a stage pool keeps a shared image alive until the stage has finished.
+    """
+    release = threading.Event()
+    stage_pool = StagePool('test', 1)
+    with SharedImage.create(np.ones((4, 4), dtype='uint8')) as shared_image:
+        future = stage_pool.submit(lambda image: (release.wait(), int(image.array().sum()))[1], shared_image)
+    assert shared_image.name in shared_image_module._segments
+    release.set()
+    assert future.result(5) == 16
+    stage_pool.close()
+    assert shared_image.name not in shared_image_module._segments
+
+
+def test_worker_process():
+    """
+    Test to see if a worker process reads and writes the pixels of the image without receiving a copy.
+    """
+    image = np.zeros((100, 100, 3), dtype='uint8')
+    with SharedImage.share(image) as shared_image, \
+            ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        assert executor.submit(brighten, shared_image).result(60) == 30000
+        assert shared_image.array().sum() == 30000
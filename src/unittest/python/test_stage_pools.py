@@ -0,0 +1,140 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the stage pools module.
+----------------------------------------------------------------------
+"""
+
+import base64
+import os
+import threading
+import time
+import pytest
+from flask import Flask
+from hutts_verification.utils import stage_pools
+from hutts_verification.utils.metrics import stage_pool_rejections
+from hutts_verification.utils.stage_pools import StagePool, Overloaded, DeadlineExceeded, STAGE_FACE, \
+    STAGE_POOL_TIMEOUT_HEADER
+from hutts_verification.verification.controllers import verify
+
+TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
+    base_path=os.path.abspath(os.path.dirname(__file__)))
+
+
+@pytest.fixture
+def pools():
+    """
+    Replaces the stage pools with pools of a single worker that admit no waiting stages, and restores the
+    default pools afterwards.
+    """
+    stage_pools.configure_stage_pools(1, 1, 0, 5)
+    yield
+    stage_pools.configure_stage_pools()
+
+
+def test_constructor_types():
+    """
+    Test to see if invalid pool sizes are rejected.
+    """
+    with pytest.raises(TypeError):
+        StagePool('test', '1')
+    with pytest.raises(TypeError):
+        StagePool('test', 1, 1.5)
+    with pytest.raises(ValueError):
+        StagePool('test', 0)
+    with pytest.raises(ValueError):
+        StagePool('test', 1, -1)
+
+
+def test_submit():
+    """
+    Test to see if stages are run on the pool and their results returned.
+    """
+    stage_pool = StagePool('test', 2)
+    futures = [stage_pool.submit(pow, base, 2) for base in range(5)]
+    assert [stage_pools.wait(future, time.monotonic() + 5) for future in futures] == [0, 1, 4, 9, 16]
+    stage_pool.close()
+    assert stage_pool.stats()['pending'] == 0
+
+
+def test_admission_control():
+    """
+    Test to see if stages are rejected once the workers are busy and the queue is full.
+    """
+    release = threading.Event()
+    stage_pool = StagePool('test_admission', 1, 1)
+    running = stage_pool.submit(release.wait)
+    waiting = stage_pool.submit(release.wait)
+    assert stage_pool.stats()['pending'] == 2
+    with pytest.raises(Overloaded):
+        stage_pool.submit(release.wait)
+    assert stage_pool_rejections.labels('test_admission').get() == 1
+    release.set()
+    running.result(5)
+    waiting.result(5)
+    stage_pool.close()
+    assert stage_pool.stats()['pending'] == 0
+
+
+def test_deadline():
+    """
+    Test to see if stages that have not started by their deadline are skipped, and waiting for a stage stops at
+    the deadline.
+    """
+    release = threading.Event()
+    stage_pool = StagePool('test', 1)
+    running = stage_pool.submit(release.wait)
+    deadline = time.monotonic() + 0.1
+    skipped = stage_pool.submit(int, deadline=deadline)
+    with pytest.raises(DeadlineExceeded):
+        stage_pools.wait(running, deadline)
+    release.set()
+    with pytest.raises(DeadlineExceeded):
+        skipped.result(5)
+
+
+def test_get_stage_pool():
+    """
+    Test to see if a ValueError is raised for unknown stages.
+    """
+    assert stage_pools.get_stage_pool(STAGE_FACE).name == STAGE_FACE
+    with pytest.raises(ValueError):
+        stage_pools.get_stage_pool('barcode')
+
+
+def test_request_deadline(pools):
+    """
+    Test to see if clients can shorten but not extend the timeout of their requests.
+    """
+    app = Flask(__name__)
+    for (header, expected) in (('1', 1), ('60', 5), ('soon', 5)):
+        with app.test_request_context(headers={STAGE_POOL_TIMEOUT_HEADER: header}):
+            assert stage_pools.request_deadline() - time.monotonic() == pytest.approx(expected, abs=0.5)
+
+
+def test_overloaded_response(pools):
+    """
+    Test to see if requests are rejected with 503 while the face pool is busy.
+    """
+    app = Flask(__name__)
+    app.register_blueprint(verify)
+    client = app.test_client()
+    with open(TEMPLATE_DIR + 'obama.jpg', 'rb') as image_file:
+        face_img = 'data:image/jpg;base64,' + base64.b64encode(image_file.read()).decode('ascii')
+    release = threading.Event()
+    busy = stage_pools.get_stage_pool(STAGE_FACE).submit(release.wait)
+    try:
+        response = client.post('/verifyFaces', json={'id_img': face_img, 'face_img': face_img})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert not response.get_json()['success']
+    finally:
+        release.set()
+        busy.result(5)
+    while stage_pools.get_stage_pool(STAGE_FACE).stats()['pending']:
+        time.sleep(0.01)
+    response = client.post('/verifyFaces', json={'id_img': face_img, 'face_img': face_img},
+                           headers={STAGE_POOL_TIMEOUT_HEADER: '60'})
+    assert response.status_code == 200
+    assert response.get_json()['is_match']
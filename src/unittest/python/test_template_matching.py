@@ -5,10 +5,11 @@ Authors: Marno Hermann
 Unit tests for the Template Matching
 ----------------------------------------------------------------------
 """
+import json
 import pytest
 import cv2
 import os
-from hutts_verification.image_preprocessing.template_matching import TemplateMatching
+from hutts_verification.image_preprocessing.template_matching import TemplateMatching, TemplateBank
 
 TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
     base_path=os.path.abspath(os.path.dirname(__file__)))
@@ -65,3 +66,53 @@ def test_to_small_template():
     cv2.setNumThreads(0)
     assert template.identify(id_book) is 'None'
     cv2.setNumThreads(-1)
+
+
+def test_match_template_scaled():
+    template = TemplateMatching()
+    for width in [400, 1000, 1600]:
+        ratio = width / direct_match.shape[1]
+        scaled = cv2.resize(direct_match, (width, int(direct_match.shape[0] * ratio)), interpolation=cv2.INTER_AREA)
+        assert template.identify(scaled) == 'idcard'
+
+
+def test_match_template_background():
+    template = TemplateMatching()
+    background = cv2.resize(brick, (1300, 900), interpolation=cv2.INTER_AREA)
+    background[100:100 + direct_match.shape[0], 200:200 + direct_match.shape[1]] = direct_match
+    assert template.identify(background) == 'idcard'
+
+
+def test_template_bank():
+    bank = TemplateBank.load()
+    assert [template.id_type for template in bank.templates] == ['idcard', 'idbook', 'studentcard']
+    for template in bank.templates:
+        assert not template.image.flags.writeable
+        assert len(template.coarse_image.shape) == 2
+
+
+def test_template_bank_extra_manifest(tmpdir):
+    cv2.imwrite(str(tmpdir.join('flag.png')), id_book)
+    tmpdir.join('manifest.json').write(json.dumps({'templates': [
+        {'file': 'flag.png', 'id_type': 'first', 'document_width': 1034, 'threshold': 0.75}
+    ]}))
+    tmpdir.join('extra.json').write(json.dumps({'templates': [
+        {'file': 'flag.png', 'id_type': 'second', 'document_width': 1034, 'threshold': 0.75}
+    ]}))
+    bank = TemplateBank.load(str(tmpdir))
+    assert [template.id_type for template in bank.templates] == ['first', 'second']
+    assert TemplateMatching(bank).identify(direct_match) == 'first'
+
+
+def test_template_bank_missing_template(tmpdir):
+    tmpdir.join('manifest.json').write(json.dumps({'templates': [
+        {'file': 'missing.png', 'id_type': 'idcard', 'document_width': 1034, 'threshold': 0.75}
+    ]}))
+    with pytest.raises(ValueError):
+        TemplateBank.load(str(tmpdir))
+
+
+def test_template_bank_invalid_manifest(tmpdir):
+    tmpdir.join('manifest.json').write(json.dumps({'files': []}))
+    with pytest.raises(ValueError):
+        TemplateBank.load(str(tmpdir))
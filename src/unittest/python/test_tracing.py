@@ -0,0 +1,124 @@
+"""
+----------------------------------------------------------------------
+Authors: Nicolai van Niekerk
+----------------------------------------------------------------------
+Unit tests for the tracing module.
+----------------------------------------------------------------------
+"""
+
+import threading
+import pytest
+from hutts_verification.utils import tracing
+
+
+@pytest.fixture
+def enabled():
+    """
+    Enables tracing with empty stage histograms for the duration of a test.
+    """
+    tracing.stage_histograms.clear()
+    tracing.enable()
+    yield
+    tracing.enable(False)
+    tracing.stage_histograms.clear()
+
+
+def test_stage_without_trace():
+    """
+    Test to see if stages do nothing when no trace has been started.
+    """
+    assert tracing.current_trace() is None
+    with tracing.stage('ocr'):
+        pass
+    with tracing.traced() as trace:
+        assert trace is None
+
+
+def test_traced_forced():
+    """
+    Test to see if the stages of a forced trace are recorded along with the total.
+    """
+    with tracing.traced(force=True) as trace:
+        with tracing.stage('ocr'):
+            pass
+        with tracing.stage('ocr'):
+            pass
+        with tracing.stage('text_cleaning'):
+            pass
+    assert tracing.current_trace() is None
+    timings = trace.timings()
+    assert list(timings.keys()) == ['ocr', 'text_cleaning', 'total']
+    assert timings['ocr']['calls'] == 2
+    assert timings['total']['wall'] >= timings['ocr']['wall'] + timings['text_cleaning']['wall']
+    assert timings['ocr']['cpu'] >= 0
+
+
+def test_traced_nested():
+    """
+    Test to see if a nested trace is added to the trace that was already started.
+    """
+    with tracing.traced(force=True) as outer:
+        with tracing.traced(force=True) as inner:
+            assert inner is outer
+        assert tracing.current_trace() is outer
+
+
+def test_traced_per_thread():
+    """
+    Test to see if traces are kept apart per thread.
+    """
+    traces = []
+
+    def trace_thread():
+        traces.append(tracing.current_trace())
+
+    with tracing.traced(force=True):
+        thread = threading.Thread(target=trace_thread)
+        thread.start()
+        thread.join()
+    assert traces == [None]
+
+
+def test_histograms_disabled():
+    """
+    Test to see if forced traces are not added to the histograms while tracing is disabled.
+    """
+    tracing.stage_histograms.clear()
+    with tracing.traced(force=True):
+        with tracing.stage('ocr'):
+            pass
+    assert tracing.stage_histograms.snapshot() == {}
+
+
+def test_histograms(enabled):
+    """
+    Test to see if finished traces are added to the histograms per stage and per ID type.
+    """
+    with tracing.traced():
+        tracing.set_id_type('idcard')
+        with tracing.stage('ocr'):
+            pass
+    with tracing.traced():
+        with tracing.stage('ocr'):
+            pass
+    snapshot = tracing.stage_histograms.snapshot()
+    assert set(snapshot.keys()) == {'ocr', 'total'}
+    assert set(snapshot['ocr'].keys()) == {'idcard', tracing.TRACING_UNKNOWN_ID_TYPE}
+    histogram = snapshot['ocr']['idcard']
+    assert histogram['count'] == 1
+    assert histogram['buckets'][-1] == (float('inf'), 1)
+    assert [count for (_, count) in histogram['buckets']] == sorted(count for (_, count) in histogram['buckets'])
+
+
+def test_histogram_buckets():
+    """
+    Test to see if observations are placed in the correct bucket.
+    """
+    histograms = tracing.StageHistograms(buckets=(0.1, 1.0))
+    trace = tracing.Trace()
+    trace.add('ocr', 0.5, 0.5)
+    trace.finish()
+    histograms.record(trace)
+    assert histograms.snapshot()['ocr'][tracing.TRACING_UNKNOWN_ID_TYPE]['buckets'] == [
+        (0.1, 0), (1.0, 1), (float('inf'), 1)
+    ]
@@ -0,0 +1,131 @@
+"""
+----------------------------------------------------------------------
+Authors: Stephan Nell
+----------------------------------------------------------------------
+Unit tests for the verification controllers.
+All the images used are from public domain and are copyright free
+----------------------------------------------------------------------
+"""
+
+import base64
+import io
+import os
+import pytest
+from flask import Flask
+from hutts_verification.utils import stage_pools
+from hutts_verification.verification import controllers
+from hutts_verification.verification.controllers import verify, initialise_branch_worker
+
+TEMPLATE_DIR = "{base_path}/../../main/python/hutts_verification/image_preprocessing/templates/".format(
+    base_path=os.path.abspath(os.path.dirname(__file__)))
+
+DETAILS = {
+    'names': 'Barack', 'surname': 'Obama', 'idNumber': '8001015009087', 'nationality': 'RSA', 'cob': 'RSA',
+    'status': 'Citizen', 'gender': 'M', 'dob': '80-01-01'
+}
+
+EXTRACTED_TEXT = {
+    'names': 'Barack', 'surname': 'Obama', 'identity_number': '8001015009087', 'nationality': 'RSA',
+    'country_of_birth': 'RSA', 'status': 'Citizen', 'sex': 'M', 'date_of_birth': '80-01-01'
+}
+
+
+def encode(file_name):
+    """
+    Encodes a template image as a base64 data URI.
+    """
+    with open(TEMPLATE_DIR + file_name, 'rb') as image_file:
+        return 'data:image/jpg;base64,' + base64.b64encode(image_file.read()).decode('ascii')
+
+
+def verify_id(client, id_file, face_file):
+    """
+    Sends a /verifyID request for the given ID and face images.
+    """
+    return client.post('/verifyID', json=dict(DETAILS, id_img=encode(id_file), face_img=encode(face_file)))
+
+
+def upload(file_name):
+    """
+    Opens a template image as an uploaded file.
+    """
+    with open(TEMPLATE_DIR + file_name, 'rb') as image_file:
+        return io.BytesIO(image_file.read()), file_name
+
+
+def fail(*args):
+    """
+    Stands in for a branch that fails.
+    """
+    raise ValueError('Could not identify ID type')
+
+
+@pytest.fixture
+def client():
+    """
+    Creates a test client for an application with the verification blueprint registered.
+    """
+    app = Flask(__name__)
+    app.register_blueprint(verify)
+    return app.test_client()
+
+
+def test_verify_id_text_branch_fails(client, monkeypatch):
+    """
+    Test to see if the face branch still contributes to the result when the text branch fails.
+    """
+    monkeypatch.setattr(controllers, 'manage_text_extractor', fail)
+    result = verify_id(client, 'obama.jpg', 'obama.jpg').get_json()
+    assert result['is_match']
+    assert result['face_match'] > 94
+    assert (result['text_match'], result['is_pass']) == (0.0, False)
+    assert result['total_match'] == pytest.approx(result['face_match'] * 0.6)
+    assert result['errors'] == {'text': 'Could not identify ID type'}
+
+
+def test_verify_id_face_branch_fails(client, monkeypatch):
+    """
+    Test to see if the text branch still contributes to the result when no face can be found.
+    """
+    monkeypatch.setattr(controllers, 'manage_text_extractor', lambda *args: dict(EXTRACTED_TEXT))
+    result = verify_id(client, 'obama.jpg', 'temp_flag.jpg').get_json()
+    assert (result['is_match'], result['face_match']) == (False, 0.0)
+    assert result['is_pass']
+    assert result['text_match'] > 90
+    assert set(result['errors']) == {'face'}
+
+
+def test_verify_id_both_branches_fail(client, monkeypatch):
+    """
+    Test to see if the request fails when both branches fail.
+    """
+    monkeypatch.setattr(controllers, 'manage_text_extractor', fail)
+    assert verify_id(client, 'obama.jpg', 'temp_flag.jpg').status_code == 500
+
+
+def test_verify_id_branch_processes(client):
+    """
+    Test to see if the branches that run in worker processes match the faces like the branches that run on
+    threads.
+    """
+    stage_pools.configure_stage_pools(branch_processes=1, branch_initializer=initialise_branch_worker,
+                                      branch_initargs=({'embedding_cache': None},))
+    try:
+        assert stage_pools.has_stage_pool(stage_pools.STAGE_BRANCH)
+        result = verify_id(client, 'obama.jpg', 'obama.jpg').get_json()
+        assert result['is_match']
+        assert result['face_match'] > 94
+        assert 'face' not in result.get('errors', {})
+    finally:
+        stage_pools.get_stage_pool(stage_pools.STAGE_BRANCH).close()
+        stage_pools.configure_stage_pools()
+    assert not stage_pools.has_stage_pool(stage_pools.STAGE_BRANCH)
+
+
+def test_verify_faces_multipart(client):
+    """
+    Test to see if the images can be uploaded as multipart/form-data instead of base64 strings.
+    """
+    result = client.post('/verifyFaces', data={'id_img': upload('obama.jpg'), 'face_img': upload('obama.jpg')})
+    assert result.status_code == 200
+    assert result.get_json()['is_match']